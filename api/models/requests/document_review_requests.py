@@ -14,3 +14,16 @@ class DocumentReviewRequest(BaseModel):
         default=None,
         description="Модель для проверки (например gpt-5.4, gpt-5.4-mini)",
     )
+    previous_document_name: Optional[str] = Field(
+        default=None,
+        description="Предыдущая редакция отчёта в GCS: проверяются только изменённые страницы",
+    )
+
+
+class DocumentReviewJobRequest(DocumentReviewRequest):
+    """Запрос на фоновую проверку документа."""
+
+    mode: str = Field(
+        default="review",
+        description="review — текстовый отчёт, fixes — структурированные замечания (find/replace)",
+    )
@@ -5,6 +5,7 @@ class ImageAnalysisRequest(BaseModel):
     """Запрос на анализ изображения"""
     image_name: str = Field(..., description="Имя изображения для анализа")
     construction_type: Optional[str] = Field(None, description="Тип конструкции для фильтрации базы дефектов")
+    construction_type_confidence: Optional[float] = Field(None, ge=0, le=1, description="Уверенность в типе конструкции (0.0-1.0), если тип определён моделью; не указана — тип задан явно")
     photo_id: Optional[int] = Field(None, description="ID фотографии для сохранения результата в БД")
     object_id: Optional[int] = Field(None, description="ID объекта для денормализации")
     defect_type: Optional[str] = Field(None, description="Тег дефекта (значение DefectType). Если тег входит в каталог кросс-категорийных дефектов — ответ возвращается из каталога без обращения к LLM")
@@ -23,6 +24,8 @@ class QueueGroupAnalysisRequest(BaseModel):
     """Запрос на постановку группового анализа дефектов в очередь"""
     image_name: str = Field(..., description="Имя репрезентативного изображения для AI-анализа")
     construction_type: Optional[str] = Field(None, description="Тип конструкции для фильтрации базы дефектов")
+    construction_type_confidence: Optional[float] = Field(None, ge=0, le=1, description="Уверенность в типе конструкции (0.0-1.0), если тип определён моделью; не указана — тип задан явно")
     photo_ids: list[int] = Field(..., description="ID всех фотографий группы (включая репрезентативное)")
     object_id: Optional[int] = Field(None, description="ID объекта для денормализации")
     defect_type: Optional[str] = Field(None, description="Тег дефекта (значение DefectType). Если тег входит в каталог кросс-категорийных дефектов — результат берётся из каталога без обращения к LLM")
+    bulk: bool = Field(False, description="Массовая постановка (анализ всего объекта и т.п.): обрабатывается после интерактивных запросов")
@@ -38,3 +38,30 @@ class DocumentReviewFixesResponse(BaseModel):
     document_name: str = Field(..., description="Имя документа в GCS")
     remarks: list[ReviewRemark] = Field(default_factory=list)
     summary: str = Field(default="", description="Итоговая строка")
+
+
+class ReviewPassResult(BaseModel):
+    """Результат одного прохода проверки."""
+
+    label: str
+    result: str
+
+
+class DocumentReviewJobResponse(BaseModel):
+    """Состояние фоновой проверки документа."""
+
+    job_id: str
+    status: str = Field(..., description="pending, running, completed, failed, cancelled")
+    mode: str
+    document_name: str
+    model: str
+    created_at: str
+    finished_at: Optional[str] = None
+    passes: list[ReviewPassResult] = Field(
+        default_factory=list, description="Результаты завершённых проходов",
+    )
+    result: Optional[dict] = Field(
+        default=None,
+        description="Итог: как у /review или /review-fixes в зависимости от mode",
+    )
+    error: Optional[dict] = Field(default=None, description="status_code и detail ошибки")
@@ -1,20 +1,33 @@
 import os
+import json
 import logging
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Header
+from fastapi.responses import StreamingResponse
 
 from api.dependencies.auth_dependencies import get_current_user
 from api.models.entities import User
-from api.models.requests.document_review_requests import DocumentReviewRequest
+from api.models.requests.document_review_requests import (
+    DocumentReviewRequest,
+    DocumentReviewJobRequest,
+)
 from api.models.responses.document_review_responses import (
     DocumentUploadResponse,
     DocumentReviewResponse,
     DocumentReviewFixesResponse,
+    DocumentReviewJobResponse,
 )
 from api.services.document_review_service import (
     DocumentReviewService,
     ALLOWED_EXTENSIONS,
     MAX_DOCUMENT_SIZE,
+    describe_review_error,
+)
+from api.services.review_job_service import (
+    ReviewJob,
+    ReviewJobService,
+    ReviewJobsOverloadedError,
 )
 from common.gc_utils import documents_storage
 
@@ -23,6 +36,7 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/documents", tags=["documents"])
 
 document_review_service = DocumentReviewService()
+review_job_service = ReviewJobService(document_review_service)
 
 
 @router.post("/upload", response_model=DocumentUploadResponse)
@@ -71,27 +85,14 @@ async def review_document(
             document_name=request.document_name,
             prompt=request.prompt,
             model=request.model,
+            previous_document_name=request.previous_document_name,
         )
         return DocumentReviewResponse(**result)
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Документ не найден в хранилище")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        err_msg = str(e)
-        lower_msg = err_msg.lower()
-        if "context_length_exceeded" in err_msg or "token" in lower_msg:
-            raise HTTPException(
-                status_code=400,
-                detail="Документ слишком большой для выбранной модели.",
-            )
-        if "429" in err_msg or "rate_limit" in lower_msg or "resource_exhausted" in lower_msg:
-            raise HTTPException(
-                status_code=429,
-                detail="Слишком много запросов к модели. Подождите минуту и попробуйте снова.",
-            )
-        logger.error("Ошибка проверки документа: %s", e)
-        raise HTTPException(status_code=500, detail=f"Ошибка проверки: {err_msg}")
+        status_code, detail = describe_review_error(e)
+        if status_code == 500:
+            logger.error("Ошибка проверки документа: %s", e)
+        raise HTTPException(status_code=status_code, detail=detail)
 
 
 @router.post("/review-fixes", response_model=DocumentReviewFixesResponse)
@@ -105,24 +106,111 @@ async def review_document_fixes(
             document_name=request.document_name,
             prompt=request.prompt,
             model=request.model,
+            previous_document_name=request.previous_document_name,
         )
         return DocumentReviewFixesResponse(**result)
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Документ не найден в хранилище")
+    except Exception as e:
+        status_code, detail = describe_review_error(e)
+        if status_code == 500:
+            logger.error("Ошибка проверки документа (fixes): %s", e)
+        raise HTTPException(status_code=status_code, detail=detail)
+
+
+# ── Фоновые проверки ──────────────────────────────────────────────
+
+def _job_response(job: ReviewJob) -> DocumentReviewJobResponse:
+    return DocumentReviewJobResponse(
+        job_id=job.id,
+        status=job.status,
+        mode=job.mode,
+        document_name=job.document_name,
+        model=job.model,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        passes=job.passes,
+        result=job.result,
+        error=job.error,
+    )
+
+
+async def _get_job_or_404(job_id: str, user: User) -> ReviewJob:
+    job = await review_job_service.get(job_id, user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача проверки не найдена")
+    return job
+
+
+@router.post("/review-jobs", response_model=DocumentReviewJobResponse, status_code=202)
+async def create_review_job(
+    request: DocumentReviewJobRequest,
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Запуск проверки в фоне. Ход проверки — GET /review-jobs/{job_id}/events (SSE),
+    итог — GET /review-jobs/{job_id}.
+    """
+    try:
+        job = await review_job_service.start(
+            user_id=current_user.id,
+            mode=request.mode,
+            document_name=request.document_name,
+            prompt=request.prompt,
+            model=request.model,
+            previous_document_name=request.previous_document_name,
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        err_msg = str(e)
-        lower_msg = err_msg.lower()
-        if "context_length_exceeded" in err_msg or "token" in lower_msg:
-            raise HTTPException(
-                status_code=400,
-                detail="Документ слишком большой для выбранной модели.",
-            )
-        if "429" in err_msg or "rate_limit" in lower_msg or "resource_exhausted" in lower_msg:
-            raise HTTPException(
-                status_code=429,
-                detail="Слишком много запросов к модели. Подождите минуту и попробуйте снова.",
-            )
-        logger.error("Ошибка проверки документа (fixes): %s", e)
-        raise HTTPException(status_code=500, detail=f"Ошибка проверки: {err_msg}")
+    except ReviewJobsOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return _job_response(job)
+
+
+@router.get("/review-jobs/{job_id}", response_model=DocumentReviewJobResponse)
+async def get_review_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """Состояние фоновой проверки и её результаты."""
+    return _job_response(await _get_job_or_404(job_id, current_user))
+
+
+@router.get("/review-jobs/{job_id}/events")
+async def stream_review_job_events(
+    job_id: str,
+    last_event_id: Optional[int] = Header(default=None, alias="Last-Event-ID"),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    SSE-поток событий проверки: status, pass (результат прохода), затем
+    result, error или cancelled. При переподключении с Last-Event-ID
+    отдаются только пропущенные события.
+    """
+    job = await _get_job_or_404(job_id, current_user)
+    after = last_event_id if last_event_id is not None else -1
+
+    async def _stream():
+        async for item in review_job_service.events(job, after):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            event_id, event = item
+            data = json.dumps(event["data"], ensure_ascii=False)
+            yield f"id: {event_id}\nevent: {event['event']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.delete("/review-jobs/{job_id}", response_model=DocumentReviewJobResponse)
+async def cancel_review_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+):
+    """Отмена фоновой проверки. Завершённая проверка возвращается без изменений."""
+    job = await review_job_service.cancel(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача проверки не найдена")
+    return _job_response(job)
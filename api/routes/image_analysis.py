@@ -8,6 +8,7 @@ from api.services.model_manager import ModelManager
 from api.services.construction_analyzer import ConstructionAnalyzer
 from api.services.redis_service import redis_service
 from api.services.defect_analysis_service import DefectAnalysisService
+from api.services.defect_draft_service import defect_draft_service
 from api.services.database import get_db
 from api.models.entities import User
 from api.dependencies.auth_dependencies import get_current_user
@@ -23,6 +24,8 @@ from api.models.responses import (
 )
 from common.gc_utils import images_storage
 from common.defects_db import get_defect_by_tag
+from common.fair_scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE
+from settings import DEFECT_SPECULATIVE_ENABLED
 
 logger = logging.getLogger(__name__)
 
@@ -66,10 +69,22 @@ async def analyze_image(
                 "category": catalog_defect["category"],
             }
         else:
-            result = await defect_analyzer.analyze_single_image_by_name(
-                image_name=request.image_name,
-                construction_type=request.construction_type
-            )
+            # Черновик упреждающего анализа (DEFECT_SPECULATIVE_ENABLED) — без ожидания модели
+            result = None
+            if DEFECT_SPECULATIVE_ENABLED:
+                result = await defect_draft_service.take(
+                    request.image_name, request.construction_type, request.defect_type,
+                )
+                if result:
+                    logger.info(f"Анализ {request.image_name} взят из черновика: код={result['code']}")
+            if not result:
+                with defect_draft_service.interactive():
+                    result = await defect_analyzer.analyze_single_image_by_name(
+                        image_name=request.image_name,
+                        construction_type=request.construction_type,
+                        defect_type=request.defect_type,
+                        construction_confidence=request.construction_type_confidence,
+                    )
 
         defect_code = result.get("code", "")
 
@@ -124,6 +139,9 @@ async def queue_group_defect_analysis(
             photo_ids=request.photo_ids,
             object_id=request.object_id,
             defect_type=request.defect_type,
+            construction_confidence=request.construction_type_confidence,
+            tenant=f"user:{current_user.id}",
+            priority=PRIORITY_BULK if request.bulk else PRIORITY_INTERACTIVE,
         )
 
         if not queued:
@@ -305,15 +323,8 @@ async def analyze_construction_type(
     try:
         logger.info(f"Получен запрос на определение типа конструкции для изображения: {request.image_name}")
         
-        cached_url = await redis_service.get_signed_url(request.image_name)
-        
-        if cached_url:
-            logger.info(f"Использование кэшированного signed URL для {request.image_name}")
-            image_url = cached_url
-        else:
-            logger.info(f"Создание нового signed URL для {request.image_name}")
-            image_url = await images_storage.create_signed_url(request.image_name, expiration_minutes=60)
-            await redis_service.cache_signed_url(request.image_name, image_url, ttl_seconds=3000)
+        # gs://-ссылка; провайдер сам выберет способ доставки (image_uri_resolver)
+        image_url = images_storage.uri(request.image_name)
         
         result = await construction_analyzer.analyze_construction_type(
             image_url=image_url,
@@ -340,15 +351,8 @@ async def analyze_defect_description(
     try:
         logger.info(f"Получен запрос на генерацию описания дефектов для изображения: {request.image_name}")
         
-        cached_url = await redis_service.get_signed_url(request.image_name)
-        
-        if cached_url:
-            logger.info(f"Использование кэшированного signed URL для {request.image_name}")
-            image_url = cached_url
-        else:
-            logger.info(f"Создание нового signed URL для {request.image_name}")
-            image_url = await images_storage.create_signed_url(request.image_name, expiration_minutes=60)
-            await redis_service.cache_signed_url(request.image_name, image_url, ttl_seconds=3000)
+        # gs://-ссылка; провайдер сам выберет способ доставки (image_uri_resolver)
+        image_url = images_storage.uri(request.image_name)
         
         result = await construction_analyzer.analyze_defect_description(
             image_url=image_url,
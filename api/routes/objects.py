@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.services.database import get_db
 from api.services.object_service import ObjectService
+from api.services.object_export_service import ObjectExportService
+from common.zip_stream import parse_range
 from api.models.requests import (
     ObjectCreateRequest, 
     ObjectUpdateRequest
@@ -116,3 +119,58 @@ async def delete_object(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
+
+@router.get("/{object_id}/export.zip")
+async def export_object_zip(
+    request: Request,
+    object_id: int = Depends(check_object_access),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    ZIP-архив объекта: фото, изображения планов, ведомость дефектов и marks.json.
+
+    Архив собирается потоково; поддерживается докачка (Range + If-Range по ETag).
+    """
+    export_service = ObjectExportService(db, is_admin=current_user.is_admin)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+
+    export = await export_service.build_export(object_id, etag=if_range if range_header else None)
+    total_size = export.total_size
+
+    if range_header and if_range and if_range != export.etag:
+        # Архив изменился с момента первой загрузки — отдаём целиком
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, total_size)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Запрошенный диапазон вне архива",
+            headers={"Content-Range": f"bytes */{total_size}"},
+        )
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": export.etag,
+        "Content-Disposition": f'attachment; filename="object_{object_id}.zip"',
+        # Фото уже сжаты, а GZipMiddleware сломал бы Content-Length и Range
+        "Content-Encoding": "identity",
+    }
+    if byte_range is None:
+        start, end = 0, total_size
+        status_code = status.HTTP_200_OK
+    else:
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{total_size}"
+    headers["Content-Length"] = str(end - start)
+
+    return StreamingResponse(
+        export.stream(start, end),
+        status_code=status_code,
+        media_type="application/zip",
+        headers=headers,
+    )
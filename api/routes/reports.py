@@ -3,6 +3,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from api.services.cpu_pool_service import CpuPoolOverloadedError
 from api.services.database import get_db
 from api.services.report_service import ReportService
 from api.dependencies.auth_dependencies import get_current_user
@@ -27,6 +28,11 @@ async def generate_defects_report(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e),
         )
+    except CpuPoolOverloadedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -16,6 +16,7 @@ import httpx
 from fastapi import APIRouter, HTTPException
 
 from common.logging_utils import get_user_logger
+from common.retry import RetryPolicy
 
 logger = get_user_logger(__name__)
 
@@ -33,6 +34,18 @@ PLATFORM_SUBPATHS: dict[str, str] = {
 
 _cache: dict[str, tuple[float, dict]] = {}
 
+# Клиент ждёт ответа интерактивно — одна быстрая повторная попытка
+_retry = RetryPolicy("releases", max_attempts=2, max_delay=2.0)
+
+
+async def _fetch_release_metadata(url: str) -> httpx.Response:
+    """GET latest.json; 429 и 5xx бросаются, чтобы сработал повтор"""
+    async with httpx.AsyncClient(timeout=5.0) as client:
+        response = await client.get(url)
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
 
 @router.get("/version")
 async def get_latest_version(
@@ -61,11 +74,13 @@ async def get_latest_version(
     subpath = PLATFORM_SUBPATHS[platform]
     url = f"{RELEASES_BASE_URL}/{subpath}/latest.json"
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(url)
+        response = await _retry.call(_fetch_release_metadata, url)
     except httpx.RequestError as exc:
         logger.error(f"Failed to fetch latest release for {platform}: {exc}")
         raise HTTPException(status_code=502, detail="Release storage unavailable")
+    except httpx.HTTPStatusError as exc:
+        logger.error(f"Unexpected status from releases storage: {exc.response.status_code}")
+        raise HTTPException(status_code=502, detail="Release storage error")
 
     if response.status_code == 404:
         raise HTTPException(status_code=404, detail=f"No releases for platform '{platform}'")
@@ -37,6 +37,8 @@ async def upload_multiple_files_blob(
 
         return responses
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при загрузке файлов: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
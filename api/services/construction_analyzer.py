@@ -1,9 +1,11 @@
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from api.models.responses.construction_responses import ConstructionTypeResult, DefectDescriptionResult
 from api.services.model_manager import ModelManager
 from common.defects_db import SYSTEM_PROMPT, USER_PROMPT_CONSTRUCTIONS, USER_PROMPT_DEFECT_DESCRIPTION
+from common.response_schemas import CONSTRUCTION_TYPE_SCHEMA, DEFECT_DESCRIPTION_SCHEMA
+from settings import LLM_CASCADE_CONSTRUCTION_MIN_CONFIDENCE
 
 logger = logging.getLogger(__name__)
 
@@ -35,12 +37,18 @@ class ConstructionAnalyzer:
                 "temperature": 0.2,
                 "max_output_tokens": 4096,
                 "model_name": "gpt-5.1",
+                "purpose": "construction_type",
+                "response_schema": CONSTRUCTION_TYPE_SCHEMA,
+                "cascade": True,
+                "local": True,
             }
-            result = await self._analyze_with_model(
+            result = await self.model_manager.call_cascade(
                 image_url=image_url,
+                mime_type="image/jpeg",
                 system_prompt=self.system_prompt,
                 user_prompt=self.user_prompt,
-                config=gen_cfg
+                config=gen_cfg,
+                escalation_reason=self._escalation_reason,
             )
             
             return ConstructionTypeResult(
@@ -53,6 +61,13 @@ class ConstructionAnalyzer:
             logger.error(f"Ошибка при определении типа конструкции для {image_url}: {e}")
             raise
     
+    @staticmethod
+    def _escalation_reason(result: Dict[str, Any]) -> Optional[str]:
+        """Тип от дешёвой модели каскада принимается при достаточной уверенности"""
+        if result.get("confidence", 0.0) < LLM_CASCADE_CONSTRUCTION_MIN_CONFIDENCE:
+            return "low_confidence"
+        return None
+
     async def analyze_defect_description(
         self, 
         image_url: str,
@@ -73,6 +88,8 @@ class ConstructionAnalyzer:
                 "temperature": 0.2,
                 "max_output_tokens": 4096,
                 "model_name": "gpt-4o",
+                "purpose": "defect_description",
+                "response_schema": DEFECT_DESCRIPTION_SCHEMA,
             }
             result = await self._analyze_with_model(
                 image_url=image_url,
@@ -110,10 +127,7 @@ class ConstructionAnalyzer:
             Результат анализа
         """
         try:
-            model_name = config.get("model_name")
-            provider = self.model_manager.get_provider(model_name)
-            
-            result = await provider.analyze_image(
+            result = await self.model_manager.call_model(
                 image_url=image_url,
                 mime_type="image/jpeg",
                 system_prompt=system_prompt,
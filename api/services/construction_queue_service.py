@@ -1,52 +1,105 @@
 import asyncio
 import logging
 
-from typing import Optional
-from sqlalchemy import select
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import or_, select
 
 from api.models.entities import Photo
+from api.models.entities.mark import Mark
+from api.models.entities.plan import Plan
 from api.services.construction_analyzer import ConstructionAnalyzer
 from api.services.database import AsyncSessionLocal
+from api.services.defect_analysis_service import CATEGORY_INPUT_MAP, DefectAnalysisService
+from api.services.defect_analyzer import DefectAnalyzer
+from api.services.defect_draft_service import defect_draft_service
 from api.services.model_manager import ModelManager
-from api.services.redis_service import redis_service
+from common.defects_db import get_defect_by_tag
+from common.fair_scheduler import PRIORITY_INTERACTIVE, FairScheduler, parse_weights
 from common.gc_utils import images_storage
-from settings import CONSTRUCTION_QUEUE_MAX_CONCURRENT, CONSTRUCTION_QUEUE_MAX_SIZE
+from common.metrics import metrics
+from settings import (
+    CONSTRUCTION_MARK_WINDOW_SECONDS,
+    CONSTRUCTION_QUEUE_MAX_CONCURRENT,
+    CONSTRUCTION_QUEUE_MAX_SIZE,
+    CONSTRUCTION_QUEUE_TENANT_MAX_DEPTH,
+    DEFECT_SPECULATIVE_ENABLED,
+    FAIR_QUEUE_STARVATION_SECONDS,
+    FAIR_QUEUE_WEIGHTS,
+    FUSED_ANALYSIS_ENABLED,
+)
 
 logger = logging.getLogger(__name__)
 
+# Фото, ожидающее определения типа: (photo_id, image_name, defect_type, tenant)
+QueuedPhoto = Tuple[int, str, Optional[str], Optional[str]]
+
+
+def _is_user_set(photo: Photo) -> bool:
+    """Тип задан пользователем: без уверенности модели или с уверенностью 1.0"""
+    return photo.type is not None and (photo.type_confidence is None or photo.type_confidence >= 1)
+
+
 class ConstructionQueueService:
     """Сервис для управления очередью запросов определения типа конструкции"""
     
-    def __init__(self, max_concurrent: int = 3, max_queue_size: int = 100):
+    def __init__(
+        self,
+        max_concurrent: int = 3,
+        max_queue_size: int = 100,
+        mark_window_seconds: float = 0,
+        max_tenant_depth: int = 0,
+    ):
         """
         Args:
             max_concurrent: Максимальное количество параллельных запросов к OpenAI
             max_queue_size: Максимальный размер очереди ожидающих задач
+            mark_window_seconds: Окно объединения фото одной отметки (0 — без объединения)
+            max_tenant_depth: Лимит задач одного пользователя (0 — без лимита)
         """
-        self.semaphore = asyncio.Semaphore(max_concurrent)
+        # Слоты AI-вызовов: по приоритету и поровну между пользователями
+        self.scheduler = FairScheduler(
+            "construction",
+            slots=max_concurrent,
+            max_tenant_depth=max_tenant_depth,
+            starvation_seconds=FAIR_QUEUE_STARVATION_SECONDS,
+            weights=parse_weights(FAIR_QUEUE_WEIGHTS),
+        )
         self.max_queue_size = max_queue_size
         self.model_manager = ModelManager()
         self.construction_analyzer = ConstructionAnalyzer(self.model_manager)
+        self.defect_analyzer = DefectAnalyzer(self.model_manager)
+        self.mark_window_seconds = mark_window_seconds
         
         # Отслеживание активных задач
         self.active_tasks: set[asyncio.Task] = set()
         self.pending_count = 0
         self._lock = asyncio.Lock()
+        # Фото отметок, ожидающие окончания окна объединения
+        self._mark_groups: Dict[int, List[QueuedPhoto]] = {}
     
     async def queue_analysis(
         self,
         photo_id: int,
-        image_name: str
+        image_name: str,
+        defect_type: Optional[str] = None,
+        mark_id: Optional[int] = None,
+        tenant: Optional[str] = None,
     ) -> bool:
         """
         Добавить задачу анализа в очередь
+
+        Фото одной отметки, добавленные в пределах mark_window_seconds,
+        объединяются: тип определяется один раз (см. _process_mark).
         
         Args:
             photo_id: ID фотографии
             image_name: Имя файла изображения
+            defect_type: Тег дефекта с отметки (для совмещённого вызова)
+            mark_id: ID отметки — для объединения её фото
+            tenant: Пользователь, добавивший фото (справедливая доля и лимит глубины)
             
         Returns:
-            True если задача добавлена, False если очередь переполнена
+            True если задача добавлена, False если очередь или лимит пользователя переполнены
         """
         async with self._lock:
             # Проверяем размер очереди
@@ -56,19 +109,39 @@ class ConstructionQueueService:
                     f"Задача для фото {photo_id} отклонена."
                 )
                 return False
+            if not self.scheduler.admit(tenant):
+                logger.warning(
+                    f"Лимит очереди для {tenant} исчерпан (max: {self.scheduler.max_tenant_depth}). "
+                    f"Задача для фото {photo_id} отклонена."
+                )
+                return False
             
             self.pending_count += 1
+
+            item = (photo_id, image_name, defect_type, tenant)
+            grouped = mark_id is not None and self.mark_window_seconds > 0
+            if grouped:
+                group = self._mark_groups.get(mark_id)
+                if group is not None:
+                    # Окно отметки открыто — фото обработается вместе с группой
+                    group.append(item)
+                    return True
+                self._mark_groups[mark_id] = [item]
+                coro = self._process_mark(mark_id)
+            else:
+                coro = self._process_analysis(*item)
         
         # Создаем задачу
-        task = asyncio.create_task(
-            self._process_analysis(photo_id, image_name)
-        )
+        task = asyncio.create_task(coro)
         
         async with self._lock:
             self.active_tasks.add(task)
         
         # Удаляем задачу из отслеживания после завершения
         task.add_done_callback(lambda t: self._cleanup_task(t))
+        if not grouped:
+            # Глубину группы отметки снимает _process_mark
+            task.add_done_callback(lambda t: self.scheduler.done(tenant))
         
         return True
     
@@ -89,86 +162,224 @@ class ConstructionQueueService:
     async def _process_analysis(
         self,
         photo_id: int,
-        image_name: str
-    ) -> None:
+        image_name: str,
+        defect_type: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ) -> Optional[Tuple[str, float]]:
         """
         Обработка анализа типа конструкции для фото
+
+        При FUSED_ANALYSIS_ENABLED тип конструкции и код дефекта
+        определяются одним вызовом модели и сохраняются вместе; для тегов
+        кросс-категорийных дефектов (код известен без модели) и при
+        неудачном совмещённом вызове определяется только тип. При
+        DEFECT_SPECULATIVE_ENABLED после типа в фоне готовится черновик
+        анализа дефекта (см. DefectDraftService).
         
         Args:
             photo_id: ID фотографии
             image_name: Имя файла изображения
+            defect_type: Тег дефекта с отметки
+            tenant: Пользователь, добавивший фото
+
+        Returns:
+            Тип конструкции и уверенность, None если определить не удалось
         """
-        async with self.semaphore:
-            max_retries = 3
-            retry_delay = 2  # секунды
-            
-            for attempt in range(max_retries):
-                try:
-                    logger.info(f"Начало определения типа конструкции для фото {photo_id} (image_name: {image_name}, попытка {attempt + 1}/{max_retries})")
-                    
-                    # Получаем signed URL для изображения
-                    cached_url = await redis_service.get_signed_url(image_name)
-                    if cached_url:
-                        image_url = cached_url
-                    else:
-                        image_url = await images_storage.create_signed_url(image_name, expiration_minutes=60)
-                        await redis_service.cache_signed_url(image_name, image_url, ttl_seconds=3000)
-                    
-                    # Определяем тип конструкции
-                    result = await self.construction_analyzer.analyze_construction_type(
+        async with self.scheduler.slot(tenant, PRIORITY_INTERACTIVE):
+            # Повторы при rate limit и временных ошибках — в провайдерах моделей (common/retry.py)
+            try:
+                logger.info(f"Начало определения типа конструкции для фото {photo_id} (image_name: {image_name})")
+
+                # gs://-ссылка; провайдер сам выберет способ доставки (image_uri_resolver)
+                image_url = images_storage.uri(image_name)
+                
+                if FUSED_ANALYSIS_ENABLED and not get_defect_by_tag(defect_type):
+                    fused = await self.model_manager.analyze_fused(
                         image_url=image_url,
-                        image_name=image_name
+                        mime_type="image/jpeg",
+                        config={"model_name": "gpt-5.1", "temperature": 0.2, "cascade": True},
                     )
-                    
-                    # Успешно получили результат, обновляем фото в БД
-                    try:
-                        async with AsyncSessionLocal() as db:
-                            result_query = await db.execute(
-                                select(Photo).where(Photo.id == photo_id)
-                            )
-                            photo = result_query.scalar_one_or_none()
-                            
-                            if photo:
-                                photo.type = result.construction_type
-                                photo.type_confidence = result.confidence
-                                await db.commit()
-                                logger.info(
-                                    f"Тип конструкции '{result.construction_type}' "
-                                    f"(confidence: {result.confidence}) установлен для фото {photo_id}"
-                                )
-                            else:
-                                logger.warning(f"Фото {photo_id} не найдено в БД при попытке обновления типа конструкции")
-                    except Exception as db_error:
-                        logger.error(f"Ошибка при обновлении фото {photo_id} в БД: {db_error}", exc_info=True)
-                    
-                    # Успешно завершили, выходим из цикла retry
-                    return
-                    
-                except Exception as e:
-                    error_msg = str(e).lower()
-                    is_rate_limit = "rate limit" in error_msg or "превышен лимит" in error_msg
-                    
-                    if is_rate_limit and attempt < max_retries - 1:
-                        # Экспоненциальная задержка при rate limit
-                        delay = retry_delay * (2 ** attempt)
-                        logger.warning(
-                            f"Rate limit при определении типа конструкции для фото {photo_id}. "
-                            f"Повтор через {delay}с (попытка {attempt + 1}/{max_retries})"
-                        )
-                        await asyncio.sleep(delay)
+                    if not fused.get("parse_error"):
+                        await self._save_fused(photo_id, fused)
+                        return fused["construction_type"], fused["confidence"]
+                    logger.warning(
+                        f"Совмещённый вызов для фото {photo_id} не дал результата, определяем только тип"
+                    )
+
+                # Определяем тип конструкции
+                result = await self.construction_analyzer.analyze_construction_type(
+                    image_url=image_url,
+                    image_name=image_name
+                )
+                
+                # Успешно получили результат, обновляем фото в БД
+                await self._save_type([photo_id], result.construction_type, result.confidence)
+                self._speculate(image_name, defect_type, tenant, result.construction_type, result.confidence)
+                return result.construction_type, result.confidence
+
+            except Exception as e:
+                logger.error(
+                    f"Не удалось определить тип конструкции для фото {photo_id}: {e}",
+                    exc_info=True
+                )
+                return None
+
+    async def _process_mark(self, mark_id: int) -> None:
+        """
+        Определение типа конструкции для фото одной отметки
+
+        Инженер снимает один элемент несколькими фото, поэтому фото,
+        добавленные в окно mark_window_seconds, классифицируются один раз —
+        по первому фото группы, — и тип переносится на остальные. Если у
+        отметки есть фото с типом, заданным пользователем, и модель с ним
+        не согласна, остальные фото группы классифицируются по отдельности.
+        Типы, заданные пользователем, не перезаписываются.
+        """
+        # Задача группы учтена в pending_count один раз — остальные фото снимаем здесь
+        items: List[QueuedPhoto] = []
+        try:
+            await asyncio.sleep(self.mark_window_seconds)
+            async with self._lock:
+                items = self._mark_groups.pop(mark_id, [])
+            if not items:
+                return
+            (photo_id, image_name, defect_type, tenant), rest = items[0], items[1:]
+            result = await self._process_analysis(photo_id, image_name, defect_type, tenant)
+            if not rest:
+                return
+
+            user_type = await self._user_set_type(mark_id, exclude=[item[0] for item in items])
+            if result is None or (user_type is not None and user_type != result[0]):
+                outcome = "failed" if result is None else "reclassified"
+                logger.info(
+                    f"Отметка {mark_id}: тип по фото {photo_id} — {result and result[0]}, "
+                    f"заданный пользователем — {user_type}; {len(rest)} фото классифицируются отдельно"
+                )
+                await asyncio.gather(*(self._process_analysis(*item) for item in rest))
+            else:
+                outcome = "propagated"
+                construction_type, confidence = result
+                await self._save_type([item[0] for item in rest], construction_type, confidence)
+                for _, rest_image, rest_defect_type, rest_tenant in rest:
+                    self._speculate(rest_image, rest_defect_type, rest_tenant, construction_type, confidence)
+                metrics.inc("construction_queue.photos_coalesced_total", len(rest))
+                logger.info(
+                    f"Отметка {mark_id}: тип '{construction_type}' перенесён с фото {photo_id} "
+                    f"на {len(rest)} фото"
+                )
+            metrics.inc("construction_queue.mark_groups_total", outcome=outcome)
+        finally:
+            async with self._lock:
+                self.pending_count = max(0, self.pending_count - max(0, len(items) - 1))
+            for item in items:
+                self.scheduler.done(item[3])
+
+    async def _user_set_type(self, mark_id: int, exclude: List[int]) -> Optional[str]:
+        """Тип конструкции, заданный пользователем для другого фото отметки"""
+        try:
+            async with AsyncSessionLocal() as db:
+                photos = (await db.execute(
+                    select(Photo)
+                    .where(
+                        Photo.mark_id == mark_id,
+                        Photo.id.notin_(exclude),
+                        Photo.type.isnot(None),
+                        or_(Photo.type_confidence.is_(None), Photo.type_confidence >= 1),
+                    )
+                    .order_by(Photo.id.desc())
+                    .limit(1)
+                )).scalars().all()
+        except Exception as db_error:
+            logger.error(f"Ошибка чтения типов фото отметки {mark_id}: {db_error}", exc_info=True)
+            return None
+        return photos[0].type if photos else None
+
+    async def _save_type(self, photo_ids: List[int], construction_type: str, confidence: float) -> None:
+        """Сохранить тип конструкции фото; типы, заданные пользователем, не меняются"""
+        try:
+            async with AsyncSessionLocal() as db:
+                photos = (await db.execute(select(Photo).where(Photo.id.in_(photo_ids)))).scalars().all()
+                if len(photos) < len(photo_ids):
+                    missing = set(photo_ids) - {photo.id for photo in photos}
+                    logger.warning(f"Фото {sorted(missing)} не найдены в БД при попытке обновления типа конструкции")
+                for photo in photos:
+                    if _is_user_set(photo):
+                        logger.info(f"Тип фото {photo.id} задан пользователем ('{photo.type}'), не перезаписываем")
                         continue
-                    else:
-                        # Другие ошибки или последняя попытка
-                        logger.error(
-                            f"Ошибка при определении типа конструкции для фото {photo_id} "
-                            f"(попытка {attempt + 1}/{max_retries}): {e}",
-                            exc_info=True
-                        )
-                        if attempt == max_retries - 1:
-                            # Последняя попытка неудачна, выходим
-                            logger.error(f"Не удалось определить тип конструкции для фото {photo_id} после {max_retries} попыток")
-                            return
-    
+                    photo.type = construction_type
+                    photo.type_confidence = confidence
+                await db.commit()
+                logger.info(
+                    f"Тип конструкции '{construction_type}' "
+                    f"(confidence: {confidence}) установлен для фото {photo_ids}"
+                )
+        except Exception as db_error:
+            logger.error(f"Ошибка при обновлении фото {photo_ids} в БД: {db_error}", exc_info=True)
+
+    def _speculate(
+        self,
+        image_name: str,
+        defect_type: Optional[str],
+        tenant: Optional[str],
+        construction_type: str,
+        confidence: float,
+    ) -> None:
+        if DEFECT_SPECULATIVE_ENABLED and not get_defect_by_tag(defect_type):
+            defect_draft_service.speculate(
+                self.defect_analyzer,
+                image_name=image_name,
+                construction_type=construction_type,
+                defect_type=defect_type,
+                construction_confidence=confidence,
+                scheduler=self.scheduler,
+                tenant=tenant,
+            )
+
+    async def _save_fused(self, photo_id: int, fused: dict) -> None:
+        """Тип конструкции и анализ дефекта сохраняются одним коммитом"""
+        try:
+            async with AsyncSessionLocal() as db:
+                photo = (await db.execute(select(Photo).where(Photo.id == photo_id))).scalar_one_or_none()
+                if not photo:
+                    logger.warning(f"Фото {photo_id} не найдено в БД при сохранении совмещённого анализа")
+                    return
+
+                if _is_user_set(photo):
+                    logger.info(f"Тип фото {photo_id} задан пользователем ('{photo.type}'), не перезаписываем")
+                else:
+                    photo.type = fused["construction_type"]
+                    photo.type_confidence = fused["confidence"]
+                if not fused.get("code"):
+                    await db.commit()
+                    logger.info(f"Тип конструкции '{photo.type}' установлен для фото {photo_id}, код дефекта не определён")
+                    return
+
+                object_id = (await db.execute(
+                    select(Plan.object_id)
+                    .join(Mark, Mark.plan_id == Plan.id)
+                    .where(Mark.id == photo.mark_id)
+                )).scalar_one_or_none()
+                category = fused.get("category") or ""
+                if category not in CATEGORY_INPUT_MAP:
+                    category = "В"  # Дефолт — наименее опасная категория
+
+                # create_analysis коммитит сессию — вместе с типом конструкции
+                await DefectAnalysisService(db).create_analysis(
+                    photo_id=photo_id,
+                    defect_description=fused["description"],
+                    recommendation=fused["recommendation"],
+                    category=category,
+                    confidence=fused.get("code_confidence"),
+                    defect_code=fused["code"],
+                    object_id=object_id,
+                )
+                logger.info(
+                    f"Совмещённый анализ сохранён для фото {photo_id}: "
+                    f"тип '{photo.type}' ({fused['confidence']}), код {fused['code']}"
+                )
+        except Exception as db_error:
+            logger.error(f"Ошибка при сохранении совмещённого анализа фото {photo_id}: {db_error}", exc_info=True)
+
     def get_queue_stats(self) -> dict:
         """
         Получить статистику очереди
@@ -180,7 +391,8 @@ class ConstructionQueueService:
             "pending_count": self.pending_count,
             "active_tasks_count": len(self.active_tasks),
             "max_queue_size": self.max_queue_size,
-            "max_concurrent": self.semaphore._value
+            "max_concurrent": self.scheduler.slots,
+            "scheduler": self.scheduler.get_stats(),
         }
 
 # Глобальный экземпляр сервиса
@@ -192,7 +404,9 @@ def get_construction_queue_service() -> ConstructionQueueService:
     if _construction_queue_service is None:
         _construction_queue_service = ConstructionQueueService(
             max_concurrent=CONSTRUCTION_QUEUE_MAX_CONCURRENT,
-            max_queue_size=CONSTRUCTION_QUEUE_MAX_SIZE
+            max_queue_size=CONSTRUCTION_QUEUE_MAX_SIZE,
+            mark_window_seconds=CONSTRUCTION_MARK_WINDOW_SECONDS,
+            max_tenant_depth=CONSTRUCTION_QUEUE_TENANT_MAX_DEPTH,
         )
     return _construction_queue_service
 
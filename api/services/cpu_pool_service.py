@@ -0,0 +1,191 @@
+"""
+Общий пул процессов для CPU-тяжёлой работы.
+
+Декодирование/сжатие изображений, парсинг DOCX/PDF и генерация отчётов
+держат GIL и останавливают event loop для всех запросов процесса. Здесь
+они выполняются в отдельных ProcessPoolExecutor — по одному на класс
+нагрузки, чтобы пачка отчётов не вытесняла сжатие загружаемых фото.
+
+У каждого пула есть лимит задач (работающие + ожидающие). При
+переполнении вызов сразу падает с CpuPoolOverloadedError — роуты
+отдают 503. Отмена корутины снимает задачу, если она ещё не запущена
+в процессе. Время ожидания в очереди и время выполнения пишутся в
+метрики cpu_pool.queue_wait_seconds / cpu_pool.run_seconds.
+
+Вызываемые функции должны быть модульного уровня (pickle) и не тянуть
+GCS/БД — см. common/image_processing.py, common/document_parsing.py.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from common.metrics import metrics
+from settings import (
+    CPU_POOL_DOCUMENT_QUEUE,
+    CPU_POOL_DOCUMENT_WORKERS,
+    CPU_POOL_IMAGE_QUEUE,
+    CPU_POOL_IMAGE_WORKERS,
+    CPU_POOL_MAX_TASKS_PER_CHILD,
+    CPU_POOL_REPORT_QUEUE,
+    CPU_POOL_REPORT_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CpuPool(str, Enum):
+    """Классы CPU-нагрузки, у каждого свой пул процессов."""
+    IMAGE = "image"
+    DOCUMENT = "document"
+    REPORT = "report"
+
+
+class CpuPoolOverloadedError(RuntimeError):
+    """Очередь пула заполнена — запрос нужно отклонить (HTTP 503)."""
+
+    def __init__(self, pool: str):
+        self.pool = pool
+        super().__init__(f"Пул обработки '{pool}' перегружен, повторите запрос позже")
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict) -> Tuple[Any, float, float]:
+    """Выполняется в процессе пула: результат и wall-clock время старта/окончания."""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return result, started, time.time()
+
+
+class _Pool:
+    """Один пул процессов с лимитом задач."""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def capacity(self) -> int:
+        return max(self.workers, 1) + self.max_queue
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=CPU_POOL_MAX_TASKS_PER_CHILD or None,
+            )
+            logger.info("CPU пул '%s' запущен: %d процессов", self.name, self.workers)
+        return self._executor
+
+    def reset(self) -> None:
+        """Выбрасывает сломанный executor; следующий вызов создаст новый."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class CpuPoolService:
+    """Диспетчер CPU-задач по пулам процессов"""
+
+    def __init__(self, pool_sizes: Dict[CpuPool, Tuple[int, int]]):
+        """
+        Args:
+            pool_sizes: {класс нагрузки: (число процессов, размер очереди)}.
+                0 процессов — задача выполняется в потоке (asyncio.to_thread),
+                лимит очереди при этом сохраняется.
+        """
+        self._pools = {
+            pool: _Pool(pool.value, workers, max_queue)
+            for pool, (workers, max_queue) in pool_sizes.items()
+        }
+
+    async def run(self, pool: CpuPool, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Выполняет fn(*args, **kwargs) в пуле процессов
+
+        Raises:
+            CpuPoolOverloadedError: очередь пула заполнена
+        """
+        p = self._pools[pool]
+        if p.in_flight >= p.capacity:
+            metrics.inc("cpu_pool.rejected_total", pool=p.name)
+            logger.warning(
+                "CPU пул '%s' перегружен (in_flight: %d, capacity: %d), задача %s отклонена",
+                p.name, p.in_flight, p.capacity, getattr(fn, "__name__", fn),
+            )
+            raise CpuPoolOverloadedError(p.name)
+
+        p.in_flight += 1
+        submitted = time.time()
+        try:
+            if p.workers <= 0:
+                result, started, finished = await asyncio.to_thread(_timed_call, fn, args, kwargs)
+            else:
+                future = p.get_executor().submit(_timed_call, fn, args, kwargs)
+                try:
+                    result, started, finished = await asyncio.wrap_future(future)
+                except BrokenProcessPool:
+                    logger.error("CPU пул '%s' сломан (процесс упал), пересоздаём", p.name)
+                    p.reset()
+                    raise
+        except asyncio.CancelledError:
+            metrics.inc("cpu_pool.cancelled_total", pool=p.name)
+            raise
+        except Exception:
+            metrics.inc("cpu_pool.failed_total", pool=p.name)
+            raise
+        finally:
+            p.in_flight -= 1
+
+        metrics.observe("cpu_pool.queue_wait_seconds", max(started - submitted, 0.0), pool=p.name)
+        metrics.observe("cpu_pool.run_seconds", finished - started, pool=p.name)
+        return result
+
+    def get_stats(self) -> dict:
+        """
+        Получить статистику пулов
+
+        Returns:
+            {pool: {workers, max_queue, in_flight}}
+        """
+        return {
+            p.name: {
+                "workers": p.workers,
+                "max_queue": p.max_queue,
+                "in_flight": p.in_flight,
+            }
+            for p in self._pools.values()
+        }
+
+    def shutdown(self) -> None:
+        for p in self._pools.values():
+            p.shutdown()
+
+
+# Глобальный экземпляр сервиса
+_cpu_pool_service: Optional[CpuPoolService] = None
+
+
+def get_cpu_pool_service() -> CpuPoolService:
+    """Получить глобальный экземпляр CpuPoolService"""
+    global _cpu_pool_service
+    if _cpu_pool_service is None:
+        _cpu_pool_service = CpuPoolService({
+            CpuPool.IMAGE: (CPU_POOL_IMAGE_WORKERS, CPU_POOL_IMAGE_QUEUE),
+            CpuPool.DOCUMENT: (CPU_POOL_DOCUMENT_WORKERS, CPU_POOL_DOCUMENT_QUEUE),
+            CpuPool.REPORT: (CPU_POOL_REPORT_WORKERS, CPU_POOL_REPORT_QUEUE),
+        })
+    return _cpu_pool_service
@@ -4,11 +4,20 @@ import logging
 from typing import Optional
 
 from api.services.defect_analyzer import DefectAnalyzer
+from api.services.defect_batcher import DefectBatcher
 from api.services.defect_analysis_service import DefectAnalysisService
 from api.services.model_manager import ModelManager
 from api.services.database import AsyncSessionLocal
 from common.defects_db import get_defect_by_tag
-from settings import DEFECT_QUEUE_MAX_CONCURRENT, DEFECT_QUEUE_MAX_SIZE
+from common.fair_scheduler import PRIORITY_INTERACTIVE, FairScheduler, parse_weights
+from settings import (
+    DEFECT_BATCH_ENABLED,
+    DEFECT_QUEUE_MAX_CONCURRENT,
+    DEFECT_QUEUE_MAX_SIZE,
+    DEFECT_QUEUE_TENANT_MAX_DEPTH,
+    FAIR_QUEUE_STARVATION_SECONDS,
+    FAIR_QUEUE_WEIGHTS,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,15 +25,27 @@ logger = logging.getLogger(__name__)
 class DefectAnalysisQueueService:
     """Сервис для управления очередью групповых запросов анализа дефектов.
 
-    Паттерн аналогичен ConstructionQueueService: fire-and-forget с семафором
-    для ограничения параллельных AI-вызовов.
+    Паттерн аналогичен ConstructionQueueService: fire-and-forget, слоты
+    AI-вызовов распределяет FairScheduler — по приоритету и поровну между
+    пользователями.
     """
 
-    def __init__(self, max_concurrent: int = 3, max_queue_size: int = 200):
-        self.semaphore = asyncio.Semaphore(max_concurrent)
+    def __init__(self, max_concurrent: int = 3, max_queue_size: int = 200, max_tenant_depth: int = 0):
         self.max_queue_size = max_queue_size
         self.model_manager = ModelManager()
         self.defect_analyzer = DefectAnalyzer(self.model_manager)
+        # Пакетный режим: параллельность вызовов ограничивает сам батчер, а
+        # планировщик — справедливый допуск групп в пакеты
+        self.batcher = (
+            DefectBatcher(self.defect_analyzer, asyncio.Semaphore(max_concurrent)) if DEFECT_BATCH_ENABLED else None
+        )
+        self.scheduler = FairScheduler(
+            "defect",
+            slots=max_concurrent * (self.batcher.max_images if self.batcher else 1),
+            max_tenant_depth=max_tenant_depth,
+            starvation_seconds=FAIR_QUEUE_STARVATION_SECONDS,
+            weights=parse_weights(FAIR_QUEUE_WEIGHTS),
+        )
 
         self.active_tasks: set[asyncio.Task] = set()
         self.pending_count = 0
@@ -37,6 +58,9 @@ class DefectAnalysisQueueService:
         photo_ids: list[int],
         object_id: Optional[int],
         defect_type: Optional[str] = None,
+        construction_confidence: Optional[float] = None,
+        tenant: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> bool:
         """
         Поставить групповой анализ в очередь.
@@ -44,8 +68,13 @@ class DefectAnalysisQueueService:
         AI анализирует одно репрезентативное изображение, результат
         сохраняется для всех photo_ids группы.
 
+        Args:
+            tenant: Пользователь, поставивший задачу (справедливая доля и лимит глубины)
+            priority: Класс приоритета (common/fair_scheduler.py)
+
         Returns:
-            True если задача поставлена в очередь, False если очередь переполнена
+            True если задача поставлена в очередь, False если очередь
+            или лимит пользователя переполнены
         """
         async with self._lock:
             if self.pending_count >= self.max_queue_size:
@@ -55,17 +84,27 @@ class DefectAnalysisQueueService:
                     f"Группа из {len(photo_ids)} фото отклонена."
                 )
                 return False
+            if not self.scheduler.admit(tenant):
+                logger.warning(
+                    f"Лимит очереди анализа дефектов для {tenant} исчерпан "
+                    f"(max: {self.scheduler.max_tenant_depth}). Группа из {len(photo_ids)} фото отклонена."
+                )
+                return False
 
             self.pending_count += 1
 
         task = asyncio.create_task(
-            self._process_group_analysis(image_name, construction_type, photo_ids, object_id, defect_type)
+            self._process_group_analysis(
+                image_name, construction_type, photo_ids, object_id, defect_type, construction_confidence,
+                tenant, priority,
+            )
         )
 
         async with self._lock:
             self.active_tasks.add(task)
 
         task.add_done_callback(lambda t: self._cleanup_task(t))
+        task.add_done_callback(lambda t: self.scheduler.done(tenant))
 
         return True
 
@@ -90,6 +129,9 @@ class DefectAnalysisQueueService:
         photo_ids: list[int],
         object_id: Optional[int],
         defect_type: Optional[str] = None,
+        construction_confidence: Optional[float] = None,
+        tenant: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
     ) -> None:
         """
         Обработка группового анализа:
@@ -131,96 +173,74 @@ class DefectAnalysisQueueService:
                 )
             return
 
-        async with self.semaphore:
-            max_retries = 3
-            retry_delay = 2
+        async with self.scheduler.slot(tenant, priority):
+            # Повторы при rate limit и временных ошибках — в провайдерах моделей (common/retry.py)
+            try:
+                logger.info(
+                    f"Начало группового анализа: image={image_name}, "
+                    f"construction_type={construction_type}, "
+                    f"photo_ids={photo_ids}"
+                )
 
-            for attempt in range(max_retries):
-                try:
-                    logger.info(
-                        f"Начало группового анализа: image={image_name}, "
-                        f"construction_type={construction_type}, "
-                        f"photo_ids={photo_ids} (попытка {attempt + 1}/{max_retries})"
-                    )
+                # 1. AI анализ репрезентативного фото (в пакетном режиме — в общем запросе)
+                analyze = self.batcher.analyze if self.batcher else self.defect_analyzer.analyze_single_image_by_name
+                result = await analyze(
+                    image_name=image_name,
+                    construction_type=construction_type,
+                    defect_type=defect_type,
+                    construction_confidence=construction_confidence,
+                )
 
-                    # 1. AI анализ репрезентативного фото
-                    result = await self.defect_analyzer.analyze_single_image_by_name(
-                        image_name=image_name,
-                        construction_type=construction_type
-                    )
+                description = result.get("description", "Дефект не определен")
+                recommendation = result.get("recommendation", "Рекомендация не предоставлена")
+                category = result.get("category", "") or ""
+                defect_code = result.get("code", "")
 
-                    description = result.get("description", "Дефект не определен")
-                    recommendation = result.get("recommendation", "Рекомендация не предоставлена")
-                    category = result.get("category", "") or ""
-                    defect_code = result.get("code", "")
+                # Нормализация категории: AI может вернуть пустую или невалидную
+                valid_categories = {"А", "Б", "В", "A", "B", "C"}
+                if category not in valid_categories:
+                    category = "В"  # Дефолт — наименее опасная категория
 
-                    # Нормализация категории: AI может вернуть пустую или невалидную
-                    valid_categories = {"А", "Б", "В", "A", "B", "C"}
-                    if category not in valid_categories:
-                        category = "В"  # Дефолт — наименее опасная категория
+                logger.info(
+                    f"AI анализ завершён для группы: code={defect_code}, "
+                    f"category={category}, photo_count={len(photo_ids)}"
+                )
+
+                # 2. Сохранение результата для всех photo_ids
+                async with AsyncSessionLocal() as db:
+                    service = DefectAnalysisService(db)
+
+                    saved_count = 0
+                    error_count = 0
+
+                    for photo_id in photo_ids:
+                        try:
+                            await service.create_analysis(
+                                photo_id=photo_id,
+                                defect_description=description,
+                                recommendation=recommendation,
+                                category=category,
+                                defect_code=defect_code,
+                                object_id=object_id
+                            )
+                            saved_count += 1
+                        except Exception as save_error:
+                            error_count += 1
+                            logger.error(
+                                f"Ошибка сохранения анализа для фото {photo_id}: {save_error}"
+                            )
 
                     logger.info(
-                        f"AI анализ завершён для группы: code={defect_code}, "
-                        f"category={category}, photo_count={len(photo_ids)}"
+                        f"Групповой анализ завершён: "
+                        f"saved={saved_count}, errors={error_count}, "
+                        f"image={image_name}"
                     )
 
-                    # 2. Сохранение результата для всех photo_ids
-                    async with AsyncSessionLocal() as db:
-                        service = DefectAnalysisService(db)
-
-                        saved_count = 0
-                        error_count = 0
-
-                        for photo_id in photo_ids:
-                            try:
-                                await service.create_analysis(
-                                    photo_id=photo_id,
-                                    defect_description=description,
-                                    recommendation=recommendation,
-                                    category=category,
-                                    defect_code=defect_code,
-                                    object_id=object_id
-                                )
-                                saved_count += 1
-                            except Exception as save_error:
-                                error_count += 1
-                                logger.error(
-                                    f"Ошибка сохранения анализа для фото {photo_id}: {save_error}"
-                                )
-
-                        logger.info(
-                            f"Групповой анализ завершён: "
-                            f"saved={saved_count}, errors={error_count}, "
-                            f"image={image_name}"
-                        )
-
-                    # Успех — выходим из retry-цикла
-                    return
-
-                except Exception as e:
-                    error_msg = str(e).lower()
-                    is_rate_limit = "rate limit" in error_msg or "превышен лимит" in error_msg
-
-                    if is_rate_limit and attempt < max_retries - 1:
-                        delay = retry_delay * (2 ** attempt)
-                        logger.warning(
-                            f"Rate limit при групповом анализе ({image_name}). "
-                            f"Повтор через {delay}с (попытка {attempt + 1}/{max_retries})"
-                        )
-                        await asyncio.sleep(delay)
-                        continue
-                    else:
-                        logger.error(
-                            f"Ошибка группового анализа ({image_name}, "
-                            f"попытка {attempt + 1}/{max_retries}): {e}",
-                            exc_info=True
-                        )
-                        if attempt == max_retries - 1:
-                            logger.error(
-                                f"Не удалось выполнить групповой анализ для {image_name} "
-                                f"после {max_retries} попыток"
-                            )
-                            return
+            except Exception as e:
+                logger.error(
+                    f"Не удалось выполнить групповой анализ для {image_name}: {e}",
+                    exc_info=True
+                )
 
     def get_queue_stats(self) -> dict:
         """Статистика очереди"""
@@ -228,7 +248,8 @@ class DefectAnalysisQueueService:
             "pending_count": self.pending_count,
             "active_tasks_count": len(self.active_tasks),
             "max_queue_size": self.max_queue_size,
-            "max_concurrent": self.semaphore._value
+            "max_concurrent": self.scheduler.slots,
+            "scheduler": self.scheduler.get_stats(),
         }
 
 
@@ -242,6 +263,7 @@ def get_defect_analysis_queue_service() -> DefectAnalysisQueueService:
     if _defect_analysis_queue_service is None:
         _defect_analysis_queue_service = DefectAnalysisQueueService(
             max_concurrent=DEFECT_QUEUE_MAX_CONCURRENT,
-            max_queue_size=DEFECT_QUEUE_MAX_SIZE
+            max_queue_size=DEFECT_QUEUE_MAX_SIZE,
+            max_tenant_depth=DEFECT_QUEUE_TENANT_MAX_DEPTH,
         )
     return _defect_analysis_queue_service
@@ -4,7 +4,7 @@ import logging
 from api.services.model_manager import ModelManager
 from api.models.config import DefectResult, AnalysisConfig, ImageInfo
 from common.gc_utils import images_storage
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -101,10 +101,32 @@ class DefectAnalyzer:
                 model_used="error"
             )
     
+    @staticmethod
+    async def resolve_image(image_name: str) -> Tuple[str, str]:
+        """
+        gs://-ссылка на изображение в GCP bucket и MIME тип по расширению файла.
+        Подпись URL или загрузку байтов провайдер делает сам (image_uri_resolver).
+        """
+        image_uri = images_storage.uri(image_name)
+
+        if image_name.lower().endswith('.png'):
+            mime_type = "image/png"
+        elif image_name.lower().endswith('.jpg') or image_name.lower().endswith('.jpeg'):
+            mime_type = "image/jpeg"
+        elif image_name.lower().endswith('.gif'):
+            mime_type = "image/gif"
+        elif image_name.lower().endswith('.webp'):
+            mime_type = "image/webp"
+        else:
+            mime_type = "image/jpeg"  # по умолчанию
+        return image_uri, mime_type
+
     async def analyze_single_image_by_name(
         self, 
         image_name: str,
-        construction_type: str = None
+        construction_type: str = None,
+        defect_type: str = None,
+        construction_confidence: float = None,
     ) -> dict:
         """
         Анализ одного изображения по имени файла
@@ -112,31 +134,22 @@ class DefectAnalyzer:
         Args:
             image_name: Имя файла изображения в GCP bucket
             construction_type: Тип конструкции для фильтрации базы дефектов
+            defect_type: Тег дефекта с отметки — для шорт-листа кандидатов
+            construction_confidence: Уверенность в типе конструкции (None — задан явно)
             
         Returns:
             Словарь с результатом анализа (description, recommendation)
         """
         try:
-            # Создаем подписной URL для изображения
-            signed_url = await images_storage.create_signed_url(image_name, expiration_minutes=60)
-            
-            # Определяем MIME тип по расширению файла
-            if image_name.lower().endswith('.png'):
-                mime_type = "image/png"
-            elif image_name.lower().endswith('.jpg') or image_name.lower().endswith('.jpeg'):
-                mime_type = "image/jpeg"
-            elif image_name.lower().endswith('.gif'):
-                mime_type = "image/gif"
-            elif image_name.lower().endswith('.webp'):
-                mime_type = "image/webp"
-            else:
-                mime_type = "image/jpeg"  # по умолчанию
+            image_uri, mime_type = await self.resolve_image(image_name)
             
-            # Конфигурация для gpt-5.1 с дефолтными параметрами
+            # Конфигурация для gpt-5.1 с дефолтными параметрами; при включённом
+            # каскаде (LLM_CASCADE_ENABLED) сначала пробуется дешёвая модель
             config = {
                 "model_name": "gpt-5.1",
                 "temperature": 0.2,
-                "max_tokens": 1024
+                "max_tokens": 1024,
+                "cascade": True,
             }
             
             logger.info(f"Начинаю анализ изображения {image_name} с моделью gpt-5.1")
@@ -145,10 +158,12 @@ class DefectAnalyzer:
             
             # Анализируем изображение
             analysis_result = await self.model_manager.analyze_image(
-                image_url=signed_url,
+                image_url=image_uri,
                 mime_type=mime_type,
                 config=config,
-                construction_type=construction_type
+                construction_type=construction_type,
+                defect_type=defect_type,
+                construction_confidence=construction_confidence,
             )
             
             # Возвращаем code, description, recommendation и category
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from api.services.defect_analyzer import DefectAnalyzer
+from common.defects_db import get_catalog, get_user_prompt
+from common.metrics import metrics
+from settings import (
+    DEFECT_BATCH_IMAGE_TOKENS,
+    DEFECT_BATCH_MAX_IMAGES,
+    DEFECT_BATCH_MAX_INPUT_TOKENS,
+    DEFECT_BATCH_TARGET_SECONDS,
+    DEFECT_BATCH_WINDOW_SECONDS,
+    DEFECT_PROMPT_CHARS_PER_TOKEN,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _BatchItem:
+    image_name: str
+    image_url: str
+    mime_type: str
+    construction_type: Optional[str]
+    defect_type: Optional[str]
+    construction_confidence: Optional[float]
+    future: asyncio.Future = field(repr=False)
+
+
+class DefectBatcher:
+    """
+    Пакетное кодирование дефектов для фоновых очередей.
+
+    Изображения одного типа конструкции (значит, с одним промптом базы)
+    копятся до DEFECT_BATCH_WINDOW_SECONDS и уходят одним запросом с
+    массивом кодов в ответе; результаты раскладываются по изображениям.
+    Размер пакета ограничен бюджетом входных токенов и подстраивается под
+    задержку: при ответе дольше DEFECT_BATCH_TARGET_SECONDS уменьшается
+    вдвое, при быстром — растёт на единицу. Одиночное изображение и
+    изображения без корректного кода в ответе анализируются обычным
+    вызовом (с шорт-листом).
+    """
+
+    def __init__(
+        self,
+        defect_analyzer: DefectAnalyzer,
+        semaphore: asyncio.Semaphore,
+        max_images: int = DEFECT_BATCH_MAX_IMAGES,
+        window_seconds: float = DEFECT_BATCH_WINDOW_SECONDS,
+        target_seconds: float = DEFECT_BATCH_TARGET_SECONDS,
+        max_input_tokens: int = DEFECT_BATCH_MAX_INPUT_TOKENS,
+        image_tokens: int = DEFECT_BATCH_IMAGE_TOKENS,
+    ):
+        self.defect_analyzer = defect_analyzer
+        self.model_manager = defect_analyzer.model_manager
+        self.semaphore = semaphore
+        self.max_images = max_images
+        self.window_seconds = window_seconds
+        self.target_seconds = target_seconds
+        self.max_input_tokens = max_input_tokens
+        self.image_tokens = image_tokens
+        self.batch_size = max_images
+
+        self._pending: Dict[Optional[str], List[_BatchItem]] = {}
+        self._timers: Dict[Optional[str], asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def _limit(self, key: Optional[str]) -> int:
+        """Размер пакета: адаптивный, но не больше бюджета входных токенов"""
+        prompt_tokens = len(get_user_prompt(key)) // DEFECT_PROMPT_CHARS_PER_TOKEN
+        by_tokens = (self.max_input_tokens - prompt_tokens) // self.image_tokens
+        return max(1, min(self.batch_size, by_tokens))
+
+    def _adapt(self, elapsed: float) -> None:
+        if elapsed > self.target_seconds:
+            self.batch_size = max(2, self.batch_size // 2)
+        elif elapsed < self.target_seconds / 2:
+            self.batch_size = min(self.max_images, self.batch_size + 1)
+
+    async def analyze(
+        self,
+        image_name: str,
+        construction_type: Optional[str] = None,
+        defect_type: Optional[str] = None,
+        construction_confidence: Optional[float] = None,
+    ) -> dict:
+        """Результат в формате DefectAnalyzer.analyze_single_image_by_name"""
+        image_url, mime_type = await self.defect_analyzer.resolve_image(image_name)
+        key = get_catalog().type_key(construction_type)
+        item = _BatchItem(
+            image_name, image_url, mime_type, construction_type, defect_type, construction_confidence,
+            asyncio.get_running_loop().create_future(),
+        )
+
+        pending = self._pending.setdefault(key, [])
+        pending.append(item)
+        if len(pending) >= self._limit(key):
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window_seconds, self._flush, key)
+        return await item.future
+
+    def _flush(self, key: Optional[str]) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(key, [])
+        if items:
+            task = asyncio.create_task(self._run(key, items))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Optional[str], items: List[_BatchItem]) -> None:
+        try:
+            results: List[Optional[dict]] = [None] * len(items)
+            if len(items) > 1:
+                results = await self._run_batch(key, items)
+            leftovers = [(i, item) for i, item in enumerate(items) if results[i] is None]
+            singles = await asyncio.gather(*(self._run_single(item) for _, item in leftovers))
+            for (i, _), result in zip(leftovers, singles):
+                results[i] = result
+            for item, result in zip(items, results):
+                if not item.future.done():
+                    item.future.set_result(result)
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+    async def _run_batch(self, key: Optional[str], items: List[_BatchItem]) -> List[Optional[dict]]:
+        config = {"model_name": "gpt-5.1", "temperature": 0.2, "max_tokens": 128 * len(items)}
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                analyses = await self.model_manager.analyze_images_batch(
+                    [(item.image_url, item.mime_type) for item in items], config, construction_type=key,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка пакетного анализа ({len(items)} фото, тип {key}): {e}")
+                metrics.inc("defect_batch.requests_total", outcome="error")
+                return [None] * len(items)
+            elapsed = time.perf_counter() - started
+
+        self._adapt(elapsed)
+        resolved = sum(1 for a in analyses if a is not None)
+        metrics.inc("defect_batch.requests_total", outcome="ok")
+        metrics.observe("defect_batch.size", len(items))
+        metrics.observe("defect_batch.seconds", elapsed)
+        metrics.inc("defect_batch.images_total", resolved, outcome="resolved")
+        metrics.inc("defect_batch.images_total", len(items) - resolved, outcome="fallback")
+        logger.info(
+            f"Пакетный анализ: {resolved}/{len(items)} фото за {elapsed:.1f} с, "
+            f"тип {key}, следующий пакет до {self.batch_size}"
+        )
+        return [
+            {
+                "code": a["code"],
+                "description": a["description"],
+                "recommendation": a["recommendation"],
+                "category": a["category"],
+            } if a is not None else None
+            for a in analyses
+        ]
+
+    async def _run_single(self, item: _BatchItem) -> dict:
+        async with self.semaphore:
+            return await self.defect_analyzer.analyze_single_image_by_name(
+                image_name=item.image_name,
+                construction_type=item.construction_type,
+                defect_type=item.defect_type,
+                construction_confidence=item.construction_confidence,
+            )
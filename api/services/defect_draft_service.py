@@ -0,0 +1,148 @@
+"""
+Упреждающий (спекулятивный) анализ дефектов.
+
+После определения типа конструкции нового фото очередь конструкций сразу
+запускает кодирование дефекта с низким приоритетом: не больше
+DEFECT_SPECULATIVE_MAX_CONCURRENT вызовов одновременно, и только пока
+интерактивных запросов /analysis/defect меньше
+DEFECT_SPECULATIVE_MAX_INTERACTIVE. Когда интерактивная нагрузка
+достигает порога, ожидающие и выполняемые упреждающие вызовы снимаются.
+Если передан планировщик очереди, вызов ещё и занимает его слот с
+приоритетом speculative — после интерактивных задач.
+
+Результат сохраняется черновиком в Redis (не в БД — пока инженер не
+запросил анализ, он не виден в отчётах). Ключ черновика — версия каталога,
+тип конструкции и тег дефекта: после изменения базы дефектов или при
+другом типе черновик не находится. /analysis/defect забирает черновик
+вместо вызова модели.
+"""
+
+import asyncio
+import contextlib
+import logging
+from typing import Optional
+
+from api.services.redis_service import redis_service
+from common.defects_db import get_catalog, get_catalog_version
+from common.fair_scheduler import PRIORITY_SPECULATIVE, FairScheduler
+from common.metrics import metrics
+from settings import (
+    DEFECT_DRAFT_TTL_SECONDS,
+    DEFECT_SPECULATIVE_MAX_CONCURRENT,
+    DEFECT_SPECULATIVE_MAX_INTERACTIVE,
+)
+
+logger = logging.getLogger(__name__)
+
+_REDIS_PREFIX = "defect_draft:"
+
+
+class DefectDraftService:
+    """Черновики анализа дефектов и упреждающие вызовы с вытеснением"""
+
+    def __init__(self, max_concurrent: int, max_interactive: int, ttl_seconds: int):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_interactive = max_interactive
+        self.ttl_seconds = ttl_seconds
+        self.interactive_count = 0
+        self._tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def draft_key(image_name: str, construction_type: Optional[str], defect_type: Optional[str]) -> str:
+        type_key = get_catalog().type_key(construction_type) or "*"
+        return f"{_REDIS_PREFIX}{get_catalog_version()}:{type_key}:{defect_type or '-'}:{image_name}"
+
+    def _overloaded(self) -> bool:
+        return self.interactive_count >= self.max_interactive
+
+    @contextlib.contextmanager
+    def interactive(self):
+        """Учёт интерактивного запроса; при пороге нагрузки упреждающие вызовы снимаются"""
+        self.interactive_count += 1
+        try:
+            if self._overloaded():
+                for task in list(self._tasks):
+                    task.cancel()
+            yield
+        finally:
+            self.interactive_count -= 1
+
+    async def take(
+        self, image_name: str, construction_type: Optional[str], defect_type: Optional[str],
+    ) -> Optional[dict]:
+        """Забрать черновик (он удаляется — результат сохраняется как обычный анализ)"""
+        key = self.draft_key(image_name, construction_type, defect_type)
+        draft = await redis_service.get_json(key)
+        metrics.inc("defect_draft.lookups_total", outcome="hit" if draft else "miss")
+        if draft:
+            await redis_service.delete(key)
+        return draft
+
+    def speculate(
+        self,
+        defect_analyzer,
+        image_name: str,
+        construction_type: Optional[str],
+        defect_type: Optional[str] = None,
+        construction_confidence: Optional[float] = None,
+        scheduler: Optional[FairScheduler] = None,
+        tenant: Optional[str] = None,
+    ) -> None:
+        """Запланировать упреждающий анализ, не дожидаясь его"""
+        if self._overloaded():
+            metrics.inc("defect_draft.speculative_total", outcome="skipped")
+            return
+        task = asyncio.create_task(self._run(
+            defect_analyzer, image_name, construction_type, defect_type, construction_confidence,
+            scheduler, tenant,
+        ))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(
+        self,
+        defect_analyzer,
+        image_name: str,
+        construction_type: Optional[str],
+        defect_type: Optional[str],
+        construction_confidence: Optional[float],
+        scheduler: Optional[FairScheduler],
+        tenant: Optional[str],
+    ) -> None:
+        slot = scheduler.slot(tenant, PRIORITY_SPECULATIVE) if scheduler else contextlib.nullcontext()
+        try:
+            async with self.semaphore, slot:
+                if self._overloaded():
+                    metrics.inc("defect_draft.speculative_total", outcome="skipped")
+                    return
+                result = await defect_analyzer.analyze_single_image_by_name(
+                    image_name=image_name,
+                    construction_type=construction_type,
+                    defect_type=defect_type,
+                    construction_confidence=construction_confidence,
+                )
+        except asyncio.CancelledError:
+            metrics.inc("defect_draft.speculative_total", outcome="preempted")
+            logger.info(f"Упреждающий анализ {image_name} снят из-за интерактивной нагрузки")
+            return
+        except Exception as e:
+            metrics.inc("defect_draft.speculative_total", outcome="error")
+            logger.warning(f"Ошибка упреждающего анализа {image_name}: {e}")
+            return
+
+        # Без кода — ошибка анализа или нераспознанный ответ: такой черновик не нужен
+        if not result.get("code"):
+            metrics.inc("defect_draft.speculative_total", outcome="error")
+            return
+        key = self.draft_key(image_name, construction_type, defect_type)
+        await redis_service.set_json(key, result, self.ttl_seconds)
+        metrics.inc("defect_draft.speculative_total", outcome="stored")
+        logger.info(f"Черновик анализа сохранён для {image_name}: код {result['code']}")
+
+
+# Глобальный экземпляр сервиса
+defect_draft_service = DefectDraftService(
+    max_concurrent=DEFECT_SPECULATIVE_MAX_CONCURRENT,
+    max_interactive=DEFECT_SPECULATIVE_MAX_INTERACTIVE,
+    ttl_seconds=DEFECT_DRAFT_TTL_SECONDS,
+)
@@ -1,15 +1,27 @@
 import asyncio
-import io
 import json
 import logging
 import re
 from pathlib import Path
-from typing import Optional
-
-from docx import Document as DocxDocument
-import pymupdf
+from typing import Awaitable, Callable, Optional
 
+from api.services.cpu_pool_service import CpuPool, CpuPoolOverloadedError, get_cpu_pool_service
+from api.services.document_text_cache import document_text_cache
+from api.services.review_result_cache import review_result_cache
+from common.document_parsing import parse_docx, parse_pdf
 from common.gc_utils import documents_storage
+from common.metrics import metrics
+from common.llm_usage import openai_usage, record_usage
+from common.reference_index import ReferenceIndex
+from common.retry import RetryPolicy
+from common.review_revision import (
+    diff_pages,
+    group_regions,
+    remap_remark_pages,
+    remark_pages,
+    split_remarks,
+)
+from settings import REFERENCE_INDEX_PATH
 
 logger = logging.getLogger(__name__)
 
@@ -20,12 +32,35 @@ DEFAULT_MODEL = "gpt-5.4"
 REVIEW_MAX_TOKENS = 32768
 REVIEW_TEMPERATURE = 0.2
 
+# Чанкованная проверка длинных отчётов (оценка токенов — по символам)
+REVIEW_CHARS_PER_TOKEN = 3
+REVIEW_SINGLE_SHOT_MAX_TOKENS = 80_000  # до этого объёма — один вызов на проход
+REVIEW_CHUNK_MAX_TOKENS = 40_000
+REVIEW_CHUNK_CONCURRENCY = 6  # одновременных вызовов LLM на одну проверку
+REVIEW_MERGE_MAX_TOKENS = 60_000  # больше — результаты объединяются по частям
+
+# Проверка новой редакции: соседние страницы для контекста и порог полной проверки
+REVISION_CONTEXT_PAGES = 1
+REVISION_MAX_CHANGED_SHARE = 0.6
+
+# Меняется вместе с парсерами/вырезкой — сбрасывает кеш извлечённого текста
+DOCUMENT_TEXT_VERSION = "2"
+# Меняется вместе с форматом сообщений проходов/merge — сбрасывает кеш результатов
+REVIEW_CACHE_VERSION = "2"
+
+_PAGE_MARKER_RE = re.compile(r"\[Страница (\d+)\]")
+
+# (метка прохода, результат, готово, всего) — вызывается по завершении каждого прохода
+PassCallback = Callable[[str, str, int, int], Awaitable[None]]
+
 AVAILABLE_MODELS = {
     "gpt-5.4": {"label": "GPT-5.4"},
     "gpt-5.4-mini": {"label": "GPT-5.4 Mini"},
 }
 
 REFERENCE_DOCS_DIR = Path(__file__).resolve().parent.parent.parent / "reference_docs"
+# Сколько символов пунктов НТД подавать в нормативный проход (на фрагмент)
+REFERENCE_MAX_CHARS = 60_000
 
 # Маркеры разделов, которые нужно исключить из проверки.
 # Regex-паттерны — ищутся как заголовки (не инлайн-упоминания).
@@ -62,11 +97,16 @@ _OUTPUT_FORMAT = """\
 проверяй документ от начала до конца. Полнота проверки важнее краткости.\
 """
 
+# Общая для всех проходов часть — системное сообщение. Инструкции прохода
+# идут в конце пользовательского сообщения, после текста отчёта: начало
+# запроса (системное сообщение + текст) побайтно совпадает у всех проходов
+# одного фрагмента, и провайдер отдаёт его из кеша префикса.
+REVIEW_SYSTEM_PROMPT = f"{_ROLE_PREAMBLE}\n\n{_OUTPUT_FORMAT}"
+
 REVIEW_PASSES = [
     {
         "needs_reference": False,
-        "system_prompt": (
-            f"{_ROLE_PREAMBLE}\n\n"
+        "instructions": (
             "КАТЕГОРИИ ЗАМЕЧАНИЙ\n"
             "🔴 КРИТ — влияет на юридическую силу (адрес, заказчик, уровень ответственности, даты)\n"
             "🟠 ЛОГИКА — внутренние противоречия, несогласованность разделов\n"
@@ -76,28 +116,24 @@ REVIEW_PASSES = [
             "- Несовпадение дат (договор / выезд / утверждение)\n"
             "- Противоречие в типе объекта: «здание» в одном месте, «фасады» в другом\n"
             "- Несогласованность цепочки: Ведомость дефектов → Заключение → Рекомендации\n"
-            "- Категория технического состояния не вытекает из описанных дефектов\n\n"
-            f"{_OUTPUT_FORMAT}"
+            "- Категория технического состояния не вытекает из описанных дефектов"
         ),
     },
     {
         "needs_reference": False,
-        "system_prompt": (
-            f"{_ROLE_PREAMBLE}\n\n"
+        "instructions": (
             "КАТЕГОРИИ ЗАМЕЧАНИЙ\n"
             "🟡 ШАБЛОН — остатки чужих данных, повторы\n"
             "🔵 ТЕКСТ — орфография, пунктуация, грамматика\n"
             "⚪️ РЕКОМЕНДАЦИЯ — не ошибка, но стоит усилить (в области текста и оформления)\n\n"
             "ТИПИЧНЫЕ ОШИБКИ (искать в первую очередь)\n"
             "- Остатки данных от предыдущего объекта (заказчик, название, габариты)\n"
-            "- Разное написание одного термина по тексту\n\n"
-            f"{_OUTPUT_FORMAT}"
+            "- Разное написание одного термина по тексту"
         ),
     },
     {
         "needs_reference": True,
-        "system_prompt": (
-            f"{_ROLE_PREAMBLE}\n\n"
+        "instructions": (
             "КАТЕГОРИИ ЗАМЕЧАНИЙ\n"
             "🟢 НОРМАТИВ — ошибки в ссылках на НТД\n"
             "⚪️ РЕКОМЕНДАЦИЯ — не ошибка, но стоит усилить (в области нормативных ссылок)\n\n"
@@ -114,8 +150,7 @@ REVIEW_PASSES = [
             "Не уверен — не пиши.\n\n"
             "ТИПИЧНЫЕ ОШИБКИ (искать в первую очередь)\n"
             "- Ссылка на ГОСТ 31937-2011 вместо ГОСТ 31937-2024\n"
-            "- Ссылки на отменённые нормы без оговорок\n\n"
-            f"{_OUTPUT_FORMAT}"
+            "- Ссылки на отменённые нормы без оговорок"
         ),
     },
 ]
@@ -179,17 +214,36 @@ MERGE_SYSTEM_PROMPT = """\
 """
 
 
+def describe_review_error(error: Exception) -> tuple[int, str]:
+    """HTTP-статус и сообщение для пользователя по ошибке проверки документа."""
+    if isinstance(error, FileNotFoundError):
+        return 404, "Документ не найден в хранилище"
+    if isinstance(error, ValueError):
+        return 400, str(error)
+    if isinstance(error, CpuPoolOverloadedError):
+        return 503, str(error)
+
+    err_msg = str(error)
+    lower_msg = err_msg.lower()
+    if "context_length_exceeded" in err_msg or "token" in lower_msg:
+        return 400, "Документ слишком большой для выбранной модели."
+    if "429" in err_msg or "rate_limit" in lower_msg or "resource_exhausted" in lower_msg:
+        return 429, "Слишком много запросов к модели. Подождите минуту и попробуйте снова."
+    return 500, f"Ошибка проверки: {err_msg}"
+
+
 class DocumentReviewService:
     """Сервис для парсинга и проверки технических отчётов."""
 
     def __init__(self):
         self._openai_client = None
-        self._reference_texts: Optional[str] = None
+        self._reference_index: Optional[ReferenceIndex] = None
 
     def _get_openai_client(self):
         if self._openai_client is None:
             from openai import OpenAI
-            self._openai_client = OpenAI()
+            # Повторы — в _call_llm (common/retry.py)
+            self._openai_client = OpenAI(max_retries=0)
         return self._openai_client
 
     async def parse_document(self, document_name: str) -> str:
@@ -197,22 +251,57 @@ class DocumentReviewService:
         file_bytes, mime_type = await documents_storage.download(document_name)
 
         if document_name.lower().endswith(".pdf"):
-            return self._parse_pdf(file_bytes)
+            return await get_cpu_pool_service().run(CpuPool.DOCUMENT, parse_pdf, file_bytes)
         elif document_name.lower().endswith(".docx"):
-            return self._parse_docx(file_bytes)
+            return await get_cpu_pool_service().run(CpuPool.DOCUMENT, parse_docx, file_bytes)
         else:
             raise ValueError(
                 f"Неподдерживаемый формат файла: {document_name}. "
                 f"Допустимые форматы: {', '.join(ALLOWED_EXTENSIONS)}"
             )
 
+    async def get_review_text(self, document_name: str) -> str:
+        """
+        Текст документа для проверки (после вырезки нерелевантных разделов).
+
+        Берётся из кеша по generation/md5 блоба; при промахе документ
+        скачивается и парсится.
+        """
+        try:
+            blob = await documents_storage.stat(document_name)
+        except Exception as e:
+            logger.warning("Не удалось получить метаданные %s: %s", document_name, e)
+            blob = None
+
+        key = None
+        if blob is not None:
+            variant = f"{DOCUMENT_TEXT_VERSION}|{'|'.join(TRUNCATE_MARKERS)}"
+            key = document_text_cache.make_key(document_name, blob.generation, blob.md5_hash, variant)
+            cached = await document_text_cache.get(key)
+            if cached is not None:
+                return cached
+
+        text = await self.parse_document(document_name)
+        text, _, _ = self._truncate_text(text)
+
+        if key is not None:
+            await document_text_cache.set(key, text)
+        return text
+
     async def review_document(
         self,
         document_name: str,
         prompt: Optional[str] = None,
         model: Optional[str] = None,
+        on_pass_result: Optional[PassCallback] = None,
+        previous_document_name: Optional[str] = None,
     ) -> dict:
-        """Парсит документ и отправляет текст на проверку LLM."""
+        """
+        Парсит документ и отправляет текст на проверку LLM.
+
+        С previous_document_name документ проверяется как новая редакция:
+        заново — только изменённые страницы.
+        """
         model = model or DEFAULT_MODEL
         if model not in AVAILABLE_MODELS:
             raise ValueError(
@@ -220,7 +309,7 @@ class DocumentReviewService:
                 f"Доступные: {', '.join(AVAILABLE_MODELS)}"
             )
 
-        text = await self.parse_document(document_name)
+        text = await self.get_review_text(document_name)
 
         if not text.strip():
             return {
@@ -229,9 +318,9 @@ class DocumentReviewService:
                 "review_result": "Документ пуст или не содержит текста.",
             }
 
-        text, truncated_section, _ = self._truncate_text(text)
-
-        review_result = await self._run_llm_review(text, prompt, model)
+        review_result = await self._review_text(
+            text, prompt, model, MERGE_SYSTEM_PROMPT, on_pass_result, previous_document_name,
+        )
 
         return {
             "document_name": document_name,
@@ -244,8 +333,15 @@ class DocumentReviewService:
         document_name: str,
         prompt: Optional[str] = None,
         model: Optional[str] = None,
+        on_pass_result: Optional[PassCallback] = None,
+        previous_document_name: Optional[str] = None,
     ) -> dict:
-        """Парсит документ и возвращает структурированные замечания с find/replace."""
+        """
+        Парсит документ и возвращает структурированные замечания с find/replace.
+
+        С previous_document_name документ проверяется как новая редакция:
+        заново — только изменённые страницы.
+        """
         model = model or DEFAULT_MODEL
         if model not in AVAILABLE_MODELS:
             raise ValueError(
@@ -253,15 +349,13 @@ class DocumentReviewService:
                 f"Доступные: {', '.join(AVAILABLE_MODELS)}"
             )
 
-        text = await self.parse_document(document_name)
+        text = await self.get_review_text(document_name)
 
         if not text.strip():
             return {"document_name": document_name, "remarks": [], "summary": ""}
 
-        text, _, _ = self._truncate_text(text)
-
-        fixes_json = await self._run_llm_review(
-            text, prompt, model, merge_prompt=MERGE_FIXES_SYSTEM_PROMPT,
+        fixes_json = await self._review_text(
+            text, prompt, model, MERGE_FIXES_SYSTEM_PROMPT, on_pass_result, previous_document_name,
         )
 
         try:
@@ -276,6 +370,17 @@ class DocumentReviewService:
             "summary": parsed.get("summary", ""),
         }
 
+    async def _review_text(
+        self, text: str, prompt: Optional[str], model: str, merge_prompt: str,
+        on_pass_result: Optional[PassCallback], previous_document_name: Optional[str],
+    ) -> str:
+        if not previous_document_name:
+            return await self._run_llm_review(text, prompt, model, merge_prompt, on_pass_result)
+        previous_text = await self.get_review_text(previous_document_name)
+        return await self._run_revision_review(
+            text, previous_text, prompt, model, merge_prompt, on_pass_result,
+        )
+
     # ── Вырезка нерелевантных разделов ─────────────────────────────
 
     _NEXT_SECTION_RE = re.compile(
@@ -363,136 +468,381 @@ class DocumentReviewService:
 
     # ── Парсинг ───────────────────────────────────────────────────
 
-    @staticmethod
-    def _has_page_break(paragraph) -> bool:
-        """Проверяет наличие разрыва страницы в параграфе."""
-        for run in paragraph.runs:
-            br_elements = run._element.findall(
-                ".//{http://schemas.openxmlformats.org/wordprocessingml/2006/main}br"
-            )
-            for br in br_elements:
-                if br.get(
-                    "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}type"
-                ) == "page":
-                    return True
-        return False
-
-    @staticmethod
-    def _parse_docx(file_bytes: bytes) -> str:
-        doc = DocxDocument(io.BytesIO(file_bytes))
+    _parse_docx = staticmethod(parse_docx)
+    _parse_pdf = staticmethod(parse_pdf)
 
-        parts: list[str] = []
-        page_num = 1
-        parts.append(f"[Страница {page_num}]")
+    # ── Reference docs (ГОСТы) ────────────────────────────────────
 
-        for paragraph in doc.paragraphs:
-            if DocumentReviewService._has_page_break(paragraph):
-                page_num += 1
-                parts.append(f"\n[Страница {page_num}]")
-            text = paragraph.text.strip()
-            if text:
-                parts.append(text)
+    def _load_reference_index(self) -> ReferenceIndex:
+        """Индекс reference_docs/: с диска, либо собирается заново при изменении файлов."""
+        if self._reference_index is not None:
+            return self._reference_index
 
-        for table in doc.tables:
-            for row in table.rows:
-                cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
-                if cells:
-                    parts.append(" | ".join(cells))
+        if REFERENCE_DOCS_DIR.exists():
+            index = ReferenceIndex.load_or_build(REFERENCE_DOCS_DIR, Path(REFERENCE_INDEX_PATH))
+        else:
+            index = ReferenceIndex("", [], [], {})
 
-        return "\n".join(parts)
+        if index.documents:
+            logger.info(
+                "Индекс reference-документов: %d документов, %d пунктов",
+                len(index.documents),
+                len(index.chunks),
+            )
+        self._reference_index = index
+        return index
 
-    @staticmethod
-    def _parse_pdf(file_bytes: bytes) -> str:
-        doc = pymupdf.open(stream=file_bytes, filetype="pdf")
-        parts: list[str] = []
+    async def warm_up(self) -> None:
+        """Загружает индекс reference-документов при старте приложения."""
+        try:
+            await asyncio.to_thread(self._load_reference_index)
+        except Exception as e:
+            logger.error("Не удалось загрузить индекс reference-документов: %s", e)
 
-        for page_num, page in enumerate(doc, start=1):
-            text = page.get_text().strip()
-            if text:
-                parts.append(f"[Страница {page_num}]\n{text}")
+    async def _select_reference(self, text: str) -> str:
+        """Пункты НТД, на которые ссылается текст (пусто, если ссылок нет)."""
+        if self._reference_index is None:
+            await asyncio.to_thread(self._load_reference_index)
+        return self._reference_index.select(text, REFERENCE_MAX_CHARS)
 
-        doc.close()
-        return "\n".join(parts)
+    # ── LLM ───────────────────────────────────────────────────────
 
-    # ── Reference docs (ГОСТы) ────────────────────────────────────
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        return len(text) // REVIEW_CHARS_PER_TOKEN
 
-    def _load_reference_texts(self) -> str:
-        """Загружает .txt файлы из reference_docs/ и склеивает."""
-        if self._reference_texts is not None:
-            return self._reference_texts
+    @staticmethod
+    def _split_pages(text: str) -> list[tuple[int, str]]:
+        """Разбивает текст по маркерам [Страница N] → [(N, текст с маркером)]."""
+        matches = list(_PAGE_MARKER_RE.finditer(text))
+        if not matches:
+            return [(1, text)]
+
+        pages: list[tuple[int, str]] = []
+        for i, match in enumerate(matches):
+            start = 0 if i == 0 else match.start()
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            page_text = text[start:end].strip()
+            if page_text:
+                pages.append((int(match.group(1)), page_text))
+        return pages
 
-        if not REFERENCE_DOCS_DIR.exists():
-            self._reference_texts = ""
-            return self._reference_texts
+    @staticmethod
+    def _split_into_chunks(
+        text: str, max_tokens: Optional[int] = None,
+    ) -> list[tuple[str, int, int]]:
+        """
+        Режет текст на фрагменты по границам страниц в пределах бюджета токенов.
+        Возвращает [(текст, первая_страница, последняя_страница)].
 
-        parts: list[str] = []
-        for txt_file in sorted(REFERENCE_DOCS_DIR.glob("*.txt")):
-            content = txt_file.read_text(encoding="utf-8").strip()
-            if content:
-                parts.append(f"=== {txt_file.stem} ===\n{content}")
+        Страница больше бюджета режется по строкам; каждая её часть
+        начинается с того же маркера [Страница N], чтобы ссылки на страницы
+        в замечаниях оставались верными.
+        """
+        max_chars = (max_tokens or REVIEW_CHUNK_MAX_TOKENS) * REVIEW_CHARS_PER_TOKEN
+        chunks: list[tuple[str, int, int]] = []
+        current: list[str] = []
+        current_len = 0
+        first_page = last_page = None
+
+        def flush():
+            nonlocal current, current_len, first_page
+            if current:
+                chunks.append(("\n".join(current), first_page, last_page))
+            current, current_len, first_page = [], 0, None
+
+        for page_num, page_text in DocumentReviewService._split_pages(text):
+            pieces = [page_text]
+            if len(page_text) > max_chars:
+                pieces = DocumentReviewService._split_long_page(page_num, page_text, max_chars)
+
+            for piece in pieces:
+                if current and current_len + len(piece) + 1 > max_chars:
+                    flush()
+                if first_page is None:
+                    first_page = page_num
+                last_page = page_num
+                current.append(piece)
+                current_len += len(piece) + 1
+        flush()
+        return chunks
 
-        self._reference_texts = "\n\n".join(parts)
-        if self._reference_texts:
-            logger.info(
-                "Загружено %d reference-документов (%d символов)",
-                len(parts),
-                len(self._reference_texts),
-            )
-        return self._reference_texts
+    @staticmethod
+    def _split_long_page(page_num: int, page_text: str, max_chars: int) -> list[str]:
+        """Режет страницу больше бюджета по строкам, повторяя маркер в каждой части."""
+        marker = f"[Страница {page_num}]"
+        body = page_text.removeprefix(marker).lstrip("\n")
+        limit = max_chars - len(marker) - 1
+
+        pieces: list[str] = []
+        current = ""
+        for line in body.split("\n"):
+            # Строка длиннее бюджета (например, склеенная таблица) — режем жёстко
+            while len(line) > limit:
+                if current:
+                    pieces.append(current)
+                    current = ""
+                pieces.append(line[:limit])
+                line = line[limit:]
+            if current and len(current) + len(line) + 1 > limit:
+                pieces.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+        if current:
+            pieces.append(current)
+        return [f"{marker}\n{piece}" for piece in pieces]
 
-    # ── LLM ───────────────────────────────────────────────────────
+    @staticmethod
+    def _build_user_message(
+        text: str, prompt: Optional[str], reference: str, fragment_note: Optional[str] = None,
+        instructions: Optional[str] = None,
+    ) -> str:
+        """
+        Сообщение прохода: сначала то, что одинаково у всех проходов
+        фрагмента (пояснение и текст отчёта, указания пользователя), затем
+        нормативные документы и инструкции конкретного прохода.
+        """
+        parts: list[str] = []
+        if fragment_note:
+            parts.append(fragment_note)
+        parts.append("ТЕКСТ ОТЧЁТА ДЛЯ ПРОВЕРКИ:\n\n" + text)
+        if prompt:
+            parts.append("ДОПОЛНИТЕЛЬНЫЕ УКАЗАНИЯ:\n\n" + prompt)
+        if reference:
+            parts.append("НОРМАТИВНЫЕ ДОКУМЕНТЫ ДЛЯ СПРАВКИ:\n\n" + reference)
+        if instructions:
+            parts.append("ЗАДАЧА ЭТОГО ПРОХОДА:\n\n" + instructions)
+        return "\n\n---\n\n".join(parts)
 
     async def _run_llm_review(
         self, text: str, prompt: Optional[str] = None, model: str = DEFAULT_MODEL,
         merge_prompt: str = MERGE_SYSTEM_PROMPT,
+        on_pass_result: Optional[PassCallback] = None,
     ) -> str:
-        """Запускает параллельные фокусированные проходы и объединяет результаты."""
-        reference = self._load_reference_texts()
-
-        # Базовое сообщение без reference docs (проходы 1, 2)
-        base_parts: list[str] = ["ТЕКСТ ОТЧЁТА ДЛЯ ПРОВЕРКИ:\n\n" + text]
-        if prompt:
-            base_parts.append("ДОПОЛНИТЕЛЬНЫЕ УКАЗАНИЯ:\n\n" + prompt)
-        base_user_message = "\n\n---\n\n".join(base_parts)
+        """
+        Запускает параллельные фокусированные проходы и объединяет результаты.
 
-        # Расширенное сообщение с reference docs (проход 3 — нормативы)
-        if reference:
-            ref_parts = [
-                "НОРМАТИВНЫЕ ДОКУМЕНТЫ ДЛЯ СПРАВКИ:\n\n" + reference,
-                "ТЕКСТ ОТЧЁТА ДЛЯ ПРОВЕРКИ:\n\n" + text,
-            ]
-            if prompt:
-                ref_parts.append("ДОПОЛНИТЕЛЬНЫЕ УКАЗАНИЯ:\n\n" + prompt)
-            ref_user_message = "\n\n---\n\n".join(ref_parts)
+        Длинный отчёт (больше REVIEW_SINGLE_SHOT_MAX_TOKENS) проверяется по
+        фрагментам: каждый проход — на каждом фрагменте, не более
+        REVIEW_CHUNK_CONCURRENCY вызовов одновременно, затем общий merge.
+        on_pass_result получает результат каждого прохода сразу по готовности.
+        """
+        if self._estimate_tokens(text) <= REVIEW_SINGLE_SHOT_MAX_TOKENS:
+            chunks = [(text, None, None)]
         else:
-            ref_user_message = base_user_message
+            chunks = self._split_into_chunks(text)
+
+        fragments: list[tuple[str, Optional[str], str]] = []
+        for chunk_idx, (chunk_text, first_page, last_page) in enumerate(chunks, start=1):
+            if len(chunks) == 1:
+                fragments.append((chunk_text, None, ""))
+                continue
+            pages = self._pages_label(first_page, last_page)
+            fragment_note = (
+                f"ФРАГМЕНТ {chunk_idx} ИЗ {len(chunks)} ({pages}). Отчёт проверяется по частям: "
+                "не считай ошибкой отсутствие разделов, которые могут быть в других фрагментах. "
+                "Номера страниц бери из маркеров [Страница N] в тексте."
+            )
+            fragments.append((chunk_text, fragment_note, f", фрагмент {chunk_idx} ({pages})"))
+
+        results = await self._run_passes(fragments, prompt, model, on_pass_result)
+        merged = await self._merge_results(
+            [result for _, _, result in results], model, merge_prompt,
+            [label for _, label, _ in results],
+        )
+        await self._save_review_record(
+            text, prompt, model,
+            [(pass_idx, remark) for pass_idx, _, result in results for remark in split_remarks(result)],
+        )
+        return merged
+
+    @staticmethod
+    def _pages_label(first_page: int, last_page: int) -> str:
+        return f"страницы {first_page}–{last_page}" if first_page != last_page else f"страница {first_page}"
+
+    async def _run_passes(
+        self,
+        fragments: list[tuple[str, Optional[str], str]],
+        prompt: Optional[str],
+        model: str,
+        on_pass_result: Optional[PassCallback] = None,
+    ) -> list[tuple[int, str, str]]:
+        """
+        Все проходы по всем фрагментам (текст, пояснение, суффикс метки).
+
+        Returns:
+            [(номер прохода, метка, результат)] — по проходам, внутри по фрагментам
+        """
+        needs_reference = any(pass_cfg["needs_reference"] for pass_cfg in REVIEW_PASSES)
+        references = [
+            await self._select_reference(fragment_text) if needs_reference else ""
+            for fragment_text, _, _ in fragments
+        ]
 
         logger.info(
-            "Запуск %d параллельных проходов: %d символов текста, %d символов reference, модель %s",
+            "Запуск %d проходов × %d фрагментов: %d символов текста, %d символов reference, модель %s",
             len(REVIEW_PASSES),
-            len(text),
-            len(reference),
+            len(fragments),
+            sum(len(fragment_text) for fragment_text, _, _ in fragments),
+            sum(len(reference) for reference in references),
             model,
         )
 
-        tasks = [
-            self._run_single_pass(
-                ref_user_message if pass_cfg["needs_reference"] else base_user_message,
-                pass_cfg,
-                model,
-            )
-            for pass_cfg in REVIEW_PASSES
-        ]
+        semaphore = asyncio.Semaphore(REVIEW_CHUNK_CONCURRENCY)
+        total = len(REVIEW_PASSES) * len(fragments)
+        done = 0
+
+        async def _limited(user_message: str, pass_cfg: dict, label: str, cache_key: str) -> str:
+            nonlocal done
+            async with semaphore:
+                result = await review_result_cache.get_or_compute(
+                    cache_key, lambda: self._run_single_pass(user_message, model),
+                )
+            done += 1
+            if on_pass_result is not None:
+                await on_pass_result(label, result, done, total)
+            return result
+
+        tasks = []
+        keys = []
+        for pass_idx, pass_cfg in enumerate(REVIEW_PASSES, start=1):
+            for fragment_idx, (fragment_text, fragment_note, label_suffix) in enumerate(fragments):
+                label = f"Проход {pass_idx}{label_suffix}"
+                reference = references[fragment_idx] if pass_cfg["needs_reference"] else ""
+                user_message = self._build_user_message(
+                    fragment_text, prompt, reference, fragment_note, pass_cfg["instructions"],
+                )
+                cache_key = review_result_cache.pass_key(
+                    model, REVIEW_SYSTEM_PROMPT, pass_cfg["instructions"], fragment_text, reference, prompt, fragment_note,
+                    self._cache_params(),
+                )
+                tasks.append(_limited(user_message, pass_cfg, label, cache_key))
+                keys.append((pass_idx, label))
+
         pass_results = await asyncio.gather(*tasks)
+        return [(pass_idx, label, result) for (pass_idx, label), result in zip(keys, pass_results)]
 
-        return await self._merge_results(pass_results, model, merge_prompt)
+    # ── Инкрементальная проверка новой редакции ───────────────────
+
+    async def _save_review_record(
+        self, text: str, prompt: Optional[str], model: str, remarks: list[tuple[int, str]],
+    ) -> None:
+        """Замечания проходов по тексту — основа для проверки следующей редакции."""
+        record = {"remarks": [{"pass": pass_idx, "text": remark} for pass_idx, remark in remarks]}
+        try:
+            await review_result_cache.set(
+                review_result_cache.record_key(model, REVIEW_SYSTEM_PROMPT, text, prompt, self._cache_params()),
+                json.dumps(record, ensure_ascii=False),
+            )
+        except Exception as e:
+            logger.warning("Не удалось сохранить замечания проверки: %s", e)
+
+    async def _load_review_record(self, text: str, prompt: Optional[str], model: str) -> Optional[dict]:
+        raw = await review_result_cache.get(
+            review_result_cache.record_key(model, REVIEW_SYSTEM_PROMPT, text, prompt, self._cache_params()),
+        )
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+
+    async def _run_revision_review(
+        self, text: str, previous_text: str, prompt: Optional[str] = None,
+        model: str = DEFAULT_MODEL, merge_prompt: str = MERGE_SYSTEM_PROMPT,
+        on_pass_result: Optional[PassCallback] = None,
+    ) -> str:
+        """
+        Проверка новой редакции отчёта относительно предыдущей.
+
+        Проходы запускаются только на изменённых страницах (плюс
+        REVISION_CONTEXT_PAGES соседних для контекста). Замечания прошлой
+        проверки по неизменённым страницам переносятся с новыми номерами
+        страниц, замечания без привязки к странице переносятся как есть.
+        Если прошлой проверки с той же моделью и промптом нет или изменена
+        большая часть отчёта — выполняется полная проверка.
+        """
+        record = await self._load_review_record(previous_text, prompt, model)
+        new_pages = self._split_pages(text)
+        if record is None:
+            logger.info("Проверка предыдущей редакции не найдена — полная проверка")
+            metrics.inc("review_revision.full_total", reason="no_previous_review")
+            return await self._run_llm_review(text, prompt, model, merge_prompt, on_pass_result)
+
+        mapping, changed = diff_pages(self._split_pages(previous_text), new_pages)
+        if len(changed) > REVISION_MAX_CHANGED_SHARE * len(new_pages):
+            logger.info("Изменено %d из %d страниц — полная проверка", len(changed), len(new_pages))
+            metrics.inc("review_revision.full_total", reason="too_many_changes")
+            return await self._run_llm_review(text, prompt, model, merge_prompt, on_pass_result)
+
+        carried: dict[int, list[str]] = {pass_idx: [] for pass_idx in range(1, len(REVIEW_PASSES) + 1)}
+        for item in record.get("remarks", []):
+            remark = remap_remark_pages(item["text"], mapping)
+            if remark is not None and item["pass"] in carried:
+                carried[item["pass"]].append(remark)
+
+        changed_set = set(changed)
+        page_texts = dict(new_pages)
+        all_pages = [page for page, _ in new_pages]
+        fragments: list[tuple[str, Optional[str], str]] = []
+        for first, last in group_regions(changed, all_pages, REVISION_CONTEXT_PAGES):
+            region_pages = [page for page in all_pages if first <= page <= last]
+            region_text = "\n".join(page_texts[page] for page in region_pages)
+            for chunk_text, chunk_first, chunk_last in self._split_into_chunks(region_text):
+                pages = self._pages_label(chunk_first, chunk_last)
+                changed_here = [p for p in region_pages if chunk_first <= p <= chunk_last and p in changed_set]
+                fragment_note = (
+                    f"ИЗМЕНЁННЫЙ ФРАГМЕНТ НОВОЙ РЕДАКЦИИ ОТЧЁТА ({pages}). Остальной отчёт не менялся "
+                    "и уже проверен. Замечания давай только по изменённым страницам: "
+                    f"{', '.join(map(str, changed_here))}; соседние страницы даны для контекста. "
+                    "Не считай ошибкой отсутствие разделов вне фрагмента. "
+                    "Номера страниц бери из маркеров [Страница N] в тексте."
+                )
+                fragments.append((chunk_text, fragment_note, f", изменения ({pages})"))
+
+        carried_count = sum(len(remarks) for remarks in carried.values())
+        logger.info(
+            "Проверка редакции: изменено %d из %d страниц, %d фрагментов, перенесено %d замечаний",
+            len(changed), len(new_pages), len(fragments), carried_count,
+        )
+        metrics.inc("review_revision.incremental_total")
+        metrics.observe("review_revision.changed_pages", len(changed))
+        metrics.inc("review_revision.remarks_carried", carried_count)
+
+        results = await self._run_passes(fragments, prompt, model, on_pass_result) if fragments else []
+
+        labels: list[str] = []
+        pass_results: list[str] = []
+        for pass_idx, remarks in carried.items():
+            labels.append(f"Проход {pass_idx}, без изменений (перенесено из предыдущей редакции)")
+            pass_results.append("\n\n".join(remarks) if remarks else "Замечаний нет")
+        for _, label, result in results:
+            labels.append(label)
+            pass_results.append(result)
+        merged = await self._merge_results(pass_results, model, merge_prompt, labels)
+
+        new_remarks = [(pass_idx, remark) for pass_idx, remarks in carried.items() for remark in remarks]
+        for pass_idx, _, result in results:
+            for remark in split_remarks(result):
+                pages = remark_pages(remark)
+                if not pages or pages & changed_set:
+                    new_remarks.append((pass_idx, remark))
+        await self._save_review_record(text, prompt, model, new_remarks)
+        return merged
+
+    @staticmethod
+    def _cache_params() -> str:
+        """Параметры генерации, от которых зависит результат, — часть ключа кеша."""
+        return f"{REVIEW_CACHE_VERSION}|{REVIEW_TEMPERATURE}|{REVIEW_MAX_TOKENS}"
 
     async def _call_llm(
         self, model: str, system_prompt: str, user_message: str,
     ) -> str:
-        """Вызов OpenAI LLM."""
+        """Вызов OpenAI LLM (с повторами при rate limit и временных ошибках)."""
         client = self._get_openai_client()
-        response = await asyncio.to_thread(
+        response = await RetryPolicy("llm.openai").call(
+            asyncio.to_thread,
             client.chat.completions.create,
             model=model,
             messages=[
@@ -502,18 +852,15 @@ class DocumentReviewService:
             temperature=REVIEW_TEMPERATURE,
             max_completion_tokens=REVIEW_MAX_TOKENS,
         )
-        logger.info(
-            "OpenAI [%s]: tokens %s/%s",
-            model, response.usage.prompt_tokens, response.usage.completion_tokens,
-        )
+        usage = openai_usage(response)
+        record_usage("openai", model, "document_review", usage)
+        logger.info("OpenAI [%s]: tokens %s (cached %s)/%s", model, *usage)
         return response.choices[0].message.content
 
-    async def _run_single_pass(
-        self, user_message: str, pass_cfg: dict, model: str,
-    ) -> str:
-        """Один фокусированный проход проверки."""
+    async def _run_single_pass(self, user_message: str, model: str) -> str:
+        """Один фокусированный проход проверки (инструкции прохода — в user_message)."""
         try:
-            result = await self._call_llm(model, pass_cfg["system_prompt"], user_message)
+            result = await self._call_llm(model, REVIEW_SYSTEM_PROMPT, user_message)
             logger.info("Проход завершён: %d символов", len(result))
             return result
         except Exception as e:
@@ -523,15 +870,67 @@ class DocumentReviewService:
     async def _merge_results(
         self, pass_results: list[str], model: str,
         merge_prompt: str = MERGE_SYSTEM_PROMPT,
+        labels: Optional[list[str]] = None,
     ) -> str:
-        """Объединяет результаты проходов, удаляя дубликаты."""
-        combined = "\n\n".join(
-            f"--- Проход {i + 1} ---\n{result}"
-            for i, result in enumerate(pass_results)
-        )
+        """
+        Объединяет результаты проходов, удаляя дубликаты.
+
+        Если результаты вместе больше REVIEW_MERGE_MAX_TOKENS (длинный отчёт:
+        проходы × фрагменты), они объединяются по уровням: соседние результаты
+        (фрагменты одного прохода) собираются в пачки в пределах бюджета,
+        каждая пачка объединяется отдельно, и так до одного вызова.
+        """
+        labels = labels or [f"Проход {i + 1}" for i in range(len(pass_results))]
+        sections = [f"--- {label} ---\n{result}" for label, result in zip(labels, pass_results)]
+        max_chars = REVIEW_MERGE_MAX_TOKENS * REVIEW_CHARS_PER_TOKEN
+
+        level = 1
+        while len("\n\n".join(sections)) > max_chars:
+            batches = self._merge_batches(sections, max_chars)
+            if len(batches) == len(sections):
+                # Каждый результат сам по себе больше бюджета — уменьшать нечего
+                break
+            logger.info(
+                "Объединение по частям, уровень %d: %d результатов → %d",
+                level, len(sections), len(batches),
+            )
+            semaphore = asyncio.Semaphore(REVIEW_CHUNK_CONCURRENCY)
+
+            async def _merge_batch(batch: list[str]) -> str:
+                if len(batch) == 1:
+                    return batch[0]
+                async with semaphore:
+                    merged = await self._merge_combined("\n\n".join(batch), model, merge_prompt)
+                return f"--- Объединение {len(batch)} результатов ---\n{merged}"
+
+            sections = list(await asyncio.gather(*(_merge_batch(batch) for batch in batches)))
+            level += 1
+
+        return await self._merge_combined("\n\n".join(sections), model, merge_prompt)
 
+    @staticmethod
+    def _merge_batches(sections: list[str], max_chars: int) -> list[list[str]]:
+        """Соседние результаты — пачками не длиннее max_chars (длинный результат — один)."""
+        batches: list[list[str]] = []
+        size = 0
+        for section in sections:
+            if batches and size + 2 + len(section) <= max_chars:
+                batches[-1].append(section)
+                size += 2 + len(section)
+            else:
+                batches.append([section])
+                size = len(section)
+        return batches
+
+    async def _merge_combined(self, combined: str, model: str, merge_prompt: str) -> str:
+        """Один вызов merge (с кешем результата)."""
+        cache_key = review_result_cache.merge_key(
+            model, REVIEW_SYSTEM_PROMPT, merge_prompt, combined, self._cache_params(),
+        )
         try:
-            result = await self._call_llm(model, merge_prompt, combined)
+            result = await review_result_cache.get_or_compute(
+                cache_key, lambda: self._call_llm(model, merge_prompt, combined),
+            )
             logger.info("Объединение завершено: %d символов", len(result))
             return result
         except Exception as e:
@@ -0,0 +1,138 @@
+"""
+Кеш извлечённого текста документов для проверки отчётов.
+
+Ключ — имя документа + generation и md5 блоба в GCS (перезаливка файла
+меняет ключ) + версия парсера. Два уровня:
+- локальный диск (zlib), LRU по mtime в пределах DOCUMENT_TEXT_CACHE_MAX_DISK_BYTES;
+- Redis (zlib + base64, клиент работает со строками), общий для всех инстансов.
+
+Попадание в Redis прогревает диск. Ошибки кеша не ломают проверку —
+документ просто парсится заново.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from api.services.redis_service import redis_service
+from common.metrics import metrics
+from settings import (
+    DOCUMENT_TEXT_CACHE_DIR,
+    DOCUMENT_TEXT_CACHE_MAX_DISK_BYTES,
+    DOCUMENT_TEXT_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_REDIS_PREFIX = "doctext:"
+_COMPRESS_LEVEL = 6
+
+
+class DocumentTextCache:
+    """Двухуровневый кеш текста документов: диск → Redis"""
+
+    def __init__(self, cache_dir: str, max_disk_bytes: int, ttl_seconds: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def make_key(document_name: str, generation, md5_hash: Optional[str], variant: str = "") -> str:
+        raw = f"{document_name}|{generation}|{md5_hash}|{variant}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.txt.z"
+
+    # ── Диск ──────────────────────────────────────────────────────
+
+    def _read_disk(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # для LRU-вытеснения
+        except FileNotFoundError:
+            return None
+        return zlib.decompress(data).decode("utf-8")
+
+    def _write_disk(self, key: str, compressed: bytes) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Удаляет самые давно использованные файлы, пока кеш больше лимита."""
+        files = []
+        total = 0
+        for path in self.cache_dir.glob("*.txt.z"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_disk_bytes:
+            return
+        for _, size, path in sorted(files):
+            path.unlink(missing_ok=True)
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    # ── API ───────────────────────────────────────────────────────
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            text = await asyncio.to_thread(self._read_disk, key)
+            if text is not None:
+                metrics.inc("document_text_cache.hits", tier="disk")
+                return text
+        except Exception as e:
+            logger.warning("Кеш текста: ошибка чтения с диска %s: %s", key, e)
+
+        encoded = await redis_service.get(_REDIS_PREFIX + key)
+        if encoded:
+            try:
+                compressed = base64.b64decode(encoded)
+                text = zlib.decompress(compressed).decode("utf-8")
+            except Exception as e:
+                logger.warning("Кеш текста: битая запись в Redis %s: %s", key, e)
+            else:
+                metrics.inc("document_text_cache.hits", tier="redis")
+                await self._safe_write_disk(key, compressed)
+                return text
+
+        metrics.inc("document_text_cache.misses")
+        return None
+
+    async def set(self, key: str, text: str) -> None:
+        compressed = zlib.compress(text.encode("utf-8"), _COMPRESS_LEVEL)
+        await self._safe_write_disk(key, compressed)
+        await redis_service.set(
+            _REDIS_PREFIX + key,
+            base64.b64encode(compressed).decode("ascii"),
+            ttl_seconds=self.ttl_seconds,
+        )
+
+    async def _safe_write_disk(self, key: str, compressed: bytes) -> None:
+        try:
+            await asyncio.to_thread(self._write_disk, key, compressed)
+        except Exception as e:
+            logger.warning("Кеш текста: ошибка записи на диск %s: %s", key, e)
+
+
+# Глобальный экземпляр кеша
+document_text_cache = DocumentTextCache(
+    DOCUMENT_TEXT_CACHE_DIR,
+    DOCUMENT_TEXT_CACHE_MAX_DISK_BYTES,
+    DOCUMENT_TEXT_CACHE_TTL_SECONDS,
+)
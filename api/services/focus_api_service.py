@@ -1,4 +1,3 @@
-import io
 import os
 import hmac
 import time
@@ -13,15 +12,30 @@ import shutil
 
 from typing import Optional, Tuple, Dict
 from fastapi import HTTPException
-from PIL import Image, ImageOps
 
 from settings import FOCUS_API_URL, FOCUS_API_KEY, FOCUS_API_SECRET
+from api.services.cpu_pool_service import CpuPool, CpuPoolOverloadedError, get_cpu_pool_service
 from common.gc_utils import images_storage
+from common.image_processing import ImageDecodeError, ImageTooLargeError, shrink_image_to_limit
 from common.logging_utils import get_user_logger
+from common.retry import ERROR_PERMANENT, RetryPolicy, classify_error
 
 logger = get_user_logger(__name__)
 
 
+def _classify_focus_error(error: Exception) -> str:
+    """
+    Таймаут чтения ответа не повторяем: Focus API мог уже обработать
+    изображение, а ещё одно ожидание до self.timeout затянет запрос вдвое.
+    """
+    if isinstance(error, httpx.ReadTimeout):
+        return ERROR_PERMANENT
+    return classify_error(error)
+
+
+_retry = RetryPolicy("focus", classify=_classify_focus_error)
+
+
 class FocusAPIService:
     """Сервис для работы с Focus API"""
     
@@ -74,7 +88,17 @@ class FocusAPIService:
         }
         return json.dumps(payload_data)
 
-    def _maybe_shrink_image_for_focus_api(
+    async def _post(self, payload: str) -> httpx.Response:
+        """POST в Focus API с повторами; подпись с меткой времени — заново на каждую попытку"""
+        async def attempt() -> httpx.Response:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.post(self.api_url, content=payload, headers=self._prepare_headers(payload))
+            response.raise_for_status()
+            return response
+
+        return await _retry.call(attempt)
+
+    async def _maybe_shrink_image_for_focus_api(
         self,
         image_bytes: bytes,
         filename: str,
@@ -85,10 +109,8 @@ class FocusAPIService:
         """
         Гарантирует, что изображение не превышает лимит Focus API по размеру.
 
-        Стратегия:
-        - если уже <= max_image_bytes: вернуть как есть
-        - иначе: декодировать через Pillow, привести к RGB (с белым фоном при alpha),
-          затем попытаться сохранить в JPEG, понижая quality; если не помогает — уменьшать размер.
+        Сжатие (quality, затем resize) выполняется в CPU-пуле, см.
+        common.image_processing.shrink_image_to_limit.
 
         Returns:
             (bytes, filename, mime_type) — возможно изменённые байты/имя/тип (обычно image/jpeg)
@@ -96,93 +118,22 @@ class FocusAPIService:
         if len(image_bytes) <= max_image_bytes:
             return image_bytes, filename, mime_type
 
-        original_size = len(image_bytes)
-        t0 = time.perf_counter()
-
         try:
-            img = Image.open(io.BytesIO(image_bytes))
-            img = ImageOps.exif_transpose(img)
-            img.load()
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Не удалось декодировать изображение для сжатия (>{max_image_bytes} bytes): {str(e)}",
-            )
-
-        try:
-            if img.mode in ("RGBA", "LA") or ("transparency" in getattr(img, "info", {})):
-                rgba = img.convert("RGBA")
-                background = Image.new("RGB", rgba.size, (255, 255, 255))
-                background.paste(rgba, mask=rgba.split()[-1])
-                img_rgb = background
-            else:
-                img_rgb = img.convert("RGB") if img.mode != "RGB" else img
-        except Exception:
-            img_rgb = img.convert("RGB")
-
-        def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
-            buf = io.BytesIO()
-            image.save(
-                buf,
-                format="JPEG",
-                quality=quality,
-                optimize=True,
-                progressive=True,
+            return await get_cpu_pool_service().run(
+                CpuPool.IMAGE,
+                shrink_image_to_limit,
+                image_bytes,
+                filename,
+                mime_type,
+                max_image_bytes,
             )
-            return buf.getvalue()
+        except ImageDecodeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except CpuPoolOverloadedError as e:
+            raise HTTPException(status_code=503, detail=str(e))
 
-        # 1) Пытаемся только quality (без ресайза)
-        for quality in (85, 80, 75, 70, 65, 60, 55, 50, 45, 40, 35):
-            candidate = _encode_jpeg(img_rgb, quality)
-            if len(candidate) <= max_image_bytes:
-                new_filename = os.path.splitext(filename)[0] + ".jpg"
-                logger.info(
-                    "Сжали изображение для Focus API (quality-only): %s -> %s bytes (q=%s, %s -> %s, %.0fms)",
-                    original_size,
-                    len(candidate),
-                    quality,
-                    filename,
-                    new_filename,
-                    (time.perf_counter() - t0) * 1000,
-                )
-                return candidate, new_filename, "image/jpeg"
-
-        # 2) Если не помогло — постепенно уменьшаем размер и снова крутим quality
-        w, h = img_rgb.size
-        # ограничиваем минимальный размер, чтобы не улететь в ноль при странных входных данных
-        min_side_limit = 320
-
-        for scale in (0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.35, 0.3):
-            new_w = max(int(w * scale), min_side_limit)
-            new_h = max(int(h * scale), min_side_limit)
-            if new_w == w and new_h == h:
-                continue
-
-            resized = img_rgb.resize((new_w, new_h), Image.Resampling.LANCZOS)
-            for quality in (80, 75, 70, 65, 60, 55, 50, 45, 40, 35):
-                candidate = _encode_jpeg(resized, quality)
-                if len(candidate) <= max_image_bytes:
-                    new_filename = os.path.splitext(filename)[0] + ".jpg"
-                    logger.info(
-                        "Сжали изображение для Focus API (resize+quality): %s -> %s bytes (scale=%.2f, q=%s, %s -> %s, %.0fms)",
-                        original_size,
-                        len(candidate),
-                        scale,
-                        quality,
-                        filename,
-                        new_filename,
-                        (time.perf_counter() - t0) * 1000,
-                    )
-                    return candidate, new_filename, "image/jpeg"
-
-        raise HTTPException(
-            status_code=413,
-            detail=(
-                f"Изображение слишком большое для Focus API: {original_size} bytes. "
-                f"Не удалось сжать до <= {max_image_bytes} bytes."
-            ),
-        )
-    
     async def process_image(
         self,
         image_bytes: bytes,
@@ -226,7 +177,7 @@ class FocusAPIService:
 
         # Focus API имеет лимит по размеру изображений (6 МБ) — ужимаем сами, чтобы не падать на стороне API.
         before_bytes = len(image_bytes)
-        image_bytes, filename, mime_type = self._maybe_shrink_image_for_focus_api(
+        image_bytes, filename, mime_type = await self._maybe_shrink_image_for_focus_api(
             image_bytes=image_bytes,
             filename=filename,
             mime_type=mime_type,
@@ -252,56 +203,47 @@ class FocusAPIService:
                 (time.perf_counter() - t_payload) * 1000,
             )
             
-            headers = self._prepare_headers(payload)
+            t_http = time.perf_counter()
+            response = await self._post(payload)
+            http_ms = (time.perf_counter() - t_http) * 1000
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                t_http = time.perf_counter()
-                response = await client.post(
-                    self.api_url,
-                    content=payload,
-                    headers=headers
+            content_type = response.headers.get("content-type", "").lower()
+            logger.info(
+                "Focus API: response received (trace=%s, status=%s, content_type=%s, bytes=%s, %.0fms)",
+                trace_id,
+                response.status_code,
+                content_type,
+                len(response.content),
+                http_ms,
+            )
+            
+            if "application/zip" in content_type or "application/x-zip-compressed" in content_type:
+                zip_bytes = response.content
+                result = await self._process_zip_response(zip_bytes, filename, trace_id=trace_id)
+                logger.info(
+                    "Focus API: process_image done (trace=%s, total=%.0fms, zip=true)",
+                    trace_id,
+                    (time.perf_counter() - t_total) * 1000,
                 )
-                http_ms = (time.perf_counter() - t_http) * 1000
-                
-                response.raise_for_status()
-                
-                content_type = response.headers.get("content-type", "").lower()
+                return result
+            
+            try:
+                result = response.json()
                 logger.info(
-                    "Focus API: response received (trace=%s, status=%s, content_type=%s, bytes=%s, %.0fms)",
+                    "Focus API: process_image done (trace=%s, total=%.0fms, zip=false)",
                     trace_id,
-                    response.status_code,
-                    content_type,
-                    len(response.content),
-                    http_ms,
+                    (time.perf_counter() - t_total) * 1000,
                 )
+                return result
+            except json.JSONDecodeError:
+                logger.warning(f"Ответ от Focus API не является JSON для файла {filename}")
+                logger.info(
+                    "Focus API: process_image done (trace=%s, total=%.0fms, zip=false, json=false)",
+                    trace_id,
+                    (time.perf_counter() - t_total) * 1000,
+                )
+                return {"response": response.text}
                 
-                if "application/zip" in content_type or "application/x-zip-compressed" in content_type:
-                    zip_bytes = response.content
-                    result = await self._process_zip_response(zip_bytes, filename, trace_id=trace_id)
-                    logger.info(
-                        "Focus API: process_image done (trace=%s, total=%.0fms, zip=true)",
-                        trace_id,
-                        (time.perf_counter() - t_total) * 1000,
-                    )
-                    return result
-                
-                try:
-                    result = response.json()
-                    logger.info(
-                        "Focus API: process_image done (trace=%s, total=%.0fms, zip=false)",
-                        trace_id,
-                        (time.perf_counter() - t_total) * 1000,
-                    )
-                    return result
-                except json.JSONDecodeError:
-                    logger.warning(f"Ответ от Focus API не является JSON для файла {filename}")
-                    logger.info(
-                        "Focus API: process_image done (trace=%s, total=%.0fms, zip=false, json=false)",
-                        trace_id,
-                        (time.perf_counter() - t_total) * 1000,
-                    )
-                    return {"response": response.text}
-                    
         except httpx.HTTPStatusError as e:
             error_msg = f"Ошибка HTTP при запросе к Focus API: {e.response.status_code}"
             if e.response.text:
@@ -365,51 +307,45 @@ class FocusAPIService:
         payload = self._prepare_url_payload(signed_url, image_name)
 
         try:
-            headers = self._prepare_headers(payload)
+            t_http = time.perf_counter()
+            response = await self._post(payload)
+            http_ms = (time.perf_counter() - t_http) * 1000
 
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                t_http = time.perf_counter()
-                response = await client.post(
-                    self.api_url, content=payload, headers=headers
-                )
-                http_ms = (time.perf_counter() - t_http) * 1000
-                response.raise_for_status()
-
-                content_type = response.headers.get("content-type", "").lower()
-                logger.info(
-                    "Focus API: response (trace=%s, status=%s, content_type=%s, bytes=%s, %.0fms)",
-                    trace_id,
-                    response.status_code,
-                    content_type,
-                    len(response.content),
-                    http_ms,
-                )
+            content_type = response.headers.get("content-type", "").lower()
+            logger.info(
+                "Focus API: response (trace=%s, status=%s, content_type=%s, bytes=%s, %.0fms)",
+                trace_id,
+                response.status_code,
+                content_type,
+                len(response.content),
+                http_ms,
+            )
 
-                # JSON с ссылками (return_links) или ZIP (фоллбэк)
-                if "application/json" in content_type:
-                    result_data = response.json()
-                    if "png_url" in result_data or "dxf_url" in result_data:
-                        result = await self._process_links_response(
-                            result_data, image_name, trace_id=trace_id
-                        )
-                    else:
-                        result = result_data
-                elif "application/zip" in content_type or "application/x-zip-compressed" in content_type:
-                    result = await self._process_zip_response(
-                        response.content, image_name, trace_id=trace_id
+            # JSON с ссылками (return_links) или ZIP (фоллбэк)
+            if "application/json" in content_type:
+                result_data = response.json()
+                if "png_url" in result_data or "dxf_url" in result_data:
+                    result = await self._process_links_response(
+                        result_data, image_name, trace_id=trace_id
                     )
                 else:
-                    try:
-                        result = response.json()
-                    except json.JSONDecodeError:
-                        result = {"response": response.text}
-
-                logger.info(
-                    "Focus API: process_image_by_name done (trace=%s, total=%.0fms)",
-                    trace_id,
-                    (time.perf_counter() - t_total) * 1000,
+                    result = result_data
+            elif "application/zip" in content_type or "application/x-zip-compressed" in content_type:
+                result = await self._process_zip_response(
+                    response.content, image_name, trace_id=trace_id
                 )
-                return result
+            else:
+                try:
+                    result = response.json()
+                except json.JSONDecodeError:
+                    result = {"response": response.text}
+
+            logger.info(
+                "Focus API: process_image_by_name done (trace=%s, total=%.0fms)",
+                trace_id,
+                (time.perf_counter() - t_total) * 1000,
+            )
+            return result
 
         except httpx.HTTPStatusError as e:
             error_msg = f"Ошибка HTTP при запросе к Focus API: {e.response.status_code}"
@@ -0,0 +1,85 @@
+"""
+Ссылки на изображения для провайдеров моделей.
+
+Вызывающий код передаёт провайдеру gs://-ссылку на файл в бакете (см.
+GCSClient.uri), а провайдер приводит её к своему способу доставки:
+
+    gcs        — gs:// как есть: Vertex AI читает бакет того же проекта
+                 сам, без подписи URL и скачивания из интернета;
+    signed_url — V4 signed URL (кешируется в Redis, как и раньше);
+    inline     — data:-URL с байтами изображения в теле запроса.
+
+Ссылки других схем (https, data:) передаются без изменений. Способ
+доставки учитывается в image_uri.resolved_total (transport).
+"""
+
+import base64
+import logging
+from typing import Tuple
+
+import httpx
+
+from api.services.redis_service import redis_service
+from common.gc_utils import GCSClient, documents_storage, images_storage, parse_gcs_uri
+from common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_GCS = "gcs"
+TRANSPORT_SIGNED_URL = "signed_url"
+TRANSPORT_INLINE = "inline"
+TRANSPORTS = (TRANSPORT_GCS, TRANSPORT_SIGNED_URL, TRANSPORT_INLINE)
+
+_SIGNED_URL_TTL_SECONDS = 3000
+
+
+def _storage(bucket_name: str) -> GCSClient:
+    for client in (images_storage, documents_storage):
+        if client.bucket_name == bucket_name:
+            return client
+    return GCSClient(bucket_name)
+
+
+async def _signed_url(bucket_name: str, blob_name: str) -> str:
+    storage = _storage(bucket_name)
+    # Кеш signed URL в Redis ведётся по имени файла в бакете изображений
+    if storage is images_storage:
+        cached_url = await redis_service.get_signed_url(blob_name)
+        if cached_url:
+            return cached_url
+    signed_url = await storage.create_signed_url(blob_name, expiration_minutes=60)
+    if storage is images_storage:
+        await redis_service.cache_signed_url(blob_name, signed_url, ttl_seconds=_SIGNED_URL_TTL_SECONDS)
+    return signed_url
+
+
+async def fetch_image_bytes(uri: str) -> bytes:
+    """Байты изображения по gs:// или http(s)-ссылке"""
+    parsed = parse_gcs_uri(uri)
+    if parsed:
+        bucket_name, blob_name = parsed
+        content, _ = await _storage(bucket_name).download(blob_name)
+        return content
+    async with httpx.AsyncClient(timeout=30) as client:
+        response = await client.get(uri)
+        response.raise_for_status()
+        return response.content
+
+
+async def resolve_image_uri(uri: str, mime_type: str, transport: str) -> str:
+    """Ссылка на изображение в виде, который принимает провайдер"""
+    parsed = parse_gcs_uri(uri)
+    if parsed is None:
+        return uri
+    metrics.inc("image_uri.resolved_total", transport=transport)
+    if transport == TRANSPORT_GCS:
+        return uri
+    if transport == TRANSPORT_INLINE:
+        content = await fetch_image_bytes(uri)
+        return f"data:{mime_type};base64,{base64.b64encode(content).decode('ascii')}"
+    return await _signed_url(*parsed)
+
+
+async def resolve_images(images, transport: str) -> list[Tuple[str, str]]:
+    """resolve_image_uri для списка (uri, mime_type)"""
+    return [(await resolve_image_uri(uri, mime_type, transport), mime_type) for uri, mime_type in images]
@@ -1,21 +1,58 @@
 import asyncio
-import re
-import os
+import base64
 import json
+import os
 import logging
+import time
 
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Set, Tuple
 
-from common.defects_db import SYSTEM_PROMPT, USER_PROMPT, get_user_prompt, get_defect_by_code
-from settings import PROJECT_ID, LOCATION
+from api.services.cpu_pool_service import CpuPool, get_cpu_pool_service
+from api.services.image_uri_resolver import fetch_image_bytes, resolve_images
+from common import local_classifier
+from common.circuit_breaker import CircuitBreaker
+from common.defect_shortlist import get_defect_shortlister
+from common.defects_db import (
+    SYSTEM_PROMPT,
+    USER_PROMPT,
+    USER_PROMPT_BATCH_SUFFIX,
+    get_catalog,
+    get_defect_by_code,
+    get_fused_prompt,
+    get_fused_response_codes,
+    get_user_prompt,
+)
+from common.llm_usage import gemini_usage, openai_usage, record_parse_failure, record_usage
+from common.metrics import metrics
+from common.response_schemas import defect_batch_schema, defect_code_schema, fused_analysis_schema, parse_response
+from common.retry import RetryPolicy
+from settings import (
+    LLM_BREAKER_FAILURE_THRESHOLD,
+    LLM_BREAKER_RESET_SECONDS,
+    LLM_CASCADE_CHEAP_MODEL,
+    LLM_CASCADE_CONSTRUCTION_MIN_CONFIDENCE,
+    LLM_CASCADE_DEFECT_MIN_CONFIDENCE,
+    LLM_CASCADE_ENABLED,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_DELAY_SECONDS,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_QUANTILE,
+    LLM_PARSE_RETRIES,
+    LOCAL_CLASSIFIER_MIN_CONFIDENCE,
+    LOCAL_CLASSIFIER_MODEL_PATH,
+    RETRY_MAX_ATTEMPTS,
+    GEMINI_IMAGE_TRANSPORT,
+    OPENAI_IMAGE_TRANSPORT,
+    PROJECT_ID,
+    LOCATION,
+)
 
 # OpenAI
 try:
-    from openai import OpenAI, RateLimitError
+    from openai import OpenAI
 except ImportError:
     OpenAI = None
-    RateLimitError = None
 
 # Google Gemini (Vertex AI)
 try:
@@ -27,30 +64,115 @@ except ImportError:
     
 logger = logging.getLogger(__name__)
 
+# Запрос к провайдеру с конфигурацией попытки (модель подставляется для провайдера)
+ProviderRequest = Callable[["BaseModelProvider", Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
 class BaseModelProvider(ABC):
     """Базовый класс для провайдеров моделей"""
-    
+
+    name = "base"
+    default_model = None
+    # Способ доставки gs://-ссылок (см. image_uri_resolver); None — как есть
+    image_transport: Optional[str] = None
+    # Попыток _generate при rate limit и временных ошибках (common/retry.py, зависимость llm.<name>)
+    retry_attempts = RETRY_MAX_ATTEMPTS
+
     @abstractmethod
-    async def analyze_image(
-        self, 
-        image_url: str, 
-        system_prompt: str, 
-        user_prompt: str, 
+    async def _generate(
+        self,
+        model_name: str,
+        images: List[Tuple[str, str]],
+        system_prompt: str,
+        user_prompt: str,
+        config: Dict[str, Any]
+        ) -> Tuple[Optional[str], Tuple[int, int, int]]:
+        """
+        Один вызов модели по изображениям (url, mime_type): текст ответа
+        и usage (prompt, cached, completion)
+        """
+        pass
+
+    async def analyze_images(
+        self,
+        images: List[Tuple[str, str]],
+        system_prompt: str,
+        user_prompt: str,
         config: Dict[str, Any]
         ) -> Dict[str, Any]:
+        """
+        Запрос к модели с одним или несколькими изображениями.
+
+        config["response_schema"] (см. common/response_schemas.py) включает
+        структурированный ответ; ответ, не прошедший разбор, запрашивается
+        повторно до LLM_PARSE_RETRIES раз. Возвращает разобранный JSON и
+        model_used; при неудаче — parse_error и исходный текст в content.
+        """
+        model_name = config.get("model_name", self.default_model)
+        purpose = config.get("purpose", "image")
+        response_schema = config.get("response_schema")
+        if self.image_transport:
+            images = await resolve_images(images, self.image_transport)
+
+        retry = RetryPolicy(f"llm.{self.name}", max_attempts=self.retry_attempts)
+        for attempt in range(LLM_PARSE_RETRIES + 1):
+            content, usage = await retry.call(self._generate, model_name, images, system_prompt, user_prompt, config)
+            record_usage(self.name, model_name, purpose, usage)
+
+            result, error = parse_response(content, response_schema)
+            if error is None:
+                logger.info(f"{self.name} результат: {result}")
+                return {**result, "model_used": model_name}
+
+            retried = attempt < LLM_PARSE_RETRIES
+            record_parse_failure(self.name, model_name, purpose, error, usage, retried)
+            logger.warning(f"{self.name}: ответ не разобран ({error}), повтор: {retried}")
 
+        return {"parse_error": error, "content": content, "model_used": model_name}
+
+    async def analyze_image(
+        self,
+        image_url: str,
+        mime_type: str,
+        system_prompt: str,
+        user_prompt: str,
+        config: Dict[str, Any]
+        ) -> Dict[str, Any]:
         """Анализ изображения с помощью модели"""
-        pass
-    
+        result = await self.analyze_images([(image_url, mime_type)], system_prompt, user_prompt, config)
+        if result.get("parse_error"):
+            content = result.pop("content")
+            return {
+                "image_url": image_url,
+                "description": content or "",
+                "recommendation": "Требуется ручная обработка ответа" if content else "Ответ пустой или нераспознан",
+                "construction_type": "",
+                **result,
+            }
+        return {
+            "image_url": image_url,
+            "code": "",
+            "description": "",
+            "recommendation": "",
+            "category": "",
+            "construction_type": "",
+            "confidence": 0.0,
+            **result,
+        }
+
     def cleanup(self):
         """Очистка ресурсов провайдера"""
         pass
 
 class OpenAIProvider(BaseModelProvider):
     """Провайдер OpenAI GPT моделей"""
-    
+
+    name = "openai"
+    default_model = "gpt-4o-mini"
+    image_transport = OPENAI_IMAGE_TRANSPORT
+
     def __init__(self):
-        self.client = OpenAI()
+        # Повторы — в common/retry.py, встроенные повторы SDK их бы умножали
+        self.client = OpenAI(max_retries=0)
         self.available_models = [
             "gpt-4o-mini",
             "gpt-4o",
@@ -61,18 +183,25 @@ class OpenAIProvider(BaseModelProvider):
     def is_available(self) -> bool:
         return bool(os.getenv("OPENAI_API_KEY"))
 
-    async def analyze_image(
-        self, 
-        image_url: str,
-        mime_type: str,
-        system_prompt: str, 
+    async def _generate(
+        self,
+        model_name: str,
+        images: List[Tuple[str, str]],
+        system_prompt: str,
         user_prompt: str,
         config: Dict[str, Any]
-        ) -> Dict[str, Any]:
+        ) -> Tuple[Optional[str], Tuple[int, int, int]]:
         try:
-            model_name = config.get("model_name", "gpt-4o-mini")
             max_tokens_value = config.get("max_tokens", 4096)
-            
+            response_schema = config.get("response_schema")
+            if response_schema:
+                response_format = {
+                    "type": "json_schema",
+                    "json_schema": {**response_schema, "strict": True},
+                }
+            else:
+                response_format = {"type": "json_object"}
+
             # Для gpt-5.1 используется max_completion_tokens вместо max_tokens
             api_params = {
                 "model": model_name,
@@ -80,11 +209,11 @@ class OpenAIProvider(BaseModelProvider):
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": [
                         {"type": "text", "text": user_prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}}
+                        *({"type": "image_url", "image_url": {"url": image_url}} for image_url, _ in images),
                     ]}
                 ],
                 "temperature": config.get("temperature", 0.2),
-                "response_format": {"type": "json_object"}
+                "response_format": response_format,
             }
             
             if model_name == "gpt-5.1":
@@ -96,29 +225,19 @@ class OpenAIProvider(BaseModelProvider):
                 self.client.chat.completions.create,
                 **api_params
             )
+            return response.choices[0].message.content, openai_usage(response)
             
-            result = json.loads(response.choices[0].message.content)
-            logger.info(f"OpenAI API результат: {result}")
-            return {
-                "image_url": image_url,
-                "code": result.get("code", ""),
-                "recommendation": result.get("recommendation", ""),
-                "category": result.get("category", ""),
-                "construction_type": result.get("construction_type", ""),
-                "description": result.get("description", ""),
-                "confidence": result.get("confidence", 0.0),
-                "model_used": config.get("model_name", "gpt-4o-mini"),
-            }
-            
-        except RateLimitError:
-            raise Exception("Превышен лимит запросов к OpenAI API")
         except Exception as e:
             logger.error(f"Ошибка OpenAI API: {e}")
             raise
 
 class GoogleGeminiProvider(BaseModelProvider):
     """Провайдер Google Gemini моделей через Vertex AI"""
-    
+
+    name = "gemini"
+    default_model = "gemini-2.5-flash"
+    image_transport = GEMINI_IMAGE_TRANSPORT
+
     def __init__(self):
         if not genai:
             raise ImportError("Vertex AI не установлен")
@@ -145,28 +264,6 @@ class GoogleGeminiProvider(BaseModelProvider):
             self.project_id and 
             self.location
         )
-    
-    @staticmethod
-    def _safe_parse_json(content: str) -> dict:
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            pass
-
-        if (content.startswith('"') and content.endswith('"')) or ("\\\"" in content):
-            try:
-                return json.loads(json.loads(content))
-            except Exception:
-                pass
-
-        match = re.search(r"\{.*\}", content, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except json.JSONDecodeError:
-                pass
-
-        return {}
 
     @staticmethod
     def _extract_text(response: GenerateContentResponse) -> str | None:
@@ -180,75 +277,95 @@ class GoogleGeminiProvider(BaseModelProvider):
                 return part.text
         return None
         
-    async def analyze_image(
-        self, image_url: str, 
-        mime_type: str, 
-        system_prompt: str, 
-        user_prompt: str, 
+    @staticmethod
+    def _image_part(image_url: str, mime_type: str) -> Dict[str, Any]:
+        """gs:// или https — ссылкой, data:-URL (transport inline) — байтами"""
+        if image_url.startswith("data:"):
+            data = base64.b64decode(image_url.partition(",")[2])
+            return {"inline_data": {"mime_type": mime_type, "data": data}}
+        return {"file_data": {"mime_type": mime_type, "file_uri": image_url}}
+
+    async def _generate(
+        self,
+        model_name: str,
+        images: List[Tuple[str, str]],
+        system_prompt: str,
+        user_prompt: str,
         config: Dict[str, Any]
-        ) -> Dict[str, Any]:
+        ) -> Tuple[Optional[str], Tuple[int, int, int]]:
         try:
+            # Постоянные системные инструкции и промпт — в начале запроса,
+            # изображение — в конце: так срабатывает кеш префикса Gemini
             contents = [
                 {
                     "role": "user",
                         "parts": [
-                            {"text": system_prompt},
                             {"text": user_prompt},
-                            {"file_data": {"mime_type": mime_type, "file_uri": image_url}}
+                            *(self._image_part(image_url, mime_type) for image_url, mime_type in images),
                         ]
                 }
             ]
 
             gen_cfg = {
+                "system_instruction": system_prompt,
                 "temperature":       config.get("temperature", 0.1),
                 "max_output_tokens": config.get("max_tokens", 4096),
                 "response_mime_type": "application/json",
             }
+            response_schema = config.get("response_schema")
+            if response_schema:
+                gen_cfg["response_json_schema"] = response_schema["schema"]
             
             response = await asyncio.to_thread(
                 self.client.models.generate_content,
-                model=config.get("model_name", "gemini-2.5-flash"),
+                model=model_name,
                 contents=contents,
                 config=gen_cfg,
             )
-            
-            content = self._extract_text(response)
-
-            if content is None:
-                return {
-                    "image_url": image_url,
-                    "description": "",
-                    "recommendation": "Ответ пустой или нераспознан",
-                    "construction_type": "",
-                    "model_used": config.get("model_name", "gemini-2.5-flash"),
-                }                
-
-            result = self._safe_parse_json(content)
-
-            if result:
-                logger.info(f"Gemini API результат: {result}")
-                return {
-                    "image_url": image_url,
-                    "code": result.get("code", ""),
-                    "description": result.get("description", ""),
-                    "recommendation": result.get("recommendation", ""),
-                    "category": result.get("category", ""),
-                    "construction_type": result.get("construction_type", ""),
-                    "model_used": config.get("model_name", "gemini-2.5-flash")
-                }
-            else:
-                return {
-                    "image_url": image_url,
-                    "description": content,
-                    "recommendation": "Требуется ручная обработка ответа",
-                    "construction_type": "",
-                    "model_used": config.get("model_name", "gemini-2.5-flash"),
-                }
+            return self._extract_text(response), gemini_usage(response)
                 
         except Exception as e:
             logger.error(f"Ошибка Vertex AI Gemini API: {e}")
             raise
 
+class LocalClassifierProvider(BaseModelProvider):
+    """
+    Локальный CPU-классификатор типа конструкции (см. common/local_classifier.py).
+
+    Отвечает только на запросы типа конструкции — JSON в формате
+    CONSTRUCTION_TYPE_SCHEMA, без токенов. Изображение скачивается из
+    бакета (или по URL), инференс выполняется в пуле процессов изображений.
+    """
+
+    name = "local"
+    # Ошибки классификатора не временные, а изображение скачивается с повторами GCS
+    retry_attempts = 1
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.default_model = os.path.basename(model_path)
+        self.available_models = [self.default_model]
+
+    def is_available(self) -> bool:
+        return local_classifier.runtime_available() and os.path.exists(self.model_path)
+
+    async def _generate(
+        self,
+        model_name: str,
+        images: List[Tuple[str, str]],
+        system_prompt: str,
+        user_prompt: str,
+        config: Dict[str, Any]
+        ) -> Tuple[Optional[str], Tuple[int, int, int]]:
+        if config.get("purpose") != "construction_type" or len(images) != 1:
+            raise ValueError("Локальный классификатор определяет только тип конструкции по одному фото")
+        content = await fetch_image_bytes(images[0][0])
+        construction_type, confidence = await get_cpu_pool_service().run(
+            CpuPool.IMAGE, local_classifier.classify, self.model_path, content,
+        )
+        answer = {"construction_type": construction_type, "confidence": round(confidence, 4)}
+        return json.dumps(answer, ensure_ascii=False), (0, 0, 0)
+
 class ModelManager:
     """Менеджер моделей для анализа дефектов"""
     
@@ -259,6 +376,22 @@ class ModelManager:
         self.user_prompt = USER_PROMPT
         
         self._init_providers()
+        self.breakers: Dict[str, CircuitBreaker] = {
+            name: CircuitBreaker(f"llm.{name}", LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+            for name in self.providers
+        }
+        # Проигравшие хедж-попытки отменяются и дожидаются отмены в фоне:
+        # запрос в потоке SDK не прервать, но повторы и переспросы снимаются
+        self._background: Set[asyncio.Task] = set()
+        # Локальный классификатор не участвует в маршрутизации LLM-запросов
+        self.local_provider: Optional[LocalClassifierProvider] = None
+        if LOCAL_CLASSIFIER_MODEL_PATH:
+            provider = LocalClassifierProvider(LOCAL_CLASSIFIER_MODEL_PATH)
+            if provider.is_available():
+                self.local_provider = provider
+                logger.info(f"Локальный классификатор подключён: {LOCAL_CLASSIFIER_MODEL_PATH}")
+            else:
+                logger.warning(f"Локальный классификатор недоступен (onnxruntime или {LOCAL_CLASSIFIER_MODEL_PATH})")
     
     def _init_providers(self):
         """Инициализация доступных провайдеров"""
@@ -299,69 +432,443 @@ class ModelManager:
         
         raise ValueError(f"Модель {model_name} не найдена в доступных провайдерах")
     
+    def _ordered_providers(self, model_name: str = None) -> List[Tuple[str, BaseModelProvider]]:
+        """Доступные провайдеры: провайдер модели, затем по умолчанию, затем остальные"""
+        ordered = []
+        if model_name:
+            ordered += [(n, p) for n, p in self.providers.items() if model_name in p.available_models]
+        if self.default_provider in self.providers:
+            ordered.append((self.default_provider, self.providers[self.default_provider]))
+        ordered += list(self.providers.items())
+
+        result, seen = [], set()
+        for name, provider in ordered:
+            if name not in seen and provider.is_available():
+                seen.add(name)
+                result.append((name, provider))
+        return result
+
+    def _route(self, model_name: str = None) -> List[Tuple[str, BaseModelProvider]]:
+        """Провайдеры с замкнутым автоматом защиты; если разомкнуты все — первый доступный"""
+        ordered = self._ordered_providers(model_name)
+        if not ordered:
+            raise Exception("Нет доступных провайдеров моделей")
+        allowed = [(name, provider) for name, provider in ordered if self.breakers[name].allow()]
+        return allowed or ordered[:1]
+
     def get_provider(self, model_name: str = None) -> BaseModelProvider:
         """Получение провайдера для указанной модели"""        
-        if model_name:
-            for _, provider in self.providers.items():
-                if model_name in provider.available_models and provider.is_available():
-                    return provider   
+        return self._route(model_name)[0][1]
 
-        if self.default_provider in self.providers and self.providers[self.default_provider].is_available():
-            return self.providers[self.default_provider]
-        
-        for provider in self.providers.values():
-            if provider.is_available():
-                return provider
-        
-        raise Exception("Нет доступных провайдеров моделей")
-    
-    async def analyze_image(
+    @staticmethod
+    def _model_for(provider: BaseModelProvider, model_name: str = None) -> str:
+        return model_name if model_name in provider.available_models else provider.default_model
+
+    def _hedge_delay(self, provider_name: str, model_name: str, purpose: str) -> Optional[float]:
+        """
+        Через сколько секунд отправлять резервный запрос: скользящий p95
+        успешных попыток модели, не меньше LLM_HEDGE_MIN_DELAY_SECONDS.
+        None — истории мало, резерв только при ошибке основного вызова.
+        """
+        labels = {"provider": provider_name, "model": model_name, "purpose": purpose, "outcome": "ok"}
+        if metrics.get_count("llm.attempt_seconds", **labels) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        p95 = metrics.get_percentile("llm.attempt_seconds", LLM_HEDGE_QUANTILE, **labels)
+        return max(p95, LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    async def _attempt(
+        self,
+        provider_name: str,
+        role: str,
+        request: ProviderRequest,
+        config: Dict[str, Any],
+        ) -> Dict[str, Any]:
+        """Одна попытка вызова: учёт в автомате защиты и метрики длительности"""
+        labels = {"provider": provider_name, "model": config["model_name"], "purpose": config.get("purpose", "image")}
+        breaker = self.breakers[provider_name]
+        outcome = "error"
+        started = time.perf_counter()
+        try:
+            result = await request(self.providers[provider_name], config)
+            outcome = "invalid" if result.get("parse_error") else "ok"
+            breaker.record_success()
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        finally:
+            metrics.observe("llm.attempt_seconds", time.perf_counter() - started, outcome=outcome, **labels)
+            metrics.inc("llm.attempts_total", role=role, outcome=outcome, **labels)
+
+    async def call_model(
+        self,
+        image_url: str,
+        mime_type: str,
+        system_prompt: str,
+        user_prompt: str,
+        config: Dict[str, Any],
+        ) -> Dict[str, Any]:
+        """
+        Вызов модели с хеджированием и переключением провайдера.
+
+        Основной запрос идёт провайдеру модели из config (или первому
+        провайдеру с замкнутым автоматом защиты). Если он не ответил за p95
+        модели, упал или вернул неразобранный ответ, тот же запрос уходит
+        второму провайдеру (его модели по умолчанию); берётся первый
+        корректный ответ.
+        """
+        return await self._hedged(
+            lambda provider, cfg: provider.analyze_image(image_url, mime_type, system_prompt, user_prompt, cfg),
+            config,
+        )
+
+    async def call_model_batch(
+        self,
+        images: List[Tuple[str, str]],
+        system_prompt: str,
+        user_prompt: str,
+        config: Dict[str, Any],
+        ) -> Dict[str, Any]:
+        """Запрос с несколькими изображениями (url, mime_type) — с тем же хеджированием"""
+        return await self._hedged(
+            lambda provider, cfg: provider.analyze_images(images, system_prompt, user_prompt, cfg),
+            config,
+        )
+
+    async def _hedged(self, request: ProviderRequest, config: Dict[str, Any]) -> Dict[str, Any]:
+        route = self._route(config.get("model_name"))
+        plan = [
+            (name, {**config, "model_name": self._model_for(provider, config.get("model_name"))})
+            for name, provider in route[:2 if LLM_HEDGE_ENABLED else 1]
+        ]
+        purpose = config.get("purpose", "image")
+        primary_name, primary_config = plan[0]
+        delay = self._hedge_delay(primary_name, primary_config["model_name"], purpose) if len(plan) > 1 else None
+
+        pending: Dict[asyncio.Task, Tuple[str, str]] = {}
+
+        def launch(index: int, role: str) -> None:
+            name, attempt_config = plan[index]
+            task = asyncio.create_task(self._attempt(name, role, request, attempt_config))
+            pending[task] = (name, role)
+
+        launch(0, "primary")
+        backup_ready = len(plan) > 1
+        fallback, error = None, None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=delay if backup_ready else None, return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    logger.info(f"Хедж: {primary_name} не ответил за {delay:.1f} с, запрос к {plan[1][0]}")
+                    metrics.inc("llm.hedges_total", provider=primary_name, purpose=purpose, reason="slow")
+                    launch(1, "hedge")
+                    backup_ready = False
+                    continue
+
+                for task in done:
+                    name, role = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if not result.get("parse_error"):
+                        metrics.inc("llm.hedge_wins_total", provider=name, role=role, purpose=purpose)
+                        return result
+                    fallback = fallback or result
+
+                if backup_ready and not pending:
+                    reason = "error" if fallback is None else "invalid"
+                    logger.warning(f"Переключение с {primary_name} на {plan[1][0]} ({reason})")
+                    metrics.inc("llm.hedges_total", provider=primary_name, purpose=purpose, reason=reason)
+                    launch(1, "failover")
+                    backup_ready = False
+        finally:
+            for task in pending:
+                task.cancel()
+                self._background.add(task)
+                task.add_done_callback(self._forget)
+
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def _forget(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    async def call_cascade(
         self,
         image_url: str,
         mime_type: str,
+        system_prompt: str,
+        user_prompt: str,
         config: Dict[str, Any],
-        construction_type: str = None
+        escalation_reason: Callable[[Dict[str, Any]], Optional[str]],
         ) -> Dict[str, Any]:
-        """Анализ изображения с помощью выбранной модели"""
+        """
+        Каскад: сначала LLM_CASCADE_CHEAP_MODEL, затем модель из config.
+
+        escalation_reason(result) возвращает причину эскалации к сильной
+        модели или None, если ответ дешёвой модели принят. Каскад работает
+        только при LLM_CASCADE_ENABLED и config["cascade"]; доля эскалаций —
+        llm.cascade_total (outcome, reason).
+
+        При config["local"] и подключённом локальном классификаторе первым
+        пробуется он: ответ с уверенностью не ниже
+        LOCAL_CLASSIFIER_MIN_CONFIDENCE принимается без сетевого вызова.
+        """
+        if config.get("local") and self.local_provider is not None:
+            result = await self._call_local(image_url, mime_type, system_prompt, user_prompt, config)
+            if result is not None:
+                return result
+
+        strong_model = config.get("model_name")
+        if not (LLM_CASCADE_ENABLED and config.get("cascade")) or strong_model == LLM_CASCADE_CHEAP_MODEL:
+            return await self.call_model(image_url, mime_type, system_prompt, user_prompt, config)
 
-        model_name = config.get("model_name")
+        purpose = config.get("purpose", "image")
+        try:
+            result = await self.call_model(
+                image_url, mime_type, system_prompt, user_prompt,
+                {**config, "model_name": LLM_CASCADE_CHEAP_MODEL},
+            )
+            reason = "invalid" if result.get("parse_error") else escalation_reason(result)
+        except Exception as e:
+            logger.warning(f"Каскад: ошибка дешёвой модели {LLM_CASCADE_CHEAP_MODEL}: {e}")
+            reason = "error"
 
-        provider = self.get_provider(model_name)
+        if reason is None:
+            metrics.inc("llm.cascade_total", purpose=purpose, outcome="accepted")
+            return result
+        metrics.inc("llm.cascade_total", purpose=purpose, outcome="escalated", reason=reason)
+        logger.info(f"Каскад ({purpose}): эскалация к {strong_model}, причина {reason}")
+        return await self.call_model(image_url, mime_type, system_prompt, user_prompt, config)
 
-        if construction_type is not None:
+    async def _call_local(
+        self,
+        image_url: str,
+        mime_type: str,
+        system_prompt: str,
+        user_prompt: str,
+        config: Dict[str, Any],
+        ) -> Optional[Dict[str, Any]]:
+        """Ответ локального классификатора, если он уверен; иначе None"""
+        purpose = config.get("purpose", "image")
+        started = time.perf_counter()
+        try:
+            result = await self.local_provider.analyze_image(
+                image_url, mime_type, system_prompt, user_prompt,
+                {**config, "model_name": self.local_provider.default_model},
+            )
+        except Exception as e:
+            logger.warning(f"Локальный классификатор: ошибка, передаём LLM: {e}")
+            metrics.inc("llm.local_total", purpose=purpose, outcome="error")
+            return None
+        finally:
+            metrics.observe("llm.local_seconds", time.perf_counter() - started, purpose=purpose)
+
+        if result.get("parse_error") or result.get("confidence", 0.0) < LOCAL_CLASSIFIER_MIN_CONFIDENCE:
+            metrics.inc("llm.local_total", purpose=purpose, outcome="fallthrough")
+            return None
+        metrics.inc("llm.local_total", purpose=purpose, outcome="accepted")
+        return result
+
+    async def analyze_image(
+        self,
+        image_url: str,
+        mime_type: str,
+        config: Dict[str, Any],
+        construction_type: str = None,
+        defect_type: str = None,
+        construction_confidence: float = None,
+        ) -> Dict[str, Any]:
+        """
+        Анализ изображения с помощью выбранной модели.
+
+        defect_type (тег отметки) и construction_confidence (уверенность в
+        типе конструкции; None — тип задан явно) используются для шорт-листа
+        кандидатов: при уверенном отборе модель получает только top-K кодов.
+        """
+
+        catalog = get_catalog()
+        shortlister = get_defect_shortlister()
+        shortlist = shortlister.shortlist(construction_type, construction_confidence, defect_type)
+        if shortlist.applied:
+            user_prompt = catalog.subset_prompt(shortlist.codes)
+            response_codes = catalog.subset_response_codes(shortlist.codes)
+            logger.info(
+                f"Шорт-лист дефектов: {len(shortlist.codes)} из {shortlist.candidates} "
+                f"(уверенность {shortlist.confidence:.2f})"
+            )
+        elif construction_type is not None:
             user_prompt = get_user_prompt(construction_type)
+            response_codes = catalog.response_codes(construction_type)
         else:
             user_prompt = self.user_prompt
+            response_codes = catalog.response_codes()
+
+        def escalation_reason(result: Dict[str, Any]) -> Optional[str]:
+            if not catalog.is_response_code(result.get("code"), shortlist.scope):
+                return "invalid_code"
+            if result.get("confidence", 0.0) < LLM_CASCADE_DEFECT_MIN_CONFIDENCE:
+                return "low_confidence"
+            return None
 
-        result = await provider.analyze_image(
+        # Код ответа ограничен enum кодов, которые модель видела в промпте
+        result = await self.call_cascade(
             image_url,
             mime_type,
             self.system_prompt,
             user_prompt,
-            config
+            {**config, "response_schema": defect_code_schema(response_codes)},
+            escalation_reason,
         )
 
         # Извлекаем код дефекта и получаем данные из базы
         code = result.get("code")
+        shortlister.record_outcome(shortlist, code)
         if code:
-            defect_data = get_defect_by_code(code)
-            if defect_data:
-                logger.info(f"Найден дефект по коду {code}: {defect_data.get('description', '')[:50]}...")
-                return {
-                    "image_url": image_url,
-                    "code": code,
-                    "description": defect_data.get("description", ""),
-                    "recommendation": defect_data.get("recommendation", ""),
-                    "category": defect_data.get("category", ""),
-                    "construction_type": defect_data.get("construction_type", ""),
-                    "model_used": config.get("model_name", "unknown"),
-                }
-            else:
-                logger.warning(f"Код дефекта {code} не найден в базе")
+            defect_result = self._defect_result(
+                image_url, code, result.get("model_used", config.get("model_name", "unknown")),
+            )
+            if defect_result:
+                return defect_result
+            logger.warning(f"Код дефекта {code} не найден в базе")
 
         # Fallback: возвращаем результат как есть (для обратной совместимости)
         return result
+
+    @staticmethod
+    def _defect_result(image_url: str, code: str, model_used: str) -> Optional[Dict[str, Any]]:
+        """Результат анализа по коду дефекта с данными из базы; None — кода нет в базе"""
+        defect_data = get_defect_by_code(code)
+        if not defect_data:
+            return None
+        logger.info(f"Найден дефект по коду {code}: {defect_data.get('description', '')[:50]}...")
+        return {
+            "image_url": image_url,
+            "code": code,
+            "description": defect_data.get("description", ""),
+            "recommendation": defect_data.get("recommendation", ""),
+            "category": defect_data.get("category", ""),
+            "construction_type": defect_data.get("construction_type", ""),
+            "model_used": model_used,
+        }
+
+    async def analyze_images_batch(
+        self,
+        images: List[Tuple[str, str]],
+        config: Dict[str, Any],
+        construction_type: str = None,
+        ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Кодирование дефектов нескольких независимых изображений одним вызовом.
+
+        Все изображения — одного типа конструкции, поэтому промпт с базой
+        общий (без шорт-листа); модель возвращает массив кодов по номерам
+        изображений. Результаты — в порядке images; None — для изображения
+        нет корректного кода (его нужно проанализировать отдельно).
+        """
+        catalog = get_catalog()
+        user_prompt = get_user_prompt(construction_type) + USER_PROMPT_BATCH_SUFFIX.format(count=len(images))
+        result = await self.call_model_batch(
+            images,
+            self.system_prompt,
+            user_prompt,
+            {
+                **config,
+                "purpose": "defect_batch",
+                "response_schema": defect_batch_schema(catalog.response_codes(construction_type)),
+            },
+        )
+        if result.get("parse_error"):
+            return [None] * len(images)
+
+        codes: Dict[int, str] = {}
+        for item in result.get("results", []):
+            index, code = item.get("image"), item.get("code")
+            if isinstance(index, int) and 1 <= index <= len(images) and index not in codes:
+                if catalog.is_response_code(code, construction_type):
+                    codes[index] = code
+        model_used = result.get("model_used", config.get("model_name", "unknown"))
+        return [
+            self._defect_result(image_url, codes[i], model_used) if i in codes else None
+            for i, (image_url, _) in enumerate(images, start=1)
+        ]
     
+    async def analyze_fused(
+        self,
+        image_url: str,
+        mime_type: str,
+        config: Dict[str, Any],
+        ) -> Dict[str, Any]:
+        """
+        Совмещённый вызов: тип конструкции и код дефекта по одному изображению.
+
+        Возвращает construction_type и confidence (уверенность в типе) и,
+        если код согласуется с выбранным типом, данные дефекта из каталога:
+        code, description, recommendation, category, code_confidence.
+        Несогласованный код отбрасывается — дефект потом определяется
+        обычным вызовом. parse_error — ответ не получен.
+        """
+        catalog = get_catalog()
+
+        def escalation_reason(result: Dict[str, Any]) -> Optional[str]:
+            if not catalog.is_response_code(result.get("code"), result.get("construction_type")):
+                return "invalid_code"
+            if result.get("confidence", 0.0) < LLM_CASCADE_CONSTRUCTION_MIN_CONFIDENCE:
+                return "low_confidence"
+            if result.get("code_confidence", 0.0) < LLM_CASCADE_DEFECT_MIN_CONFIDENCE:
+                return "low_confidence"
+            return None
+
+        result = await self.call_cascade(
+            image_url,
+            mime_type,
+            self.system_prompt,
+            get_fused_prompt(),
+            {
+                **config,
+                "purpose": "fused",
+                "response_schema": fused_analysis_schema(get_fused_response_codes()),
+            },
+            escalation_reason,
+        )
+        if result.get("parse_error"):
+            metrics.inc("fused_analysis.requests_total", outcome="failed")
+            return result
+
+        construction_type = result.get("construction_type")
+        fused = {
+            "image_url": image_url,
+            "construction_type": construction_type,
+            "confidence": result.get("confidence", 0.0),
+            "model_used": result.get("model_used", config.get("model_name", "unknown")),
+        }
+        code = result.get("code")
+        defect_data = get_defect_by_code(code) if catalog.is_response_code(code, construction_type) else None
+        if defect_data is None:
+            logger.warning(f"Совмещённый вызов: код {code} не относится к типу {construction_type}, отброшен")
+            metrics.inc("fused_analysis.requests_total", outcome="type_only")
+            return fused
+
+        metrics.inc("fused_analysis.requests_total", outcome="complete")
+        fused.update({
+            "code": code,
+            "description": defect_data.get("description", ""),
+            "recommendation": defect_data.get("recommendation", ""),
+            "category": defect_data.get("category", ""),
+            "code_confidence": result.get("code_confidence"),
+        })
+        return fused
+
     def cleanup_all(self):
         """Очистка ресурсов всех провайдеров"""
         for provider in self.providers.values():
@@ -0,0 +1,418 @@
+"""
+Сервис экспорта объекта в ZIP-архив.
+
+Архив собирается на лету: фото, изображения планов, ведомость дефектов
+(из GCS) и marks.json с отметками и анализами. Раскладка архива
+детерминирована (см. common/zip_stream.py), поэтому клиент может докачать
+его Range-запросом с If-Range по ETag. Ведомость закрепляется за ETag
+(blob и generation в Redis): при докачке берётся та же ведомость, даже
+если кеш отчёта истёк и новая ещё не сгенерирована.
+
+Блобы скачиваются кусками по EXPORT_CHUNK_SIZE, вперёд качается не более
+EXPORT_GCS_CONCURRENCY файлов, у каждого — очередь на пару кусков, так что
+память не зависит от размера объекта. CRC-32 файлов кешируются в Redis по
+generation блоба — при докачке их не нужно пересчитывать.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from enum import Enum
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.models.entities import Mark, Photo, PhotoDefectAnalysis, Plan
+from api.services.redis_service import redis_service
+from api.services.report_service import ReportService
+from common.gc_utils import GCSClient, images_storage
+from common.zip_stream import ZipEntry, ZipLayout, clip, overlap
+from settings import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_CRC_TTL_SECONDS,
+    EXPORT_GCS_CONCURRENCY,
+    EXPORT_STATEMENT_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+MARKS_JSON_NAME = "marks.json"
+STATEMENT_NAME = "defects_statement.docx"
+
+# Сколько кусков блоба может лежать в очереди одного загрузчика
+_FETCH_QUEUE_SIZE = 2
+
+
+@dataclass
+class ExportItem:
+    """Файл архива: либо blob из GCS (конкретной generation), либо байты в памяти."""
+    entry: ZipEntry
+    blob_name: Optional[str] = None
+    generation: Optional[int] = None
+    data: Optional[bytes] = None
+
+    @property
+    def crc_cache_key(self) -> str:
+        return f"export:crc:{self.blob_name}:{self.generation}"
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+class _BlobFetcher:
+    """Фоновая загрузка одного блоба кусками в ограниченную очередь."""
+
+    def __init__(
+        self,
+        storage: GCSClient,
+        item: ExportItem,
+        window: Optional[Tuple[int, int]],
+        want_crc: bool,
+    ):
+        self.storage = storage
+        self.item = item
+        self.window = window
+        self.want_crc = want_crc
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=_FETCH_QUEUE_SIZE)
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        entry = self.item.entry
+        try:
+            # Для CRC нужен весь файл, иначе качаем только запрошенный кусок
+            read_from, read_to = (0, entry.size) if self.want_crc else self.window
+            crc = 0
+            pos = read_from
+            while pos < read_to:
+                length = min(EXPORT_CHUNK_SIZE, read_to - pos)
+                data = await self.storage.download_range(
+                    self.item.blob_name, pos, pos + length, generation=self.item.generation,
+                )
+                if len(data) != length:
+                    raise IOError(
+                        f"{self.item.blob_name}: ожидалось {length} байт с позиции {pos}, получено {len(data)}"
+                    )
+                if self.want_crc:
+                    crc = zlib.crc32(data, crc)
+                if self.window:
+                    piece = clip(data, self.window[0], self.window[1], pos)
+                    if piece:
+                        await self.queue.put(piece)
+                pos += length
+
+            if self.want_crc:
+                entry.crc = crc
+                await redis_service.set(self.item.crc_cache_key, str(crc), ttl_seconds=EXPORT_CRC_TTL_SECONDS)
+            await self.queue.put(None)
+        except Exception as e:
+            await self.queue.put(e)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class ObjectExport:
+    """Собранный манифест архива объекта."""
+
+    def __init__(self, object_id: int, items: List[ExportItem], storage: GCSClient = images_storage):
+        self.object_id = object_id
+        self.items = items
+        self.storage = storage
+        self.layout = ZipLayout([item.entry for item in items])
+
+        fingerprint = hashlib.sha1()
+        for item in items:
+            source = item.blob_name and f"{item.blob_name}#{item.generation}"
+            if item.data is not None:
+                source = hashlib.sha1(item.data).hexdigest()
+            fingerprint.update(f"{item.entry.name}|{item.entry.size}|{source}\n".encode("utf-8"))
+        self.etag = f'"{fingerprint.hexdigest()}"'
+
+    @property
+    def total_size(self) -> int:
+        return self.layout.total_size
+
+    async def stream(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Отдаёт байты архива из диапазона [start, end)."""
+        layout = self.layout
+        end = layout.total_size if end is None else end
+        need_directory = overlap(start, end, layout.central_offset, layout.total_size) is not None
+
+        plan = []
+        for item in self.items:
+            entry = item.entry
+            window = overlap(start, end, entry.data_offset, entry.descriptor_offset)
+            want_crc = entry.crc is None and (
+                need_directory
+                or overlap(start, end, entry.descriptor_offset, entry.end_offset) is not None
+            )
+            plan.append((item, window, want_crc))
+
+        # Загрузчики стартуют строго по порядку записей — не более EXPORT_GCS_CONCURRENCY вперёд
+        jobs = deque(
+            (item, window, want_crc)
+            for item, window, want_crc in plan
+            if item.data is None and (window or want_crc)
+        )
+        fetchers: dict[int, _BlobFetcher] = {}
+        running: deque[_BlobFetcher] = deque()
+
+        def fill():
+            while jobs and len(running) < EXPORT_GCS_CONCURRENCY:
+                item, window, want_crc = jobs.popleft()
+                fetcher = _BlobFetcher(self.storage, item, window, want_crc)
+                fetchers[id(item)] = fetcher
+                running.append(fetcher)
+
+        try:
+            fill()
+            for item, window, want_crc in plan:
+                entry = item.entry
+                header = clip(entry.local_header(), start, end, entry.offset)
+                if header:
+                    yield header
+
+                if item.data is not None:
+                    if window:
+                        yield item.data[window[0]:window[1]]
+                elif window or want_crc:
+                    fetcher = fetchers.pop(id(item))
+                    async for chunk in fetcher.chunks():
+                        yield chunk
+                    running.remove(fetcher)
+                    fill()
+
+                if overlap(start, end, entry.descriptor_offset, entry.end_offset):
+                    yield clip(entry.data_descriptor(), start, end, entry.descriptor_offset)
+
+            if need_directory:
+                yield clip(layout.central_directory(), start, end, layout.central_offset)
+        finally:
+            for fetcher in running:
+                fetcher.task.cancel()
+
+
+class ObjectExportService:
+    """Сервис сборки ZIP-экспорта объекта"""
+
+    def __init__(self, db: AsyncSession, is_admin: bool = False):
+        self.db = db
+        self.is_admin = is_admin
+
+    async def build_export(self, object_id: int, etag: Optional[str] = None) -> ObjectExport:
+        """
+        Собирает манифест архива: метаданные блобов, ведомость и marks.json.
+        Доступ к объекту должен быть проверен вызывающим кодом.
+
+        Args:
+            object_id: ID объекта
+            etag: ETag из If-Range при докачке — ведомость берётся та,
+                что была закреплена за этим архивом
+        """
+        plans = (await self.db.execute(
+            select(Plan).where(Plan.object_id == object_id).order_by(Plan.id)
+        )).scalars().all()
+        plan_ids = [plan.id for plan in plans]
+
+        marks = (await self.db.execute(
+            select(Mark).where(Mark.plan_id.in_(plan_ids)).order_by(Mark.id)
+        )).scalars().all() if plan_ids else []
+        mark_ids = [mark.id for mark in marks]
+
+        photos = (await self.db.execute(
+            select(Photo).where(Photo.mark_id.in_(mark_ids)).order_by(Photo.id)
+        )).scalars().all() if mark_ids else []
+        photo_ids = [photo.id for photo in photos]
+
+        analyses = (await self.db.execute(
+            select(PhotoDefectAnalysis)
+            .where(PhotoDefectAnalysis.photo_id.in_(photo_ids))
+            .order_by(PhotoDefectAnalysis.id)
+        )).scalars().all() if photo_ids else []
+
+        marks_by_id = {mark.id: mark for mark in marks}
+        sources: List[Tuple[str, str, Optional[int]]] = []
+        for plan in plans:
+            if plan.image_name:
+                sources.append((f"plans/{plan.id}{self._ext(plan.image_name)}", plan.image_name, None))
+        photo_paths: dict[int, str] = {}
+        for photo in photos:
+            mark = marks_by_id[photo.mark_id]
+            path = f"photos/plan_{mark.plan_id}/mark_{mark.id}/{photo.id}{self._ext(photo.image_name)}"
+            photo_paths[photo.id] = path
+            sources.append((path, photo.image_name, None))
+
+        pinned = await self._pinned_statement(etag) if etag else None
+        if pinned:
+            statement_blob, statement_generation = pinned
+        else:
+            report_service = ReportService(self.db, is_admin=self.is_admin)
+            statement_blob = await report_service.get_defects_report_blob(object_id)
+            statement_generation = None
+        sources.append((STATEMENT_NAME, statement_blob, statement_generation))
+
+        items = await self._stat_blobs(sources)
+        present = {item.entry.name for item in items}
+
+        marks_json = self._dump_marks(object_id, plans, marks, photos, analyses, photo_paths, present)
+        newest = max((item.entry.modified for item in items if item.entry.modified), default=None)
+        items.append(ExportItem(
+            entry=ZipEntry(MARKS_JSON_NAME, len(marks_json), newest, zlib.crc32(marks_json)),
+            data=marks_json,
+        ))
+
+        await self._load_cached_crcs(items)
+        export = ObjectExport(object_id, items)
+        await self._pin_statement(export)
+        return export
+
+    @staticmethod
+    def _statement_cache_key(etag: str) -> str:
+        return f"export:statement:{etag}"
+
+    async def _pinned_statement(self, etag: str) -> Optional[Tuple[str, int]]:
+        """Ведомость (blob, generation), закреплённая за архивом с этим ETag."""
+        cached = await redis_service.get(self._statement_cache_key(etag))
+        if not cached:
+            return None
+        blob_name, generation = json.loads(cached)
+        return blob_name, generation
+
+    async def _pin_statement(self, export: ObjectExport) -> None:
+        statement = next(
+            (item for item in export.items if item.entry.name == STATEMENT_NAME), None
+        )
+        if statement is None:
+            return
+        await redis_service.set(
+            self._statement_cache_key(export.etag),
+            json.dumps([statement.blob_name, statement.generation]),
+            ttl_seconds=EXPORT_STATEMENT_TTL_SECONDS,
+        )
+
+    @staticmethod
+    def _ext(image_name: str) -> str:
+        return os.path.splitext(image_name)[1].lower()
+
+    async def _stat_blobs(self, sources: List[Tuple[str, str, Optional[int]]]) -> List[ExportItem]:
+        """
+        Метаданные блобов с ограниченной параллельностью; отсутствующие пропускаются.
+        sources — (путь в архиве, blob, generation или None для текущей).
+        """
+        semaphore = asyncio.Semaphore(EXPORT_GCS_CONCURRENCY)
+
+        async def _stat(blob_name: str, generation: Optional[int]):
+            async with semaphore:
+                try:
+                    return await images_storage.stat(blob_name, generation)
+                except Exception as e:
+                    logger.warning("Экспорт: не удалось получить метаданные %s: %s", blob_name, e)
+                    return None
+
+        blobs = await asyncio.gather(*(
+            _stat(blob_name, generation) for _, blob_name, generation in sources
+        ))
+
+        items = []
+        for (path, blob_name, _), blob in zip(sources, blobs):
+            if blob is None:
+                logger.warning("Экспорт: файл %s отсутствует в GCS, пропущен", blob_name)
+                continue
+            modified = blob.updated.astimezone(timezone.utc) if blob.updated else None
+            items.append(ExportItem(
+                entry=ZipEntry(path, blob.size or 0, modified),
+                blob_name=blob_name,
+                generation=blob.generation,
+            ))
+        return items
+
+    @staticmethod
+    async def _load_cached_crcs(items: List[ExportItem]) -> None:
+        blob_items = [item for item in items if item.blob_name]
+        cached = await redis_service.mget([item.crc_cache_key for item in blob_items])
+        for item, crc in zip(blob_items, cached):
+            if crc is not None:
+                item.entry.crc = int(crc)
+
+    @staticmethod
+    def _dump_marks(object_id, plans, marks, photos, analyses, photo_paths, present) -> bytes:
+        analyses_by_photo: dict[int, list] = {}
+        for analysis in analyses:
+            analyses_by_photo.setdefault(analysis.photo_id, []).append({
+                "id": analysis.id,
+                "defect_code": analysis.defect_code,
+                "defect_description": analysis.defect_description,
+                "recommendation": analysis.recommendation,
+                "category": analysis.category,
+                "confidence": analysis.confidence,
+                "created_at": analysis.created_at,
+            })
+
+        photos_by_mark: dict[int, list] = {}
+        for photo in photos:
+            path = photo_paths[photo.id]
+            photos_by_mark.setdefault(photo.mark_id, []).append({
+                "id": photo.id,
+                "image_name": photo.image_name,
+                "archive_path": path if path in present else None,
+                "type": photo.type,
+                "type_confidence": photo.type_confidence,
+                "description": photo.description,
+                "order": photo.order,
+                "created_at": photo.created_at,
+                "defect_analysis": analyses_by_photo.get(photo.id, []),
+            })
+
+        marks_by_plan: dict[int, list] = {}
+        for mark in marks:
+            marks_by_plan.setdefault(mark.plan_id, []).append({
+                "id": mark.id,
+                "name": mark.name,
+                "description": mark.description,
+                "type": mark.type,
+                "x": mark.x,
+                "y": mark.y,
+                "defect_type": mark.defect_type,
+                "defect_volume_value": mark.defect_volume_value,
+                "defect_volume_unit": mark.defect_volume_unit,
+                "created_at": mark.created_at,
+                "photos": photos_by_mark.get(mark.id, []),
+            })
+
+        dump = {
+            "object_id": object_id,
+            "plans": [
+                {
+                    "id": plan.id,
+                    "name": plan.name,
+                    "description": plan.description,
+                    "image_name": plan.image_name,
+                    "axes": plan.axes,
+                    "created_at": plan.created_at,
+                    "marks": marks_by_plan.get(plan.id, []),
+                }
+                for plan in plans
+            ],
+        }
+        return json.dumps(dump, ensure_ascii=False, indent=2, default=_json_default).encode("utf-8")
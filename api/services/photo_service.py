@@ -76,7 +76,10 @@ class PhotoService:
             # Только для отметок типа "дефект" и если тип конструкции не был указан явно
             if mark.type == MarkType.defect and not photo_data.type and photo.image_name:
                 queue_service = get_construction_queue_service()
-                queued = await queue_service.queue_analysis(photo.id, photo.image_name)
+                queued = await queue_service.queue_analysis(
+                    photo.id, photo.image_name, mark.defect_type.value if mark.defect_type else None,
+                    mark_id=mark.id, tenant=f"user:{user_id}",
+                )
                 if not queued:
                     logger.warning(
                         f"Не удалось добавить задачу определения конструкции для фото {photo.id} "
@@ -31,6 +31,15 @@ class RedisService:
             # Тихо обрабатываем ошибку - Redis недоступен, вернем None
             return None
     
+    async def mget(self, keys: list[str]) -> list[Optional[str]]:
+        """Получение значений по списку ключей (None для отсутствующих)"""
+        if not keys:
+            return []
+        try:
+            return await self.redis_client.mget(keys)
+        except Exception:
+            return [None] * len(keys)
+
     async def set(self, key: str, value: str, ttl_seconds: Optional[int] = None) -> bool:
         """Сохранение значения по ключу с опциональным TTL"""
         try:
@@ -5,7 +5,10 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
+import os
+import tempfile
 from datetime import datetime
 
 from sqlalchemy import select
@@ -14,12 +17,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from api.models.entities import Plan, Mark, Photo, PhotoDefectAnalysis
 from api.models.database.enums import MarkType
 from api.services.access_control_service import AccessControlService
+from api.services.cpu_pool_service import CpuPool, get_cpu_pool_service
 from api.services.redis_service import redis_service
 from common.gc_utils import images_storage
-from docx_generator.generate_defects_statement_2_report import generate_defects_statement_2_report
+from docx_generator.stream_defects_statement_2_report import write_defects_statement_2_report
 
 logger = logging.getLogger(__name__)
 
+# Одновременных скачиваний фото для ведомости
+REPORT_PHOTO_CONCURRENCY = 8
+
 # Типы конструкций (синхронизировано с веб-клиентом и десктопом)
 CONSTRUCTION_TYPES = [
     'Фундамент',
@@ -120,16 +127,7 @@ class ReportService:
         if cached_url:
             return cached_url
 
-        # Собираем данные
-        rows = await self._collect_defect_rows(object_id)
-
-        # Генерируем DOCX
-        buffer = generate_defects_statement_2_report(rows)
-
-        # Загружаем в GCS
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        filename = f"reports/{object_id}/defects_{timestamp}.docx"
-        await images_storage.upload_bytes(buffer.getvalue(), filename, content_type=DOCX_CONTENT_TYPE)
+        filename = await self.get_defects_report_blob(object_id)
 
         # Создаём signed URL
         signed_url = await images_storage.create_signed_url(filename, expiration_minutes=60, content_type=DOCX_CONTENT_TYPE)
@@ -139,6 +137,63 @@ class ReportService:
 
         return signed_url
 
+    async def get_defects_report_blob(self, object_id: int) -> str:
+        """
+        Имя blob-а с актуальной ведомостью дефектов в images_storage.
+        Генерирует отчёт, если за последний час его не строили.
+        """
+        cache_key = f"report:defects:blob:{object_id}"
+        cached_blob = await redis_service.get(cache_key)
+        if cached_blob:
+            return cached_blob
+
+        # Собираем данные
+        rows = await self._collect_defect_rows(object_id)
+
+        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        filename = f"reports/{object_id}/defects_{timestamp}.docx"
+
+        # Фото скачиваем во временные файлы, DOCX генерируем в CPU-пуле
+        # (строка читает своё фото с диска) и загружаем в GCS
+        with tempfile.TemporaryDirectory(prefix="report_") as tmp_dir:
+            await self._spool_photos(rows, tmp_dir)
+            docx_path = os.path.join(tmp_dir, "defects.docx")
+            await get_cpu_pool_service().run(
+                CpuPool.REPORT, write_defects_statement_2_report, rows, docx_path,
+            )
+            with open(docx_path, "rb") as docx_file:
+                await images_storage.upload_file(docx_file, filename, content_type=DOCX_CONTENT_TYPE)
+
+        await redis_service.set(cache_key, filename, ttl_seconds=3600)
+        return filename
+
+    @staticmethod
+    async def _spool_photos(rows: list[dict], tmp_dir: str) -> None:
+        """
+        Скачивает фото строк (каждое имя один раз) в файлы tmp_dir и заменяет
+        photo_name на photo_path. Недоступное фото — строка без фото.
+        """
+        row_names = [row.pop("photo_name") for row in rows]
+        names = [name for name in dict.fromkeys(row_names) if name]
+        semaphore = asyncio.Semaphore(REPORT_PHOTO_CONCURRENCY)
+        paths: dict[str, str] = {}
+
+        async def _download(idx: int, name: str) -> None:
+            async with semaphore:
+                try:
+                    data, _ = await images_storage.download(name)
+                except Exception as e:
+                    logger.warning(f"Не удалось скачать фото {name}: {e}")
+                    return
+            path = os.path.join(tmp_dir, f"photo_{idx}")
+            with open(path, "wb") as f:
+                f.write(data)
+            paths[name] = path
+
+        await asyncio.gather(*(_download(idx, name) for idx, name in enumerate(names)))
+        for row, name in zip(rows, row_names):
+            row["photo_path"] = paths.get(name)
+
     async def _collect_defect_rows(self, object_id: int) -> list[dict]:
         """
         Собирает данные дефектов и группирует их — порт логики из DefectsPage.tsx.
@@ -225,16 +280,6 @@ class ReportService:
                 if not group["photo_name"] and photo.image_name:
                     group["photo_name"] = photo.image_name
 
-        # Собираем уникальные image_name для скачивания
-        photo_names = {g["photo_name"] for g in groups.values() if g["photo_name"]}
-        photo_bytes_map: dict[str, bytes] = {}
-        for name in photo_names:
-            try:
-                data, _ = await images_storage.download(name)
-                photo_bytes_map[name] = data
-            except Exception as e:
-                logger.warning(f"Не удалось скачать фото {name}: {e}")
-
         # Формируем строки для DOCX
         rows = []
         counter = 1
@@ -267,7 +312,7 @@ class ReportService:
                 "element_name": group["construction_type"],
                 "defect_volume": total_volume,
                 "defects_and_causes": group["description"],
-                "photo_data": photo_bytes_map.get(group["photo_name"]),
+                "photo_name": group["photo_name"],
                 "danger_category": category_display,
                 "work_recommendations": work_recommendations,
                 "recommended_work_types": work_types,
@@ -0,0 +1,304 @@
+"""
+Фоновые задачи проверки документов.
+
+Проверка (несколько проходов LLM + merge) идёт минутами, поэтому вместо
+одного долгого HTTP-запроса она запускается задачей: клиент получает
+job_id и подписывается на SSE-поток событий — результат каждого прохода
+приходит сразу по готовности, затем итог. Задачу можно отменить.
+
+События и итог хранятся в памяти процесса, а снимок состояния — в Redis
+(review_job:{id}) на REVIEW_JOB_TTL_SECONDS, чтобы результат можно было
+забрать позже, в том числе после рестарта или с другого инстанса.
+"""
+
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from api.services.document_review_service import (
+    AVAILABLE_MODELS,
+    DEFAULT_MODEL,
+    DocumentReviewService,
+    describe_review_error,
+)
+from api.services.redis_service import redis_service
+from common.metrics import metrics
+from settings import REVIEW_JOB_MAX_ACTIVE, REVIEW_JOB_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_REDIS_PREFIX = "review_job:"
+# Сколько завершённых задач держать в памяти (остальные — только в Redis)
+_KEEP_FINISHED = 100
+
+JOB_MODES = ("review", "fixes")
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINAL_STATUSES = {STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED}
+
+
+class ReviewJobsOverloadedError(RuntimeError):
+    """Слишком много активных задач проверки (HTTP 503)."""
+
+    def __init__(self):
+        super().__init__("Слишком много проверок в работе, повторите запрос позже")
+
+
+@dataclass
+class ReviewJob:
+    """Состояние задачи проверки; events — история для SSE (id события = индекс)."""
+    id: str
+    user_id: int
+    mode: str
+    document_name: str
+    prompt: Optional[str]
+    model: str
+    previous_document_name: Optional[str] = None
+    status: str = STATUS_PENDING
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    finished_at: Optional[str] = None
+    events: list[dict] = field(default_factory=list)
+
+    @property
+    def passes(self) -> list[dict]:
+        return [
+            {"label": e["data"]["label"], "result": e["data"]["result"]}
+            for e in self.events if e["event"] == "pass"
+        ]
+
+    def _last_data(self, event: str) -> Optional[dict]:
+        return next((e["data"] for e in reversed(self.events) if e["event"] == event), None)
+
+    @property
+    def result(self) -> Optional[dict]:
+        return self._last_data("result")
+
+    @property
+    def error(self) -> Optional[dict]:
+        return self._last_data("error")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "mode": self.mode,
+            "document_name": self.document_name,
+            "prompt": self.prompt,
+            "model": self.model,
+            "previous_document_name": self.previous_document_name,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "events": self.events,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReviewJob":
+        return cls(
+            id=data["job_id"],
+            user_id=data["user_id"],
+            mode=data["mode"],
+            document_name=data["document_name"],
+            prompt=data.get("prompt"),
+            model=data["model"],
+            previous_document_name=data.get("previous_document_name"),
+            status=data["status"],
+            created_at=data["created_at"],
+            finished_at=data.get("finished_at"),
+            events=data.get("events", []),
+        )
+
+
+class ReviewJobService:
+    """Запуск, отслеживание и отмена фоновых проверок документов"""
+
+    def __init__(self, review_service: DocumentReviewService, max_active: int = REVIEW_JOB_MAX_ACTIVE):
+        self.review_service = review_service
+        self.max_active = max_active
+
+        self._jobs: dict[str, ReviewJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        # Будит подписчиков SSE при новом событии задачи
+        self._updates: dict[str, asyncio.Condition] = {}
+
+    # ── Запуск ────────────────────────────────────────────────────
+
+    async def start(
+        self,
+        user_id: int,
+        mode: str,
+        document_name: str,
+        prompt: Optional[str] = None,
+        model: Optional[str] = None,
+        previous_document_name: Optional[str] = None,
+    ) -> ReviewJob:
+        """
+        Создаёт задачу и запускает проверку в фоне.
+
+        Raises:
+            ValueError: неизвестный режим или модель
+            ReviewJobsOverloadedError: превышен лимит активных задач
+        """
+        if mode not in JOB_MODES:
+            raise ValueError(f"Неизвестный режим проверки: {mode}. Доступные: {', '.join(JOB_MODES)}")
+        model = model or DEFAULT_MODEL
+        if model not in AVAILABLE_MODELS:
+            raise ValueError(
+                f"Неподдерживаемая модель: {model}. "
+                f"Доступные: {', '.join(AVAILABLE_MODELS)}"
+            )
+        if len(self._tasks) >= self.max_active:
+            metrics.inc("review_jobs.rejected_total")
+            raise ReviewJobsOverloadedError()
+
+        job = ReviewJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            mode=mode,
+            document_name=document_name,
+            prompt=prompt,
+            model=model,
+            previous_document_name=previous_document_name,
+        )
+        self._jobs[job.id] = job
+        self._updates[job.id] = asyncio.Condition()
+        await self._persist(job)
+
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._on_done(job.id))
+
+        metrics.inc("review_jobs.started_total", mode=mode)
+        logger.info("Задача проверки %s (%s) запущена: %s", job.id, mode, document_name)
+        return job
+
+    async def _run(self, job: ReviewJob) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await self._emit(job, "status", {"status": STATUS_RUNNING}, status=STATUS_RUNNING)
+
+        async def on_pass_result(label: str, result: str, done: int, total: int) -> None:
+            await self._emit(job, "pass", {"label": label, "result": result, "done": done, "total": total})
+
+        try:
+            if job.mode == "fixes":
+                result = await self.review_service.review_document_fixes(
+                    job.document_name, job.prompt, job.model, on_pass_result=on_pass_result,
+                    previous_document_name=job.previous_document_name,
+                )
+            else:
+                result = await self.review_service.review_document(
+                    job.document_name, job.prompt, job.model, on_pass_result=on_pass_result,
+                    previous_document_name=job.previous_document_name,
+                )
+        except asyncio.CancelledError:
+            await self._emit(job, "cancelled", {}, status=STATUS_CANCELLED)
+            metrics.inc("review_jobs.finished_total", status=STATUS_CANCELLED)
+            raise
+        except Exception as e:
+            status_code, detail = describe_review_error(e)
+            if status_code == 500:
+                logger.error("Ошибка задачи проверки %s: %s", job.id, e)
+            error = {"status_code": status_code, "detail": detail}
+            await self._emit(job, "error", error, status=STATUS_FAILED)
+            metrics.inc("review_jobs.finished_total", status=STATUS_FAILED)
+            return
+
+        await self._emit(job, "result", result, status=STATUS_COMPLETED)
+        metrics.inc("review_jobs.finished_total", status=STATUS_COMPLETED)
+        metrics.observe("review_jobs.duration_seconds", loop.time() - started, mode=job.mode)
+
+    # ── Состояние ─────────────────────────────────────────────────
+
+    async def _emit(self, job: ReviewJob, event: str, data: dict, status: Optional[str] = None) -> None:
+        if status is not None:
+            job.status = status
+            if status in FINAL_STATUSES:
+                job.finished_at = datetime.now(timezone.utc).isoformat()
+        job.events.append({"event": event, "data": data})
+
+        update = self._updates.get(job.id)
+        if update is not None:
+            async with update:
+                update.notify_all()
+        await self._persist(job)
+
+    def _on_done(self, job_id: str) -> None:
+        """Убирает задачу из активных и вытесняет старые завершённые из памяти."""
+        self._tasks.pop(job_id, None)
+        finished = [
+            jid for jid, job in self._jobs.items()
+            if job.status in FINAL_STATUSES and jid not in self._tasks
+        ]
+        for jid in finished[:-_KEEP_FINISHED]:
+            self._jobs.pop(jid, None)
+            self._updates.pop(jid, None)
+
+    async def _persist(self, job: ReviewJob) -> None:
+        await redis_service.set_json(_REDIS_PREFIX + job.id, job.to_dict(), REVIEW_JOB_TTL_SECONDS)
+
+    async def get(self, job_id: str, user_id: int) -> Optional[ReviewJob]:
+        """Задача пользователя: из памяти, иначе сохранённый снимок из Redis."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            data = await redis_service.get_json(_REDIS_PREFIX + job_id)
+            if data is None:
+                return None
+            job = ReviewJob.from_dict(data)
+        if job.user_id != user_id:
+            return None
+        return job
+
+    async def cancel(self, job_id: str, user_id: int) -> Optional[ReviewJob]:
+        """Отменяет задачу. Завершённая задача возвращается как есть."""
+        job = await self.get(job_id, user_id)
+        if job is None:
+            return None
+
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            logger.info("Задача проверки %s отменена", job_id)
+        if job.status not in FINAL_STATUSES:
+            # Задача отменена до старта либо выполняется не этим процессом
+            await self._emit(job, "cancelled", {}, status=STATUS_CANCELLED)
+        return job
+
+    async def events(
+        self, job: ReviewJob, after: int = -1, keepalive_seconds: float = 15.0,
+    ) -> AsyncIterator[Optional[tuple[int, dict]]]:
+        """
+        События задачи начиная с after + 1; None — keepalive. Поток
+        заканчивается после финального события.
+        """
+        next_id = after + 1
+        while True:
+            while next_id < len(job.events):
+                yield next_id, job.events[next_id]
+                next_id += 1
+            if job.status in FINAL_STATUSES:
+                return
+
+            update = self._updates.get(job.id)
+            if update is None:
+                # Задача не этого процесса — отдаём то, что есть в снимке
+                return
+            try:
+                async with update:
+                    await asyncio.wait_for(
+                        update.wait_for(lambda: len(job.events) > next_id),
+                        timeout=keepalive_seconds,
+                    )
+            except asyncio.TimeoutError:
+                yield None
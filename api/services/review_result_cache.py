@@ -0,0 +1,135 @@
+"""
+Кеш результатов LLM-проверки документов.
+
+Кешируются отдельно результаты проходов и результат merge. Ключ прохода —
+хеш общего системного промпта проверки, текста (фрагмента), инструкций
+прохода, выбранных пунктов НТД, пользовательского промпта и модели; ключи
+merge и замечаний тоже включают системный промпт, поэтому правка роли или
+формата ответа не отдаёт из кеша старые результаты. /review и /review-fixes
+выполняют одни и те же проходы и различаются только merge-промптом, поэтому
+проходы, посчитанные одним эндпоинтом, переиспользуются другим.
+
+Отдельно хранятся замечания проверки по тексту (record) — из них
+переносятся замечания при проверке следующей редакции отчёта.
+
+Хранение — Redis (zlib + base64), общий для всех инстансов. Одинаковые
+вычисления, идущие одновременно в одном процессе, выполняются один раз.
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import zlib
+from typing import Awaitable, Callable, Optional
+
+from api.services.redis_service import redis_service
+from common.metrics import metrics
+from settings import REVIEW_RESULT_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_REDIS_PREFIX = "review:"
+_COMPRESS_LEVEL = 6
+
+
+def _sha(value: Optional[str]) -> str:
+    return hashlib.sha256((value or "").encode("utf-8")).hexdigest()
+
+
+class ReviewResultCache:
+    """Кеш результатов проходов и merge с объединением одновременных вычислений"""
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def pass_key(
+        model: str, system_prompt: str, instructions: str, text: str, reference: str,
+        prompt: Optional[str], fragment_note: Optional[str], params: str,
+    ) -> str:
+        parts = [
+            model, _sha(system_prompt), _sha(instructions), _sha(text), _sha(reference),
+            _sha(prompt), _sha(fragment_note), params,
+        ]
+        return "pass:" + _sha("|".join(parts))
+
+    @staticmethod
+    def merge_key(model: str, system_prompt: str, merge_prompt: str, combined: str, params: str) -> str:
+        parts = [model, _sha(system_prompt), _sha(merge_prompt), _sha(combined), params]
+        return "merge:" + _sha("|".join(parts))
+
+    @staticmethod
+    def record_key(model: str, system_prompt: str, text: str, prompt: Optional[str], params: str) -> str:
+        """Ключ замечаний проверки текста — для инкрементальной проверки следующей редакции."""
+        return "record:" + _sha("|".join([model, _sha(system_prompt), _sha(text), _sha(prompt), params]))
+
+    async def get(self, key: str) -> Optional[str]:
+        encoded = await redis_service.get(_REDIS_PREFIX + key)
+        if not encoded:
+            return None
+        try:
+            return zlib.decompress(base64.b64decode(encoded)).decode("utf-8")
+        except Exception as e:
+            logger.warning("Кеш проверки: битая запись %s: %s", key, e)
+            return None
+
+    async def set(self, key: str, value: str) -> None:
+        compressed = zlib.compress(value.encode("utf-8"), _COMPRESS_LEVEL)
+        await redis_service.set(
+            _REDIS_PREFIX + key,
+            base64.b64encode(compressed).decode("ascii"),
+            ttl_seconds=self.ttl_seconds,
+        )
+
+    async def _wait_inflight(self, future: asyncio.Future, kind: str) -> Optional[str]:
+        """Результат чужого вычисления; None — оно было отменено, считаем сами."""
+        try:
+            value = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled() and not asyncio.current_task().cancelling():
+                return None
+            raise
+        metrics.inc("review_cache.hits", kind=kind, tier="inflight")
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Значение из кеша, иначе compute(). Пустой результат не кешируется;
+        ошибка compute пробрасывается всем ожидающим.
+        """
+        kind = key.split(":", 1)[0]
+        cached = await self.get(key)
+        if cached is not None:
+            metrics.inc("review_cache.hits", kind=kind, tier="redis")
+            return cached
+
+        while (inflight := self._inflight.get(key)) is not None:
+            value = await self._wait_inflight(inflight, kind)
+            if value is not None:
+                return value
+
+        metrics.inc("review_cache.misses", kind=kind)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # помечаем как полученное, если никто не ждал
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        future.set_result(value)
+        if value:
+            await self.set(key, value)
+        return value
+
+
+# Глобальный экземпляр кеша
+review_result_cache = ReviewResultCache(REVIEW_RESULT_CACHE_TTL_SECONDS)
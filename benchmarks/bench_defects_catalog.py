@@ -0,0 +1,104 @@
+"""
+Микробенчмарк каталога дефектов: прежние функции defects_db против
+скомпилированного каталога (common/defects_catalog.py).
+
+Запуск из корня репозитория:
+    JWT_SECRET_KEY=x python -m benchmarks.bench_defects_catalog [число повторов]
+
+Замеряются поиск по тегу, список дефектов по типу конструкции и
+сборка промпта анализа для типа конструкции (в полном формате базы, чтобы
+сравнение было на одном и том же тексте); печатается среднее время
+одного вызова в микросекундах и время компиляции каталога.
+"""
+
+import sys
+import time
+
+from common.defects_catalog import DefectCatalog, _prompt_lines, catalog_version
+from common.defects_db import (
+    CONSTRUCTION_TYPE_ALIASES,
+    CROSS_CUTTING_DEFECTS,
+    DEFECTS_DB,
+    ENGINEERING_CONSTRUCTION_TYPES,
+    SYSTEM_PROMPT,
+    USER_PROMPT_FULL_TEMPLATE,
+    normalize_construction_type,
+)
+
+DEFAULT_REPEATS = 2000
+CONSTRUCTION_TYPES = ("Стена", "Перекрытие", "Инженерные сети", "Фундамент", None)
+
+
+def _legacy_by_tag(tag):
+    for d in CROSS_CUTTING_DEFECTS:
+        if d.get("tag") == tag:
+            return d
+    return None
+
+
+def _legacy_defects_for(construction_type):
+    normalized_type = normalize_construction_type(construction_type)
+    if normalized_type and normalized_type in DEFECTS_DB:
+        return list(DEFECTS_DB[normalized_type])
+    if normalized_type == "Инженерные сети":
+        defects = []
+        for type_name in ENGINEERING_CONSTRUCTION_TYPES:
+            defects.extend(DEFECTS_DB.get(type_name, []))
+        return defects
+    defects = []
+    for value in DEFECTS_DB.values():
+        defects.extend(value)
+    return defects
+
+
+def _legacy_user_prompt(construction_type):
+    """Прежняя сборка: текст базы форматируется заново на каждый вызов."""
+    lst = _legacy_defects_for(construction_type)
+    lst.extend(CROSS_CUTTING_DEFECTS)
+    lines = [line for d in lst for line in _prompt_lines(d)]
+    return USER_PROMPT_FULL_TEMPLATE.format(defects_text="\n".join(lines))
+
+
+def _compile() -> DefectCatalog:
+    return DefectCatalog(
+        DEFECTS_DB, CROSS_CUTTING_DEFECTS, CONSTRUCTION_TYPE_ALIASES, ENGINEERING_CONSTRUCTION_TYPES,
+        USER_PROMPT_FULL_TEMPLATE,
+        version=catalog_version(
+            DEFECTS_DB, CROSS_CUTTING_DEFECTS, CONSTRUCTION_TYPE_ALIASES,
+            ENGINEERING_CONSTRUCTION_TYPES, SYSTEM_PROMPT, USER_PROMPT_FULL_TEMPLATE,
+        ),
+    )
+
+
+def _per_call_us(fn, args, repeats: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for arg in args:
+            fn(arg)
+    return (time.perf_counter() - t0) / (repeats * len(args)) * 1e6
+
+
+def main(repeats: int) -> None:
+    t0 = time.perf_counter()
+    catalog = _compile()
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    tags = [d["tag"] for d in CROSS_CUTTING_DEFECTS if d.get("tag")]
+    tags_last = tags[-3:] + ["нет_такого_тега"]
+    prompt_repeats = max(1, repeats // 100)
+
+    cases = [
+        ("tag lookup", _legacy_by_tag, catalog.get_by_tag, tags_last, repeats),
+        ("defects by type", _legacy_defects_for, catalog.defects_for, CONSTRUCTION_TYPES, repeats),
+        ("user prompt", _legacy_user_prompt, catalog.user_prompt, CONSTRUCTION_TYPES, prompt_repeats),
+    ]
+    print(f"compile: {compile_ms:.1f} ms, version {catalog.version}, {len(catalog.by_code)} codes")
+    print(f"{'case':<16} | {'legacy, us':>10} | {'compiled, us':>12} | {'speedup':>8}")
+    for name, legacy, compiled, args, n in cases:
+        legacy_us = _per_call_us(legacy, args, n)
+        compiled_us = _per_call_us(compiled, args, n)
+        print(f"{name:<16} | {legacy_us:>10.2f} | {compiled_us:>12.2f} | {legacy_us / compiled_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REPEATS)
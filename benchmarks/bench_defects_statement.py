@@ -0,0 +1,98 @@
+"""
+Бенчмарк генерации ведомости дефектов: python-docx против потокового writer.
+
+Запуск из корня репозитория:
+    JWT_SECRET_KEY=x python -m benchmarks.bench_defects_statement [--full] [100 1000 5000]
+
+Каждый замер идёт в отдельном дочернем процессе, печатается время и пиковый
+RSS (lxml аллоцирует в C, tracemalloc его не видит). python-docx квадратичен
+по числу картинок, поэтому без --full он замеряется только до 1000 строк.
+Фото — 60 уникальных JPEG, повторяются по строкам, как в реальных
+ведомостях, где одно фото иллюстрирует несколько групп.
+"""
+
+import io
+import multiprocessing
+import resource
+import sys
+import time
+
+from PIL import Image
+
+from docx_generator.generate_defects_statement_2_report import generate_defects_statement_2_report
+from docx_generator.stream_defects_statement_2_report import stream_defects_statement_2_report
+
+DEFAULT_SIZES = (100, 1000, 5000)
+DOCX_MAX_ROWS = 1000
+UNIQUE_PHOTOS = 60
+
+
+def _make_photos() -> list[bytes]:
+    photos = []
+    for i in range(UNIQUE_PHOTOS):
+        img = Image.effect_noise((320, 240), 40 + i).convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=85)
+        photos.append(buf.getvalue())
+    return photos
+
+
+def _make_rows(count: int, photos: list[bytes]) -> list[dict]:
+    return [
+        {
+            "number": str(i + 1),
+            "scheme_name": f"План этажа {i % 12 + 1}",
+            "element_name": "Стена",
+            "defect_volume": f"{(i % 7) * 1.5:g}",
+            "defects_and_causes": "Трещины в кладке до 5 мм вследствие неравномерной осадки",
+            "photo_data": photos[i % len(photos)],
+            "danger_category": "Б",
+            "work_recommendations": "Расшить, инъектировать; мониторинг динамики маяками",
+            "recommended_work_types": "Ремонт кладки",
+        }
+        for i in range(count)
+    ]
+
+
+def _run(kind: str, count: int) -> tuple[float, float]:
+    """Выполняется в дочернем процессе: (секунды, пиковый RSS в МБ)."""
+    rows = _make_rows(count, _make_photos())
+    if kind == "stream":
+        stream_defects_statement_2_report([], io.BytesIO())  # прогрев шаблона
+
+    t0 = time.perf_counter()
+    if kind == "docx":
+        generate_defects_statement_2_report(rows)
+    else:
+        stream_defects_statement_2_report(iter(rows), io.BytesIO())
+    elapsed = time.perf_counter() - t0
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, peak_kb / 1024
+
+
+def _measure(kind: str, count: int) -> tuple[float, float]:
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(_run, (kind, count))
+
+
+def main(sizes, full: bool = False) -> None:
+    print(f"{'rows':>6} | {'python-docx, s':>14} | {'RSS MB':>7} | {'stream, s':>9} | {'RSS MB':>7} | {'speedup':>7}")
+    for count in sizes:
+        stream_s, stream_mb = _measure("stream", count)
+        if full or count <= DOCX_MAX_ROWS:
+            docx_s, docx_mb = _measure("docx", count)
+            print(
+                f"{count:>6} | {docx_s:>14.2f} | {docx_mb:>7.0f} | "
+                f"{stream_s:>9.2f} | {stream_mb:>7.0f} | {docx_s / stream_s:>6.1f}x"
+            )
+        else:
+            print(f"{count:>6} | {'—':>14} | {'—':>7} | {stream_s:>9.2f} | {stream_mb:>7.0f} | {'—':>7}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    full = "--full" in args
+    sizes = [int(a) for a in args if a != "--full"]
+    main(sizes or DEFAULT_SIZES, full=full)
@@ -0,0 +1,145 @@
+"""
+Бенчмарк извлечения текста для проверки отчётов: python-docx против
+потокового разбора document.xml, и PDF целиком против постраничного.
+
+Запуск из корня репозитория:
+    JWT_SECRET_KEY=x python -m benchmarks.bench_document_parsing [500 1500]
+
+Аргументы — число страниц. Документ похож на реальный отчёт: на каждой
+странице заголовок, несколько абзацев и таблица, страницы разделены
+w:br type="page". Каждый замер идёт в отдельном дочернем процессе,
+печатается время и пиковый RSS.
+"""
+
+import io
+import multiprocessing
+import resource
+import sys
+import time
+
+import pymupdf
+from docx import Document as DocxDocument
+from docx.enum.text import WD_BREAK
+
+from common.document_parsing import parse_docx, parse_pdf
+
+DEFAULT_PAGES = (500, 1500)
+PARAGRAPHS_PER_PAGE = 8
+TABLE_ROWS_PER_PAGE = 6
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_PARAGRAPH = (
+    "Обследованием установлено: в кладке наружных стен выявлены трещины "
+    "шириной раскрытия до 5 мм, следы замачивания и разрушение защитного слоя "
+    "бетона перемычек с оголением и коррозией арматуры."
+)
+
+
+def _make_docx(pages: int) -> bytes:
+    doc = DocxDocument()
+    for page in range(pages):
+        doc.add_heading(f"Раздел {page + 1}. Техническое состояние конструкций", level=2)
+        for _ in range(PARAGRAPHS_PER_PAGE):
+            doc.add_paragraph(_PARAGRAPH)
+        table = doc.add_table(rows=TABLE_ROWS_PER_PAGE, cols=4)
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                cell.text = f"Ячейка {r}.{c}"
+        doc.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def _make_pdf(pages: int) -> bytes:
+    doc = pymupdf.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(
+            pymupdf.Rect(50, 50, 550, 800),
+            f"Страница {page_num + 1}\n" + "\n".join([_PARAGRAPH] * PARAGRAPHS_PER_PAGE),
+            fontsize=9,
+        )
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _legacy_parse_docx(file_bytes: bytes) -> str:
+    """Прежняя реализация: всё дерево в памяти, таблицы в конце документа."""
+    doc = DocxDocument(io.BytesIO(file_bytes))
+    parts = ["[Страница 1]"]
+    page_num = 1
+    for paragraph in doc.paragraphs:
+        has_break = any(
+            br.get(f"{_W_NS}type") == "page"
+            for run in paragraph.runs
+            for br in run._element.findall(f".//{_W_NS}br")
+        )
+        if has_break:
+            page_num += 1
+            parts.append(f"\n[Страница {page_num}]")
+        text = paragraph.text.strip()
+        if text:
+            parts.append(text)
+    for table in doc.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if cells:
+                parts.append(" | ".join(cells))
+    return "\n".join(parts)
+
+
+def _legacy_parse_pdf(file_bytes: bytes) -> str:
+    doc = pymupdf.open(stream=file_bytes, filetype="pdf")
+    parts = []
+    for page_num, page in enumerate(doc, start=1):
+        text = page.get_text().strip()
+        if text:
+            parts.append(f"[Страница {page_num}]\n{text}")
+    doc.close()
+    return "\n".join(parts)
+
+
+_PARSERS = {
+    "docx-legacy": (_make_docx, _legacy_parse_docx),
+    "docx-stream": (_make_docx, parse_docx),
+    "pdf-legacy": (_make_pdf, _legacy_parse_pdf),
+    "pdf-stream": (_make_pdf, parse_pdf),
+}
+
+
+def _run(kind: str, pages: int) -> tuple[float, float, float]:
+    """Выполняется в дочернем процессе: (секунды, RSS до разбора и пиковый RSS в МБ)."""
+    make, parse = _PARSERS[kind]
+    data = make(pages)
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    t0 = time.perf_counter()
+    parse(data)
+    elapsed = time.perf_counter() - t0
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, base_kb / 1024, peak_kb / 1024
+
+
+def _measure(kind: str, pages: int) -> tuple[float, float, float]:
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(_run, (kind, pages))
+
+
+def main(sizes) -> None:
+    print(f"{'pages':>6} | {'parser':>12} | {'time, s':>8} | {'RSS MB':>7} | {'+RSS MB':>7}")
+    for pages in sizes:
+        for kind in _PARSERS:
+            elapsed, base_mb, peak_mb = _measure(kind, pages)
+            print(
+                f"{pages:>6} | {kind:>12} | {elapsed:>8.2f} | "
+                f"{peak_mb:>7.0f} | {peak_mb - base_mb:>7.0f}"
+            )
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]]
+    main(sizes or DEFAULT_PAGES)
@@ -0,0 +1,72 @@
+"""
+Бенчмарк локального классификатора типа конструкции: задержка
+предобработки и инференса на CPU (common/local_classifier.py).
+
+Запуск из корня репозитория:
+    JWT_SECRET_KEY=x python -m benchmarks.bench_local_classifier models/construction.onnx [число повторов]
+
+Изображение — синтетический JPEG 4032×3024 (как с камеры телефона).
+Первый вызов (загрузка сессии ONNX Runtime) замеряется отдельно; дальше
+печатаются p50/p95/max отдельно для декодирования с ресайзом и для
+инференса. Нужен onnxruntime.
+"""
+
+import io
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+from common.local_classifier import _load, classify, runtime_available
+
+DEFAULT_REPEATS = 50
+PHOTO_SIZE = (4032, 3024)
+
+
+def _make_photo() -> bytes:
+    img = Image.new("RGB", PHOTO_SIZE, (150, 140, 130))
+    draw = ImageDraw.Draw(img)
+    for i in range(0, PHOTO_SIZE[0], 64):
+        draw.line([(i, 0), (i + 400, PHOTO_SIZE[1])], fill=(90, 85, 80), width=6)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return statistics.median(ordered), p95, ordered[-1]
+
+
+def main(model_path: str, repeats: int) -> None:
+    if not runtime_available():
+        raise SystemExit("onnxruntime не установлен")
+    content = _make_photo()
+
+    t0 = time.perf_counter()
+    label, confidence = classify(model_path, content)
+    print(f"Первый вызов (с загрузкой модели): {(time.perf_counter() - t0) * 1000:.0f} мс → {label} ({confidence:.2f})")
+
+    model = _load(model_path)
+    preprocess_ms, inference_ms = [], []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        tensor = model.preprocess(content)
+        t1 = time.perf_counter()
+        model.session.run(None, {model.input_name: tensor})
+        t2 = time.perf_counter()
+        preprocess_ms.append((t1 - t0) * 1000)
+        inference_ms.append((t2 - t1) * 1000)
+
+    print(f"{'этап':>14} | {'p50, мс':>8} | {'p95, мс':>8} | {'max, мс':>8}")
+    for stage, samples in (("предобработка", preprocess_ms), ("инференс", inference_ms)):
+        p50, p95, worst = _percentiles(samples)
+        print(f"{stage:>14} | {p50:>8.1f} | {p95:>8.1f} | {worst:>8.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REPEATS)
@@ -0,0 +1,53 @@
+"""
+Размер промпта анализа дефекта по типам конструкций: полный формат базы
+против компактного (с бюджетом DEFECT_PROMPT_MAX_TOKENS).
+
+Запуск из корня репозитория:
+    JWT_SECRET_KEY=x python -m benchmarks.report_defect_prompt_sizes [бюджет в токенах]
+
+Токены оцениваются как символы / DEFECT_PROMPT_CHARS_PER_TOKEN. Строка
+«все типы» — промпт без указанного типа конструкции (вся база).
+"""
+
+import sys
+
+from common.defects_catalog import DefectCatalog
+from common.defects_db import (
+    CONSTRUCTION_TYPE_ALIASES,
+    CROSS_CUTTING_DEFECTS,
+    DEFECTS_DB,
+    ENGINEERING_CONSTRUCTION_TYPES,
+    USER_PROMPT_COMPACT_TEMPLATE,
+    USER_PROMPT_FULL_TEMPLATE,
+)
+from settings import DEFECT_PROMPT_CHARS_PER_TOKEN, DEFECT_PROMPT_MAX_TOKENS
+
+
+def _catalog(template: str, compact: bool, max_tokens: int) -> DefectCatalog:
+    return DefectCatalog(
+        DEFECTS_DB, CROSS_CUTTING_DEFECTS, CONSTRUCTION_TYPE_ALIASES, ENGINEERING_CONSTRUCTION_TYPES,
+        template, version="report", compact=compact,
+        prompt_max_chars=max_tokens * DEFECT_PROMPT_CHARS_PER_TOKEN,
+    )
+
+
+def main(max_tokens: int) -> None:
+    full = _catalog(USER_PROMPT_FULL_TEMPLATE, False, max_tokens)
+    compact = _catalog(USER_PROMPT_COMPACT_TEMPLATE, True, max_tokens)
+
+    types = list(DEFECTS_DB) + ["Инженерные сети", None]
+    total_full = total_compact = 0
+    print(f"budget: {max_tokens} tokens (~{max_tokens * DEFECT_PROMPT_CHARS_PER_TOKEN} chars)")
+    print(f"{'construction type':<38} | {'full, chars':>11} | {'compact':>8} | {'~tokens':>15} | {'ratio':>5}")
+    for ctype in types:
+        before = len(full.user_prompt(ctype))
+        after = len(compact.user_prompt(ctype))
+        total_full += before
+        total_compact += after
+        tokens = f"{before // DEFECT_PROMPT_CHARS_PER_TOKEN}→{after // DEFECT_PROMPT_CHARS_PER_TOKEN}"
+        print(f"{ctype or 'все типы':<38} | {before:>11} | {after:>8} | {tokens:>15} | {before / after:>4.1f}x")
+    print(f"{'итого':<38} | {total_full:>11} | {total_compact:>8} | {'':>15} | {total_full / total_compact:>4.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFECT_PROMPT_MAX_TOKENS)
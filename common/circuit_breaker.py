@@ -0,0 +1,57 @@
+"""
+Автомат защиты (circuit breaker) для внешних сервисов.
+
+После failure_threshold ошибок подряд автомат размыкается: вызовы к
+сервису не отправляются reset_timeout секунд, и вызывающий код сразу
+переходит к запасному варианту. По истечении таймаута автомат пропускает
+пробные вызовы (half_open): первый успех замыкает его, первая ошибка
+снова размыкает. Переходы считаются в circuit_breaker.transitions_total (breaker, state).
+"""
+
+import threading
+import time
+
+from common.metrics import metrics
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Автомат защиты одного сервиса"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            metrics.inc("circuit_breaker.transitions_total", breaker=self.name, state=state)
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить вызов."""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._transition(STATE_HALF_OPEN)
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._transition(STATE_CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition(STATE_OPEN)
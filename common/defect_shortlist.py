@@ -0,0 +1,229 @@
+"""
+Предварительный отбор кандидатов для кодирования дефекта (шорт-лист).
+
+Без типа конструкции или для широкого типа («Инженерные сети» — девять
+разделов каталога) модель получает сотни кодов. Шорт-лист сужает их до
+top-K до вызова модели по тому, что известно заранее:
+
+- тег дефекта с отметки (defect_type) → поисковый запрос (DEFECT_TYPE_QUERIES);
+- тип конструкции и уверенность в нём: при уверенности не ниже
+  DEFECT_SHORTLIST_TYPE_TRUST кандидаты берутся только из раздела типа,
+  иначе из всего каталога с приоритетом для дефектов этого типа;
+- локальный BM25-индекс по damage_type и material записей каталога.
+
+Если запроса нет, совпадений нет или оценки размазаны (доля top-K в
+сумме оценок ниже DEFECT_SHORTLIST_MIN_CONFIDENCE), используется полный
+список. Метрики defect_shortlist.* показывают долю применённых
+шорт-листов и долю попаданий выбранного моделью кода в top-K — по ним
+подбирается K. Попадания считаются по вызовам, где модель видела полный
+список: при откате и в аудите (доля DEFECT_SHORTLIST_AUDIT_RATE).
+"""
+
+import math
+import random
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from common.defects_catalog import ALL_TYPES_KEY, DefectCatalog
+from common.defects_db import get_catalog
+from common.metrics import metrics
+from common.reference_index import BM25_B, BM25_K1, normalize
+from settings import (
+    DEFECT_SHORTLIST_AUDIT_RATE,
+    DEFECT_SHORTLIST_MIN_CONFIDENCE,
+    DEFECT_SHORTLIST_TOP_K,
+    DEFECT_SHORTLIST_TYPE_TRUST,
+)
+
+# Тег отметки (DefectType) → поисковый запрос по видимым признакам и материалу.
+# Кросс-категорийные теги (сварные швы, болты и т.п.) сюда не входят — они
+# берутся из каталога без вызова модели.
+DEFECT_TYPE_QUERIES: Dict[str, str] = {
+    "emergency_section": "аварийный обрушение разрушение угроза",
+    "concrete_reinforcement": "оголение коррозия арматуры защитный слой бетона",
+    "concrete_destruction": "скол разрушение бетона раковины выбоины",
+    "leak_traces": "следы протечек увлажнение потёки пятна",
+    "efflorescence": "высолы белый налёт",
+    "brick_cracks": "трещины кладка кирпич",
+    "brick_destruction": "выкрашивание разрушение кирпича кладка",
+    "concrete_cracks": "трещины бетон железобетон",
+    "soil_vegetation": "растительность мох почвенно-растительный слой",
+    "element_bends": "прогиб искривление выгиб элемента",
+    "mechanical_deform": "механические повреждения деформация вмятины",
+    "bio_corrosion_wood": "гниль биопоражение древесина",
+    "masonry_joint_weathering": "выветривание швы кладки раствор выкрошен",
+    "floor_flooding": "затопление вода на полу замокание",
+    "non_compliance": "несоответствие проекту отсутствие",
+    "structural_collapse": "обрушение вывалы разрушение",
+    "vent_grille_damage": "вентиляционная решётка повреждение",
+    "gate_damage": "ворота повреждение",
+    "door_damage": "дверь полотно коробка повреждение",
+    "engineering_network_damage": "трубопровод коррозия течь изоляция",
+    "roof_damage": "кровля протечки разрушение покрытия кровли",
+    "porch_damage": "крыльцо ступени разрушение",
+    "stairway_damage": "лестница ступени марши повреждение",
+    "blind_area_damage": "отмостка трещины просадка",
+    "window_damage": "окна рамы остекление повреждение",
+    "foundation_damage": "фундамент цоколь разрушение",
+    "oil_contamination": "масляные пятна загрязнение нефтепродукты",
+    "support_zone_destruction": "опорная зона разрушение опирание",
+    "wood_destruction": "разрушение древесины",
+    "slab_joint_destruction": "швы плит разрушение межпанельные",
+    "floor_destruction": "разрушение пола покрытия стяжки",
+    "material_storage": "складирование материалов захламление",
+    "through_corrosion": "сквозная коррозия",
+    "through_hole": "сквозное отверстие пробоина",
+    "layered_corrosion": "пластовая слоистая коррозия металла",
+    "fungal_growth": "плесень грибок",
+    "fire_traces": "следы пожара копоть обгорание",
+    "floor_cracks": "трещины пол стяжка",
+    "wood_cracks": "трещины древесина усушка",
+    "plaster_cracks": "трещины штукатурка отделка",
+    "finishing_loss": "отслоение утрата отделочного слоя штукатурки окраски",
+    "structural_absence": "отсутствие элемента",
+    "pitting_corrosion": "язвенная коррозия металла",
+}
+
+
+@dataclass
+class Shortlist:
+    """Результат отбора: codes — что отдаётся модели (пусто — полный список)."""
+    scope: Optional[str]
+    candidates: int
+    ranked: List[str] = field(default_factory=list)
+    codes: List[str] = field(default_factory=list)
+    confidence: float = 0.0
+    reason: str = "applied"
+    audit: bool = False
+
+    @property
+    def applied(self) -> bool:
+        return bool(self.codes) and not self.audit
+
+
+class DefectShortlister:
+    """BM25 по видимым признакам и материалу записей каталога"""
+
+    def __init__(
+        self,
+        catalog: DefectCatalog,
+        top_k: int = DEFECT_SHORTLIST_TOP_K,
+        min_confidence: float = DEFECT_SHORTLIST_MIN_CONFIDENCE,
+        type_trust: float = DEFECT_SHORTLIST_TYPE_TRUST,
+        audit_rate: float = DEFECT_SHORTLIST_AUDIT_RATE,
+    ):
+        self.catalog = catalog
+        self.top_k = top_k
+        self.min_confidence = min_confidence
+        self.type_trust = type_trust
+        self.audit_rate = audit_rate
+
+        self._terms: Dict[str, Counter] = {}
+        self._lengths: Dict[str, int] = {}
+        self._df: Counter = Counter()
+        for record in catalog.by_type[ALL_TYPES_KEY] + catalog.cross_cutting:
+            if not catalog.is_detectable(record.code):
+                continue
+            terms = Counter(normalize(f"{record.damage_type or ''} {record.material or ''}"))
+            self._terms[record.code] = terms
+            self._lengths[record.code] = sum(terms.values())
+            self._df.update(terms.keys())
+        self._avg_length = sum(self._lengths.values()) / (len(self._lengths) or 1)
+
+    def _score(self, query: List[str], code: str) -> float:
+        terms = self._terms[code]
+        total = len(self._terms)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[code] / (self._avg_length or 1))
+        score = 0.0
+        for term, qtf in Counter(query).items():
+            tf = terms.get(term)
+            if not tf:
+                continue
+            df = self._df[term]
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            score += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return score
+
+    def _candidates(self, scope: Optional[str]) -> List[str]:
+        records = self.catalog.by_type[scope] + self.catalog.cross_cutting
+        return [r.code for r in records if r.code in self._terms]
+
+    def shortlist(
+        self,
+        construction_type: Optional[str] = None,
+        type_confidence: Optional[float] = None,
+        defect_type: Optional[str] = None,
+    ) -> Shortlist:
+        """
+        Отбор top-K кандидатов. type_confidence=None — тип задан явно
+        (пользователем или клиентом) и ему доверяем полностью.
+        """
+        detected = self.catalog.type_key(construction_type) if construction_type else ALL_TYPES_KEY
+        trust = 1.0 if type_confidence is None else type_confidence
+        scope = detected if trust >= self.type_trust else ALL_TYPES_KEY
+        candidates = self._candidates(scope)
+        result = Shortlist(scope=scope, candidates=len(candidates))
+
+        query = normalize(DEFECT_TYPE_QUERIES.get(defect_type or "", ""))
+        if len(candidates) <= self.top_k:
+            result.reason = "small_catalog"
+        elif not query:
+            result.reason = "no_query"
+        else:
+            detected_codes = (
+                {r.code for r in self.catalog.by_type[detected]} if detected is not ALL_TYPES_KEY else set()
+            )
+            scores: Dict[str, float] = defaultdict(float)
+            for code in candidates:
+                score = self._score(query, code)
+                if score > 0:
+                    # Тип определён неуверенно — его дефекты всё же вероятнее
+                    scores[code] = score * (1 + trust) if code in detected_codes else score
+            result.ranked = sorted(scores, key=scores.get, reverse=True)
+            top = result.ranked[:self.top_k]
+            total = sum(scores.values())
+            result.confidence = sum(scores[c] for c in top) / total if total else 0.0
+            if not top:
+                result.reason = "no_match"
+            elif result.confidence < self.min_confidence:
+                result.reason = "low_confidence"
+            else:
+                result.codes = top
+                result.audit = random.random() < self.audit_rate
+
+        outcome = "audit" if result.audit else ("applied" if result.codes else result.reason)
+        metrics.inc("defect_shortlist.requests_total", outcome=outcome)
+        if result.codes:
+            metrics.observe("defect_shortlist.size", len(result.codes))
+        return result
+
+    def record_outcome(self, shortlist: Shortlist, code: Optional[str]) -> None:
+        """Учитывает код, выбранный моделью: попал ли он в top-K шорт-листа."""
+        record = self.catalog.get_by_code(code)
+        if record is None:
+            return
+        top_code = record.parent_code or record.code
+
+        if shortlist.applied:
+            # Модель видела только шорт-лист: код вне его — ошибка формата ответа
+            metrics.inc("defect_shortlist.chosen_in_list_total", hit=str(top_code in shortlist.codes).lower())
+            return
+        if not shortlist.ranked:
+            return
+        # Модель видела полный список — оцениваем, попал бы код в top-K
+        rank = shortlist.ranked.index(top_code) + 1 if top_code in shortlist.ranked else None
+        hit = rank is not None and rank <= self.top_k
+        metrics.inc("defect_shortlist.recall_total", hit=str(hit).lower(), reason=shortlist.reason)
+        if rank is not None:
+            metrics.observe("defect_shortlist.chosen_rank", rank)
+
+
+_SHORTLISTER: Optional[DefectShortlister] = None
+
+
+def get_defect_shortlister() -> DefectShortlister:
+    global _SHORTLISTER
+    if _SHORTLISTER is None:
+        _SHORTLISTER = DefectShortlister(get_catalog())
+    return _SHORTLISTER
@@ -0,0 +1,465 @@
+"""
+Скомпилированный каталог дефектов.
+
+DEFECTS_DB и CROSS_CUTTING_DEFECTS (common/defects_db.py) — исходные данные,
+удобные для редактирования, но не для поиска: тег искался перебором, список
+дефектов по типу конструкции копировался, а текст базы для промпта
+собирался заново на каждый запрос анализа. DefectCatalog один раз строит из
+них индексы по тегу, коду и нормализованному типу конструкции с компактными
+записями, строки базы для промпта и хеш версии каталога; готовые промпты
+кешируются по типу конструкции.
+
+Для промпта есть два формата базы. Полный (get_defects_text) — код,
+описание, рекомендация, категория и материал каждой записи. Компактный —
+только то, что нужно для выбора кода: код, видимые признаки (damage_type) и
+диапазоны параметров, строки сгруппированы по материалу; описание,
+рекомендацию и категорию ModelManager всё равно берёт из каталога по коду.
+Компактный текст укладывается в бюджет символов: сначала укорачиваются
+признаки, в крайнем случае отбрасываются последние строки.
+"""
+
+import hashlib
+import json
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from common.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключ индекса по типу для неизвестного/не указанного типа — все конструкции
+ALL_TYPES_KEY = None
+ENGINEERING_GROUP = "Инженерные сети"
+
+# Ступени укорачивания видимых признаков в компактном формате (None — без укорачивания)
+COMPACT_SIGNS_LIMITS = (None, 60, 40)
+# Длина описания качественного варианта (диапазон без min/max) в компактном формате;
+# при укорачивании признаков укорачивается и оно
+COMPACT_VARIANT_CHARS = 80
+
+
+class DefectRecord:
+    """
+    Запись каталога. Поддерживает record["key"] и record.get("key", default),
+    как прежние словари, поэтому вызывающий код не меняется.
+    """
+
+    __slots__ = (
+        "code", "parent_code", "construction_type", "tag",
+        "material", "damage_type", "category", "description", "recommendation",
+        "parameter", "min", "max", "parameters", "photo_detectable",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self) -> str:
+        return f"DefectRecord(code={self.code!r}, construction_type={self.construction_type!r})"
+
+
+def _ambiguous_category(ranges: List[dict]) -> str:
+    categories = [r.get("category", "") for r in ranges if r.get("category")]
+    if len(set(categories)) == 1:
+        return categories[0]
+    return "Б"
+
+
+def _base_record(defect: dict, construction_type: Optional[str]) -> DefectRecord:
+    """Запись дефекта; для параметризованного — родительская запись по всем диапазонам."""
+    category = defect.get("category")
+    description = defect.get("description")
+    recommendation = defect.get("recommendation")
+
+    if "parameters" in defect:
+        ranges = [
+            r for cfg in defect["parameters"].values() for r in cfg.get("ranges", [])
+        ]
+        range_codes = [r["code"] for r in ranges if r.get("code")]
+        category = category or _ambiguous_category(ranges)
+        description = description or defect.get("damage_type", "")
+        if not recommendation:
+            recommendation = "Уточнить числовые параметры дефекта и выбрать соответствующий вариант"
+            if range_codes:
+                recommendation += ": " + ", ".join(range_codes)
+
+    return DefectRecord(
+        code=defect.get("code"),
+        construction_type=construction_type,
+        tag=defect.get("tag"),
+        material=defect.get("material"),
+        damage_type=defect.get("damage_type"),
+        category=category,
+        description=description,
+        recommendation=recommendation,
+        parameters=defect.get("parameters"),
+        photo_detectable=defect.get("photo_detectable"),
+    )
+
+
+def _range_records(defect: dict, construction_type: str) -> Iterable[DefectRecord]:
+    for pn, cfg in defect["parameters"].items():
+        for r in cfg.get("ranges", []):
+            if r.get("code"):
+                yield DefectRecord(
+                    code=r["code"],
+                    parent_code=defect["code"],
+                    construction_type=construction_type,
+                    material=defect.get("material", ""),
+                    damage_type=defect.get("damage_type", ""),
+                    category=r.get("category", ""),
+                    description=r.get("description", ""),
+                    recommendation=r.get("recommendation", ""),
+                    parameter=pn,
+                    min=r.get("min"),
+                    max=r.get("max"),
+                )
+
+
+def _prompt_lines(defect: dict) -> Tuple[str, ...]:
+    """Строки базы дефектов для промпта (для параметризованного — по строке на диапазон)."""
+    # Дефекты, которые нельзя достоверно распознать по фотографии
+    # (отклонения от вертикали/крен, внутренние дефекты сварных швов,
+    # контроль болтов по проекту/щупу и т.п.), исключаем из подсказки ИИ.
+    # В каталоге они остаются и доступны для ручного ввода инженером.
+    if defect.get("photo_detectable") is False:
+        return ()
+    if "parameters" not in defect:
+        return (
+            f"code: {defect.get('code', '')}; description: {defect['description']}; "
+            f"recommendation: {defect['recommendation']}; category: {defect['category']}; "
+            f"material: {defect.get('material', '')}.",
+        )
+
+    lines = []
+    for pn, cfg in defect["parameters"].items():
+        unit = cfg.get("unit", "")
+        for r in cfg.get("ranges", []):
+            vc = r.get("code", "")
+            if not vc:
+                continue
+            rmin, rmax = r.get("min"), r.get("max")
+            rng = ""
+            if rmin is not None and rmax is not None:
+                rng = f" [{pn}: {rmin}-{rmax} {unit}]"
+            elif rmax is not None:
+                rng = f" [{pn}: до {rmax} {unit}]"
+            elif rmin is not None:
+                rng = f" [{pn}: более {rmin} {unit}]"
+            lines.append(
+                f"code: {vc};{rng} description: {r.get('description', '')}; "
+                f"recommendation: {r.get('recommendation', '')}; category: {r.get('category', '')}; "
+                f"material: {defect.get('material', '')}."
+            )
+    return tuple(lines)
+
+
+def _range_label(rmin, rmax) -> str:
+    if rmin is not None and rmax is not None:
+        return f"{rmin}-{rmax}"
+    if rmax is not None:
+        return f"до {rmax}"
+    if rmin is not None:
+        return f"более {rmin}"
+    return ""
+
+
+def _compact_entry(defect: dict) -> Optional[tuple]:
+    """
+    (материал, код, признаки, параметры) для компактного формата;
+    параметр — (имя с единицей, ((код, границы, описание), ...)).
+    None — дефект не распознаётся по фото.
+    """
+    if defect.get("photo_detectable") is False:
+        return None
+    signs = defect.get("damage_type") or defect.get("description", "")
+    params = []
+    for pn, cfg in defect.get("parameters", {}).items():
+        unit = cfg.get("unit", "")
+        ranges = tuple(
+            (r["code"], _range_label(r.get("min"), r.get("max")), r.get("description", ""))
+            for r in cfg.get("ranges", []) if r.get("code")
+        )
+        if ranges:
+            params.append((f"{pn}, {unit}" if unit else pn, ranges))
+    if defect.get("parameters") and not params:
+        return None
+    return defect.get("material", ""), defect.get("code", ""), signs, tuple(params)
+
+
+def _render_param(label: str, ranges: tuple, limit: Optional[int]) -> str:
+    """
+    Варианты параметра: у числового диапазона — границы, у качественного
+    (без min/max) — описание, иначе варианты не различить.
+    """
+    limit = COMPACT_VARIANT_CHARS if limit is None else min(limit, COMPACT_VARIANT_CHARS)
+    items = (f"{code} {bounds or _shorten(description, limit)}".rstrip() for code, bounds, description in ranges)
+    return f"{label}: " + "; ".join(items)
+
+
+def _response_codes(defect: dict) -> Tuple[str, ...]:
+    """Коды, которыми модель может ответить на дефект (для параметризованного — коды вариантов)."""
+    if defect.get("photo_detectable") is False:
+        return ()
+    if "parameters" not in defect:
+        return (defect["code"],) if defect.get("code") else ()
+    return tuple(
+        r["code"] for cfg in defect["parameters"].values() for r in cfg.get("ranges", []) if r.get("code")
+    )
+
+
+def _shorten(text: str, limit: Optional[int]) -> str:
+    if limit is None or len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(" ", 1)[0].rstrip(",;:")
+    return cut + "…"
+
+
+def _render_compact(entries: Tuple[tuple, ...], signs_limit: Optional[int]) -> List[str]:
+    """Строки компактного формата, сгруппированные по материалу (порядок — первое появление)."""
+    groups: Dict[str, List[str]] = {}
+    for material, code, signs, params in entries:
+        line = " | ".join(
+            (code, _shorten(signs, signs_limit)) + tuple(_render_param(*p, signs_limit) for p in params)
+        )
+        groups.setdefault(material, []).append(line)
+    lines = []
+    for material, group in groups.items():
+        lines.append(f"## {material or '—'}")
+        lines.extend(group)
+    return lines
+
+
+def catalog_version(*parts) -> str:
+    """Хеш содержимого каталога и шаблонов промптов."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class DefectCatalog:
+    """Индексы каталога дефектов и кеш промптов по типу конструкции"""
+
+    def __init__(
+        self,
+        defects_db: Dict[str, List[dict]],
+        cross_cutting: List[dict],
+        aliases: Dict[str, str],
+        engineering_types: Iterable[str],
+        user_prompt_template: str,
+        version: str,
+        compact: bool = False,
+        prompt_max_chars: Optional[int] = None,
+    ):
+        self.aliases = aliases
+        self.user_prompt_template = user_prompt_template
+        self.version = version
+        self.compact = compact
+        self.prompt_max_chars = prompt_max_chars
+
+        self.by_code: Dict[str, DefectRecord] = {}
+        self.by_tag: Dict[str, DefectRecord] = {}
+        # Нормализованный тип → записи верхнего уровня в порядке DEFECTS_DB
+        self.by_type: Dict[Optional[str], Tuple[DefectRecord, ...]] = {}
+        self._prompts: Dict[Optional[str], str] = {}
+        # Код записи верхнего уровня → строки полного и запись компактного формата
+        self._lines_by_code: Dict[str, Tuple[str, ...]] = {}
+        self._entry_by_code: Dict[str, tuple] = {}
+        # Код записи верхнего уровня → допустимые коды ответа; кеш по типу
+        self._response_codes_by_code: Dict[str, Tuple[str, ...]] = {}
+        self._response_codes: Dict[Optional[str], Tuple[str, ...]] = {}
+        self._response_code_sets: Dict[Optional[str], frozenset] = {}
+
+        cross_records = []
+        cross_lines: List[str] = []
+        cross_entries = []
+        for defect in cross_cutting:
+            record = _base_record(defect, None)
+            cross_records.append(record)
+            self._add_prompt_parts(record.code, defect, cross_lines, cross_entries)
+            if record.code:
+                self.by_code[record.code] = record
+            if record.tag:
+                self.by_tag.setdefault(record.tag, record)
+        self.cross_cutting: Tuple[DefectRecord, ...] = tuple(cross_records)
+
+        own_lines: Dict[Optional[str], Tuple[str, ...]] = {}
+        own_entries: Dict[Optional[str], tuple] = {}
+        for ctype, defects in defects_db.items():
+            records, lines, entries = [], [], []
+            for defect in defects:
+                record = _base_record(defect, ctype)
+                records.append(record)
+                self._add_prompt_parts(record.code, defect, lines, entries)
+                if record.code:
+                    self.by_code[record.code] = record
+                if "parameters" in defect:
+                    for range_record in _range_records(defect, ctype):
+                        self.by_code[range_record.code] = range_record
+            self.by_type[ctype] = tuple(records)
+            own_lines[ctype] = tuple(lines)
+            own_entries[ctype] = tuple(entries)
+
+        if ENGINEERING_GROUP not in self.by_type:
+            group = [t for t in engineering_types if t in self.by_type]
+            self.by_type[ENGINEERING_GROUP] = tuple(r for t in group for r in self.by_type[t])
+            own_lines[ENGINEERING_GROUP] = tuple(line for t in group for line in own_lines[t])
+            own_entries[ENGINEERING_GROUP] = tuple(e for t in group for e in own_entries[t])
+        self.by_type[ALL_TYPES_KEY] = tuple(r for t in defects_db for r in self.by_type[t])
+        own_lines[ALL_TYPES_KEY] = tuple(line for t in defects_db for line in own_lines[t])
+        own_entries[ALL_TYPES_KEY] = tuple(e for t in defects_db for e in own_entries[t])
+
+        self._own_entries = own_entries
+        self._cross_entries = tuple(cross_entries)
+        self._lines_by_type = {key: lines + tuple(cross_lines) for key, lines in own_lines.items()}
+        self._compact_by_type = {
+            key: tuple(e for e in entries + tuple(cross_entries) if e is not None)
+            for key, entries in own_entries.items()
+        }
+
+    def _add_prompt_parts(self, code: Optional[str], defect: dict, lines: List[str], entries: list) -> None:
+        """Добавляет части промпта дефекта в списки типа и в индекс по коду."""
+        defect_lines = _prompt_lines(defect)
+        entry = _compact_entry(defect)
+        lines.extend(defect_lines)
+        entries.append(entry)
+        if code and entry is not None:
+            self._lines_by_code[code] = defect_lines
+            self._entry_by_code[code] = entry
+            self._response_codes_by_code[code] = _response_codes(defect)
+
+    def normalize_type(self, construction_type: Optional[str] = None) -> Optional[str]:
+        """Имя раздела DEFECTS_DB для текущих backend/UI-названий."""
+        if construction_type is None:
+            return None
+        value = str(construction_type).strip()
+        return self.aliases.get(value, value)
+
+    def type_key(self, construction_type: Optional[str] = None) -> Optional[str]:
+        """Ключ индекса по типу; неизвестный тип — все конструкции."""
+        normalized = self.normalize_type(construction_type)
+        return normalized if normalized in self.by_type else ALL_TYPES_KEY
+
+    def get_by_code(self, code: Optional[str]) -> Optional[DefectRecord]:
+        return self.by_code.get(code) if code else None
+
+    def get_by_tag(self, tag: Optional[str]) -> Optional[DefectRecord]:
+        return self.by_tag.get(tag) if tag else None
+
+    def defects_for(self, construction_type: Optional[str] = None) -> Tuple[DefectRecord, ...]:
+        """Дефекты типа конструкции (без кросс-категорийных)."""
+        return self.by_type[self.type_key(construction_type)]
+
+    def defects_text(self, construction_type: Optional[str] = None) -> str:
+        """База дефектов для промпта: дефекты типа и кросс-категорийные."""
+        return "\n".join(self._lines_by_type[self.type_key(construction_type)])
+
+    def _fit(self, render: Callable[[Optional[int]], List[str]], label: str) -> str:
+        """
+        Текст в пределах prompt_max_chars: сначала укорачиваются признаки
+        (COMPACT_SIGNS_LIMITS), затем отбрасываются последние строки.
+        """
+        budget = self.prompt_max_chars
+        for limit in COMPACT_SIGNS_LIMITS:
+            text = "\n".join(render(limit))
+            if budget is None or len(text) <= budget:
+                if limit is not None:
+                    logger.info("Промпт дефектов (%s): признаки укорочены до %d символов", label, limit)
+                return text
+
+        lines = render(COMPACT_SIGNS_LIMITS[-1])
+        kept, size = [], 0
+        for line in lines:
+            if size + len(line) + 1 > budget:
+                break
+            kept.append(line)
+            size += len(line) + 1
+        while kept and kept[-1].startswith("#"):
+            kept.pop()
+        dropped = len(lines) - len(kept)
+        metrics.inc("defect_prompt.truncated_total", construction_type=label)
+        logger.warning(
+            "Промпт дефектов (%s) не уложился в %d символов: отброшено строк %d", label, budget, dropped,
+        )
+        return "\n".join(kept)
+
+    def compact_text(self, construction_type: Optional[str] = None) -> str:
+        """База дефектов в компактном формате в пределах prompt_max_chars."""
+        key = self.type_key(construction_type)
+        entries = self._compact_by_type[key]
+        return self._fit(lambda limit: _render_compact(entries, limit), key or "all")
+
+    def sectioned_text(self, construction_types: Iterable[str], common_title: str) -> str:
+        """
+        Двухуровневая база для промпта: раздел «# тип» с дефектами каждого
+        типа конструкции и общий раздел кросс-категорийных дефектов.
+        """
+        sections = []
+        for construction_type in construction_types:
+            key = self.type_key(construction_type)
+            sections.append((construction_type, tuple(e for e in self._own_entries[key] if e is not None)))
+        sections.append((common_title, tuple(e for e in self._cross_entries if e is not None)))
+
+        def render(limit: Optional[int]) -> List[str]:
+            lines = []
+            for title, entries in sections:
+                lines.append(f"# {title}")
+                lines.extend(_render_compact(entries, limit))
+            return lines
+
+        return self._fit(render, "sectioned")
+
+    def is_detectable(self, code: Optional[str]) -> bool:
+        """Запись верхнего уровня, которая попадает в промпт (распознаётся по фото)."""
+        return code in self._entry_by_code
+
+    def subset_prompt(self, codes: Iterable[str]) -> str:
+        """Промпт анализа только по указанным дефектам верхнего уровня (шорт-лист)."""
+        codes = [code for code in codes if code in self._entry_by_code]
+        if self.compact:
+            lines = _render_compact(tuple(self._entry_by_code[code] for code in codes), None)
+        else:
+            lines = [line for code in codes for line in self._lines_by_code[code]]
+        return self.user_prompt_template.format(defects_text="\n".join(lines))
+
+    def subset_response_codes(self, codes: Iterable[str]) -> Tuple[str, ...]:
+        """Допустимые коды ответа для дефектов верхнего уровня (enum схемы ответа)."""
+        return tuple(c for code in codes for c in self._response_codes_by_code.get(code, ()))
+
+    def response_codes(self, construction_type: Optional[str] = None) -> Tuple[str, ...]:
+        """Допустимые коды ответа для промпта типа конструкции."""
+        key = self.type_key(construction_type)
+        codes = self._response_codes.get(key)
+        if codes is None:
+            codes = self.subset_response_codes(r.code for r in self.by_type[key] + self.cross_cutting)
+            self._response_codes[key] = codes
+        return codes
+
+    def is_response_code(self, code: Optional[str], construction_type: Optional[str] = None) -> bool:
+        """Код допустим как ответ для типа конструкции."""
+        key = self.type_key(construction_type)
+        codes = self._response_code_sets.get(key)
+        if codes is None:
+            codes = self._response_code_sets[key] = frozenset(self.response_codes(key))
+        return code in codes
+
+    def user_prompt(self, construction_type: Optional[str] = None) -> str:
+        """Промпт анализа дефекта; собирается один раз на тип конструкции."""
+        key = self.type_key(construction_type)
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            defects_text = self.compact_text(key) if self.compact else self.defects_text(key)
+            prompt = self.user_prompt_template.format(defects_text=defects_text)
+            self._prompts[key] = prompt
+        return prompt
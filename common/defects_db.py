@@ -6,6 +6,9 @@ description, recommendation, [parameters]. Универсальные дефек
 Категории: А — аварийное, Б — ограниченно работоспособное, В — работоспособное.
 """
 
+from common.defects_catalog import DefectCatalog, catalog_version
+from settings import DEFECT_PROMPT_CHARS_PER_TOKEN, DEFECT_PROMPT_COMPACT, DEFECT_PROMPT_MAX_TOKENS
+
 DEFECTS_DB = {
     "Фундамент": [
     {
@@ -4017,163 +4020,133 @@ def normalize_construction_type(construction_type=None):
     return CONSTRUCTION_TYPE_ALIASES.get(value, value)
 
 
-def _defects_for_construction_type(construction_type=None):
-    normalized_type = normalize_construction_type(construction_type)
-    if normalized_type and normalized_type in DEFECTS_DB:
-        return list(DEFECTS_DB[normalized_type])
-    if normalized_type == "Инженерные сети":
-        defects = []
-        for type_name in ENGINEERING_CONSTRUCTION_TYPES:
-            defects.extend(DEFECTS_DB.get(type_name, []))
-        return defects
+SYSTEM_PROMPT = "Ты инженер-обследователь. Технический специалист по обследованию зданий и сооружений."
 
-    defects = []
-    for value in DEFECTS_DB.values():
-        defects.extend(value)
-    return defects
 
+# Шаблоны промпта анализа дефекта; {defects_text} — база дефектов типа конструкции.
+# Постоянная часть (инструкции и формат ответа) идёт первой, база — в конце:
+# так у запросов с разными типами конструкций совпадает начало промпта и
+# срабатывает кеширование префикса у провайдера.
+_USER_PROMPT_HEAD = """
+Ты технический специалист. На фото — участок строительной конструкции с повреждением.
+База известных дефектов с их кодами приведена в конце сообщения.
 
-def _ambiguous_category(ranges):
-    categories = [r.get("category", "") for r in ranges if r.get("category")]
-    unique_categories = set(categories)
-    if len(unique_categories) == 1:
-        return categories[0]
-    return "Б"
+Выполни анализ по шагам:
+1. Опиши что ты видишь на фото: тип повреждения, его характер и масштаб.
+2. Оцени размер дефекта по эталонным элементам в кадре: кирпич 250×120×65 мм, шов кладки ~10–12 мм, бетонный блок, доска и т.п. Так оценивай ширину трещины (мм), глубину/площадь выкрашивания кладки, размер повреждения.
+3. Выбирай дефект ТОЛЬКО по тем признакам, которые реально видны на фото. Не оценивай отклонение от вертикали, крен, прогиб по числам, потерю сечения в процентах или внутренние дефекты — таких кодов в базе нет, они определяются приборами.
+4. На основе видимых признаков и оценённого размера выбери наиболее подходящий дефект из базы.
+5. Верни КОД этого дефекта.
 
+Ответ строго в JSON:
+{{
+  "code": "КОД_ДЕФЕКТА",
+  "confidence": 0.9,
+  "reasoning": null
+}}
+"confidence" — уверенность в выбранном коде от 0.0 до 1.0: ниже 0.5, если дефект плохо виден или подходят несколько кодов.
+Поле "reasoning" необязательное: null или одна короткая фраза, если выбор неочевиден.
+"""
 
-def _parameterized_parent_record(defect):
-    ranges = []
-    range_codes = []
-    for cfg in defect.get("parameters", {}).values():
-        for range_item in cfg.get("ranges", []):
-            ranges.append(range_item)
-            if range_item.get("code"):
-                range_codes.append(range_item["code"])
+# Полный формат базы: код, описание, рекомендация, категория, материал
+USER_PROMPT_FULL_TEMPLATE = _USER_PROMPT_HEAD + """
+Вот база известных дефектов с их кодами:
+{defects_text}
+"""
 
-    recommendation = defect.get("recommendation")
-    if not recommendation:
-        recommendation = "Уточнить числовые параметры дефекта и выбрать соответствующий вариант"
-        if range_codes:
-            recommendation += ": " + ", ".join(range_codes)
+# Компактный формат: код, видимые признаки, диапазоны параметров
+USER_PROMPT_COMPACT_TEMPLATE = _USER_PROMPT_HEAD + """
+Вот база известных дефектов с их кодами. Строки сгруппированы по материалу (## материал), формат строки:
+КОД | видимые признаки | параметр, единица: КОД_ВАРИАНТА диапазон; ...
+Для дефекта с параметрами выбирай код варианта, диапазон которого соответствует оценённому значению.
+{defects_text}
+"""
 
-    return {
-        **defect,
-        "category": defect.get("category") or _ambiguous_category(ranges),
-        "description": defect.get("description") or defect.get("damage_type", ""),
-        "recommendation": recommendation,
-    }
 
+USER_PROMPT_TEMPLATE = USER_PROMPT_COMPACT_TEMPLATE if DEFECT_PROMPT_COMPACT else USER_PROMPT_FULL_TEMPLATE
 
-def get_defect_by_tag(tag):
-    if not tag:
-        return None
-    for d in CROSS_CUTTING_DEFECTS:
-        if d.get("tag") == tag:
-            return d
-    return None
+# Дописывается после базы при пакетном анализе: постоянная часть промпта
+# остаётся общей с одиночными вызовами (кеш префикса провайдера)
+USER_PROMPT_BATCH_SUFFIX = """
+В этом запросе несколько фото ({count}), пронумерованных по порядку начиная с 1.
+Каждое фото — отдельный независимый дефект, анализируй их по отдельности.
+Вместо формата выше ответ строго в JSON — по элементу на каждое фото:
+{{"results": [{{"image": 1, "code": "КОД_ДЕФЕКТА", "confidence": 0.9}}, ...]}}
+"""
+
+
+_CATALOG = None
+
+
+def get_catalog():
+    """Скомпилированный каталог (индексы и промпты), строится при первом обращении."""
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = DefectCatalog(
+            DEFECTS_DB,
+            CROSS_CUTTING_DEFECTS,
+            CONSTRUCTION_TYPE_ALIASES,
+            ENGINEERING_CONSTRUCTION_TYPES,
+            USER_PROMPT_TEMPLATE,
+            version=catalog_version(
+                DEFECTS_DB, CROSS_CUTTING_DEFECTS, CONSTRUCTION_TYPE_ALIASES,
+                ENGINEERING_CONSTRUCTION_TYPES, SYSTEM_PROMPT, USER_PROMPT_TEMPLATE,
+                DEFECT_PROMPT_COMPACT, DEFECT_PROMPT_MAX_TOKENS,
+            ),
+            compact=DEFECT_PROMPT_COMPACT,
+            prompt_max_chars=DEFECT_PROMPT_MAX_TOKENS * DEFECT_PROMPT_CHARS_PER_TOKEN,
+        )
+    return _CATALOG
 
 
-_DEFECTS_BY_CODE = None
+def get_catalog_version():
+    """Хеш содержимого каталога и промптов — для ключей кешей, зависящих от каталога."""
+    return get_catalog().version
 
 
-def _build_code_index():
-    global _DEFECTS_BY_CODE
-    if _DEFECTS_BY_CODE is not None:
-        return _DEFECTS_BY_CODE
-    idx = {}
-    for d in CROSS_CUTTING_DEFECTS:
-        if d.get("code"):
-            idx[d["code"]] = {**d, "construction_type": None}
-    for ctype, defects in DEFECTS_DB.items():
-        for d in defects:
-            if d.get("code"):
-                base_defect = _parameterized_parent_record(d) if "parameters" in d else d
-                idx[d["code"]] = {**base_defect, "construction_type": ctype}
-            if "parameters" in d:
-                for pn, cfg in d["parameters"].items():
-                    for r in cfg.get("ranges", []):
-                        if r.get("code"):
-                            idx[r["code"]] = {
-                                "code": r["code"], "parent_code": d["code"],
-                                "construction_type": ctype, "material": d.get("material", ""),
-                                "damage_type": d.get("damage_type", ""),
-                                "category": r.get("category", ""),
-                                "description": r.get("description", ""),
-                                "recommendation": r.get("recommendation", ""),
-                                "parameter": pn, "min": r.get("min"), "max": r.get("max"),
-                            }
-    _DEFECTS_BY_CODE = idx
-    return idx
+def get_defect_by_tag(tag):
+    return get_catalog().get_by_tag(tag)
 
 
 def get_defect_by_code(code):
-    return _build_code_index().get(code)
+    return get_catalog().get_by_code(code)
 
 
 def get_all_codes():
-    return list(_build_code_index().keys())
+    return list(get_catalog().by_code)
 
 
 def get_defects_text(construction_type=None):
-    lst = _defects_for_construction_type(construction_type)
-    lst.extend(CROSS_CUTTING_DEFECTS)
-    lines = []
-    for d in lst:
-        # Дефекты, которые нельзя достоверно распознать по фотографии
-        # (отклонения от вертикали/крен, внутренние дефекты сварных швов,
-        # контроль болтов по проекту/щупу и т.п.), исключаем из подсказки ИИ.
-        # В каталоге они остаются и доступны для ручного ввода инженером.
-        if d.get("photo_detectable") is False:
-            continue
-        code = d.get("code", "")
-        if "parameters" in d:
-            for pn, cfg in d["parameters"].items():
-                unit = cfg.get("unit", "")
-                for r in cfg.get("ranges", []):
-                    vc = r.get("code", "")
-                    if not vc:
-                        continue
-                    rmin, rmax = r.get("min"), r.get("max")
-                    rng = ""
-                    if rmin is not None and rmax is not None:
-                        rng = f" [{pn}: {rmin}-{rmax} {unit}]"
-                    elif rmax is not None:
-                        rng = f" [{pn}: до {rmax} {unit}]"
-                    elif rmin is not None:
-                        rng = f" [{pn}: более {rmin} {unit}]"
-                    lines.append(f"code: {vc};{rng} description: {r.get('description','')}; recommendation: {r.get('recommendation','')}; category: {r.get('category','')}; material: {d.get('material','')}.")
-        else:
-            lines.append(f"code: {code}; description: {d['description']}; recommendation: {d['recommendation']}; category: {d['category']}; material: {d.get('material','')}.")
-    return "\n".join(lines)
-
-
-SYSTEM_PROMPT = "Ты инженер-обследователь. Технический специалист по обследованию зданий и сооружений."
+    return get_catalog().defects_text(construction_type)
 
 
 def get_user_prompt(construction_type=None):
-    defects_text = get_defects_text(construction_type)
-    return f"""
-Ты технический специалист. На фото — участок строительной конструкции с повреждением.
+    return get_catalog().user_prompt(construction_type)
 
-Вот база известных дефектов с их кодами:
-{defects_text}
 
-Выполни анализ по шагам:
-1. Опиши что ты видишь на фото: тип повреждения, его характер и масштаб.
-2. Оцени размер дефекта по эталонным элементам в кадре: кирпич 250×120×65 мм, шов кладки ~10–12 мм, бетонный блок, доска и т.п. Так оценивай ширину трещины (мм), глубину/площадь выкрашивания кладки, размер повреждения.
-3. Выбирай дефект ТОЛЬКО по тем признакам, которые реально видны на фото. Не оценивай отклонение от вертикали, крен, прогиб по числам, потерю сечения в процентах или внутренние дефекты — таких кодов в базе нет, они определяются приборами.
-4. На основе видимых признаков и оценённого размера выбери наиболее подходящий дефект из базы.
-5. Верни КОД этого дефекта.
-
-Ответ строго в JSON:
-{{
-  "reasoning": "краткое описание: что видно, оценка параметров, почему выбран этот код",
-  "code": "КОД_ДЕФЕКТА"
-}}
-"""
+USER_PROMPT = get_user_prompt()
 
 
-USER_PROMPT = get_user_prompt()
+# Варианты ответа классификации конструкции (совпадают со списком в промпте)
+CONSTRUCTION_TYPE_CHOICES = (
+    "Фундамент",
+    "Фасад",
+    "Стена",
+    "Пол",
+    "Перекрытие",
+    "Покрытие",
+    "Отмостка",
+    "Крыльцо",
+    "Балкон/лоджия",
+    "Лестница",
+    "Стропильная система покрытия",
+    "Стропильная ферма покрытия",
+    "Колонна",
+    "Балка",
+    "Кровля",
+    "Инженерные сети",
+    "Другие конструкции",
+)
 
 
 USER_PROMPT_CONSTRUCTIONS = """
@@ -4231,3 +4204,58 @@ USER_PROMPT_DEFECT_DESCRIPTION = """
   "description": "дефекты и повреждения"
 }
 """
+
+
+# Совмещённый вызов: тип конструкции и код дефекта за одно обращение к модели.
+# База двухуровневая: разделы по типам из CONSTRUCTION_TYPE_CHOICES и общий
+# раздел кросс-категорийных дефектов.
+FUSED_COMMON_SECTION = "Любая конструкция"
+
+USER_PROMPT_FUSED_TEMPLATE = """
+Ты технический специалист. На фото — участок строительной конструкции с повреждением.
+База известных дефектов с их кодами приведена в конце сообщения, разделы «# Тип конструкции».
+
+Выполни анализ по шагам:
+1. Определи конструкцию на фото — один из заголовков разделов базы, кроме «{common_section}».
+   Фасад — это стена с наружной стороны, для остальных стен используй «Стена».
+   Потолок является частью перекрытия или покрытия. Пол — напольные покрытия, стяжка или черновой пол.
+   Если на фото несколько конструкций, уверенность в типе — не выше 0.6–0.7.
+2. Оцени размер дефекта по эталонным элементам в кадре: кирпич 250×120×65 мм, шов кладки ~10–12 мм, бетонный блок, доска и т.п.
+3. Выбирай дефект ТОЛЬКО по видимым признакам и ТОЛЬКО из раздела выбранной конструкции или раздела «{common_section}».
+   Для дефекта с параметрами выбирай код варианта, диапазон которого соответствует оценённому значению.
+
+Ответ строго в JSON:
+{{
+  "construction_type": "Тип конструкции",
+  "confidence": 0.9,
+  "code": "КОД_ДЕФЕКТА",
+  "code_confidence": 0.9,
+  "reasoning": null
+}}
+"confidence" — уверенность в типе конструкции, "code_confidence" — в коде дефекта (от 0.0 до 1.0).
+Поле "reasoning" необязательное: null или одна короткая фраза.
+
+Вот база известных дефектов. Формат строки: КОД | видимые признаки | параметр, единица: КОД_ВАРИАНТА диапазон; ...
+{defects_text}
+"""
+
+_FUSED_PROMPT = None
+
+
+def get_fused_prompt():
+    """Промпт совмещённого вызова; собирается один раз."""
+    global _FUSED_PROMPT
+    if _FUSED_PROMPT is None:
+        _FUSED_PROMPT = USER_PROMPT_FUSED_TEMPLATE.format(
+            common_section=FUSED_COMMON_SECTION,
+            defects_text=get_catalog().sectioned_text(CONSTRUCTION_TYPE_CHOICES, FUSED_COMMON_SECTION),
+        )
+    return _FUSED_PROMPT
+
+
+def get_fused_response_codes():
+    """Допустимые коды ответа совмещённого вызова (все разделы без повторов)."""
+    catalog = get_catalog()
+    return tuple(dict.fromkeys(
+        code for construction_type in CONSTRUCTION_TYPE_CHOICES for code in catalog.response_codes(construction_type)
+    ))
@@ -0,0 +1,165 @@
+"""
+Извлечение текста из DOCX/PDF с маркерами страниц [Страница N].
+
+DOCX читается потоково: word/document.xml распаковывается на лету и
+разбирается lxml.iterparse, элементы верхнего уровня тела (абзацы и
+таблицы) обрабатываются в порядке документа и сразу освобождаются.
+Разрывы страниц (w:br w:type="page") ставят маркер ровно в месте разрыва.
+
+PDF обрабатывается постранично: страница загружается, из неё берётся
+текст, и она сразу выгружается.
+
+Функции чисто CPU-шные и не зависят от сервисов приложения, поэтому
+выполняются в процессах CpuPoolService.
+"""
+
+import io
+import zipfile
+from typing import Iterator, List, Tuple
+
+import pymupdf
+from lxml import etree
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_BODY = f"{_W_NS}body"
+_P = f"{_W_NS}p"
+_TBL = f"{_W_NS}tbl"
+_TR = f"{_W_NS}tr"
+_TC = f"{_W_NS}tc"
+_T = f"{_W_NS}t"
+_TAB = f"{_W_NS}tab"
+_PTAB = f"{_W_NS}ptab"
+_BR = f"{_W_NS}br"
+_CR = f"{_W_NS}cr"
+_NO_BREAK_HYPHEN = f"{_W_NS}noBreakHyphen"
+_BR_TYPE = f"{_W_NS}type"
+# Текст надписей дублируется в mc:Fallback и не относится к потоку абзаца
+_TXBX_CONTENT = f"{_W_NS}txbxContent"
+
+_DOCUMENT_PART = "word/document.xml"
+
+# Разрыв страницы внутри абзаца
+_PAGE_BREAK = object()
+
+
+def _paragraph_pieces(paragraph) -> List[object]:
+    """
+    Текст абзаца по кускам в порядке документа: строки и _PAGE_BREAK.
+    Символы как в python-docx: w:tab → \\t, w:br/w:cr → \\n, noBreakHyphen → -.
+    """
+    pieces: List[object] = []
+    buffer: List[str] = []
+    stack = list(reversed(paragraph))
+    while stack:
+        el = stack.pop()
+        tag = el.tag
+        if tag == _T:
+            if el.text:
+                buffer.append(el.text)
+        elif tag == _TAB or tag == _PTAB:
+            buffer.append("\t")
+        elif tag == _BR:
+            br_type = el.get(_BR_TYPE)
+            if br_type == "page":
+                pieces.append("".join(buffer))
+                pieces.append(_PAGE_BREAK)
+                buffer = []
+            elif br_type in (None, "textWrapping"):
+                buffer.append("\n")
+        elif tag == _CR:
+            buffer.append("\n")
+        elif tag == _NO_BREAK_HYPHEN:
+            buffer.append("-")
+        elif tag == _TXBX_CONTENT or tag == _P:
+            continue
+        else:
+            stack.extend(reversed(el))
+    pieces.append("".join(buffer))
+    return pieces
+
+
+def _cell_text(cell) -> str:
+    """Текст ячейки: абзацы (включая вложенные таблицы) через перевод строки."""
+    lines = []
+    for paragraph in cell.iter(_P):
+        text = "".join(p for p in _paragraph_pieces(paragraph) if p is not _PAGE_BREAK).strip()
+        if text:
+            lines.append(text)
+    return "\n".join(lines)
+
+
+def _table_rows(table) -> Iterator[str]:
+    for row in table.iterchildren(_TR):
+        cells = []
+        for cell in row.iterchildren(_TC):
+            text = _cell_text(cell)
+            if text:
+                cells.append(text)
+        if cells:
+            yield " | ".join(cells)
+
+
+def _iter_body_elements(xml_stream) -> Iterator[etree._Element]:
+    """Элементы верхнего уровня w:body по мере разбора; после обработки освобождаются."""
+    depth = 0
+    body_depth = None
+    for event, el in etree.iterparse(
+        xml_stream, events=("start", "end"), huge_tree=True, resolve_entities=False,
+    ):
+        if event == "start":
+            depth += 1
+            if el.tag == _BODY:
+                body_depth = depth
+            continue
+
+        if body_depth is not None and depth == body_depth + 1:
+            yield el
+            el.clear()
+            # Освобождаем уже обработанных соседей, чтобы дерево не росло
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+        depth -= 1
+
+
+def parse_docx(file_bytes: bytes) -> str:
+    parts: list[str] = []
+    page_num = 1
+    parts.append(f"[Страница {page_num}]")
+
+    with zipfile.ZipFile(io.BytesIO(file_bytes)) as zf, zf.open(_DOCUMENT_PART) as xml_stream:
+        for el in _iter_body_elements(xml_stream):
+            if el.tag == _P:
+                for piece in _paragraph_pieces(el):
+                    if piece is _PAGE_BREAK:
+                        page_num += 1
+                        parts.append(f"\n[Страница {page_num}]")
+                        continue
+                    text = piece.strip()
+                    if text:
+                        parts.append(text)
+            elif el.tag == _TBL:
+                parts.extend(_table_rows(el))
+
+    return "\n".join(parts)
+
+
+def iter_pdf_pages(file_bytes: bytes) -> Iterator[Tuple[int, str]]:
+    """Постранично отдаёт (номер страницы, текст); страницы грузятся по одной."""
+    doc = pymupdf.open(stream=file_bytes, filetype="pdf")
+    try:
+        for index in range(doc.page_count):
+            page = doc.load_page(index)
+            yield index + 1, page.get_text()
+            page = None
+    finally:
+        doc.close()
+
+
+def parse_pdf(file_bytes: bytes) -> str:
+    parts: list[str] = []
+    for page_num, text in iter_pdf_pages(file_bytes):
+        text = text.strip()
+        if text:
+            parts.append(f"[Страница {page_num}]\n{text}")
+    return "\n".join(parts)
@@ -0,0 +1,219 @@
+"""
+Планировщик слотов AI-вызовов с классами приоритета и справедливой
+долей между пользователями (tenant).
+
+Вместо общего семафора очереди ожидающие задачи раскладываются по
+классам приоритета (interactive > speculative > bulk) и внутри класса —
+по очередям пользователей. Освободившийся слот получает задача высшего
+непустого класса; внутри класса — пользователь с наименьшим
+виртуальным временем (weighted fair queuing: каждый выданный слот
+сдвигает время пользователя на 1/вес, простоявший пользователь
+начинает с текущего времени класса, а не с накопленного кредита).
+Так один пользователь с сотней задач в очереди получает слоты по
+очереди с остальными, а не все подряд.
+
+Защита от голодания: задача, прождавшая дольше starvation_seconds,
+получает слот первой независимо от класса. Глубина очереди одного
+пользователя (ожидающие + выполняемые) ограничена max_tenant_depth —
+сверх неё admit() отказывает, очередь отвечает 503 только ему.
+
+Метрики: fair_queue.wait_seconds (queue, tenant, priority),
+fair_queue.rejected_total (queue, tenant),
+fair_queue.starvation_promotions_total (queue).
+"""
+
+import asyncio
+import contextlib
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional
+
+from common.metrics import metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SPECULATIVE = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_SPECULATIVE: "speculative",
+    PRIORITY_BULK: "bulk",
+}
+
+DEFAULT_TENANT = "anonymous"
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """Веса пользователей из строки вида "user:1=2,user:7=0.5" """
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        tenant, _, weight = item.rpartition("=")
+        weights[tenant] = float(weight)
+    return weights
+
+
+@dataclass
+class _Waiter:
+    tenant: str
+    priority: int
+    seq: int
+    enqueued: float
+    future: asyncio.Future = field(repr=False)
+
+
+class FairScheduler:
+    """Слоты одного ресурса (очереди) с приоритетами и справедливой долей"""
+
+    def __init__(
+        self,
+        name: str,
+        slots: int,
+        max_tenant_depth: int = 0,
+        starvation_seconds: float = 0,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Args:
+            name: Имя очереди (метка метрик)
+            slots: Число одновременно выполняемых задач
+            max_tenant_depth: Лимит задач одного пользователя (0 — без лимита)
+            starvation_seconds: Ожидание, после которого задача идёт первой (0 — выключено)
+            weights: Веса пользователей (по умолчанию 1)
+        """
+        self.name = name
+        self.slots = slots
+        self.max_tenant_depth = max_tenant_depth
+        self.starvation_seconds = starvation_seconds
+        self.weights = weights or {}
+
+        self.running = 0
+        self.depth: Dict[str, int] = {}
+        self._queues: Dict[int, Dict[str, Deque[_Waiter]]] = {p: {} for p in PRIORITY_NAMES}
+        self._vtime: Dict[tuple, float] = {}
+        self._vclock: Dict[int, float] = {p: 0.0 for p in PRIORITY_NAMES}
+        self._seq = itertools.count()
+
+    # ── Глубина очереди пользователя ─────────────────────────────
+
+    def admit(self, tenant: Optional[str]) -> bool:
+        """Учесть новую задачу пользователя; False — его лимит исчерпан"""
+        tenant = tenant or DEFAULT_TENANT
+        if self.max_tenant_depth and self.depth.get(tenant, 0) >= self.max_tenant_depth:
+            metrics.inc("fair_queue.rejected_total", queue=self.name, tenant=tenant)
+            return False
+        self.depth[tenant] = self.depth.get(tenant, 0) + 1
+        return True
+
+    def done(self, tenant: Optional[str]) -> None:
+        """Задача пользователя, учтённая admit(), завершена"""
+        tenant = tenant or DEFAULT_TENANT
+        left = self.depth.get(tenant, 0) - 1
+        if left > 0:
+            self.depth[tenant] = left
+        else:
+            self.depth.pop(tenant, None)
+
+    # ── Слоты ────────────────────────────────────────────────────
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tenant: Optional[str], priority: int = PRIORITY_INTERACTIVE):
+        """Занять слот на время блока"""
+        await self.acquire(tenant, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tenant: Optional[str], priority: int = PRIORITY_INTERACTIVE) -> None:
+        tenant = tenant or DEFAULT_TENANT
+        labels = {"queue": self.name, "tenant": tenant, "priority": PRIORITY_NAMES[priority]}
+        if self.running < self.slots and not self.waiting:
+            self.running += 1
+            metrics.observe("fair_queue.wait_seconds", 0.0, **labels)
+            return
+
+        waiter = _Waiter(
+            tenant, priority, next(self._seq), time.monotonic(),
+            asyncio.get_running_loop().create_future(),
+        )
+        self._queues[priority].setdefault(tenant, deque()).append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже выдан — возвращаем его следующему
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+        metrics.observe("fair_queue.wait_seconds", time.monotonic() - waiter.enqueued, **labels)
+
+    def release(self) -> None:
+        self.running -= 1
+        self._dispatch()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for tenants in self._queues.values() for q in tenants.values())
+
+    def _remove(self, waiter: _Waiter) -> None:
+        tenants = self._queues[waiter.priority]
+        queue = tenants.get(waiter.tenant)
+        if queue is not None:
+            with contextlib.suppress(ValueError):
+                queue.remove(waiter)
+            if not queue:
+                del tenants[waiter.tenant]
+
+    def _dispatch(self) -> None:
+        while self.running < self.slots:
+            waiter = self._next()
+            if waiter is None:
+                return
+            self._remove(waiter)
+            if waiter.future.done():
+                continue
+            self.running += 1
+            waiter.future.set_result(None)
+
+    def _next(self) -> Optional[_Waiter]:
+        heads = [q[0] for tenants in self._queues.values() for q in tenants.values()]
+        if not heads:
+            return None
+
+        if self.starvation_seconds:
+            oldest = min(heads, key=lambda w: w.seq)
+            if time.monotonic() - oldest.enqueued >= self.starvation_seconds:
+                metrics.inc("fair_queue.starvation_promotions_total", queue=self.name)
+                self._charge(oldest)
+                return oldest
+
+        priority = min(w.priority for w in heads)
+        candidates = [w for w in heads if w.priority == priority]
+        vclock = self._vclock[priority]
+        chosen = min(
+            candidates,
+            key=lambda w: (max(self._vtime.get((priority, w.tenant), 0.0), vclock), w.seq),
+        )
+        self._charge(chosen)
+        return chosen
+
+    def _charge(self, waiter: _Waiter) -> None:
+        """Сдвиг виртуального времени пользователя за выданный слот"""
+        key = (waiter.priority, waiter.tenant)
+        start = max(self._vtime.get(key, 0.0), self._vclock[waiter.priority])
+        self._vtime[key] = start + 1.0 / self.weights.get(waiter.tenant, 1.0)
+        self._vclock[waiter.priority] = start
+
+    def get_stats(self) -> dict:
+        """Статистика: слоты, ожидающие по классам, глубина по пользователям"""
+        return {
+            "slots": self.slots,
+            "running": self.running,
+            "waiting": {
+                PRIORITY_NAMES[p]: sum(len(q) for q in tenants.values())
+                for p, tenants in self._queues.items()
+            },
+            "tenant_depth": dict(self.depth),
+        }
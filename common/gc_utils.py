@@ -2,25 +2,39 @@ import uuid
 import asyncio
 import logging
 import mimetypes
-from typing import Tuple, Optional
+from typing import BinaryIO, Tuple, Optional
 
 from google.cloud import storage
 from datetime import datetime, timedelta, timezone
 
 from api.services.redis_service import redis_service
+from common.retry import RetryPolicy
 from settings import PROJECT_ID, BUCKET_NAME, DOCUMENTS_BUCKET_NAME
 
 logger = logging.getLogger(__name__)
 
 storage_client = storage.Client(project=PROJECT_ID)
 
+# Повторы запросов к GCS — общие для всех бакетов (common/retry.py)
+_retry = RetryPolicy("gcs")
+
 
 class GCSClient:
     """Клиент для работы с Google Cloud Storage бакетом."""
 
     def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
         self._bucket = storage_client.bucket(bucket_name)
 
+    @staticmethod
+    async def _call(fn, *args, **kwargs):
+        """Вызов клиента GCS в потоке с повторами; встроенные повторы библиотеки выключены."""
+        return await _retry.call(asyncio.to_thread, fn, *args, retry=None, **kwargs)
+
+    def uri(self, blob_name: str) -> str:
+        """gs://-ссылка на файл — для сервисов GCP, читающих бакет напрямую."""
+        return f"gs://{self.bucket_name}/{blob_name}"
+
     async def create_signed_url(
         self,
         blob_name: str,
@@ -41,7 +55,8 @@ class GCSClient:
             response_type = "image/*"
 
         try:
-            return await asyncio.to_thread(
+            return await _retry.call(
+                asyncio.to_thread,
                 blob.generate_signed_url,
                 version="v4",
                 expiration=expiration_time,
@@ -69,7 +84,7 @@ class GCSClient:
                 content_type = "image/jpeg"
 
         blob.content_type = content_type
-        await asyncio.to_thread(blob.upload_from_filename, file_path, content_type)
+        await self._call(blob.upload_from_filename, file_path, content_type)
         return blob
 
     async def upload_from_file_with_signed_url(
@@ -90,7 +105,7 @@ class GCSClient:
                 content_type = "application/octet-stream"
 
         blob.content_type = content_type
-        await asyncio.to_thread(blob.upload_from_filename, file_path)
+        await self._call(blob.upload_from_filename, file_path)
         signed_url = await self.create_signed_url(
             filename, expiration_minutes, content_type
         )
@@ -106,8 +121,25 @@ class GCSClient:
         blob = self._bucket.blob(filename)
         blob.content_type = content_type
 
+        await self._call(blob.upload_from_string, data, content_type=content_type)
+        return filename
+
+    async def upload_file(
+        self,
+        file_obj: BinaryIO,
+        filename: str,
+        content_type: str = "application/octet-stream",
+    ) -> str:
+        """
+        Загрузка из файлоподобного объекта (с текущей позиции), возвращает blob_name.
+
+        Без повторов: после неудачной попытки позиция в потоке уже сдвинута.
+        """
+        blob = self._bucket.blob(filename)
+        blob.content_type = content_type
+
         def _upload():
-            blob.upload_from_string(data, content_type=content_type)
+            blob.upload_from_file(file_obj, content_type=content_type)
 
         await asyncio.to_thread(_upload)
         return filename
@@ -116,12 +148,12 @@ class GCSClient:
         """Скачивание файла, возвращает (bytes, mime_type)."""
         blob = self._bucket.blob(blob_name)
 
-        if not await asyncio.to_thread(blob.exists):
+        if not await self._call(blob.exists):
             raise FileNotFoundError(
                 f"Файл {blob_name} не найден в GCS bucket"
             )
 
-        file_bytes = await asyncio.to_thread(blob.download_as_bytes)
+        file_bytes = await self._call(blob.download_as_bytes)
         mime_type = blob.content_type or "application/octet-stream"
         return file_bytes, mime_type
 
@@ -151,16 +183,39 @@ class GCSClient:
             )
             return False
 
+    async def stat(self, blob_name: str, generation: Optional[int] = None) -> Optional[storage.Blob]:
+        """Метаданные файла (size, generation, updated) без скачивания, или None."""
+        return await self._call(self._bucket.get_blob, blob_name, generation=generation)
+
+    async def download_range(
+        self,
+        blob_name: str,
+        start: int,
+        end: int,
+        generation: Optional[int] = None,
+    ) -> bytes:
+        """Скачивание диапазона [start, end) — конкретной generation, если указана."""
+        blob = self._bucket.blob(blob_name, generation=generation)
+        return await self._call(blob.download_as_bytes, start=start, end=end - 1)
+
     async def get_blob_size(self, blob_name: str) -> Optional[int]:
         """Размер файла (bytes) без скачивания, или None."""
         blob = self._bucket.blob(blob_name)
         try:
-            await asyncio.to_thread(blob.reload)
+            await self._call(blob.reload)
             return blob.size
         except Exception:
             return None
 
 
+def parse_gcs_uri(uri: str) -> Optional[Tuple[str, str]]:
+    """(бакет, имя файла) для gs://-ссылки, иначе None."""
+    if not uri.startswith("gs://"):
+        return None
+    bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+    return (bucket_name, blob_name) if bucket_name and blob_name else None
+
+
 # ── Инстансы для бакетов ──────────────────────────────────────────
 
 images_storage = GCSClient(BUCKET_NAME)
@@ -0,0 +1,166 @@
+"""
+CPU-тяжёлая обработка изображений: HEIC→JPEG, сжатие до лимита по размеру.
+
+Модуль не тянет GCS/Redis/настройки, поэтому его функции безопасно
+выполнять в процессах CpuPoolService.
+"""
+
+import io
+import os
+import time
+import logging
+from typing import Tuple
+
+from PIL import Image, ImageOps
+from pillow_heif import register_heif_opener
+
+logger = logging.getLogger(__name__)
+
+register_heif_opener()
+
+QUALITY_STEPS = (85, 80, 75, 70, 65, 60, 55, 50, 45, 40, 35)
+SCALE_STEPS = (0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.35, 0.3)
+MIN_SIDE_LIMIT = 320
+# Лимит размера загружаемого фото: больше — сжимается (compress_image)
+MAX_UPLOAD_IMAGE_BYTES = 6_000_000
+
+
+class ImageDecodeError(ValueError):
+    """Изображение не удалось декодировать."""
+
+
+class ImageTooLargeError(ValueError):
+    """Изображение не удалось сжать до требуемого размера."""
+
+
+def _open_rgb(content: bytes) -> Image.Image:
+    """Декодирует изображение с учётом EXIF-поворота и приводит к RGB (alpha → белый фон)."""
+    img = Image.open(io.BytesIO(content))
+    img = ImageOps.exif_transpose(img)
+    img.load()
+
+    if img.mode in ("RGBA", "LA") or "transparency" in getattr(img, "info", {}):
+        rgba = img.convert("RGBA")
+        bg = Image.new("RGB", rgba.size, (255, 255, 255))
+        bg.paste(rgba, mask=rgba.split()[-1])
+        return bg
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _fit_jpeg(img: Image.Image, max_bytes: int, resize_qualities) -> Tuple[bytes, str] | None:
+    """Подбирает quality, затем масштаб + quality. Возвращает (bytes, описание) или None."""
+    for q in QUALITY_STEPS:
+        candidate = _encode_jpeg(img, q)
+        if len(candidate) <= max_bytes:
+            return candidate, f"q={q}"
+
+    w, h = img.size
+    for scale in SCALE_STEPS:
+        new_w, new_h = max(int(w * scale), MIN_SIDE_LIMIT), max(int(h * scale), MIN_SIDE_LIMIT)
+        if new_w == w and new_h == h:
+            continue
+        resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        for q in resize_qualities:
+            candidate = _encode_jpeg(resized, q)
+            if len(candidate) <= max_bytes:
+                return candidate, f"scale={scale:.2f}, q={q}"
+    return None
+
+
+def convert_heic_to_jpeg(content: bytes, filename: str) -> Tuple[bytes, str]:
+    """Конвертирует HEIC/HEIF байты в JPEG. Возвращает (jpeg_bytes, '.jpg')."""
+    t0 = time.perf_counter()
+    img = _open_rgb(content)
+    t_decode = time.perf_counter()
+
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85, optimize=True)
+    result = buf.getvalue()
+    t_encode = time.perf_counter()
+
+    logger.info(
+        "HEIC→JPEG: %s (%s -> %s bytes, decode=%.0fms, encode=%.0fms, total=%.0fms)",
+        filename,
+        len(content),
+        len(result),
+        (t_decode - t0) * 1000,
+        (t_encode - t_decode) * 1000,
+        (t_encode - t0) * 1000,
+    )
+    return result, ".jpg"
+
+
+def compress_image(
+    content: bytes,
+    filename: str,
+    file_extension: str,
+    max_bytes: int = MAX_UPLOAD_IMAGE_BYTES,
+) -> Tuple[bytes, str]:
+    """Сжимает изображение если > max_bytes. Возвращает (bytes, extension)."""
+    if len(content) <= max_bytes:
+        return content, file_extension
+
+    fitted = _fit_jpeg(_open_rgb(content), max_bytes, (80, 70, 60, 50, 40, 35))
+    if fitted is None:
+        logger.warning("Could not compress %s below %s bytes", filename, max_bytes)
+        return content, file_extension
+
+    candidate, how = fitted
+    logger.info("Compressed %s: %s -> %s bytes (%s)", filename, len(content), len(candidate), how)
+    return candidate, ".jpg"
+
+
+def shrink_image_to_limit(
+    image_bytes: bytes,
+    filename: str,
+    mime_type: str,
+    max_image_bytes: int = 6_000_000,
+) -> Tuple[bytes, str, str]:
+    """
+    Гарантирует, что изображение не превышает лимит по размеру (для Focus API).
+
+    Returns:
+        (bytes, filename, mime_type) — возможно изменённые байты/имя/тип (обычно image/jpeg)
+
+    Raises:
+        ImageDecodeError: изображение не декодируется
+        ImageTooLargeError: не удалось сжать до max_image_bytes
+    """
+    if len(image_bytes) <= max_image_bytes:
+        return image_bytes, filename, mime_type
+
+    t0 = time.perf_counter()
+    try:
+        img = _open_rgb(image_bytes)
+    except Exception as e:
+        raise ImageDecodeError(
+            f"Не удалось декодировать изображение для сжатия (>{max_image_bytes} bytes): {str(e)}"
+        )
+
+    fitted = _fit_jpeg(img, max_image_bytes, (80, 75, 70, 65, 60, 55, 50, 45, 40, 35))
+    if fitted is None:
+        raise ImageTooLargeError(
+            f"Изображение слишком большое для Focus API: {len(image_bytes)} bytes. "
+            f"Не удалось сжать до <= {max_image_bytes} bytes."
+        )
+
+    candidate, how = fitted
+    new_filename = os.path.splitext(filename)[0] + ".jpg"
+    logger.info(
+        "Сжали изображение: %s -> %s bytes (%s, %s -> %s, %.0fms)",
+        len(image_bytes),
+        len(candidate),
+        how,
+        filename,
+        new_filename,
+        (time.perf_counter() - t0) * 1000,
+    )
+    return candidate, new_filename, "image/jpeg"
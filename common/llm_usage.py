@@ -0,0 +1,69 @@
+"""
+Учёт токенов LLM-вызовов, в том числе попаданий в кеш префикса провайдера.
+
+OpenAI и Gemini кешируют совпадающее начало промпта автоматически; сколько
+токенов пришло из кеша, видно только в usage ответа. Счётчики
+llm.prompt_tokens_total / llm.cached_tokens_total (provider, model, purpose)
+позволяют проверить, что постоянная часть промптов действительно кешируется.
+Сбои разбора структурированного ответа и их цена — llm.parse_failures_total
+и llm.parse_failure_tokens_total.
+"""
+
+from typing import Any, Optional, Tuple
+
+from common.metrics import metrics
+
+
+def _as_int(value: Any) -> int:
+    return value if isinstance(value, int) else 0
+
+
+def openai_usage(response: Any) -> Tuple[int, int, int]:
+    """(prompt, cached, completion) токены из ответа OpenAI Chat Completions."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    return (
+        _as_int(getattr(usage, "prompt_tokens", 0)),
+        _as_int(cached),
+        _as_int(getattr(usage, "completion_tokens", 0)),
+    )
+
+
+def gemini_usage(response: Any) -> Tuple[int, int, int]:
+    """(prompt, cached, completion) токены из ответа Gemini generate_content."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0, 0
+    return (
+        _as_int(getattr(usage, "prompt_token_count", 0)),
+        _as_int(getattr(usage, "cached_content_token_count", 0)),
+        _as_int(getattr(usage, "candidates_token_count", 0)),
+    )
+
+
+def record_usage(
+    provider: str, model: Optional[str], purpose: str, usage: Tuple[int, int, int],
+) -> None:
+    prompt_tokens, cached_tokens, completion_tokens = usage
+    labels = {"provider": provider, "model": model or "unknown", "purpose": purpose}
+    metrics.inc("llm.requests_total", **labels)
+    metrics.inc("llm.prompt_tokens_total", prompt_tokens, **labels)
+    metrics.inc("llm.cached_tokens_total", cached_tokens, **labels)
+    metrics.inc("llm.completion_tokens_total", completion_tokens, **labels)
+
+
+def record_parse_failure(
+    provider: str, model: Optional[str], purpose: str, reason: str,
+    usage: Tuple[int, int, int], retried: bool,
+) -> None:
+    """
+    Ответ не прошёл разбор по схеме. llm.parse_failure_tokens_total —
+    токены, потраченные впустую (цена повтора вызова).
+    """
+    prompt_tokens, _, completion_tokens = usage
+    labels = {"provider": provider, "model": model or "unknown", "purpose": purpose}
+    metrics.inc("llm.parse_failures_total", reason=reason, retried=str(retried).lower(), **labels)
+    metrics.inc("llm.parse_failure_tokens_total", prompt_tokens + completion_tokens, **labels)
@@ -0,0 +1,88 @@
+"""
+Локальный классификатор типа конструкции (ONNX, CPU).
+
+Модель — файл .onnx с сопроводительным JSON рядом (<модель>.json):
+    {"labels": [...], "image_size": 224, "mean": [...], "std": [...]}
+labels — типы конструкций в порядке выходов модели. Вход модели —
+float32 NCHW, изображение приводится к квадрату image_size с
+нормализацией mean/std; выход — логиты по labels. Файл и сопроводительный
+JSON готовит scripts/train_construction_classifier.py.
+
+Модуль не тянет GCS/Redis/настройки, поэтому classify безопасно
+выполнять в процессах CpuPoolService. Сессия ONNX Runtime загружается
+один раз на процесс и путь модели.
+"""
+
+import io
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+from PIL import Image, ImageOps
+
+try:
+    import numpy as np
+    import onnxruntime
+except ImportError:
+    np = None
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_SIZE = 224
+DEFAULT_MEAN = (0.485, 0.456, 0.406)
+DEFAULT_STD = (0.229, 0.224, 0.225)
+
+
+def metadata_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def runtime_available() -> bool:
+    return onnxruntime is not None
+
+
+class _Model:
+
+    def __init__(self, model_path: str):
+        with open(metadata_path(model_path), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.labels: List[str] = meta["labels"]
+        self.image_size = int(meta.get("image_size", DEFAULT_IMAGE_SIZE))
+        self.mean = np.asarray(meta.get("mean", DEFAULT_MEAN), dtype=np.float32).reshape(3, 1, 1)
+        self.std = np.asarray(meta.get("std", DEFAULT_STD), dtype=np.float32).reshape(3, 1, 1)
+
+        options = onnxruntime.SessionOptions()
+        # Пул процессов уже параллелит вызовы — внутри одного вызова один поток
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def preprocess(self, content: bytes) -> "np.ndarray":
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(content))).convert("RGB")
+        img = img.resize((self.image_size, self.image_size), Image.BILINEAR)
+        pixels = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        return ((pixels - self.mean) / self.std)[np.newaxis]
+
+    def predict(self, content: bytes) -> Tuple[str, float]:
+        logits = self.session.run(None, {self.input_name: self.preprocess(content)})[0][0]
+        exp = np.exp(logits - logits.max())
+        probs = exp / exp.sum()
+        best = int(probs.argmax())
+        return self.labels[best], float(probs[best])
+
+
+@lru_cache(maxsize=2)
+def _load(model_path: str) -> _Model:
+    logger.info(f"Загрузка локального классификатора {model_path}")
+    return _Model(model_path)
+
+
+def classify(model_path: str, content: bytes) -> Tuple[str, float]:
+    """Тип конструкции и вероятность по байтам изображения"""
+    if not runtime_available():
+        raise RuntimeError("onnxruntime не установлен")
+    return _load(model_path).predict(content)
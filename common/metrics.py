@@ -0,0 +1,120 @@
+"""
+Простые in-process метрики: счётчики и распределения длительностей.
+
+Метрика идентифицируется именем и набором меток (pool="image", model=...).
+Снимок отдаётся эндпоинтом /metrics в JSON; для распределений хранится
+скользящее окно последних значений, по нему считаются p50/p95.
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+TIMING_WINDOW = 1024
+
+LabelsKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, object]) -> LabelsKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max", "window")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window: deque = deque(maxlen=TIMING_WINDOW)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.window.append(value)
+
+    def percentile(self, q: float) -> float:
+        return _percentile(sorted(self.window), q)
+
+    def snapshot(self) -> dict:
+        values = sorted(self.window)
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(_percentile(values, 0.5), 6),
+            "p95": round(_percentile(values, 0.95), 6),
+        }
+
+
+class MetricsRegistry:
+    """Потокобезопасный реестр метрик процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelsKey, float]] = {}
+        self._timings: Dict[str, Dict[LabelsKey, _Timing]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._timings.setdefault(name, {})
+            timing = series.get(key)
+            if timing is None:
+                timing = series[key] = _Timing()
+            timing.observe(value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels_key(labels), 0)
+
+    def get_percentile(self, name: str, q: float, **labels) -> Optional[float]:
+        """Перцентиль по окну, или None если наблюдений ещё нет."""
+        with self._lock:
+            timing = self._timings.get(name, {}).get(_labels_key(labels))
+            if timing is None or not timing.window:
+                return None
+            return timing.percentile(q)
+
+    def get_count(self, name: str, **labels) -> int:
+        with self._lock:
+            timing = self._timings.get(name, {}).get(_labels_key(labels))
+            return timing.count if timing else 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self._counters.items()
+                },
+                "timings": {
+                    name: [{"labels": dict(key), **timing.snapshot()} for key, timing in series.items()]
+                    for name, series in self._timings.items()
+                },
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+# Глобальный реестр
+metrics = MetricsRegistry()
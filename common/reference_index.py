@@ -0,0 +1,334 @@
+"""
+Поисковый индекс по нормативным документам (reference_docs/*.txt).
+
+Документ режется на пункты по нумерации (5, 5.2, 5.2.1 …), пункты
+нормализуются (нижний регистр, ё→е, стоп-слова, отсечение русских
+окончаний) и индексируются для BM25. Индекс сохраняется на диск и
+пересобирается только при изменении исходных файлов.
+
+При проверке отчёта в контекст идут только пункты тех ГОСТ/СП/СНиП,
+на которые отчёт ссылается: сначала пункты, указанные явно («п. 5.2
+ГОСТ 31937»), затем наиболее похожие на текст вокруг ссылок.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Меняется вместе с форматом файла/нормализацией — индекс пересобирается
+INDEX_VERSION = "1"
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+CHUNK_MAX_CHARS = 2000
+CITATION_CONTEXT_CHARS = 400
+
+# ── Обозначения стандартов ────────────────────────────────────────
+
+_STANDARD_RE = re.compile(
+    r"(?<![А-Яа-яA-Za-z])(ГОСТ(?:[\s_]+Р(?:[\s_]+ИСО)?)?|СП|СНиП|GOST(?:[\s_]+R)?|SP|SNIP)"
+    r"[\s_]*(?:№\s*)?(\d+(?:[.\-]\d+)*)",
+    re.IGNORECASE,
+)
+_YEAR_SUFFIX_RE = re.compile(r"(?:[-.]\d{4}|-\d{2})$")
+_CLAUSE_BEFORE_RE = re.compile(
+    r"(?:п\.|пп\.|пункт[а-я]*|раздел[а-я]*)\s*(\d+(?:\.\d+)*)(?:(?!ГОСТ|СП|СНиП)[^\n]){0,40}$",
+    re.IGNORECASE,
+)
+_LATIN_KIND = {"GOST": "ГОСТ", "GOST R": "ГОСТ Р", "SP": "СП", "SNIP": "СНиП"}
+
+
+def standard_key(kind: str, number: str) -> str:
+    """
+    Ключ стандарта без года редакции: «ГОСТ 31937-2011» и «ГОСТ 31937-2024»
+    дают один ключ «гост 31937».
+    """
+    kind = re.sub(r"[\s_]+", " ", kind.strip()).upper()
+    kind = _LATIN_KIND.get(kind, kind).lower()
+    number = _YEAR_SUFFIX_RE.sub("", number) or number
+    return f"{kind} {number}"
+
+
+def find_citations(text: str) -> List[Tuple[str, int, int, Optional[str]]]:
+    """Ссылки на стандарты: [(ключ, начало, конец, номер пункта или None)]."""
+    citations = []
+    for match in _STANDARD_RE.finditer(text):
+        clause_match = _CLAUSE_BEFORE_RE.search(text, max(0, match.start() - 60), match.start())
+        clause = clause_match.group(1) if clause_match else None
+        citations.append((standard_key(match.group(1), match.group(2)), match.start(), match.end(), clause))
+    return citations
+
+
+def document_key(stem: str, content: str) -> Optional[Tuple[str, str]]:
+    """
+    (ключ, обозначение) документа по имени файла, иначе по первым строкам.
+    Короткое имя файла («SP_20») уточняется обозначением из текста («СП 20.13330»).
+    """
+    found = []
+    for source in (stem, content[:500]):
+        for match in _STANDARD_RE.finditer(source):
+            designation = re.sub(r"[\s_]+", " ", match.group(0)).strip()
+            found.append((standard_key(match.group(1), match.group(2)), designation))
+    if not found:
+        return None
+    if _STANDARD_RE.search(stem):
+        key = found[0][0]
+        for candidate in found[1:]:
+            if candidate[0].startswith(key + ".") or candidate[0].startswith(key + "-"):
+                return candidate
+    return found[0]
+
+
+# ── Нормализация ──────────────────────────────────────────────────
+
+_TOKEN_RE = re.compile(r"[а-яa-z0-9]+")
+
+_STOPWORDS = frozenset(
+    "а без более бы был была были было быть в вне во все всех где да для до "
+    "его ее если есть же за и из или им их к как ко когда который которые "
+    "ли либо между может на над не нее нет ни но о об от по под при с со "
+    "так также то того только у чем что это этого эти"
+    .split()
+)
+
+# Окончания по убыванию длины; отсекается самое длинное, если основа ≥ 3 букв
+_SUFFIXES = sorted(
+    (
+        "иями ями ами ыми ими ого его ому ему ая яя ое ее ые ие ый ий ой ей ую юю "
+        "ах ях ов ев ом ем ам ям ых их ию ия ие ью ья ье ей "
+        "ость ости остей ение ения ению ением ений ениях ениям ениями "
+        "ание ания анию анием аний "
+        "ировать ированный ированной ированного ировании "
+        "ать ять ить еть уть ешь ет ут ют ит ат ят ла ло ли ны но на "
+        "а я о е ы и у ю ь"
+        .split()
+    ),
+    key=len,
+    reverse=True,
+)
+
+
+def _stem(word: str) -> str:
+    if word.isdigit() or len(word) <= 3:
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def normalize(text: str) -> List[str]:
+    """Токены для индекса: нижний регистр, ё→е, без стоп-слов, с отсечением окончаний."""
+    text = text.lower().replace("ё", "е")
+    return [_stem(token) for token in _TOKEN_RE.findall(text) if token not in _STOPWORDS]
+
+
+# ── Нарезка на пункты ─────────────────────────────────────────────
+
+_CLAUSE_HEADING_RE = re.compile(r"^\s*(\d{1,2}(?:\.\d{1,3}){0,4})\.?\s+\S", re.MULTILINE)
+
+
+def split_clauses(content: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Режет текст стандарта на пункты [(номер, текст)]. Длинный пункт делится
+    по строкам на куски до CHUNK_MAX_CHARS с тем же номером.
+    """
+    starts = [(m.start(), m.group(1)) for m in _CLAUSE_HEADING_RE.finditer(content)]
+    if not starts or starts[0][0] > 0:
+        starts.insert(0, (0, None))
+
+    clauses: List[Tuple[Optional[str], str]] = []
+    for i, (start, number) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(content)
+        body = content[start:end].strip()
+        if not body:
+            continue
+        current = ""
+        for line in body.split("\n"):
+            if current and len(current) + len(line) + 1 > CHUNK_MAX_CHARS:
+                clauses.append((number, current))
+                current = ""
+            current = f"{current}\n{line}" if current else line[:CHUNK_MAX_CHARS]
+        if current.strip():
+            clauses.append((number, current))
+    return clauses
+
+
+# ── Индекс ────────────────────────────────────────────────────────
+
+@dataclass
+class ReferenceChunk:
+    doc: int
+    clause: Optional[str]
+    text: str
+    length: int
+
+
+class ReferenceIndex:
+    """BM25-индекс пунктов нормативных документов."""
+
+    def __init__(self, fingerprint: str, documents: List[dict], chunks: List[ReferenceChunk],
+                 postings: Dict[str, List[Tuple[int, int]]]):
+        self.fingerprint = fingerprint
+        self.documents = documents  # [{"key", "designation", "name"}]
+        self.chunks = chunks
+        self.postings = postings
+        self.avg_length = (sum(c.length for c in chunks) / len(chunks)) if chunks else 0.0
+        self._by_key: Dict[str, List[int]] = defaultdict(list)
+        for doc_id, doc in enumerate(documents):
+            if doc["key"]:
+                self._by_key[doc["key"]].append(doc_id)
+
+    # ── Сборка и хранение ─────────────────────────────────────────
+
+    @staticmethod
+    def fingerprint_of(source_dir: Path) -> str:
+        """Отпечаток набора исходных файлов: имена, размеры, mtime."""
+        digest = hashlib.sha256(INDEX_VERSION.encode())
+        for path in sorted(source_dir.glob("*.txt")):
+            stat = path.stat()
+            digest.update(f"{path.name}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, source_dir: Path) -> "ReferenceIndex":
+        documents: List[dict] = []
+        chunks: List[ReferenceChunk] = []
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+
+        for path in sorted(source_dir.glob("*.txt")):
+            content = path.read_text(encoding="utf-8").strip()
+            if not content:
+                continue
+            key, designation = document_key(path.stem, content) or (None, path.stem)
+            doc_id = len(documents)
+            documents.append({"key": key, "designation": designation, "name": path.stem})
+            for clause, text in split_clauses(content):
+                terms = normalize(text)
+                chunk_id = len(chunks)
+                chunks.append(ReferenceChunk(doc_id, clause, text, len(terms)))
+                for term, tf in Counter(terms).items():
+                    postings[term].append((chunk_id, tf))
+
+        return cls(cls.fingerprint_of(source_dir), documents, chunks, dict(postings))
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "version": INDEX_VERSION,
+            "fingerprint": self.fingerprint,
+            "documents": self.documents,
+            "chunks": [[c.doc, c.clause, c.text, c.length] for c in self.chunks],
+            "postings": self.postings,
+        }
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ReferenceIndex"]:
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        if payload.get("version") != INDEX_VERSION:
+            return None
+        chunks = [ReferenceChunk(*row) for row in payload["chunks"]]
+        postings = {term: [tuple(p) for p in items] for term, items in payload["postings"].items()}
+        return cls(payload["fingerprint"], payload["documents"], chunks, postings)
+
+    @classmethod
+    def load_or_build(cls, source_dir: Path, index_path: Path) -> "ReferenceIndex":
+        """Индекс с диска, если исходники не менялись; иначе собирается и сохраняется."""
+        fingerprint = cls.fingerprint_of(source_dir)
+        index = cls.load(index_path)
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+        index = cls.build(source_dir)
+        try:
+            index.save(index_path)
+        except OSError:
+            pass  # индекс просто не переживёт рестарт
+        return index
+
+    # ── Поиск ─────────────────────────────────────────────────────
+
+    def score(self, query_terms: Iterable[str], doc_ids: Sequence[int]) -> Dict[int, float]:
+        """BM25 пунктов указанных документов по запросу."""
+        allowed = set(doc_ids)
+        total = len(self.chunks)
+        scores: Dict[int, float] = defaultdict(float)
+        for term, qtf in Counter(query_terms).items():
+            items = self.postings.get(term)
+            if not items:
+                continue
+            idf = math.log(1 + (total - len(items) + 0.5) / (len(items) + 0.5))
+            for chunk_id, tf in items:
+                chunk = self.chunks[chunk_id]
+                if chunk.doc not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * chunk.length / (self.avg_length or 1))
+                scores[chunk_id] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def select(self, report_text: str, max_chars: int) -> str:
+        """
+        Пункты стандартов, на которые ссылается отчёт, в пределах max_chars.
+
+        Явно указанные пункты идут первыми, остальные — по убыванию BM25
+        относительно текста вокруг ссылок. В ответе пункты сгруппированы по
+        документам и идут в порядке документа.
+        """
+        citations = find_citations(report_text)
+        doc_ids = sorted({d for key, *_ in citations for d in self._by_key.get(key, ())})
+        if not doc_ids:
+            return ""
+
+        cited_clauses = {
+            (doc_id, clause)
+            for key, _, _, clause in citations if clause
+            for doc_id in self._by_key.get(key, ())
+        }
+        query: List[str] = []
+        for _, start, end, _ in citations:
+            lo = max(0, start - CITATION_CONTEXT_CHARS)
+            query.extend(normalize(report_text[lo:end + CITATION_CONTEXT_CHARS]))
+        scores = self.score(query, doc_ids)
+
+        def _pinned(chunk: ReferenceChunk) -> bool:
+            return chunk.clause is not None and any(
+                doc == chunk.doc and (chunk.clause == clause or chunk.clause.startswith(clause + "."))
+                for doc, clause in cited_clauses
+            )
+
+        allowed = set(doc_ids)
+        candidates = [
+            chunk_id for chunk_id, chunk in enumerate(self.chunks)
+            if chunk.doc in allowed and (chunk_id in scores or _pinned(chunk))
+        ]
+        candidates.sort(key=lambda cid: (not _pinned(self.chunks[cid]), -scores.get(cid, 0.0), cid))
+
+        selected: List[int] = []
+        used = 0
+        for chunk_id in candidates:
+            size = len(self.chunks[chunk_id].text) + 2
+            if used + size > max_chars:
+                continue
+            selected.append(chunk_id)
+            used += size
+
+        parts: List[str] = []
+        by_doc: Dict[int, List[int]] = defaultdict(list)
+        for chunk_id in sorted(selected):
+            by_doc[self.chunks[chunk_id].doc].append(chunk_id)
+        for doc_id, chunk_ids in by_doc.items():
+            body = "\n\n".join(self.chunks[cid].text for cid in chunk_ids)
+            parts.append(f"=== {self.documents[doc_id]['name']} ===\n{body}")
+        return "\n\n".join(parts)
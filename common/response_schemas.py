@@ -0,0 +1,139 @@
+"""
+JSON-схемы структурированных ответов моделей.
+
+Схема передаётся провайдеру в config["response_schema"] как
+{"name": ..., "schema": ...}: OpenAI получает её в response_format
+(json_schema, strict), Gemini — в response_json_schema. Код дефекта —
+enum допустимых кодов каталога для выбранного типа конструкции или
+шорт-листа, поэтому модель не может вернуть неизвестный код или текст
+вокруг JSON. Ответ, который всё же не прошёл проверку validate(),
+считается сбоем разбора (llm.parse_failures_total) и запрашивается заново.
+
+В strict-режиме OpenAI все поля обязательны, поэтому необязательное
+обоснование описано как строка или null.
+"""
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from common.defects_db import CONSTRUCTION_TYPE_CHOICES
+
+_JSON_TYPES = {
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "array": list,
+    "null": type(None),
+}
+
+
+def _object(properties: Dict[str, dict]) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+@lru_cache(maxsize=256)
+def defect_code_schema(codes: Tuple[str, ...]) -> dict:
+    """Схема ответа кодирования дефекта: код из переданного списка, уверенность и необязательное обоснование."""
+    return {
+        "name": "defect_code",
+        "schema": _object({
+            "code": {"type": "string", "enum": list(codes)},
+            "confidence": {"type": "number"},
+            "reasoning": {"type": ["string", "null"]},
+        }),
+    }
+
+
+@lru_cache(maxsize=64)
+def defect_batch_schema(codes: Tuple[str, ...]) -> dict:
+    """Схема пакетного кодирования: по элементу с номером изображения на каждое фото."""
+    return {
+        "name": "defect_batch",
+        "schema": _object({
+            "results": {
+                "type": "array",
+                "items": _object({
+                    "image": {"type": "integer"},
+                    "code": {"type": "string", "enum": list(codes)},
+                    "confidence": {"type": "number"},
+                }),
+            },
+        }),
+    }
+
+
+@lru_cache(maxsize=4)
+def fused_analysis_schema(codes: Tuple[str, ...]) -> dict:
+    """Схема совмещённого ответа: тип конструкции и код дефекта с уверенностями."""
+    return {
+        "name": "fused_analysis",
+        "schema": _object({
+            "construction_type": {"type": "string", "enum": list(CONSTRUCTION_TYPE_CHOICES)},
+            "confidence": {"type": "number"},
+            "code": {"type": "string", "enum": list(codes)},
+            "code_confidence": {"type": "number"},
+            "reasoning": {"type": ["string", "null"]},
+        }),
+    }
+
+
+CONSTRUCTION_TYPE_SCHEMA = {
+    "name": "construction_type",
+    "schema": _object({
+        "construction_type": {"type": "string", "enum": list(CONSTRUCTION_TYPE_CHOICES)},
+        "confidence": {"type": "number"},
+    }),
+}
+
+DEFECT_DESCRIPTION_SCHEMA = {
+    "name": "defect_description",
+    "schema": _object({
+        "description": {"type": "string"},
+    }),
+}
+
+
+def parse_response(content: Optional[str], response_schema: Optional[dict]) -> Tuple[dict, Optional[str]]:
+    """
+    Разбор ответа модели: (результат, причина сбоя или None).
+
+    Причины: empty — пустой ответ, invalid_json — не JSON-объект,
+    schema — не хватает поля, лишний тип или значение вне enum.
+    """
+    if not content:
+        return {}, "empty"
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError:
+        return {}, "invalid_json"
+    if not isinstance(result, dict):
+        return {}, "invalid_json"
+    if response_schema is not None and not _matches(result, response_schema["schema"]):
+        return result, "schema"
+    return result, None
+
+
+def _matches(result: Dict[str, Any], schema: dict) -> bool:
+    properties = schema.get("properties", {})
+    for key in schema.get("required", []):
+        if key not in result:
+            return False
+    for key, value in result.items():
+        spec = properties.get(key)
+        if spec is None:
+            continue
+        types = spec.get("type")
+        types = types if isinstance(types, list) else [types]
+        expected = tuple(_JSON_TYPES[t] for t in types if t in _JSON_TYPES)
+        if expected and (not isinstance(value, expected) or isinstance(value, bool)):
+            return False
+        if "enum" in spec and value not in spec["enum"]:
+            return False
+    return True
+
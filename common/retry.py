@@ -0,0 +1,240 @@
+"""
+Повторы исходящих вызовов с бюджетом на зависимость.
+
+Ошибка вызова классифицируется (classify_error):
+
+    rate_limit — 429 / RESOURCE_EXHAUSTED: повтор не раньше Retry-After;
+    transient  — таймауты, обрывы соединения, 408 и 5xx: повтор с задержкой;
+    permanent  — остальное (404, ошибки запроса, валидация): без повтора.
+
+Задержка — decorrelated jitter: случайная в [base_delay, 3 × предыдущая],
+не больше max_delay; при Retry-After — не меньше него, а если сервер
+просит ждать дольше max_delay, вызов не повторяется. Повторы зависимости
+ограничены бюджетом (RetryBudget): при массовом отказе сервиса они не
+умножают нагрузку на него, а быстро отдают ошибку вызывающему коду.
+
+Метрики: retry.attempts_total (dependency, outcome: ok или класс ошибки),
+retry.give_ups_total (dependency, reason: exhausted | budget | retry_after),
+retry.delay_seconds (dependency).
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from common.metrics import metrics
+from settings import (
+    RETRY_BASE_DELAY_SECONDS,
+    RETRY_BUDGET_MIN_PER_SECOND,
+    RETRY_BUDGET_RATIO,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_MAX_DELAY_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_TRANSIENT = "transient"
+ERROR_PERMANENT = "permanent"
+
+_TRANSIENT_STATUSES = {408, 500, 502, 503, 504}
+_PERMANENT_TYPES = (FileNotFoundError, PermissionError, IsADirectoryError, ValueError)
+_TRANSIENT_TYPES = (TimeoutError, asyncio.TimeoutError, ConnectionError, httpx.TransportError, OSError)
+
+# Запас бюджета — столько секунд пополнения min_per_second
+_BUDGET_BURST_SECONDS = 10.0
+
+
+class RetryableError(Exception):
+    """Ошибка с явным классом — для ответов, которые не выражены HTTP-статусом"""
+
+    def __init__(self, message: str, error_class: str = ERROR_TRANSIENT, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.error_class = error_class
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _status_of(error: Exception) -> Optional[int]:
+    """HTTP-статус ошибки SDK: status_code (openai, httpx), code (google)"""
+    for value in (
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+        getattr(error, "code", None),
+    ):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """Retry-After из ошибки или заголовков её ответа"""
+    if isinstance(error, RetryableError):
+        return error.retry_after
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return parse_retry_after(headers.get("retry-after")) if headers is not None else None
+    except Exception:
+        return None
+
+
+def classify_error(error: Exception) -> str:
+    """Класс ошибки: rate_limit, transient или permanent"""
+    if isinstance(error, RetryableError):
+        return error.error_class
+    status = _status_of(error)
+    if status is not None:
+        if status == 429:
+            return ERROR_RATE_LIMIT
+        return ERROR_TRANSIENT if status in _TRANSIENT_STATUSES else ERROR_PERMANENT
+    if isinstance(error, _PERMANENT_TYPES):
+        return ERROR_PERMANENT
+    if isinstance(error, _TRANSIENT_TYPES):
+        return ERROR_TRANSIENT
+    # Ошибки соединения SDK без статуса (APIConnectionError, APITimeoutError и т.п.)
+    name = type(error).__name__
+    if "Timeout" in name or "Connection" in name:
+        return ERROR_TRANSIENT
+    return ERROR_PERMANENT
+
+
+class RetryBudget:
+    """
+    Бюджет повторов одной зависимости.
+
+    Каждый вызов добавляет ratio повтора, каждый повтор тратит один;
+    дополнительно бюджет пополняется на min_per_second в секунду, чтобы
+    редкие вызовы тоже могли повторяться. Запас ограничен, поэтому
+    накопленное в спокойное время не выпускает лавину повторов при отказе.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(min_per_second * _BUDGET_BURST_SECONDS, 1.0)
+        self.balance = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self.balance = min(self.capacity, self.balance + amount)
+
+    def record_request(self) -> None:
+        self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Списать один повтор; False — бюджет исчерпан"""
+        self._refill()
+        if self.balance < 1.0:
+            return False
+        self.balance -= 1.0
+        return True
+
+
+_budgets: Dict[str, RetryBudget] = {}
+
+
+def get_retry_budget(dependency: str) -> RetryBudget:
+    """Общий бюджет повторов зависимости"""
+    if dependency not in _budgets:
+        _budgets[dependency] = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND)
+    return _budgets[dependency]
+
+
+class RetryPolicy:
+    """Повторы вызовов одной зависимости"""
+
+    def __init__(
+        self,
+        dependency: str,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay: float = RETRY_BASE_DELAY_SECONDS,
+        max_delay: float = RETRY_MAX_DELAY_SECONDS,
+        classify: Callable[[Exception], str] = classify_error,
+    ):
+        """
+        Args:
+            dependency: Имя зависимости (метка метрик и ключ бюджета)
+            max_attempts: Попыток всего, включая первую
+            base_delay: Минимальная задержка повтора
+            max_delay: Максимальная задержка повтора
+            classify: Классификатор ошибок (по умолчанию classify_error)
+        """
+        self.dependency = dependency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+        self.budget = get_retry_budget(dependency)
+
+    def _next_delay(self, previous: float) -> float:
+        """Decorrelated jitter"""
+        return min(self.max_delay, random.uniform(self.base_delay, max(previous, self.base_delay) * 3))
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Вызвать func с повторами; после отказа от повторов пробрасывается последняя ошибка"""
+        self.budget.record_request()
+        jitter = self.base_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                error_class = self.classify(e)
+                metrics.inc("retry.attempts_total", dependency=self.dependency, outcome=error_class)
+                if error_class == ERROR_PERMANENT:
+                    raise
+
+                retry_after = retry_after_of(e) if error_class == ERROR_RATE_LIMIT else None
+                if attempt == self.max_attempts:
+                    reason = "exhausted"
+                elif retry_after is not None and retry_after > self.max_delay:
+                    reason = "retry_after"
+                elif not self.budget.try_spend():
+                    reason = "budget"
+                else:
+                    reason = None
+                if reason:
+                    metrics.inc("retry.give_ups_total", dependency=self.dependency, reason=reason)
+                    logger.warning(
+                        f"{self.dependency}: без повтора ({reason}, {error_class}, "
+                        f"попытка {attempt}/{self.max_attempts}): {e}"
+                    )
+                    raise
+
+                jitter = self._next_delay(jitter)
+                delay = max(jitter, retry_after or 0.0)
+                metrics.observe("retry.delay_seconds", delay, dependency=self.dependency)
+                logger.info(
+                    f"{self.dependency}: {error_class}, повтор через {delay:.1f} с "
+                    f"(попытка {attempt}/{self.max_attempts}): {e}"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            metrics.inc("retry.attempts_total", dependency=self.dependency, outcome="ok")
+            return result
@@ -0,0 +1,123 @@
+"""
+Сравнение редакций отчёта и перенос замечаний для инкрементальной проверки.
+
+Текст сравнивается постранично (по маркерам [Страница N]): страницы с тем
+же содержимым сопоставляются через difflib, даже если после вставки или
+удаления страниц их номера сдвинулись. Замечания проходов привязываются к
+страницам по строке «Где: …» — замечание по неизменённым страницам можно
+перенести в новую редакцию, заменив номера страниц.
+"""
+
+import difflib
+import hashlib
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+_MARKER_LINE_RE = re.compile(r"^\[Страница \d+\]\s*", re.MULTILINE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Начало замечания: строка с эмодзи категории
+_REMARK_START_RE = re.compile(r"^\s*(?:\[)?(?:🔴|🟠|🟡|🔵|🟢|⚪)", re.MULTILINE)
+_WHERE_RE = re.compile(r"^\s*Где:.*$", re.MULTILINE)
+_PAGE_REF_RE = re.compile(
+    r"(?P<prefix>\[Страница\s*|стр(?:аниц[аеыу]?)?\.?\s*)"
+    r"(?P<first>\d+)(?:(?P<sep>\s*[-–]\s*)(?P<last>\d+))?",
+    re.IGNORECASE,
+)
+
+
+def page_fingerprint(page_text: str) -> str:
+    """Хеш содержимого страницы без маркера и различий в пробелах."""
+    body = _MARKER_LINE_RE.sub("", page_text)
+    body = _WHITESPACE_RE.sub(" ", body).strip()
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+
+def diff_pages(
+    old_pages: List[Tuple[int, str]], new_pages: List[Tuple[int, str]],
+) -> Tuple[Dict[int, int], List[int]]:
+    """
+    Returns:
+        (номер старой страницы → номер новой для неизменённых страниц,
+         номера изменённых/новых страниц новой редакции по порядку)
+    """
+    old_hashes = [page_fingerprint(text) for _, text in old_pages]
+    new_hashes = [page_fingerprint(text) for _, text in new_pages]
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+
+    mapping: Dict[int, int] = {}
+    changed: List[int] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                mapping[old_pages[i1 + offset][0]] = new_pages[j1 + offset][0]
+        else:
+            changed.extend(page for page, _ in new_pages[j1:j2])
+    return mapping, changed
+
+
+def group_regions(changed: List[int], all_pages: List[int], context: int) -> List[Tuple[int, int]]:
+    """Изменённые страницы с context соседними → непересекающиеся диапазоны (first, last)."""
+    if not changed:
+        return []
+    index = {page: i for i, page in enumerate(all_pages)}
+    spans = sorted(
+        (max(0, index[page] - context), min(len(all_pages) - 1, index[page] + context))
+        for page in changed
+    )
+    regions: List[List[int]] = []
+    for lo, hi in spans:
+        if regions and lo <= regions[-1][1] + 1:
+            regions[-1][1] = max(regions[-1][1], hi)
+        else:
+            regions.append([lo, hi])
+    return [(all_pages[lo], all_pages[hi]) for lo, hi in regions]
+
+
+def split_remarks(pass_result: str) -> List[str]:
+    """Разбивает результат прохода на отдельные замечания (итоговые строки отбрасываются)."""
+    starts = [m.start() for m in _REMARK_START_RE.finditer(pass_result)]
+    remarks = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(pass_result)
+        block = pass_result[start:end].strip()
+        if _WHERE_RE.search(block):
+            remarks.append(block)
+    return remarks
+
+
+def remark_pages(remark: str) -> Set[int]:
+    """Страницы, указанные в строке «Где:» замечания (пусто — без привязки)."""
+    where = _WHERE_RE.search(remark)
+    if where is None:
+        return set()
+    pages: Set[int] = set()
+    for match in _PAGE_REF_RE.finditer(where.group(0)):
+        first = int(match.group("first"))
+        last = int(match.group("last")) if match.group("last") else first
+        if last < first or last - first > 50:
+            last = first
+        pages.update(range(first, last + 1))
+    return pages
+
+
+def remap_remark_pages(remark: str, mapping: Dict[int, int]) -> Optional[str]:
+    """
+    Замечание с номерами страниц новой редакции; None — если хотя бы одна
+    его страница изменена или удалена.
+    """
+    pages = remark_pages(remark)
+    if any(page not in mapping for page in pages):
+        return None
+    if not pages:
+        return remark
+
+    def _sub(match: re.Match) -> str:
+        text = f"{match.group('prefix')}{mapping[int(match.group('first'))]}"
+        if match.group("last"):
+            text += f"{match.group('sep')}{mapping.get(int(match.group('last')), match.group('last'))}"
+        return text
+
+    where = _WHERE_RE.search(remark)
+    new_where = _PAGE_REF_RE.sub(_sub, where.group(0))
+    return remark[:where.start()] + new_where + remark[where.end():]
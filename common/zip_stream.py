@@ -0,0 +1,212 @@
+"""
+Детерминированная раскладка ZIP-архива для потоковой отдачи с Range.
+
+Записи хранятся без сжатия (ZIP_STORED) с data descriptor (флаг 3):
+CRC-32 пишется после данных, поэтому файл можно отдавать по мере скачивания.
+Размеры всех записей известны заранее, значит известны смещение каждого
+заголовка и полный размер архива — любой диапазон байт можно собрать
+заново, не генерируя архив с начала.
+
+Для архивов больше 4 ГБ центральный каталог пишется в формате ZIP64;
+отдельные записи больше 4 ГБ не поддерживаются.
+"""
+
+import struct
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_ZIP64_EXTRA_OFFSET = struct.Struct("<HHQ")
+_ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+_ZIP64_LOCATOR = struct.Struct("<IIQI")
+_END = struct.Struct("<IHHHHIIH")
+
+_LOCAL_SIG = 0x04034B50
+_DESCRIPTOR_SIG = 0x08074B50
+_CENTRAL_SIG = 0x02014B50
+_ZIP64_END_SIG = 0x06064B50
+_ZIP64_LOCATOR_SIG = 0x07064B50
+_END_SIG = 0x06054B50
+
+# бит 3 — data descriptor, бит 11 — имена в UTF-8
+_FLAGS = 0x0808
+_VERSION = 20
+_VERSION_ZIP64 = 45
+_MAX_32 = 0xFFFFFFFF
+_MAX_16 = 0xFFFF
+
+
+def _dos_datetime(dt: Optional[datetime]) -> Tuple[int, int]:
+    if dt is None or dt.year < 1980:
+        return (0 << 9) | (1 << 5) | 1, 0
+    date = ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+    time = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    return date, time
+
+
+@dataclass
+class ZipEntry:
+    """Запись архива. crc можно не знать до окончания чтения данных."""
+    name: str
+    size: int
+    modified: Optional[datetime] = None
+    crc: Optional[int] = None
+
+    # Заполняется ZipLayout
+    offset: int = field(default=0, init=False)
+
+    @property
+    def encoded_name(self) -> bytes:
+        return self.name.encode("utf-8")
+
+    @property
+    def header_size(self) -> int:
+        return _LOCAL_HEADER.size + len(self.encoded_name)
+
+    @property
+    def data_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def descriptor_offset(self) -> int:
+        return self.data_offset + self.size
+
+    @property
+    def end_offset(self) -> int:
+        return self.descriptor_offset + _DATA_DESCRIPTOR.size
+
+    def local_header(self) -> bytes:
+        date, time = _dos_datetime(self.modified)
+        name = self.encoded_name
+        return _LOCAL_HEADER.pack(
+            _LOCAL_SIG, _VERSION, _FLAGS, 0, time, date, 0, 0, 0, len(name), 0,
+        ) + name
+
+    def data_descriptor(self) -> bytes:
+        if self.crc is None:
+            raise ValueError(f"CRC для {self.name} ещё не вычислен")
+        return _DATA_DESCRIPTOR.pack(_DESCRIPTOR_SIG, self.crc, self.size, self.size)
+
+    def _needs_zip64(self) -> bool:
+        return self.offset >= _MAX_32
+
+    def central_header_size(self) -> int:
+        extra = _ZIP64_EXTRA_OFFSET.size if self._needs_zip64() else 0
+        return _CENTRAL_HEADER.size + len(self.encoded_name) + extra
+
+    def central_header(self) -> bytes:
+        if self.crc is None:
+            raise ValueError(f"CRC для {self.name} ещё не вычислен")
+        date, time = _dos_datetime(self.modified)
+        name = self.encoded_name
+        if self._needs_zip64():
+            extra = _ZIP64_EXTRA_OFFSET.pack(0x0001, 8, self.offset)
+            version, offset = _VERSION_ZIP64, _MAX_32
+        else:
+            extra, version, offset = b"", _VERSION, self.offset
+        return _CENTRAL_HEADER.pack(
+            _CENTRAL_SIG, version, version, _FLAGS, 0, time, date,
+            self.crc, self.size, self.size, len(name), len(extra), 0, 0, 0, 0, offset,
+        ) + name + extra
+
+
+class ZipLayout:
+    """Смещения всех частей архива по списку записей с известными размерами."""
+
+    def __init__(self, entries: List[ZipEntry]):
+        self.entries = entries
+        offset = 0
+        for entry in entries:
+            if entry.size >= _MAX_32:
+                raise ValueError(f"Запись {entry.name} больше 4 ГБ — не поддерживается")
+            entry.offset = offset
+            offset = entry.end_offset
+
+        self.central_offset = offset
+        self.central_size = sum(entry.central_header_size() for entry in entries)
+        self.zip64 = (
+            len(entries) >= _MAX_16
+            or self.central_offset >= _MAX_32
+            or self.central_size >= _MAX_32
+        )
+        end_size = _END.size
+        if self.zip64:
+            end_size += _ZIP64_END.size + _ZIP64_LOCATOR.size
+        self.total_size = self.central_offset + self.central_size + end_size
+
+    def central_directory(self) -> bytes:
+        """Центральный каталог и завершающие записи. Нужны CRC всех записей."""
+        parts = [entry.central_header() for entry in self.entries]
+        count = len(self.entries)
+        if self.zip64:
+            zip64_end_offset = self.central_offset + self.central_size
+            parts.append(_ZIP64_END.pack(
+                _ZIP64_END_SIG, _ZIP64_END.size - 12, _VERSION_ZIP64, _VERSION_ZIP64,
+                0, 0, count, count, self.central_size, self.central_offset,
+            ))
+            parts.append(_ZIP64_LOCATOR.pack(_ZIP64_LOCATOR_SIG, 0, zip64_end_offset, 1))
+            parts.append(_END.pack(_END_SIG, 0, 0, _MAX_16, _MAX_16, _MAX_32, _MAX_32, 0))
+        else:
+            parts.append(_END.pack(
+                _END_SIG, 0, 0, count, count, self.central_size, self.central_offset, 0,
+            ))
+        return b"".join(parts)
+
+
+def overlap(start: int, end: int, part_start: int, part_end: int) -> Optional[Tuple[int, int]]:
+    """
+    Пересечение запрошенного диапазона [start, end) с частью [part_start, part_end)
+    в координатах части, или None.
+    """
+    lo, hi = max(start, part_start), min(end, part_end)
+    if lo >= hi:
+        return None
+    return lo - part_start, hi - part_start
+
+
+def parse_range(header: Optional[str], total_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает заголовок Range в полуинтервал [start, end).
+
+    Returns:
+        None — заголовка нет или он не поддерживается (несколько диапазонов,
+        другие единицы) — отдаётся весь архив.
+
+    Raises:
+        ValueError: диапазон не пересекается с архивом (416)
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    if not sep:
+        return None
+    try:
+        first_pos = int(first) if first else None
+        last_pos = int(last) if last else None
+    except ValueError:
+        return None
+
+    if first_pos is None:
+        if last_pos is None:
+            return None
+        start, end = max(total_size - last_pos, 0), total_size
+    else:
+        if last_pos is not None and last_pos < first_pos:
+            return None
+        start = first_pos
+        end = total_size if last_pos is None else min(last_pos + 1, total_size)
+
+    if start >= end:
+        raise ValueError(f"Диапазон {header} вне архива размером {total_size}")
+    return start, end
+
+
+def clip(data: bytes, start: int, end: int, part_start: int) -> bytes:
+    """Кусок data (часть архива со смещением part_start), попавший в [start, end)."""
+    window = overlap(start, end, part_start, part_start + len(data))
+    if window is None:
+        return b""
+    return data[window[0]:window[1]]
@@ -0,0 +1,314 @@
+"""
+Потоковый генератор ведомости дефектов и повреждений №2.
+
+python-docx строит DOM всего документа в памяти, а на каждую картинку
+делает линейный поиск по sha1 и XPath по всему документу (next_id),
+поэтому тысячи строк с фото обрабатываются за секунды и сотни МБ.
+
+Здесь шаблон (заголовок, шапка таблицы, строка нумерации) один раз
+строится тем же generate_defects_statement_2_report, а строки данных и
+изображения дописываются в zip по одной: XML строки — в spooled-буфер,
+изображение — сразу отдельной записью архива. Вместо photo_data строка
+может нести photo_path: тогда байты фото получает load_photo (по умолчанию
+read_photo_file) в момент записи строки, и в памяти держится одна картинка. Разметка document.xml
+совпадает с генератором на python-docx байт в байт.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import re
+import shutil
+import tempfile
+import zipfile
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Optional
+from xml.sax.saxutils import escape
+
+from docx.image.image import Image as DocxImage
+from docx.shared import Cm
+
+from docx_generator.generate_defects_statement_2_report import (
+    _normalize,
+    generate_defects_statement_2_report,
+)
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+PHOTO_WIDTH = Cm(2.0)
+
+# Порог, после которого XML строк уходит из памяти во временный файл
+ROWS_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+_IMAGE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+
+# Символы, недопустимые в XML 1.0 (python-docx падает на них с ValueError)
+_XML_INVALID_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_RUN_PR = (
+    '<w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman"/>'
+    '<w:b w:val="0"/><w:sz w:val="20"/></w:rPr>'
+)
+
+_INLINE_PICTURE = (
+    '<w:r><w:drawing><wp:inline'
+    ' xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main"'
+    ' xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{shape_id}" name="Picture {shape_id}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/></wp:cNvGraphicFramePr>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="{filename}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"/></pic:spPr></pic:pic></a:graphicData></a:graphic>'
+    '</wp:inline></w:drawing></w:r>'
+)
+
+# Выравнивание столбцов данных — как в _create_defects_statement_2_table
+_COLUMN_ALIGN = {
+    "number": "center",
+    "scheme_name": "left",
+    "element_name": "left",
+    "defect_volume": "center",
+    "defects_and_causes": "left",
+    "danger_category": "left",
+    "work_recommendations": "left",
+    "recommended_work_types": "left",
+}
+
+_template: Optional["_Template"] = None
+
+# Загрузчик фото по пути: bytes или None, если фото недоступно
+PhotoLoader = Callable[[str], Optional[bytes]]
+
+
+def read_photo_file(path: str) -> Optional[bytes]:
+    """Загрузчик по умолчанию: фото, заранее сохранённое в локальный файл."""
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class _Template:
+    """Разобранный пустой документ: части архива и точки вставки строк."""
+
+    def __init__(self, docx_bytes: bytes):
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as zf:
+            self.parts = [(info, zf.read(info)) for info in zf.infolist()]
+
+        parts = {info.filename: data for info, data in self.parts}
+        document = parts[DOCUMENT_PART].decode("utf-8")
+        table_end = document.rindex("</w:tbl>")
+        self.document_head = document[:table_end].encode("utf-8")
+        self.document_tail = document[table_end:].encode("utf-8")
+
+        self.rels = parts[DOCUMENT_RELS_PART].decode("utf-8")
+        self.content_types = parts[CONTENT_TYPES_PART].decode("utf-8")
+
+        rid_numbers = [int(n) for n in re.findall(r'Id="rId(\d+)"', self.rels)]
+        self.next_rid = max(rid_numbers, default=0) + 1
+        shape_ids = [int(n) for n in re.findall(r'\bid="(\d+)"', document)]
+        self.next_shape_id = max(shape_ids, default=0) + 1
+
+        # Ширина ячейки берётся из шапки таблицы, чтобы не расходиться с шаблоном
+        self.cell_pr = re.search(r"<w:tcPr>.*?</w:tcPr>", document).group(0)
+
+
+def _get_template() -> _Template:
+    global _template
+    if _template is None:
+        _template = _Template(generate_defects_statement_2_report([]).getvalue())
+    return _template
+
+
+def _run_content(text: str) -> str:
+    """XML содержимого run — повторяет _RunContentAppender из python-docx."""
+    parts: list[str] = []
+    buffer: list[str] = []
+
+    def flush():
+        if buffer:
+            chunk = "".join(buffer)
+            space = ' xml:space="preserve"' if len(chunk.strip()) < len(chunk) else ""
+            parts.append(f"<w:t{space}>{escape(chunk)}</w:t>")
+            buffer.clear()
+
+    for char in _XML_INVALID_RE.sub("", text):
+        if char == "\t":
+            flush()
+            parts.append("<w:tab/>")
+        elif char in "\r\n":
+            flush()
+            parts.append("<w:br/>")
+        else:
+            buffer.append(char)
+    flush()
+    return "".join(parts)
+
+
+class _StatementWriter:
+    """Пишет строки ведомости в открытый zip-архив."""
+
+    def __init__(
+        self,
+        zf: zipfile.ZipFile,
+        rows_buffer: BinaryIO,
+        template: _Template,
+        load_photo: PhotoLoader = read_photo_file,
+    ):
+        self._zf = zf
+        self._load_photo = load_photo
+        self._rows = rows_buffer
+        self._template = template
+        self._next_rid = template.next_rid
+        self._next_shape_id = template.next_shape_id
+        self._next_media_idx = 1
+        self._images_by_sha1: dict[str, tuple[str, str]] = {}
+        self._image_rels: list[str] = []
+        self._extensions: dict[str, str] = {}
+
+    def _text_cell(self, text: str, align: str) -> str:
+        return (
+            f"<w:tc>{self._template.cell_pr}<w:p><w:pPr><w:jc w:val=\"{align}\"/></w:pPr>"
+            f"<w:r/><w:r>{_RUN_PR}{_run_content(text)}</w:r></w:p></w:tc>"
+        )
+
+    def _add_image(self, blob: bytes) -> tuple[str, DocxImage]:
+        """Добавляет картинку в архив (с дедупликацией по sha1), возвращает rId."""
+        image = DocxImage.from_blob(blob)
+        sha1 = hashlib.sha1(blob).hexdigest()
+        existing = self._images_by_sha1.get(sha1)
+        if existing is not None:
+            return existing[0], image
+
+        rid = f"rId{self._next_rid}"
+        self._next_rid += 1
+        target = f"media/image{self._next_media_idx}.{image.ext}"
+        self._next_media_idx += 1
+
+        self._zf.writestr(f"word/{target}", blob, compress_type=zipfile.ZIP_STORED)
+        self._image_rels.append(
+            f'<Relationship Id="{rid}" Type="{_IMAGE_REL_TYPE}" Target="{target}"/>'
+        )
+        self._extensions.setdefault(image.ext, image.content_type)
+        self._images_by_sha1[sha1] = (rid, target)
+        return rid, image
+
+    def _photo_cell(self, photo_data: Optional[bytes]) -> str:
+        if not photo_data:
+            return self._text_cell("", "center")
+        try:
+            rid, image = self._add_image(photo_data)
+        except Exception:
+            return self._text_cell("", "center")
+
+        cx, cy = image.scaled_dimensions(PHOTO_WIDTH, None)
+        shape_id = self._next_shape_id
+        self._next_shape_id += 1
+        picture = _INLINE_PICTURE.format(
+            cx=cx, cy=cy, shape_id=shape_id, filename=escape(image.filename), rid=rid,
+        )
+        return (
+            f"<w:tc>{self._template.cell_pr}<w:p><w:pPr><w:jc w:val=\"center\"/></w:pPr>"
+            f"<w:r/>{picture}</w:p></w:tc>"
+        )
+
+    def _photo_of(self, row_data: Dict[str, Any]) -> Optional[bytes]:
+        photo_data = row_data.get("photo_data")
+        photo_path = row_data.get("photo_path")
+        if photo_data is None and photo_path:
+            photo_data = self._load_photo(photo_path)
+        return photo_data
+
+    def write_row(self, row_data: Dict[str, Any]) -> None:
+        cells = [
+            self._text_cell(_normalize(row_data.get(key, "")), _COLUMN_ALIGN[key])
+            for key in ("number", "scheme_name", "element_name", "defect_volume", "defects_and_causes")
+        ]
+        cells.append(self._photo_cell(self._photo_of(row_data)))
+        cells.extend(
+            self._text_cell(_normalize(row_data.get(key, "")), _COLUMN_ALIGN[key])
+            for key in ("danger_category", "work_recommendations", "recommended_work_types")
+        )
+        self._rows.write(("<w:tr>" + "".join(cells) + "</w:tr>").encode("utf-8"))
+
+    def finish(self) -> None:
+        """Дописывает document.xml, связи и типы содержимого."""
+        template = self._template
+
+        with self._zf.open(DOCUMENT_PART, "w") as dst:
+            dst.write(template.document_head)
+            self._rows.seek(0)
+            shutil.copyfileobj(self._rows, dst)
+            dst.write(template.document_tail)
+
+        rels = template.rels.replace(
+            "</Relationships>", "".join(self._image_rels) + "</Relationships>"
+        )
+        self._zf.writestr(DOCUMENT_RELS_PART, rels.encode("utf-8"))
+
+        # Default-записи держим отсортированными по расширению, как python-docx
+        content_types = template.content_types
+        defaults = dict(re.findall(
+            r'<Default Extension="([^"]+)" ContentType="([^"]+)"/>', content_types,
+        ))
+        for ext, content_type in self._extensions.items():
+            defaults.setdefault(ext, content_type)
+        defaults_xml = "".join(
+            f'<Default Extension="{ext}" ContentType="{defaults[ext]}"/>'
+            for ext in sorted(defaults)
+        )
+        content_types = re.sub(r"(?:<Default [^>]*/>)+", defaults_xml, content_types, count=1)
+        self._zf.writestr(CONTENT_TYPES_PART, content_types.encode("utf-8"))
+
+
+def stream_defects_statement_2_report(
+    rows: Iterable[Dict[str, Any]],
+    output: BinaryIO,
+    load_photo: PhotoLoader = read_photo_file,
+) -> None:
+    """
+    Потоковая генерация DOCX с ведомостью дефектов и повреждений №2.
+
+    Args:
+        rows: Итерируемый источник строк (можно генератор) с теми же ключами,
+            что и у generate_defects_statement_2_report
+        output: Файлоподобный объект для записи архива (BytesIO, файл,
+            SpooledTemporaryFile)
+        load_photo: Загрузчик фото для строк с photo_path вместо photo_data
+    """
+    template = _get_template()
+    skip = {DOCUMENT_PART, DOCUMENT_RELS_PART, CONTENT_TYPES_PART}
+
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf, \
+            tempfile.SpooledTemporaryFile(max_size=ROWS_SPOOL_MAX_SIZE) as rows_buffer:
+        for info, data in template.parts:
+            if info.filename not in skip:
+                zf.writestr(info, data)
+
+        writer = _StatementWriter(zf, rows_buffer, template, load_photo)
+        for row_data in rows:
+            writer.write_row(row_data)
+        writer.finish()
+
+
+def write_defects_statement_2_report(
+    rows: Iterable[Dict[str, Any]],
+    path: str,
+    load_photo: PhotoLoader = read_photo_file,
+) -> int:
+    """
+    Пишет ведомость в файл по пути path. Возвращает размер файла в байтах.
+
+    Точка входа для CPU-пула: передаётся путь, а не файловый объект,
+    который нельзя передать в другой процесс. Фото тоже передаются путями
+    (photo_path) к файлам, скачанным вызывающим кодом; load_photo — функция
+    уровня модуля, чтобы её можно было передать по ссылке.
+    """
+    with open(path, "wb") as output:
+        stream_defects_statement_2_report(rows, output, load_photo)
+        return output.tell()
@@ -1,6 +1,7 @@
 import logging
 import os
 import uvicorn
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
@@ -10,7 +11,9 @@ from starlette.middleware.gzip import GZipMiddleware
 from datetime import datetime
 
 from common.logging_utils import get_user_logger
+from common.metrics import metrics
 
+from api.services.cpu_pool_service import CpuPoolOverloadedError, get_cpu_pool_service
 from api.services.defect_analyzer import DefectAnalyzer
 from api.services.model_manager import ModelManager
 from api.models.config import (
@@ -33,7 +36,10 @@ from api.routes.reports import router as reports_router
 from api.routes.web_auth import router as web_auth_router
 from api.routes.web_data import router as web_data_router
 from api.routes.web_admin import router as web_admin_router
-from api.routes.document_review import router as document_review_router
+from api.routes.document_review import (
+    router as document_review_router,
+    document_review_service,
+)
 from api.routes.updates import router as updates_router
 from api.middleware.logging_middleware import UserLoggingMiddleware
 
@@ -48,7 +54,17 @@ class HealthFilter(logging.Filter):
 
 uvicorn_logger.addFilter(HealthFilter())
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Индекс reference_docs/ грузится с диска (или собирается) до первых запросов
+    await document_review_service.warm_up()
+    yield
+    # Процессы CPU-пулов завершаются вместе с приложением (в том числе при reload)
+    get_cpu_pool_service().shutdown()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     root_path="/repgen",
     title="Defect Analysis API",
     description="API для анализа дефектов строительных конструкций по изображениям",
@@ -83,6 +99,15 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": exc.errors()},
     )
 
+@app.exception_handler(CpuPoolOverloadedError)
+async def cpu_pool_overloaded_handler(request: Request, exc: CpuPoolOverloadedError):
+    logger.warning(f"CPU пул '{exc.pool}' перегружен: {request.method} {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "5"},
+    )
+
 app.include_router(auth_router)
 app.include_router(users_router)
 app.include_router(projects_router)
@@ -122,6 +147,15 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Внутренние метрики процесса (счётчики, перцентили длительностей, CPU-пулы)"""
+    return {
+        **metrics.snapshot(),
+        "cpu_pools": get_cpu_pool_service().get_stats(),
+    }
+
+
 @app.post("/analyze_images", response_model=DefectAnalysisResponse)
 async def analyze_defects(
     request: DefectAnalysisRequest,
@@ -0,0 +1,191 @@
+"""
+Обучение и экспорт локального классификатора типа конструкции.
+
+Метки — накопленные Photo.type: типы, заданные пользователем (без
+уверенности или с уверенностью 1.0), и, при --min-confidence, типы,
+определённые моделью с уверенностью не ниже порога. Учитываются только
+типы из CONSTRUCTION_TYPE_CHOICES. Изображения скачиваются из бакета в
+--cache-dir (повторный запуск их не качает).
+
+Дообучается MobileNetV3-Small (ImageNet), результат экспортируется в ONNX
+вместе с сопроводительным JSON (метки и нормализация) — формат
+common/local_classifier.py. Подключение: LOCAL_CLASSIFIER_MODEL_PATH.
+
+Нужны torch и torchvision (в requirements.txt не входят — только для
+обучения). Запуск из корня репозитория:
+    JWT_SECRET_KEY=x python -m scripts.train_construction_classifier \\
+        --out models/construction.onnx [--min-confidence 0.95] [--epochs 8]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+from collections import Counter
+from typing import List, Tuple
+
+from sqlalchemy import or_, select
+
+from api.models.entities import Photo
+from api.services.database import AsyncSessionLocal
+from common.defects_db import CONSTRUCTION_TYPE_CHOICES
+from common.gc_utils import images_storage
+from common.local_classifier import DEFAULT_IMAGE_SIZE, DEFAULT_MEAN, DEFAULT_STD, metadata_path
+
+MIN_PER_CLASS = 20
+
+
+async def _load_labels(min_confidence: float | None) -> List[Tuple[str, str]]:
+    """(image_name, тип) размеченных фото"""
+    user_set = or_(Photo.type_confidence.is_(None), Photo.type_confidence >= 1)
+    condition = user_set if min_confidence is None else or_(user_set, Photo.type_confidence >= min_confidence)
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Photo.image_name, Photo.type).where(
+                Photo.image_name.isnot(None),
+                Photo.type.in_(CONSTRUCTION_TYPE_CHOICES),
+                condition,
+            )
+        )).all()
+    return [(image_name, construction_type) for image_name, construction_type in rows]
+
+
+async def _download(samples: List[Tuple[str, str]], cache_dir: str) -> List[Tuple[str, str]]:
+    """Локальные пути изображений; не скачавшиеся пропускаются"""
+    os.makedirs(cache_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(16)
+
+    async def fetch(image_name: str, construction_type: str):
+        path = os.path.join(cache_dir, image_name.replace("/", "_"))
+        if not os.path.exists(path):
+            async with semaphore:
+                try:
+                    content, _ = await images_storage.download(image_name)
+                except Exception as e:
+                    print(f"пропуск {image_name}: {e}")
+                    return None
+            with open(path, "wb") as f:
+                f.write(content)
+        return path, construction_type
+
+    fetched = await asyncio.gather(*(fetch(*sample) for sample in samples))
+    return [item for item in fetched if item is not None]
+
+
+async def _prepare(args) -> Tuple[List[Tuple[str, str]], List[str]]:
+    samples = await _load_labels(args.min_confidence)
+    counts = Counter(construction_type for _, construction_type in samples)
+    labels = sorted(t for t, n in counts.items() if n >= MIN_PER_CLASS)
+    print(f"Размечено фото: {len(samples)}; классы ({len(labels)}): "
+          + ", ".join(f"{t}={counts[t]}" for t in labels))
+    if len(labels) < 2:
+        raise SystemExit(f"Нужно хотя бы два типа с {MIN_PER_CLASS}+ фото")
+    return await _download([s for s in samples if s[1] in labels], args.cache_dir), labels
+
+
+def _train(samples: List[Tuple[str, str]], labels: List[str], args) -> None:
+    try:
+        import torch
+        from PIL import Image
+        from torch import nn
+        from torch.utils.data import DataLoader, Dataset
+        from torchvision import models, transforms
+    except ImportError:
+        raise SystemExit("Для обучения нужны torch и torchvision: pip install torch torchvision")
+
+    index = {label: i for i, label in enumerate(labels)}
+    normalize = transforms.Normalize(DEFAULT_MEAN, DEFAULT_STD)
+    train_tf = transforms.Compose([
+        transforms.RandomResizedCrop(DEFAULT_IMAGE_SIZE, scale=(0.6, 1.0)),
+        transforms.RandomHorizontalFlip(),
+        transforms.ColorJitter(0.2, 0.2, 0.2),
+        transforms.ToTensor(),
+        normalize,
+    ])
+    # Как в common/local_classifier.py: сжатие до квадрата без обрезки
+    eval_tf = transforms.Compose([
+        transforms.Resize((DEFAULT_IMAGE_SIZE, DEFAULT_IMAGE_SIZE)),
+        transforms.ToTensor(),
+        normalize,
+    ])
+
+    class Photos(Dataset):
+        def __init__(self, items, tf):
+            self.items, self.tf = items, tf
+
+        def __len__(self):
+            return len(self.items)
+
+        def __getitem__(self, i):
+            path, construction_type = self.items[i]
+            return self.tf(Image.open(path).convert("RGB")), index[construction_type]
+
+    random.Random(0).shuffle(samples)
+    split = max(1, int(len(samples) * 0.1))
+    val, train = samples[:split], samples[split:]
+    train_loader = DataLoader(Photos(train, train_tf), batch_size=32, shuffle=True, num_workers=4)
+    val_loader = DataLoader(Photos(val, eval_tf), batch_size=64, num_workers=4)
+
+    model = models.mobilenet_v3_small(weights=models.MobileNet_V3_Small_Weights.IMAGENET1K_V1)
+    model.classifier[-1] = nn.Linear(model.classifier[-1].in_features, len(labels))
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
+    loss_fn = nn.CrossEntropyLoss()
+
+    for epoch in range(args.epochs):
+        model.train()
+        for images, targets in train_loader:
+            optimizer.zero_grad()
+            loss_fn(model(images), targets).backward()
+            optimizer.step()
+
+        model.eval()
+        correct = confident = confident_correct = 0
+        with torch.no_grad():
+            for images, targets in val_loader:
+                probs = model(images).softmax(dim=1)
+                conf, pred = probs.max(dim=1)
+                correct += (pred == targets).sum().item()
+                gate = conf >= args.gate
+                confident += gate.sum().item()
+                confident_correct += ((pred == targets) & gate).sum().item()
+        print(
+            f"эпоха {epoch + 1}: точность {correct / len(val):.3f}, "
+            f"доля уверенных (>= {args.gate}) {confident / len(val):.3f}, "
+            f"точность уверенных {confident_correct / max(confident, 1):.3f}"
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    model.eval()
+    torch.onnx.export(
+        model, torch.zeros(1, 3, DEFAULT_IMAGE_SIZE, DEFAULT_IMAGE_SIZE), args.out,
+        input_names=["image"], output_names=["logits"], opset_version=17,
+    )
+    with open(metadata_path(args.out), "w", encoding="utf-8") as f:
+        json.dump({
+            "labels": labels,
+            "image_size": DEFAULT_IMAGE_SIZE,
+            "mean": list(DEFAULT_MEAN),
+            "std": list(DEFAULT_STD),
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Модель: {args.out}, метки: {metadata_path(args.out)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="Путь .onnx")
+    parser.add_argument("--cache-dir", default="/tmp/repgen_construction_photos")
+    parser.add_argument("--min-confidence", type=float, default=None,
+                        help="Брать и типы модели с уверенностью не ниже (по умолчанию — только пользовательские)")
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=3e-4)
+    parser.add_argument("--gate", type=float, default=0.9,
+                        help="Порог уверенности для отчёта (LOCAL_CLASSIFIER_MIN_CONFIDENCE)")
+    args = parser.parse_args()
+
+    samples, labels = asyncio.run(_prepare(args))
+    _train(samples, labels, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -36,7 +36,106 @@ JWT_REFRESH_TOKEN_EXPIRE_DAYS = 60  # 60 дней
 # Construction queue settings
 CONSTRUCTION_QUEUE_MAX_CONCURRENT = 5
 CONSTRUCTION_QUEUE_MAX_SIZE = 500
+CONSTRUCTION_QUEUE_TENANT_MAX_DEPTH = int(os.environ.get("CONSTRUCTION_QUEUE_TENANT_MAX_DEPTH", "250"))
+# Окно объединения фото одной отметки: тип конструкции определяется один раз на группу (0 — выключено)
+CONSTRUCTION_MARK_WINDOW_SECONDS = float(os.environ.get("CONSTRUCTION_MARK_WINDOW_SECONDS", "5"))
 
 # Defect analysis queue settings
 DEFECT_QUEUE_MAX_CONCURRENT = 3
 DEFECT_QUEUE_MAX_SIZE = 200
+DEFECT_QUEUE_TENANT_MAX_DEPTH = int(os.environ.get("DEFECT_QUEUE_TENANT_MAX_DEPTH", "60"))
+
+# Справедливое распределение слотов очередей между пользователями (common/fair_scheduler.py)
+FAIR_QUEUE_STARVATION_SECONDS = float(os.environ.get("FAIR_QUEUE_STARVATION_SECONDS", "120"))
+FAIR_QUEUE_WEIGHTS = os.environ.get("FAIR_QUEUE_WEIGHTS", "")
+
+# CPU worker pools (процессы на класс нагрузки; 0 — выполнять в потоке)
+CPU_POOL_IMAGE_WORKERS = int(os.environ.get("CPU_POOL_IMAGE_WORKERS", "2"))
+CPU_POOL_IMAGE_QUEUE = int(os.environ.get("CPU_POOL_IMAGE_QUEUE", "40"))
+CPU_POOL_DOCUMENT_WORKERS = int(os.environ.get("CPU_POOL_DOCUMENT_WORKERS", "1"))
+CPU_POOL_DOCUMENT_QUEUE = int(os.environ.get("CPU_POOL_DOCUMENT_QUEUE", "10"))
+CPU_POOL_REPORT_WORKERS = int(os.environ.get("CPU_POOL_REPORT_WORKERS", "1"))
+CPU_POOL_REPORT_QUEUE = int(os.environ.get("CPU_POOL_REPORT_QUEUE", "5"))
+CPU_POOL_MAX_TASKS_PER_CHILD = int(os.environ.get("CPU_POOL_MAX_TASKS_PER_CHILD", "200"))
+
+# Object ZIP export
+EXPORT_GCS_CONCURRENCY = 8
+EXPORT_CHUNK_SIZE = 1024 * 1024
+EXPORT_CRC_TTL_SECONDS = 7 * 24 * 3600
+EXPORT_STATEMENT_TTL_SECONDS = 7 * 24 * 3600
+
+# Document text cache (извлечённый текст для проверки отчётов)
+DOCUMENT_TEXT_CACHE_DIR = os.environ.get("DOCUMENT_TEXT_CACHE_DIR", "/tmp/repgen_document_text_cache")
+DOCUMENT_TEXT_CACHE_MAX_DISK_BYTES = 512 * 1024 * 1024
+DOCUMENT_TEXT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Индекс reference_docs/ для нормативного прохода проверки отчётов
+REFERENCE_INDEX_PATH = os.environ.get("REFERENCE_INDEX_PATH", "/tmp/repgen_reference_index.json")
+
+# Фоновые задачи проверки документов
+REVIEW_JOB_MAX_ACTIVE = 20
+REVIEW_JOB_TTL_SECONDS = 24 * 3600
+
+# Кеш результатов проходов и merge проверки документов
+REVIEW_RESULT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Промпт анализа дефекта: компактный формат базы дефектов и его бюджет
+DEFECT_PROMPT_COMPACT = os.environ.get("DEFECT_PROMPT_COMPACT", "1") == "1"
+DEFECT_PROMPT_MAX_TOKENS = int(os.environ.get("DEFECT_PROMPT_MAX_TOKENS", "10000"))
+DEFECT_PROMPT_CHARS_PER_TOKEN = 3
+
+# Шорт-лист кандидатов перед кодированием дефекта моделью
+DEFECT_SHORTLIST_TOP_K = int(os.environ.get("DEFECT_SHORTLIST_TOP_K", "25"))
+DEFECT_SHORTLIST_MIN_CONFIDENCE = 0.6
+DEFECT_SHORTLIST_TYPE_TRUST = 0.7
+DEFECT_SHORTLIST_AUDIT_RATE = float(os.environ.get("DEFECT_SHORTLIST_AUDIT_RATE", "0.05"))
+
+# Повторы вызова модели, если ответ не соответствует JSON-схеме
+LLM_PARSE_RETRIES = int(os.environ.get("LLM_PARSE_RETRIES", "1"))
+
+# Хеджирование вызовов моделей и автоматы защиты провайдеров
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_QUANTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("LLM_HEDGE_MIN_DELAY_SECONDS", "2"))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Повторы исходящих вызовов (LLM, GCS, Focus API, метаданные релизов), см. common/retry.py
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "1"))
+RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", "30"))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+
+# Доставка изображений провайдерам (см. api/services/image_uri_resolver.py):
+# gcs — gs://-ссылка, signed_url — подписанный URL, inline — байты в запросе
+GEMINI_IMAGE_TRANSPORT = os.environ.get("GEMINI_IMAGE_TRANSPORT", "gcs")
+OPENAI_IMAGE_TRANSPORT = os.environ.get("OPENAI_IMAGE_TRANSPORT", "signed_url")
+
+# Каскад моделей: сначала дешёвая модель, сильная — при низкой уверенности
+LLM_CASCADE_ENABLED = os.environ.get("LLM_CASCADE_ENABLED", "0") == "1"
+LLM_CASCADE_CHEAP_MODEL = os.environ.get("LLM_CASCADE_CHEAP_MODEL", "gpt-4.1-mini")
+LLM_CASCADE_DEFECT_MIN_CONFIDENCE = float(os.environ.get("LLM_CASCADE_DEFECT_MIN_CONFIDENCE", "0.7"))
+LLM_CASCADE_CONSTRUCTION_MIN_CONFIDENCE = float(os.environ.get("LLM_CASCADE_CONSTRUCTION_MIN_CONFIDENCE", "0.8"))
+
+# Локальный CPU-классификатор типа конструкции (ONNX); пустой путь — выключен
+LOCAL_CLASSIFIER_MODEL_PATH = os.environ.get("LOCAL_CLASSIFIER_MODEL_PATH", "")
+LOCAL_CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get("LOCAL_CLASSIFIER_MIN_CONFIDENCE", "0.9"))
+
+# Совмещённый вызов: тип конструкции и код дефекта за одно обращение к модели
+FUSED_ANALYSIS_ENABLED = os.environ.get("FUSED_ANALYSIS_ENABLED", "0") == "1"
+
+# Пакетный анализ дефектов в очереди групп: несколько фото одного типа за вызов
+DEFECT_BATCH_ENABLED = os.environ.get("DEFECT_BATCH_ENABLED", "0") == "1"
+DEFECT_BATCH_MAX_IMAGES = int(os.environ.get("DEFECT_BATCH_MAX_IMAGES", "8"))
+DEFECT_BATCH_WINDOW_SECONDS = float(os.environ.get("DEFECT_BATCH_WINDOW_SECONDS", "0.5"))
+DEFECT_BATCH_TARGET_SECONDS = float(os.environ.get("DEFECT_BATCH_TARGET_SECONDS", "20"))
+DEFECT_BATCH_MAX_INPUT_TOKENS = int(os.environ.get("DEFECT_BATCH_MAX_INPUT_TOKENS", "40000"))
+DEFECT_BATCH_IMAGE_TOKENS = 1100
+
+# Упреждающий анализ дефекта после определения типа конструкции: черновик в Redis
+DEFECT_SPECULATIVE_ENABLED = os.environ.get("DEFECT_SPECULATIVE_ENABLED", "0") == "1"
+DEFECT_SPECULATIVE_MAX_CONCURRENT = int(os.environ.get("DEFECT_SPECULATIVE_MAX_CONCURRENT", "1"))
+DEFECT_SPECULATIVE_MAX_INTERACTIVE = int(os.environ.get("DEFECT_SPECULATIVE_MAX_INTERACTIVE", "3"))
+DEFECT_DRAFT_TTL_SECONDS = int(os.environ.get("DEFECT_DRAFT_TTL_SECONDS", str(24 * 3600)))
@@ -0,0 +1,112 @@
+"""Тесты объединения фото отметки при определении типа конструкции."""
+
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from api.services.construction_queue_service import ConstructionQueueService
+from api.services.model_manager import ModelManager
+from common.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class _Recorder:
+    """Подменяет классификацию и запись в БД у сервиса очереди."""
+
+    def __init__(self, service, construction_type="Стена", user_type=None):
+        self.classified = []
+        self.saved = []
+        self.construction_type = construction_type
+        self.user_type = user_type
+        service._process_analysis = self.process
+        service._save_type = self.save
+        service._user_set_type = self.user_set_type
+
+    async def process(self, photo_id, image_name, defect_type=None, tenant=None):
+        self.classified.append(photo_id)
+        return self.construction_type, 0.9
+
+    async def save(self, photo_ids, construction_type, confidence):
+        self.saved.append((photo_ids, construction_type))
+
+    async def user_set_type(self, mark_id, exclude):
+        return self.user_type
+
+
+def _service(window=0.05):
+    with patch.object(ModelManager, "_init_providers", lambda self: setattr(self, "providers", {})):
+        return ConstructionQueueService(max_concurrent=2, max_queue_size=10, mark_window_seconds=window)
+
+
+async def _queue_and_wait(service, photos, mark_id=7):
+    for photo_id in photos:
+        assert await service.queue_analysis(photo_id, f"{photo_id}.jpg", None, mark_id=mark_id)
+    await asyncio.gather(*list(service.active_tasks))
+    await asyncio.sleep(0)
+
+
+class TestMarkCoalescing:
+
+    @pytest.mark.asyncio
+    async def test_group_is_classified_once(self):
+        service = _service()
+        recorder = _Recorder(service)
+
+        await _queue_and_wait(service, [1, 2, 3])
+
+        assert recorder.classified == [1]
+        assert recorder.saved == [([2, 3], "Стена")]
+        assert service.pending_count == 0
+        assert metrics.get_counter("construction_queue.photos_coalesced_total") == 2
+
+    @pytest.mark.asyncio
+    async def test_disagreement_with_user_type_reclassifies(self):
+        service = _service()
+        recorder = _Recorder(service, construction_type="Колонна", user_type="Стена")
+
+        await _queue_and_wait(service, [1, 2, 3])
+
+        assert recorder.classified == [1, 2, 3]
+        assert recorder.saved == []
+        assert metrics.get_counter("construction_queue.mark_groups_total", outcome="reclassified") == 1
+
+    @pytest.mark.asyncio
+    async def test_zero_window_keeps_per_photo_tasks(self):
+        service = _service(window=0)
+        recorder = _Recorder(service)
+
+        await _queue_and_wait(service, [1, 2])
+
+        assert recorder.classified == [1, 2]
+        assert service.pending_count == 0
+
+
+class TestSaveFused:
+
+    @pytest.mark.asyncio
+    async def test_user_set_type_is_not_overwritten(self):
+        service = _service()
+        photo = SimpleNamespace(id=1, type="Стена", type_confidence=None, mark_id=7)
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=MagicMock(**{"scalar_one_or_none.return_value": photo}))
+        db.commit = AsyncMock()
+
+        @asynccontextmanager
+        async def session():
+            yield db
+
+        fused = {"construction_type": "Колонна", "confidence": 0.8, "code": None}
+        with patch("api.services.construction_queue_service.AsyncSessionLocal", session):
+            await service._save_fused(1, fused)
+
+        assert (photo.type, photo.type_confidence) == ("Стена", None)
+        db.commit.assert_awaited_once()
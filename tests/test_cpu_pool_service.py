@@ -0,0 +1,61 @@
+"""Тесты для CpuPoolService."""
+
+import asyncio
+import threading
+
+import pytest
+
+from api.services.cpu_pool_service import CpuPool, CpuPoolOverloadedError, CpuPoolService
+from common.document_parsing import parse_docx
+from common.metrics import metrics
+
+
+def _blocking(event: threading.Event) -> str:
+    event.wait(5)
+    return "done"
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class TestCpuPoolService:
+
+    async def test_runs_in_process_pool(self, sample_docx_bytes):
+        service = CpuPoolService({CpuPool.DOCUMENT: (1, 2)})
+        try:
+            text = await service.run(CpuPool.DOCUMENT, parse_docx, sample_docx_bytes)
+        finally:
+            service.shutdown()
+
+        assert "Заголовок отчёта" in text
+        assert metrics.get_count("cpu_pool.run_seconds", pool="document") == 1
+        assert metrics.get_count("cpu_pool.queue_wait_seconds", pool="document") == 1
+
+    async def test_rejects_when_queue_full(self):
+        service = CpuPoolService({CpuPool.IMAGE: (0, 1)})
+        event = threading.Event()
+        first = asyncio.create_task(service.run(CpuPool.IMAGE, _blocking, event))
+        second = asyncio.create_task(service.run(CpuPool.IMAGE, _blocking, event))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(CpuPoolOverloadedError):
+            await service.run(CpuPool.IMAGE, _blocking, event)
+        assert metrics.get_counter("cpu_pool.rejected_total", pool="image") == 1
+        assert service.get_stats()["image"]["in_flight"] == 2
+
+        event.set()
+        assert await asyncio.gather(first, second) == ["done", "done"]
+        assert service.get_stats()["image"]["in_flight"] == 0
+
+    async def test_errors_propagate_and_release_slot(self):
+        service = CpuPoolService({CpuPool.DOCUMENT: (0, 0)})
+
+        with pytest.raises(Exception):
+            await service.run(CpuPool.DOCUMENT, parse_docx, b"not a docx")
+
+        assert metrics.get_counter("cpu_pool.failed_total", pool="document") == 1
+        assert service.get_stats()["document"]["in_flight"] == 0
@@ -0,0 +1,134 @@
+"""Тесты пакетного анализа дефектов: сборка пакета и раскладка результатов."""
+
+import asyncio
+import json
+
+import pytest
+from unittest.mock import patch
+
+from api.services.defect_batcher import DefectBatcher
+from api.services.model_manager import BaseModelProvider, ModelManager
+from common.defects_db import get_catalog
+from common.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _wall_codes(n):
+    return get_catalog().response_codes("Стена")[:n]
+
+
+class _BatchProvider(BaseModelProvider):
+    name = "openai"
+    default_model = "gpt-5.1"
+    available_models = ["gpt-5.1"]
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+
+    def is_available(self):
+        return True
+
+    async def _generate(self, model_name, images, system_prompt, user_prompt, config):
+        self.requests.append((images, user_prompt))
+        return json.dumps(self.answer), (0, 0, 0)
+
+
+def _manager(provider):
+    def init(self):
+        self.providers = {"openai": provider}
+
+    with patch.object(ModelManager, "_init_providers", init):
+        return ModelManager()
+
+
+class TestAnalyzeImagesBatch:
+
+    @pytest.mark.asyncio
+    async def test_results_follow_image_numbers(self):
+        first, second = _wall_codes(2)
+        provider = _BatchProvider({"results": [
+            {"image": 2, "code": second, "confidence": 0.9},
+            {"image": 1, "code": first, "confidence": 0.8},
+            {"image": 3, "code": "НЕТ_ТАКОГО", "confidence": 0.9},
+        ]})
+        images = [("u1", "image/jpeg"), ("u2", "image/jpeg"), ("u3", "image/png")]
+
+        results = await _manager(provider).analyze_images_batch(images, {"model_name": "gpt-5.1"}, "Стена")
+
+        assert [r and r["code"] for r in results] == [first, second, None]
+        assert results[0]["image_url"] == "u1"
+        sent_images, prompt = provider.requests[0]
+        assert sent_images == images
+        assert prompt.startswith(get_catalog().user_prompt("Стена"))
+
+
+class _FakeAnalyzer:
+
+    def __init__(self, batch_results):
+        self.model_manager = self
+        self.batch_results = batch_results
+        self.batches = []
+        self.singles = []
+
+    @staticmethod
+    async def resolve_image(image_name):
+        return f"https://signed/{image_name}", "image/jpeg"
+
+    async def analyze_images_batch(self, images, config, construction_type=None):
+        self.batches.append([url for url, _ in images])
+        return self.batch_results(images)
+
+    async def analyze_single_image_by_name(self, image_name, **kwargs):
+        self.singles.append(image_name)
+        return {"code": "SINGLE", "description": "", "recommendation": "", "category": "В"}
+
+
+def _analysis(code):
+    return {"code": code, "description": "d", "recommendation": "r", "category": "Б"}
+
+
+class TestDefectBatcher:
+
+    @pytest.mark.asyncio
+    async def test_same_type_images_share_one_request(self):
+        analyzer = _FakeAnalyzer(lambda images: [_analysis(f"C{i}") for i in range(len(images))])
+        batcher = DefectBatcher(analyzer, asyncio.Semaphore(2), max_images=3, window_seconds=0.05)
+
+        results = await asyncio.gather(*(batcher.analyze(f"{i}.jpg", "Стена") for i in range(3)))
+
+        assert [r["code"] for r in results] == ["C0", "C1", "C2"]
+        assert len(analyzer.batches) == 1
+        assert metrics.get_count("defect_batch.size") == 1
+
+    @pytest.mark.asyncio
+    async def test_unresolved_and_lonely_images_go_single(self):
+        analyzer = _FakeAnalyzer(lambda images: [_analysis("C0"), None])
+        batcher = DefectBatcher(analyzer, asyncio.Semaphore(2), max_images=4, window_seconds=0.05)
+
+        results = await asyncio.gather(
+            batcher.analyze("a.jpg", "Стена"),
+            batcher.analyze("b.jpg", "Стена"),
+            batcher.analyze("c.jpg", "Кровля"),
+        )
+
+        assert [r["code"] for r in results] == ["C0", "SINGLE", "SINGLE"]
+        assert analyzer.batches == [["https://signed/a.jpg", "https://signed/b.jpg"]]
+        assert sorted(analyzer.singles) == ["b.jpg", "c.jpg"]
+
+    def test_batch_size_adapts_to_latency(self):
+        batcher = DefectBatcher(_FakeAnalyzer(None), asyncio.Semaphore(1), max_images=8, target_seconds=10)
+
+        batcher._adapt(25)
+        assert batcher.batch_size == 4
+        batcher._adapt(2)
+        assert batcher.batch_size == 5
+        # Бюджет токенов ограничивает пакет независимо от задержки
+        batcher.max_input_tokens = batcher.image_tokens * 2 + len(get_catalog().user_prompt("Стена")) // 3
+        assert batcher._limit("Стена") == 2
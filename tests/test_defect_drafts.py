@@ -0,0 +1,103 @@
+"""Тесты упреждающего анализа дефектов: черновики и вытеснение."""
+
+import asyncio
+
+import pytest
+from unittest.mock import patch
+
+from api.services.defect_draft_service import DefectDraftService
+from common.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def draft_store():
+    """Черновики — в словаре вместо Redis."""
+    store = {}
+
+    async def _get_json(key):
+        return store.get(key)
+
+    async def _set_json(key, value, ttl_seconds=None):
+        store[key] = value
+        return True
+
+    async def _delete(key):
+        return store.pop(key, None) is not None
+
+    with patch("api.services.defect_draft_service.redis_service") as redis:
+        redis.get_json.side_effect = _get_json
+        redis.set_json.side_effect = _set_json
+        redis.delete.side_effect = _delete
+        yield store
+
+
+class _SlowAnalyzer:
+
+    def __init__(self, delay=0.0, code="ДЕФ-1"):
+        self.delay = delay
+        self.code = code
+        self.calls = 0
+
+    async def analyze_single_image_by_name(self, image_name, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"code": self.code, "description": "d", "recommendation": "r", "category": "Б"}
+
+
+async def _drain(service):
+    await asyncio.gather(*service._tasks, return_exceptions=True)
+
+
+class TestDefectDrafts:
+
+    @pytest.mark.asyncio
+    async def test_draft_is_taken_once_for_same_type(self, draft_store):
+        service = DefectDraftService(max_concurrent=1, max_interactive=2, ttl_seconds=60)
+
+        service.speculate(_SlowAnalyzer(), "a.jpg", "Стена", "crack", 0.9)
+        await _drain(service)
+
+        assert await service.take("a.jpg", "Колонна", "crack") is None
+        assert (await service.take("a.jpg", "Стена", "crack"))["code"] == "ДЕФ-1"
+        assert await service.take("a.jpg", "Стена", "crack") is None
+        assert metrics.get_counter("defect_draft.lookups_total", outcome="hit") == 1
+
+    @pytest.mark.asyncio
+    async def test_key_follows_catalog_version(self):
+        key = DefectDraftService.draft_key("a.jpg", "Стена", None)
+
+        with patch("api.services.defect_draft_service.get_catalog_version", return_value="other"):
+            assert DefectDraftService.draft_key("a.jpg", "Стена", None) != key
+
+    @pytest.mark.asyncio
+    async def test_interactive_load_preempts_speculation(self, draft_store):
+        service = DefectDraftService(max_concurrent=1, max_interactive=1, ttl_seconds=60)
+        analyzer = _SlowAnalyzer(delay=1.0)
+
+        service.speculate(analyzer, "a.jpg", "Стена")
+        service.speculate(analyzer, "b.jpg", "Стена")
+        await asyncio.sleep(0)
+        with service.interactive():
+            service.speculate(analyzer, "c.jpg", "Стена")
+        await _drain(service)
+
+        assert draft_store == {}
+        assert analyzer.calls == 1
+        assert metrics.get_counter("defect_draft.speculative_total", outcome="preempted") == 2
+        assert metrics.get_counter("defect_draft.speculative_total", outcome="skipped") == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_analysis_leaves_no_draft(self, draft_store):
+        service = DefectDraftService(max_concurrent=1, max_interactive=2, ttl_seconds=60)
+
+        service.speculate(_SlowAnalyzer(code=""), "a.jpg", "Стена")
+        await _drain(service)
+
+        assert draft_store == {}
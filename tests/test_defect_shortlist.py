@@ -0,0 +1,92 @@
+"""Тесты шорт-листа кандидатов перед кодированием дефекта."""
+
+import pytest
+
+from common.defect_shortlist import DefectShortlister
+from common.defects_catalog import DefectCatalog
+from common.metrics import metrics
+
+
+def _defect(code, damage_type, material="Кирпичная кладка"):
+    return {
+        "code": code, "material": material, "damage_type": damage_type,
+        "category": "В", "description": damage_type, "recommendation": "—",
+    }
+
+
+_DB = {
+    "Стена": [
+        _defect("STN1", "Трещины в кладке"),
+        _defect("STN2", "Выкрашивание кирпича"),
+        _defect("STN3", "Плесень на поверхности", "Любые поверхности"),
+        _defect("STN4", "Отслоение штукатурки", "Штукатурка"),
+    ],
+    "Фундамент": [
+        _defect("FND1", "Трещины по бетону", "Железобетон, бетон"),
+        _defect("FND2", "Высолы на кладке"),
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _shortlister(**kwargs):
+    catalog = DefectCatalog(_DB, [], {}, (), "{defects_text}", version="v", compact=True)
+    kwargs = {"top_k": 2, "min_confidence": 0.5, "type_trust": 0.7, "audit_rate": 0.0, **kwargs}
+    return DefectShortlister(catalog, **kwargs)
+
+
+class TestDefectShortlister:
+
+    def test_narrows_by_defect_type(self):
+        shortlist = _shortlister().shortlist(None, None, "brick_cracks")
+
+        assert shortlist.applied
+        assert set(shortlist.codes) == {"STN1", "STN2"}
+        assert metrics.get_counter("defect_shortlist.requests_total", outcome="applied") == 1
+
+    def test_falls_back_without_query_or_for_small_type(self):
+        shortlister = _shortlister(top_k=3)
+
+        assert shortlister.shortlist(None, None, None).reason == "no_query"
+        assert shortlister.shortlist("Фундамент", None, "brick_cracks").reason == "small_catalog"
+
+    def test_uncertain_type_widens_scope(self):
+        shortlister = _shortlister()
+
+        assert shortlister.shortlist("Фундамент", 0.9, "concrete_cracks").scope == "Фундамент"
+        uncertain = shortlister.shortlist("Фундамент", 0.3, "concrete_cracks")
+        assert uncertain.scope is None
+        assert uncertain.ranked[0] == "FND1"  # дефекты определённого типа всё равно выше
+
+    def test_low_confidence_falls_back_to_full_list(self):
+        shortlist = _shortlister(top_k=1, min_confidence=0.9).shortlist(None, None, "brick_destruction")
+
+        assert not shortlist.applied
+        assert shortlist.reason == "low_confidence"
+        assert shortlist.ranked
+
+    def test_records_recall_on_full_list_calls(self):
+        shortlister = _shortlister(audit_rate=1.0)
+        shortlist = shortlister.shortlist(None, None, "brick_cracks")
+        assert shortlist.audit and not shortlist.applied
+
+        shortlister.record_outcome(shortlist, "STN1")
+        shortlister.record_outcome(shortlist, "STN3")
+
+        assert metrics.get_counter("defect_shortlist.recall_total", hit="true", reason="applied") == 1
+        assert metrics.get_counter("defect_shortlist.recall_total", hit="false", reason="applied") == 1
+        assert metrics.get_count("defect_shortlist.chosen_rank") == 1
+
+    def test_subset_prompt_contains_only_shortlist(self):
+        shortlister = _shortlister()
+        shortlist = shortlister.shortlist(None, None, "brick_cracks")
+
+        prompt = shortlister.catalog.subset_prompt(shortlist.codes)
+        assert "STN1" in prompt
+        assert "STN4" not in prompt
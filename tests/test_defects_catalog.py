@@ -0,0 +1,158 @@
+"""Тесты скомпилированного каталога дефектов."""
+
+from common.defects_catalog import DefectCatalog, catalog_version
+from common.defects_db import (
+    CROSS_CUTTING_DEFECTS,
+    DEFECTS_DB,
+    get_catalog,
+    get_defect_by_code,
+    get_defect_by_tag,
+    get_user_prompt,
+)
+
+_DB = {
+    "Стена": [
+        {"code": "W1", "material": "кирпич", "category": "В", "description": "Трещина", "recommendation": "Заделать"},
+        {
+            "code": "W2", "material": "кирпич", "damage_type": "Раскрытие трещины",
+            "parameters": {"width": {"unit": "мм", "ranges": [
+                {"code": "W2.1", "max": 1, "category": "В", "description": "до 1 мм", "recommendation": "Следить"},
+                {"code": "W2.2", "min": 1, "category": "Б", "description": "более 1 мм", "recommendation": "Усилить"},
+            ]}},
+        },
+    ],
+    "Инженерные сети: ХВС": [
+        {"code": "H1", "category": "В", "description": "Течь", "recommendation": "Заменить", "photo_detectable": False},
+    ],
+}
+_CROSS = [
+    {"code": "X1", "tag": "weld", "category": "Б", "description": "Шов", "recommendation": "Переварить"},
+]
+
+
+def _catalog(template="{defects_text}", **kwargs):
+    return DefectCatalog(
+        _DB, _CROSS, {"Наружная стена": "Стена"}, ("Инженерные сети: ХВС",), template, version="v", **kwargs,
+    )
+
+
+class TestDefectCatalog:
+
+    def test_indexes(self):
+        catalog = _catalog()
+
+        assert catalog.get_by_tag("weld")["code"] == "X1"
+        assert catalog.get_by_tag("нет") is None
+        assert catalog.get_by_code("W2.2").get("parent_code") == "W2"
+        parent = catalog.get_by_code("W2")
+        assert parent["category"] == "Б"  # диапазоны разных категорий
+        assert parent["recommendation"].endswith("W2.1, W2.2")
+        assert [r.code for r in catalog.defects_for("Наружная стена")] == ["W1", "W2"]
+        assert [r.code for r in catalog.defects_for("Инженерные сети")] == ["H1"]
+        assert [r.code for r in catalog.defects_for("Неизвестно")] == ["W1", "W2", "H1"]
+
+    def test_prompt_text_and_memoization(self):
+        catalog = _catalog()
+
+        text = catalog.user_prompt("Стена")
+        assert text.splitlines() == [
+            "code: W1; description: Трещина; recommendation: Заделать; category: В; material: кирпич.",
+            "code: W2.1; [width: до 1 мм] description: до 1 мм; recommendation: Следить; category: В; material: кирпич.",
+            "code: W2.2; [width: более 1 мм] description: более 1 мм; recommendation: Усилить; category: Б; material: кирпич.",
+            "code: X1; description: Шов; recommendation: Переварить; category: Б; material: .",
+        ]
+        # Не распознаваемые по фото дефекты в промпт не попадают
+        assert "H1" not in catalog.user_prompt("Инженерные сети")
+        assert catalog.user_prompt("Наружная стена") is text
+
+    def test_compact_format_groups_by_material(self):
+        catalog = _catalog(compact=True)
+
+        assert catalog.user_prompt("Стена").splitlines() == [
+            "## кирпич",
+            "W1 | Трещина",
+            "W2 | Раскрытие трещины | width, мм: W2.1 до 1; W2.2 более 1",
+            "## —",
+            "X1 | Шов",
+        ]
+
+    def test_compact_qualitative_variants_keep_description(self):
+        db = {"Стена": [{
+            "code": "R1", "material": "дерево", "damage_type": "Гниль",
+            "parameters": {"rot_extent": {"unit": "", "ranges": [
+                {"code": "R1.1", "category": "Б", "description": "Поверхностная гниль", "recommendation": "-"},
+                {"code": "R1.2", "category": "А", "description": "Сквозное поражение", "recommendation": "-"},
+            ]}},
+        }]}
+        catalog = DefectCatalog(db, [], {}, (), "{defects_text}", version="v", compact=True)
+
+        assert catalog.subset_prompt(["R1"]) == (
+            "## дерево\nR1 | Гниль | rot_extent: R1.1 Поверхностная гниль; R1.2 Сквозное поражение"
+        )
+
+    def test_compact_text_respects_budget(self, monkeypatch):
+        monkeypatch.setattr("common.defects_catalog.COMPACT_SIGNS_LIMITS", (None, 10))
+        full = _catalog(compact=True).compact_text("Стена")
+
+        shortened = _catalog(compact=True, prompt_max_chars=len(full) - 1).compact_text("Стена")
+        assert "W2 | Раскрытие… | width" in shortened
+        assert len(shortened) < len(full)
+
+        tiny = _catalog(compact=True, prompt_max_chars=30).compact_text("Стена")
+        assert len(tiny) <= 30
+        assert tiny.splitlines() == ["## кирпич", "W1 | Трещина"]
+
+    def test_record_behaves_like_dict(self):
+        record = _catalog().get_by_code("W1")
+
+        assert record.get("tag", "") == ""
+        assert record.get("description") == "Трещина"
+        assert record.as_dict()["construction_type"] == "Стена"
+
+    def test_version_changes_with_content(self):
+        assert catalog_version(_DB, _CROSS) == catalog_version(_DB, _CROSS)
+        assert catalog_version(_DB, _CROSS) != catalog_version(_DB, [])
+
+
+class TestDefectsDbFacade:
+
+    def test_real_catalog_lookups(self):
+        tagged = next(d for d in CROSS_CUTTING_DEFECTS if d.get("tag"))
+        assert get_defect_by_tag(tagged["tag"])["code"] == tagged["code"]
+
+        first = DEFECTS_DB["Стена"][0]
+        assert get_defect_by_code(first["code"])["construction_type"] == "Стена"
+        assert get_user_prompt("Стена") is get_user_prompt("Стена")
+        assert len(get_catalog().version) == 16
+
+    def test_compact_variants_are_distinguishable(self):
+        # Каждый код ответа в компактном промпте сопровождается текстом,
+        # который отличает его от соседних вариантов того же параметра
+        # (в том числе когда описания укорочены под бюджет промпта)
+        catalog = get_catalog()
+        codes = set(catalog.response_codes())
+        shown = set()
+        for line in catalog.compact_text().splitlines():
+            if line.startswith("#"):
+                continue
+            segments = line.split(" | ")
+            shown.add(segments[0])
+            for segment in segments[2:]:
+                labels = {}
+                for piece in segment.split(": ", 1)[1].split("; "):
+                    head, _, rest = piece.partition(" ")
+                    if head in codes:
+                        current = head
+                        labels[current] = rest
+                    else:
+                        labels[current] += "; " + piece
+                assert all(labels.values()), segment
+                assert len(set(labels.values())) == len(labels), segment
+                shown.update(labels)
+        assert codes <= shown
+
+    def test_prompts_start_with_shared_prefix(self):
+        # База дефектов — в конце промпта: начало одинаково для всех типов
+        head = get_user_prompt("Стена").split("Вот база известных дефектов")[0]
+        assert get_user_prompt("Фундамент").startswith(head)
+        assert get_user_prompt(None).startswith(head)
@@ -1,9 +1,53 @@
 """Тесты для DocumentReviewService — парсинг, reference docs, LLM review."""
 
+import asyncio
+import re
+
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 
 from api.services.document_review_service import DocumentReviewService
+from api.services.document_text_cache import DocumentTextCache
+from common.reference_index import ReferenceIndex
+
+
+@pytest.fixture(autouse=True)
+def _no_document_text_cache():
+    """Без метаданных блоба кеш текста не используется."""
+    with patch(
+        "api.services.document_review_service.documents_storage.stat",
+        new_callable=AsyncMock,
+        return_value=None,
+    ):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def review_cache_store():
+    """Кеш результатов проверки — в словаре вместо Redis."""
+    store = {}
+
+    async def _get(key):
+        return store.get(key)
+
+    async def _set(key, value, ttl_seconds=None):
+        store[key] = value
+        return True
+
+    with patch("api.services.review_result_cache.redis_service") as redis:
+        redis.get.side_effect = _get
+        redis.set.side_effect = _set
+        yield store
+
+
+@pytest.fixture(autouse=True)
+def _reference_index_path(tmp_path):
+    """Индекс reference-документов сохраняется во временную директорию."""
+    with patch(
+        "api.services.document_review_service.REFERENCE_INDEX_PATH",
+        str(tmp_path / "reference_index.json"),
+    ):
+        yield
 
 
 class TestParseDocx:
@@ -30,6 +74,29 @@ class TestParseDocx:
         # поэтому у пустого документа остаётся только он
         assert text.strip() == "[Страница 1]"
 
+    def test_tables_and_page_breaks_in_body_order(self):
+        import io
+        from docx import Document
+        from docx.enum.text import WD_BREAK
+
+        doc = Document()
+        doc.add_paragraph("Введение")
+        table = doc.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = "Этажность"
+        table.cell(0, 1).text = "3"
+        run = doc.add_paragraph("Конец раздела").add_run()
+        run.add_break(WD_BREAK.PAGE)
+        doc.add_paragraph("Заключение")
+        buf = io.BytesIO()
+        doc.save(buf)
+
+        text = DocumentReviewService._parse_docx(buf.getvalue())
+
+        assert text == (
+            "[Страница 1]\nВведение\nЭтажность | 3\nКонец раздела"
+            "\n\n[Страница 2]\nЗаключение"
+        )
+
 
 class TestParsePdf:
 
@@ -50,53 +117,83 @@ class TestParsePdf:
         assert text.strip() == ""
 
 
-class TestLoadReferenceTexts:
+class TestReferenceIndex:
 
-    def test_loads_txt_files(self, reference_docs_dir):
+    @pytest.mark.asyncio
+    async def test_selects_only_cited_standards(self, reference_docs_dir):
         service = DocumentReviewService()
 
         with patch(
             "api.services.document_review_service.REFERENCE_DOCS_DIR",
             reference_docs_dir,
         ):
-            result = service._load_reference_texts()
+            result = await service._select_reference("Обследование по ГОСТ 31937-2011.")
 
         assert "ГОСТ 31937-2024" in result
-        assert "СП 20.13330.2016" in result
+        assert "СП 20.13330.2016" not in result
 
-    def test_caches_result(self, reference_docs_dir):
+    @pytest.mark.asyncio
+    async def test_no_citations_returns_empty(self, reference_docs_dir):
         service = DocumentReviewService()
 
         with patch(
             "api.services.document_review_service.REFERENCE_DOCS_DIR",
             reference_docs_dir,
         ):
-            result1 = service._load_reference_texts()
-            result2 = service._load_reference_texts()
+            result = await service._select_reference("Текст без ссылок на нормы")
 
-        assert result1 is result2  # тот же объект — из кэша
+        assert result == ""
 
-    def test_missing_dir_returns_empty(self, tmp_path):
+    @pytest.mark.asyncio
+    async def test_cited_clause_goes_first(self, tmp_path):
+        ref_dir = tmp_path / "refs"
+        ref_dir.mkdir()
+        clauses = "\n".join(
+            f"5.{i} Требования к обследованию фундаментов, вариант {i}" for i in range(1, 40)
+        )
+        (ref_dir / "SP_13-102-2003.txt").write_text(
+            "СП 13-102-2003\n" + clauses + "\n6.3 Категории технического состояния конструкций",
+            encoding="utf-8",
+        )
         service = DocumentReviewService()
 
-        with patch(
-            "api.services.document_review_service.REFERENCE_DOCS_DIR",
-            tmp_path / "nonexistent",
+        with (
+            patch("api.services.document_review_service.REFERENCE_DOCS_DIR", ref_dir),
+            patch("api.services.document_review_service.REFERENCE_MAX_CHARS", 200),
         ):
-            result = service._load_reference_texts()
+            result = await service._select_reference(
+                "Фундаменты обследованы, категория назначена по п. 6.3 СП 13-102-2003"
+            )
 
-        assert result == ""
+        assert "6.3 Категории технического состояния" in result
+        assert len(result) < 300
+
+    def test_index_persisted_and_rebuilt_on_change(self, reference_docs_dir, tmp_path):
+        from common.reference_index import ReferenceIndex
+
+        index_path = tmp_path / "index.json"
+        built = ReferenceIndex.load_or_build(reference_docs_dir, index_path)
+        assert index_path.exists()
+
+        loaded = ReferenceIndex.load(index_path)
+        assert loaded.fingerprint == built.fingerprint
+        assert len(loaded.chunks) == len(built.chunks)
+
+        (reference_docs_dir / "SNIP_2.01.07-85.txt").write_text(
+            "СНиП 2.01.07-85 Нагрузки", encoding="utf-8",
+        )
+        rebuilt = ReferenceIndex.load_or_build(reference_docs_dir, index_path)
+        assert len(rebuilt.documents) == 3
 
-    def test_empty_dir_returns_empty(self, tmp_path):
-        empty_dir = tmp_path / "empty_refs"
-        empty_dir.mkdir()
+    @pytest.mark.asyncio
+    async def test_missing_dir_returns_empty(self, tmp_path):
         service = DocumentReviewService()
 
         with patch(
             "api.services.document_review_service.REFERENCE_DOCS_DIR",
-            empty_dir,
+            tmp_path / "nonexistent",
         ):
-            result = service._load_reference_texts()
+            result = await service._select_reference("ГОСТ 31937-2024")
 
         assert result == ""
 
@@ -181,8 +278,9 @@ class TestRunLlmReview:
             "api.services.document_review_service.REFERENCE_DOCS_DIR",
             reference_docs_dir,
         ):
-            service._reference_texts = None  # сбросить кэш
-            result = await service._run_llm_review("Отчёт текст", "Доп. указания")
+            result = await service._run_llm_review(
+                "Отчёт текст по ГОСТ 31937-2011", "Доп. указания",
+            )
 
         assert result == "Замечаний нет"
 
@@ -219,7 +317,6 @@ class TestRunLlmReview:
             "api.services.document_review_service.REFERENCE_DOCS_DIR",
             tmp_path / "nope",
         ):
-            service._reference_texts = None
             result = await service._run_llm_review("Текст")
 
         assert result == "Результат"
@@ -248,7 +345,6 @@ class TestRunLlmReview:
             "api.services.document_review_service.REFERENCE_DOCS_DIR",
             tmp_path / "nope",
         ):
-            service._reference_texts = None
             result = await service._run_llm_review("Текст")
 
         call_kwargs = mock_client.chat.completions.create.call_args
@@ -256,3 +352,363 @@ class TestRunLlmReview:
         user_msg = messages[1]["content"]
 
         assert "ДОПОЛНИТЕЛЬНЫЕ УКАЗАНИЯ" not in user_msg
+
+
+    @pytest.mark.asyncio
+    async def test_passes_share_stable_prefix_and_record_cached_tokens(self):
+        import os
+        from common.metrics import metrics
+
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+
+        mock_response = MagicMock()
+        mock_response.choices = [MagicMock()]
+        mock_response.choices[0].message.content = "OK"
+        mock_response.usage.prompt_tokens = 2000
+        mock_response.usage.prompt_tokens_details.cached_tokens = 1536
+        mock_response.usage.completion_tokens = 10
+        mock_client = MagicMock()
+        mock_client.chat.completions.create.return_value = mock_response
+        service._openai_client = mock_client
+
+        metrics.reset()
+        report = "[Страница 1]\n" + "Текст отчёта. " * 50
+        await service._run_llm_review(report, "Доп. указания")
+
+        pass_calls = mock_client.chat.completions.create.call_args_list[:-1]
+        systems = {c.kwargs["messages"][0]["content"] for c in pass_calls}
+        users = [c.kwargs["messages"][1]["content"] for c in pass_calls]
+        assert len(systems) == 1
+        # Текст отчёта и указания — в общем начале всех проходов, инструкции прохода — в конце
+        assert "Доп. указания" in os.path.commonprefix(users)
+        assert all(u.rindex("ЗАДАЧА ЭТОГО ПРОХОДА") > u.index("ТЕКСТ ОТЧЁТА") for u in users)
+        labels = {"provider": "openai", "model": "gpt-5.4", "purpose": "document_review"}
+        assert metrics.get_counter("llm.cached_tokens_total", **labels) == 1536 * 4
+        metrics.reset()
+
+
+class TestChunkedReview:
+
+    def test_split_keeps_page_markers_and_budget(self):
+        text = "\n".join(f"[Страница {n}]\n" + "слово " * 200 for n in range(1, 11))
+
+        chunks = DocumentReviewService._split_into_chunks(text, max_tokens=1000)
+
+        assert len(chunks) > 1
+        assert all(len(chunk) <= 3000 for chunk, _, _ in chunks)
+        assert chunks[0][1] == 1 and chunks[-1][2] == 10
+        for chunk_text, first_page, last_page in chunks:
+            assert chunk_text.startswith(f"[Страница {first_page}]")
+            assert f"[Страница {last_page}]" in chunk_text
+
+    def test_split_long_page_repeats_marker(self):
+        text = "[Страница 7]\n" + "\n".join("строка таблицы " * 10 for _ in range(100))
+
+        chunks = DocumentReviewService._split_into_chunks(text, max_tokens=500)
+
+        assert len(chunks) > 1
+        assert all(chunk.startswith("[Страница 7]\n") for chunk, _, _ in chunks)
+        assert all((first, last) == (7, 7) for _, first, last in chunks)
+
+    @pytest.mark.asyncio
+    async def test_runs_each_pass_per_chunk_then_merges(self, tmp_path):
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+        text = "\n".join(f"[Страница {n}]\n" + "текст " * 300 for n in range(1, 5))
+
+        with (
+            patch("api.services.document_review_service.REVIEW_SINGLE_SHOT_MAX_TOKENS", 100),
+            patch("api.services.document_review_service.REVIEW_CHUNK_MAX_TOKENS", 700),
+            patch.object(service, "_call_llm", new_callable=AsyncMock) as mock_llm,
+        ):
+            mock_llm.return_value = "замечание"
+            result = await service._run_llm_review(text)
+
+        assert result == "замечание"
+        calls = mock_llm.call_args_list
+        merge_input = calls[-1].args[2]
+        n_chunks = merge_input.count("Проход 1, фрагмент")
+        assert n_chunks == 4
+        assert len(calls) == 3 * n_chunks + 1
+        assert "ФРАГМЕНТ 2 ИЗ 4 (страница 2)" in calls[1].args[2]
+
+
+class TestDocumentTextCache:
+
+    @pytest.fixture
+    def redis_store(self):
+        store = {}
+
+        async def _get(key):
+            return store.get(key)
+
+        async def _set(key, value, ttl_seconds=None):
+            store[key] = value
+            return True
+
+        with patch("api.services.document_text_cache.redis_service") as redis:
+            redis.get.side_effect = _get
+            redis.set.side_effect = _set
+            yield store
+
+    @pytest.mark.asyncio
+    async def test_second_review_skips_parse(self, tmp_path, redis_store):
+        service = DocumentReviewService()
+        cache = DocumentTextCache(str(tmp_path), 10 * 1024 * 1024, 3600)
+        blob = MagicMock(generation=42, md5_hash="abc")
+
+        with (
+            patch("api.services.document_review_service.document_text_cache", cache),
+            patch(
+                "api.services.document_review_service.documents_storage.stat",
+                new_callable=AsyncMock, return_value=blob,
+            ),
+            patch.object(service, "parse_document", new_callable=AsyncMock) as mock_parse,
+        ):
+            mock_parse.return_value = "[Страница 1]\nТекст отчёта"
+            first = await service.get_review_text("report.docx")
+            second = await service.get_review_text("report.docx")
+
+            blob.generation = 43  # файл перезалит — кеш не должен сработать
+            await service.get_review_text("report.docx")
+
+        assert first == second == "[Страница 1]\nТекст отчёта"
+        assert mock_parse.await_count == 2
+        assert len(redis_store) == 2
+
+    @pytest.mark.asyncio
+    async def test_redis_hit_warms_disk(self, tmp_path, redis_store):
+        shared = DocumentTextCache(str(tmp_path / "a"), 10 * 1024 * 1024, 3600)
+        other_instance = DocumentTextCache(str(tmp_path / "b"), 10 * 1024 * 1024, 3600)
+
+        await shared.set("k", "текст")
+        assert await other_instance.get("k") == "текст"
+        assert (tmp_path / "b" / "k.txt.z").exists()
+
+    def test_disk_eviction_keeps_limit(self, tmp_path):
+        cache = DocumentTextCache(str(tmp_path), 1500, 3600)
+        for i in range(5):
+            cache._write_disk(f"k{i}", bytes(600))
+
+        remaining = sorted(p.name for p in tmp_path.glob("*.txt.z"))
+        assert remaining == ["k3.txt.z", "k4.txt.z"]
+
+
+class TestReviewResultCache:
+
+    @pytest.mark.asyncio
+    async def test_repeat_review_uses_cache(self):
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+
+        with patch.object(service, "_call_llm", new_callable=AsyncMock) as mock_llm:
+            mock_llm.return_value = "замечание"
+            first = await service._run_llm_review("Текст отчёта", "Проверь даты")
+            calls = mock_llm.call_count
+            second = await service._run_llm_review("Текст отчёта", "Проверь даты")
+
+        assert first == second == "замечание"
+        assert calls == 4  # три прохода + merge
+        assert mock_llm.call_count == calls
+
+    @pytest.mark.asyncio
+    async def test_passes_shared_between_review_and_fixes(self):
+        from api.services.document_review_service import MERGE_FIXES_SYSTEM_PROMPT
+
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+
+        with patch.object(service, "_call_llm", new_callable=AsyncMock) as mock_llm:
+            mock_llm.return_value = "замечание"
+            await service._run_llm_review("Текст отчёта")
+            mock_llm.reset_mock()
+            await service._run_llm_review(
+                "Текст отчёта", merge_prompt=MERGE_FIXES_SYSTEM_PROMPT,
+            )
+
+        # Повторно вызывается только merge с другим промптом
+        assert mock_llm.call_count == 1
+        assert mock_llm.call_args.args[1] == MERGE_FIXES_SYSTEM_PROMPT
+
+    @pytest.mark.asyncio
+    async def test_prompt_and_model_change_key(self):
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+
+        with patch.object(service, "_call_llm", new_callable=AsyncMock) as mock_llm:
+            mock_llm.return_value = "замечание"
+            await service._run_llm_review("Текст отчёта")
+            await service._run_llm_review("Текст отчёта", "Другой промпт")
+            await service._run_llm_review("Текст отчёта", model="gpt-5.4-mini")
+
+        # merge тоже не переиспользуется: проходы совпали, но ключ включает модель
+        assert mock_llm.call_count == 4 + 3 + 4
+
+    @pytest.mark.asyncio
+    async def test_system_prompt_change_invalidates_cache(self):
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+
+        with patch.object(service, "_call_llm", new_callable=AsyncMock) as mock_llm:
+            mock_llm.return_value = "замечание"
+            await service._run_llm_review("Текст отчёта")
+            with patch(
+                "api.services.document_review_service.REVIEW_SYSTEM_PROMPT", "Новая роль и формат ответа",
+            ):
+                await service._run_llm_review("Текст отчёта")
+
+        # Проходы и merge пересчитаны, хотя текст, инструкции и модель те же
+        assert mock_llm.call_count == 4 + 4
+
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_calls_run_once(self):
+        from api.services.review_result_cache import ReviewResultCache
+
+        cache = ReviewResultCache(60)
+        started = asyncio.Event()
+        release = asyncio.Event()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            started.set()
+            await release.wait()
+            return "результат"
+
+        first = asyncio.create_task(cache.get_or_compute("pass:x", compute))
+        await started.wait()
+        second = asyncio.create_task(cache.get_or_compute("pass:x", compute))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await first == await second == "результат"
+        assert calls == 1
+
+
+class TestMergeBudget:
+
+    @pytest.mark.asyncio
+    async def test_large_merge_is_split_into_levels(self):
+        from api.services.document_review_service import MERGE_SYSTEM_PROMPT
+
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+        text = "\n".join(f"[Страница {n}]\nРаздел {n}." for n in range(1, 9))
+        passes, merges = [], []
+
+        async def _call(model, system_prompt, user_message):
+            if system_prompt == MERGE_SYSTEM_PROMPT:
+                merges.append(user_message)
+                return f"объединено {len(merges)}"
+            passes.append(user_message)
+            return "замечание " * 10
+
+        with (
+            patch.object(service, "_call_llm", side_effect=_call),
+            patch("api.services.document_review_service.REVIEW_SINGLE_SHOT_MAX_TOKENS", 10),
+            patch("api.services.document_review_service.REVIEW_CHUNK_MAX_TOKENS", 15),
+            patch("api.services.document_review_service.REVIEW_MERGE_MAX_TOKENS", 100),
+        ):
+            merged = await service._run_llm_review(text)
+
+        # 3 прохода × 8 фрагментов не помещаются в один merge
+        assert len(passes) == 24
+        assert len(merges) > 1
+        assert all(len(message) <= 100 * 3 for message in merges)
+        assert merged == f"объединено {len(merges)}"
+
+
+class TestRevisionReview:
+
+    @staticmethod
+    def _report(pages):
+        return "\n".join(f"[Страница {n}]\n{body}" for n, body in enumerate(pages, start=1))
+
+    @staticmethod
+    def _fake_llm(calls):
+        """Проход → замечание по первой странице сообщения; merge → возвращает свой вход."""
+        from api.services.document_review_service import MERGE_SYSTEM_PROMPT
+
+        async def _call(model, system_prompt, user_message):
+            if system_prompt == MERGE_SYSTEM_PROMPT:
+                return user_message
+            calls.append(user_message)
+            page = re.search(r"\[Страница (\d+)\]", user_message.split("ТЕКСТ ОТЧЁТА")[1]).group(1)
+            return f"🔵 ТЕКСТ № 1\nГде: страница {page}\nЧто не так: опечатка\nКак исправить: исправить"
+
+        return _call
+
+    @pytest.mark.asyncio
+    async def test_only_changed_pages_are_rereviewed(self):
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+        pages = [f"Раздел {n}. Текст раздела {n}." for n in range(1, 11)]
+        old_text = self._report(pages)
+        # Вставлена страница после 2-й: страницы 3..10 сдвинулись на 4..11
+        new_text = self._report(pages[:2] + ["Новый раздел."] + pages[2:])
+        calls = []
+
+        with patch.object(service, "_call_llm", side_effect=self._fake_llm(calls)):
+            # Первая редакция — постранично, чтобы замечания были на каждой странице
+            with (
+                patch("api.services.document_review_service.REVIEW_SINGLE_SHOT_MAX_TOKENS", 10),
+                patch("api.services.document_review_service.REVIEW_CHUNK_MAX_TOKENS", 15),
+            ):
+                await service._run_llm_review(old_text)
+            calls.clear()
+            merged = await service._run_revision_review(new_text, old_text)
+
+        # Один фрагмент (страницы 2–4) × три прохода
+        assert len(calls) == 3
+        assert all("страницы 2–4" in message for message in calls)
+        assert "Раздел 7" not in calls[0]
+        # Замечания по неизменённым страницам перенесены с новыми номерами
+        assert "перенесено из предыдущей редакции" in merged
+        assert "Где: страница 11" in merged
+
+    @pytest.mark.asyncio
+    async def test_without_previous_review_falls_back_to_full(self):
+        service = DocumentReviewService()
+        service._reference_index = ReferenceIndex("", [], [], {})
+        calls = []
+
+        with patch.object(service, "_call_llm", side_effect=self._fake_llm(calls)):
+            await service._run_revision_review(self._report(["а", "б"]), self._report(["а", "в"]))
+
+        assert len(calls) == 3
+        assert "ТЕКСТ ОТЧЁТА ДЛЯ ПРОВЕРКИ:\n\n[Страница 1]" in calls[0]
+
+
+class TestReviewRevisionHelpers:
+
+    def test_diff_maps_shifted_pages(self):
+        from common.review_revision import diff_pages
+
+        old = [(1, "[Страница 1]\nа"), (2, "[Страница 2]\nб"), (3, "[Страница 3]\nв")]
+        new = [(1, "[Страница 1]\nа"), (2, "[Страница 2]\nX"), (3, "[Страница 3]\nб"), (4, "[Страница 4]\nв  ")]
+
+        mapping, changed = diff_pages(old, new)
+
+        assert mapping == {1: 1, 2: 3, 3: 4}
+        assert changed == [2]
+
+    def test_remark_pages_remapped_or_dropped(self):
+        from common.review_revision import remap_remark_pages, split_remarks
+
+        result = (
+            "🔴 КРИТ № 1\nГде: стр. 3–4, раздел 2\nЧто не так: x\nКак исправить: y\n\n"
+            "🟡 ШАБЛОН № 2\nГде: страница 5\nЧто не так: x\nКак исправить: y\n\n"
+            "Всего замечаний: 🔴 1 / 🟡 1"
+        )
+        remarks = split_remarks(result)
+
+        assert len(remarks) == 2
+        assert "Где: стр. 4–5, раздел 2" in remap_remark_pages(remarks[0], {3: 4, 4: 5})
+        assert remap_remark_pages(remarks[1], {3: 4, 4: 5}) is None
+
+    def test_regions_merge_with_context(self):
+        from common.review_revision import group_regions
+
+        assert group_regions([3, 5, 9], list(range(1, 11)), 1) == [(2, 6), (8, 10)]
@@ -0,0 +1,102 @@
+"""Тесты планировщика слотов: приоритеты, справедливая доля, голодание."""
+
+import asyncio
+
+import pytest
+
+from common.fair_scheduler import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    FairScheduler,
+    parse_weights,
+)
+from common.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+async def _grant_order(scheduler, requests):
+    """Порядок выдачи слотов задачам, вставшим в очередь за занятым слотом"""
+    order = []
+    await scheduler.acquire("holder")
+
+    async def job(label, tenant, priority):
+        async with scheduler.slot(tenant, priority):
+            order.append(label)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for label, tenant, priority in requests:
+        tasks.append(asyncio.create_task(job(label, tenant, priority)))
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+class TestFairScheduler:
+
+    @pytest.mark.asyncio
+    async def test_tenants_share_slots_round_robin(self):
+        scheduler = FairScheduler("test", slots=1)
+        requests = [(f"a{i}", "user:a", PRIORITY_INTERACTIVE) for i in range(4)]
+        requests += [(f"b{i}", "user:b", PRIORITY_INTERACTIVE) for i in range(2)]
+
+        order = await _grant_order(scheduler, requests)
+
+        assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+        assert metrics.get_count("fair_queue.wait_seconds", queue="test", tenant="user:b", priority="interactive") == 2
+
+    @pytest.mark.asyncio
+    async def test_weights_scale_share(self):
+        scheduler = FairScheduler("test", slots=1, weights=parse_weights("user:a=2"))
+        requests = [(f"a{i}", "user:a", PRIORITY_INTERACTIVE) for i in range(4)]
+        requests += [(f"b{i}", "user:b", PRIORITY_INTERACTIVE) for i in range(2)]
+
+        order = await _grant_order(scheduler, requests)
+
+        assert order == ["a0", "b0", "a1", "a2", "b1", "a3"]
+
+    @pytest.mark.asyncio
+    async def test_interactive_goes_before_bulk(self):
+        scheduler = FairScheduler("test", slots=1)
+
+        order = await _grant_order(scheduler, [
+            ("bulk", "user:a", PRIORITY_BULK),
+            ("interactive", "user:b", PRIORITY_INTERACTIVE),
+        ])
+
+        assert order == ["interactive", "bulk"]
+
+    @pytest.mark.asyncio
+    async def test_starving_task_is_promoted(self):
+        scheduler = FairScheduler("test", slots=1, starvation_seconds=0.001)
+        await scheduler.acquire("holder")
+        bulk = asyncio.create_task(scheduler.acquire("user:a", PRIORITY_BULK))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.create_task(scheduler.acquire("user:b", PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+
+        scheduler.release()
+        await asyncio.sleep(0)
+
+        assert bulk.done() and not interactive.done()
+        assert metrics.get_counter("fair_queue.starvation_promotions_total", queue="test") == 1
+        interactive.cancel()
+        await asyncio.gather(interactive, return_exceptions=True)
+        assert scheduler.waiting == 0
+
+    def test_tenant_depth_limit(self):
+        scheduler = FairScheduler("test", slots=1, max_tenant_depth=2)
+
+        assert scheduler.admit("user:a") and scheduler.admit("user:a")
+        assert not scheduler.admit("user:a")
+        assert scheduler.admit("user:b")
+        scheduler.done("user:a")
+        assert scheduler.admit("user:a")
+        assert metrics.get_counter("fair_queue.rejected_total", queue="test", tenant="user:a") == 1
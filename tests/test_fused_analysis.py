@@ -0,0 +1,91 @@
+"""Тесты совмещённого вызова: тип конструкции и код дефекта за одно обращение."""
+
+import json
+
+import pytest
+from unittest.mock import patch
+
+from api.services.model_manager import BaseModelProvider, ModelManager
+from common.defects_db import FUSED_COMMON_SECTION, get_catalog, get_fused_prompt, get_fused_response_codes
+from common.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class _FusedProvider(BaseModelProvider):
+    name = "openai"
+    default_model = "gpt-5.1"
+    available_models = ["gpt-5.1"]
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.configs = []
+
+    def is_available(self):
+        return True
+
+    async def _generate(self, model_name, images, system_prompt, user_prompt, config):
+        self.configs.append(config)
+        return json.dumps(self.answer), (0, 0, 0)
+
+
+def _manager(provider):
+    def init(self):
+        self.providers = {"openai": provider}
+
+    with patch.object(ModelManager, "_init_providers", init):
+        return ModelManager()
+
+
+def _wall_code():
+    catalog = get_catalog()
+    return next(code for code in catalog.response_codes("Стена") if catalog.get_by_code(code).construction_type == "Стена")
+
+
+class TestFusedPrompt:
+
+    def test_sections_per_construction_type(self):
+        prompt = get_fused_prompt()
+
+        assert "# Стена\n" in prompt and "# Инженерные сети\n" in prompt
+        assert f"# {FUSED_COMMON_SECTION}\n" in prompt
+        assert prompt.index("Ответ строго в JSON") < prompt.index("# Фундамент")
+        codes = get_fused_response_codes()
+        assert len(codes) == len(set(codes)) and _wall_code() in codes
+
+
+class TestAnalyzeFused:
+
+    @pytest.mark.asyncio
+    async def test_type_and_defect_from_one_call(self):
+        code = _wall_code()
+        provider = _FusedProvider({
+            "construction_type": "Стена", "confidence": 0.9, "code": code, "code_confidence": 0.8, "reasoning": None,
+        })
+
+        result = await _manager(provider).analyze_fused("url", "image/jpeg", {"model_name": "gpt-5.1"})
+
+        assert len(provider.configs) == 1
+        assert provider.configs[0]["response_schema"]["name"] == "fused_analysis"
+        assert result["construction_type"] == "Стена"
+        assert result["code"] == code
+        assert result["description"] == get_catalog().get_by_code(code).description
+        assert metrics.get_counter("fused_analysis.requests_total", outcome="complete") == 1
+
+    @pytest.mark.asyncio
+    async def test_code_of_other_type_is_dropped(self):
+        provider = _FusedProvider({
+            "construction_type": "Кровля", "confidence": 0.9, "code": _wall_code(), "code_confidence": 0.8,
+            "reasoning": None,
+        })
+
+        result = await _manager(provider).analyze_fused("url", "image/jpeg", {"model_name": "gpt-5.1"})
+
+        assert result["construction_type"] == "Кровля"
+        assert "code" not in result
+        assert metrics.get_counter("fused_analysis.requests_total", outcome="type_only") == 1
@@ -33,7 +33,7 @@ class TestUploadBytes:
         mock_bucket.blob.assert_called_once_with("test.txt")
         assert mock_blob.content_type == "text/plain"
         mock_blob.upload_from_string.assert_called_once_with(
-            b"hello", content_type="text/plain"
+            b"hello", content_type="text/plain", retry=None
         )
 
 
@@ -0,0 +1,70 @@
+"""Тесты выбора способа доставки изображения провайдеру."""
+
+import base64
+
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from api.services.image_uri_resolver import (
+    TRANSPORT_GCS,
+    TRANSPORT_INLINE,
+    TRANSPORT_SIGNED_URL,
+    resolve_image_uri,
+)
+from api.services.model_manager import GoogleGeminiProvider
+from common.gc_utils import images_storage, parse_gcs_uri
+from common.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def storage():
+    with patch("api.services.image_uri_resolver.redis_service") as redis, \
+            patch.object(images_storage, "create_signed_url", AsyncMock(return_value="https://signed/a.jpg")) as sign, \
+            patch.object(images_storage, "download", AsyncMock(return_value=(b"jpeg", "image/jpeg"))):
+        redis.get_signed_url = AsyncMock(return_value=None)
+        redis.cache_signed_url = AsyncMock(return_value=True)
+        yield sign, redis
+
+
+class TestResolveImageUri:
+
+    def test_uri_round_trip(self):
+        assert parse_gcs_uri(images_storage.uri("dir/a.jpg")) == (images_storage.bucket_name, "dir/a.jpg")
+        assert parse_gcs_uri("https://example.com/a.jpg") is None
+
+    @pytest.mark.asyncio
+    async def test_gcs_transport_skips_signing(self, storage):
+        sign, _ = storage
+        uri = images_storage.uri("a.jpg")
+
+        assert await resolve_image_uri(uri, "image/jpeg", TRANSPORT_GCS) == uri
+        assert sign.await_count == 0
+        assert metrics.get_counter("image_uri.resolved_total", transport=TRANSPORT_GCS) == 1
+
+    @pytest.mark.asyncio
+    async def test_signed_url_is_cached(self, storage):
+        sign, redis = storage
+
+        url = await resolve_image_uri(images_storage.uri("a.jpg"), "image/jpeg", TRANSPORT_SIGNED_URL)
+
+        assert url == "https://signed/a.jpg"
+        redis.cache_signed_url.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_inline_embeds_bytes(self, storage):
+        url = await resolve_image_uri(images_storage.uri("a.jpg"), "image/jpeg", TRANSPORT_INLINE)
+
+        assert url == "data:image/jpeg;base64," + base64.b64encode(b"jpeg").decode()
+        part = GoogleGeminiProvider._image_part(url, "image/jpeg")
+        assert part == {"inline_data": {"mime_type": "image/jpeg", "data": b"jpeg"}}
+
+    @pytest.mark.asyncio
+    async def test_other_schemes_pass_through(self, storage):
+        assert await resolve_image_uri("https://x/a.jpg", "image/jpeg", TRANSPORT_INLINE) == "https://x/a.jpg"
@@ -0,0 +1,221 @@
+"""Тесты хеджирования, переключения провайдеров и автомата защиты."""
+
+import asyncio
+import json
+
+import pytest
+from unittest.mock import patch
+
+from api.services.model_manager import BaseModelProvider, ModelManager
+from common.circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+from common.metrics import metrics
+from common.response_schemas import CONSTRUCTION_TYPE_SCHEMA
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class _FakeProvider(BaseModelProvider):
+
+    def __init__(self, name, model, delay=0.0, fail=False):
+        self.name = name
+        self.default_model = model
+        self.available_models = [model]
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def is_available(self):
+        return True
+
+    async def _generate(self, *args):
+        raise NotImplementedError
+
+    async def analyze_image(self, image_url, mime_type, system_prompt, user_prompt, config):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("503")
+        return {"code": "A1", "model_used": config["model_name"]}
+
+
+def _manager(primary, backup):
+    def init(self):
+        self.providers = {primary.name: primary, backup.name: backup}
+
+    with patch.object(ModelManager, "_init_providers", init):
+        return ModelManager()
+
+
+class TestCallModel:
+
+    @pytest.mark.asyncio
+    async def test_failover_on_error(self):
+        manager = _manager(_FakeProvider("openai", "gpt-4o-mini", fail=True), _FakeProvider("gemini", "gemini-2.5-flash"))
+
+        result = await manager.call_model("url", "image/jpeg", "sys", "user", {"model_name": "gpt-4o-mini"})
+
+        assert result["model_used"] == "gemini-2.5-flash"
+        assert manager.breakers["openai"].failures == 1
+        assert metrics.get_counter("llm.hedges_total", provider="openai", purpose="image", reason="error") == 1
+
+    @pytest.mark.asyncio
+    async def test_hedges_past_rolling_p95(self):
+        primary = _FakeProvider("openai", "gpt-4o-mini", delay=0.5)
+        manager = _manager(primary, _FakeProvider("gemini", "gemini-2.5-flash"))
+        labels = {"provider": "openai", "model": "gpt-4o-mini", "purpose": "image", "outcome": "ok"}
+        for _ in range(30):
+            metrics.observe("llm.attempt_seconds", 0.01, **labels)
+
+        with patch("api.services.model_manager.LLM_HEDGE_MIN_DELAY_SECONDS", 0.05):
+            result = await manager.call_model("url", "image/jpeg", "sys", "user", {"model_name": "gpt-4o-mini"})
+
+        assert result["model_used"] == "gemini-2.5-flash"
+        assert metrics.get_counter("llm.hedge_wins_total", provider="gemini", role="hedge", purpose="image") == 1
+        # Проигравшая попытка отменена: без повторов и без ошибки в автомате защиты
+        await asyncio.gather(*manager._background, return_exceptions=True)
+        assert not manager._background
+        assert metrics.get_count("llm.attempt_seconds", **{**labels, "outcome": "cancelled"}) == 1
+        assert manager.breakers["openai"].failures == 0
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_routes_around_provider(self):
+        primary = _FakeProvider("openai", "gpt-4o-mini")
+        manager = _manager(primary, _FakeProvider("gemini", "gemini-2.5-flash"))
+        for _ in range(manager.breakers["openai"].failure_threshold):
+            manager.breakers["openai"].record_failure()
+
+        result = await manager.call_model("url", "image/jpeg", "sys", "user", {"model_name": "gpt-4o-mini"})
+
+        assert result["model_used"] == "gemini-2.5-flash"
+        assert primary.calls == 0
+        assert manager.get_provider("gpt-4o-mini").name == "gemini"
+
+
+class _ConfidenceProvider(_FakeProvider):
+    """Уверенность ответа зависит от модели."""
+
+    def __init__(self, confidences):
+        super().__init__("openai", "gpt-5.1")
+        self.available_models = list(confidences)
+        self.confidences = confidences
+        self.models = []
+
+    async def analyze_image(self, image_url, mime_type, system_prompt, user_prompt, config):
+        self.models.append(config["model_name"])
+        return {"code": "A1", "confidence": self.confidences[config["model_name"]], "model_used": config["model_name"]}
+
+
+class TestCallCascade:
+
+    @staticmethod
+    def _reason(result):
+        return None if result["confidence"] >= 0.7 else "low_confidence"
+
+    async def _call(self, provider, config):
+        manager = _manager(provider, _FakeProvider("gemini", "gemini-2.5-flash"))
+        with patch("api.services.model_manager.LLM_CASCADE_ENABLED", True):
+            return await manager.call_cascade("url", "image/jpeg", "sys", "user", config, self._reason)
+
+    @pytest.mark.asyncio
+    async def test_confident_cheap_answer_is_accepted(self):
+        provider = _ConfidenceProvider({"gpt-4.1-mini": 0.9, "gpt-5.1": 0.95})
+
+        result = await self._call(provider, {"model_name": "gpt-5.1", "cascade": True})
+
+        assert result["model_used"] == "gpt-4.1-mini"
+        assert provider.models == ["gpt-4.1-mini"]
+        assert metrics.get_counter("llm.cascade_total", purpose="image", outcome="accepted") == 1
+
+    @pytest.mark.asyncio
+    async def test_low_confidence_escalates(self):
+        provider = _ConfidenceProvider({"gpt-4.1-mini": 0.4, "gpt-5.1": 0.95})
+
+        result = await self._call(provider, {"model_name": "gpt-5.1", "cascade": True})
+
+        assert result["model_used"] == "gpt-5.1"
+        assert provider.models == ["gpt-4.1-mini", "gpt-5.1"]
+        assert metrics.get_counter(
+            "llm.cascade_total", purpose="image", outcome="escalated", reason="low_confidence",
+        ) == 1
+
+    @pytest.mark.asyncio
+    async def test_calls_without_cascade_flag_go_straight_to_model(self):
+        provider = _ConfidenceProvider({"gpt-4.1-mini": 0.9, "gpt-5.1": 0.95})
+
+        await self._call(provider, {"model_name": "gpt-5.1"})
+
+        assert provider.models == ["gpt-5.1"]
+
+
+class _LocalProvider(BaseModelProvider):
+    name = "local"
+    default_model = "construction.onnx"
+    available_models = ["construction.onnx"]
+
+    def __init__(self, confidence):
+        self.confidence = confidence
+
+    def is_available(self):
+        return True
+
+    async def _generate(self, model_name, images, system_prompt, user_prompt, config):
+        return json.dumps({"construction_type": "Стена", "confidence": self.confidence}), (0, 0, 0)
+
+
+class TestLocalGate:
+
+    async def _call(self, local_confidence, backup):
+        manager = _manager(backup, _FakeProvider("gemini", "gemini-2.5-flash"))
+        manager.local_provider = _LocalProvider(local_confidence)
+        config = {
+            "model_name": "gpt-5.1", "purpose": "construction_type",
+            "response_schema": CONSTRUCTION_TYPE_SCHEMA, "local": True,
+        }
+        return await manager.call_cascade("url", "image/jpeg", "sys", "user", config, lambda result: None)
+
+    @pytest.mark.asyncio
+    async def test_confident_local_answer_skips_network(self):
+        remote = _FakeProvider("openai", "gpt-5.1")
+
+        result = await self._call(0.97, remote)
+
+        assert result["construction_type"] == "Стена"
+        assert result["model_used"] == "construction.onnx"
+        assert remote.calls == 0
+        assert metrics.get_counter("llm.local_total", purpose="construction_type", outcome="accepted") == 1
+
+    @pytest.mark.asyncio
+    async def test_unsure_local_answer_falls_through(self):
+        remote = _FakeProvider("openai", "gpt-5.1")
+
+        result = await self._call(0.5, remote)
+
+        assert result["model_used"] == "gpt-5.1"
+        assert remote.calls == 1
+        assert metrics.get_counter("llm.local_total", purpose="construction_type", outcome="fallthrough") == 1
+
+
+class TestCircuitBreaker:
+
+    def test_opens_then_probes_after_timeout(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+        breaker.record_failure()
+        assert breaker.allow() and breaker.state == STATE_CLOSED
+
+        breaker.record_failure()
+        assert breaker.state == STATE_OPEN and not breaker.allow()
+
+        breaker.opened_at -= 10
+        assert breaker.allow() and breaker.state == STATE_HALF_OPEN
+        breaker.record_failure()
+        assert breaker.state == STATE_OPEN
+
+        breaker.opened_at -= 10
+        breaker.allow()
+        breaker.record_success()
+        assert breaker.state == STATE_CLOSED and breaker.failures == 0
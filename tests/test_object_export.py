@@ -0,0 +1,143 @@
+"""Тесты для потокового ZIP-экспорта объекта."""
+
+import io
+import zipfile
+import zlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from api.services.object_export_service import (
+    STATEMENT_NAME,
+    ExportItem,
+    ObjectExport,
+    ObjectExportService,
+)
+from common.zip_stream import ZipEntry, parse_range
+
+
+class FakeStorage:
+    def __init__(self, blobs: dict):
+        self.blobs = blobs
+        self.requests = []
+
+    async def download_range(self, blob_name, start, end, generation=None):
+        self.requests.append((blob_name, start, end))
+        return self.blobs[blob_name][start:end]
+
+
+@pytest.fixture
+def blobs():
+    return {
+        "a.jpg": bytes(range(256)) * 40,
+        "b.png": b"\x89PNG" + b"x" * 3000,
+        "empty.jpg": b"",
+    }
+
+
+@pytest.fixture(autouse=True)
+def _no_redis():
+    with patch("api.services.object_export_service.redis_service") as redis:
+        redis.set = AsyncMock(return_value=True)
+        yield redis
+
+
+def _export(blobs, storage) -> ObjectExport:
+    items = [
+        ExportItem(ZipEntry(f"photos/{name}", len(data)), blob_name=name, generation=1)
+        for name, data in blobs.items()
+    ]
+    marks = b'{"a": 1}\n'
+    items.append(ExportItem(ZipEntry("marks.json", len(marks), crc=zlib.crc32(marks)), data=marks))
+    return ObjectExport(1, items, storage=storage)
+
+
+async def _collect(export: ObjectExport, start=0, end=None) -> bytes:
+    return b"".join([chunk async for chunk in export.stream(start, end)])
+
+
+class TestObjectExport:
+
+    async def test_full_archive_is_valid_zip(self, blobs):
+        export = _export(blobs, FakeStorage(blobs))
+        data = await _collect(export)
+
+        assert len(data) == export.total_size
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.testzip() is None
+            assert zf.read("photos/a.jpg") == blobs["a.jpg"]
+            assert zf.read("photos/empty.jpg") == b""
+            assert zf.read("marks.json") == b'{"a": 1}\n'
+
+    async def test_ranges_reassemble_full_archive(self, blobs):
+        full = await _collect(_export(blobs, FakeStorage(blobs)))
+
+        # Каждый диапазон — новый манифест без известных CRC, как при докачке
+        cuts = [0, 17, 5000, 5030, 8000, len(full)]
+        parts = [
+            await _collect(_export(blobs, FakeStorage(blobs)), start, end)
+            for start, end in zip(cuts, cuts[1:])
+        ]
+        assert b"".join(parts) == full
+
+    async def test_known_crc_fetches_only_requested_bytes(self, blobs):
+        storage = FakeStorage(blobs)
+        export = _export(blobs, storage)
+        await _collect(export)  # CRC вычислены
+
+        storage.requests.clear()
+        entry = export.items[0].entry
+        await _collect(export, entry.data_offset + 100, entry.data_offset + 200)
+        assert storage.requests == [("a.jpg", 100, 200)]
+
+
+class TestStatementPinning:
+
+    @staticmethod
+    def _service() -> ObjectExportService:
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=MagicMock(**{"scalars.return_value.all.return_value": []}))
+        return ObjectExportService(db)
+
+    async def test_resume_reuses_pinned_statement(self, _no_redis):
+        stored = {}
+        _no_redis.set = AsyncMock(side_effect=lambda key, value, ttl_seconds=None: stored.update({key: value}))
+        _no_redis.get = AsyncMock(side_effect=lambda key: stored.get(key))
+        _no_redis.mget = AsyncMock(side_effect=lambda keys: [None] * len(keys))
+
+        async def stat(blob_name, generation=None):
+            return SimpleNamespace(size=10, generation=generation or 7, updated=datetime.now(timezone.utc))
+
+        report = AsyncMock(side_effect=["reports/1/defects_old.docx", "reports/1/defects_new.docx"])
+        with patch("api.services.object_export_service.ReportService") as report_service, \
+                patch("api.services.object_export_service.images_storage") as storage:
+            report_service.return_value.get_defects_report_blob = report
+            storage.stat = AsyncMock(side_effect=stat)
+
+            first = await self._service().build_export(1)
+            # Кеш отчёта истёк: без закрепления докачка получила бы новую ведомость
+            resumed = await self._service().build_export(1, etag=first.etag)
+
+        assert report.await_count == 1
+        assert resumed.etag == first.etag
+        statement = next(item for item in resumed.items if item.entry.name == STATEMENT_NAME)
+        assert (statement.blob_name, statement.generation) == ("reports/1/defects_old.docx", 7)
+        storage.stat.assert_awaited_with("reports/1/defects_old.docx", 7)
+
+
+class TestParseRange:
+
+    def test_variants(self):
+        assert parse_range(None, 100) is None
+        assert parse_range("bytes=10-", 100) == (10, 100)
+        assert parse_range("bytes=10-19", 100) == (10, 20)
+        assert parse_range("bytes=-30", 100) == (70, 100)
+        assert parse_range("bytes=90-500", 100) == (90, 100)
+        assert parse_range("bytes=0-1,5-6", 100) is None
+        assert parse_range("items=0-1", 100) is None
+
+    def test_unsatisfiable(self):
+        with pytest.raises(ValueError):
+            parse_range("bytes=100-", 100)
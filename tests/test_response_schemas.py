@@ -0,0 +1,99 @@
+"""Тесты структурированных ответов: схемы, разбор и повтор при сбое."""
+
+import json
+
+import pytest
+
+from api.services.model_manager import BaseModelProvider
+from common.defects_db import get_catalog
+from common.metrics import metrics
+from common.response_schemas import CONSTRUCTION_TYPE_SCHEMA, defect_code_schema, parse_response
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class _ScriptedProvider(BaseModelProvider):
+    """Отдаёт заранее заданные ответы по одному на вызов."""
+
+    name = "fake"
+    default_model = "fake-model"
+
+    def __init__(self, *contents):
+        self.contents = list(contents)
+        self.calls = 0
+
+    async def _generate(self, model_name, images, system_prompt, user_prompt, config):
+        self.calls += 1
+        return self.contents.pop(0), (100, 0, 10)
+
+
+class TestParseResponse:
+
+    def test_enum_and_types_are_checked(self):
+        schema = defect_code_schema(("A1", "A2"))
+
+        assert parse_response('{"code": "A1", "confidence": 0.8, "reasoning": null}', schema) == (
+            {"code": "A1", "confidence": 0.8, "reasoning": None}, None,
+        )
+        assert parse_response('{"code": "ZZ", "confidence": 0.8, "reasoning": null}', schema)[1] == "schema"
+        assert parse_response('{"reasoning": "трещина"}', schema)[1] == "schema"
+        assert parse_response('{"construction_type": "Стена", "confidence": "0.9"}', CONSTRUCTION_TYPE_SCHEMA)[1] == "schema"
+
+    def test_malformed_content(self):
+        assert parse_response(None, None) == ({}, "empty")
+        assert parse_response('Ответ: {"code": "A1"}', None) == ({}, "invalid_json")
+        assert parse_response('["A1"]', None) == ({}, "invalid_json")
+
+
+class TestResponseCodes:
+
+    def test_codes_are_those_shown_in_prompt(self):
+        catalog = get_catalog()
+        prompt = catalog.user_prompt("Стена")
+        codes = catalog.response_codes("Стена")
+
+        assert codes and all(code in prompt for code in codes)
+        assert len(codes) == len(set(codes))
+        # Параметризованные дефекты отвечают кодом варианта, а не родителя
+        parent = next(r for r in catalog.defects_for("Стена") if r.parameters and catalog.is_detectable(r.code))
+        assert parent.code not in codes
+        assert catalog.subset_response_codes([parent.code])
+
+    def test_schema_is_memoized_per_code_set(self):
+        codes = get_catalog().response_codes("Стена")
+        assert defect_code_schema(codes) is defect_code_schema(codes)
+
+
+class TestProviderRetry:
+
+    @pytest.mark.asyncio
+    async def test_retries_once_and_counts_wasted_tokens(self):
+        provider = _ScriptedProvider("не JSON", json.dumps({"code": "A1", "confidence": 1, "reasoning": None}))
+        config = {"purpose": "image", "response_schema": defect_code_schema(("A1",))}
+
+        result = await provider.analyze_image("gs://b/img.jpg", "image/jpeg", "sys", "user", config)
+
+        assert result["code"] == "A1"
+        assert provider.calls == 2
+        labels = {"provider": "fake", "model": "fake-model", "purpose": "image"}
+        assert metrics.get_counter(
+            "llm.parse_failures_total", reason="invalid_json", retried="true", **labels,
+        ) == 1
+        assert metrics.get_counter("llm.parse_failure_tokens_total", **labels) == 110
+        assert metrics.get_counter("llm.requests_total", **labels) == 2
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_retries(self):
+        provider = _ScriptedProvider('{"code": "ZZ", "confidence": 1, "reasoning": null}', None)
+        config = {"response_schema": defect_code_schema(("A1",))}
+
+        result = await provider.analyze_image("gs://b/img.jpg", "image/jpeg", "sys", "user", config)
+
+        assert result["parse_error"] == "empty"
+        assert result["recommendation"] == "Ответ пустой или нераспознан"
+        assert "code" not in result
@@ -0,0 +1,136 @@
+"""Тесты повторов исходящих вызовов: классификация, Retry-After, бюджет."""
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from common.metrics import metrics
+from common.retry import (
+    ERROR_PERMANENT,
+    ERROR_RATE_LIMIT,
+    ERROR_TRANSIENT,
+    RetryableError,
+    RetryBudget,
+    RetryPolicy,
+    classify_error,
+    parse_retry_after,
+)
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _status_error(status: int, headers: dict = None) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://example.test")
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+class _GoogleError(Exception):
+    """Как google.api_core / google.genai: HTTP-статус в атрибуте code"""
+    code = 429
+
+
+class _Flaky:
+    """Падает заданными ошибками, затем отвечает"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+class TestClassification:
+
+    def test_http_statuses(self):
+        assert classify_error(_status_error(429)) == ERROR_RATE_LIMIT
+        assert classify_error(_status_error(503)) == ERROR_TRANSIENT
+        assert classify_error(_status_error(404)) == ERROR_PERMANENT
+        assert classify_error(_GoogleError()) == ERROR_RATE_LIMIT
+
+    def test_exception_types(self):
+        assert classify_error(httpx.ConnectError("refused")) == ERROR_TRANSIENT
+        assert classify_error(TimeoutError()) == ERROR_TRANSIENT
+        assert classify_error(FileNotFoundError("missing")) == ERROR_PERMANENT
+        assert classify_error(Exception("boom")) == ERROR_PERMANENT
+        assert classify_error(RetryableError("busy", ERROR_RATE_LIMIT)) == ERROR_RATE_LIMIT
+
+    def test_retry_after(self):
+        assert parse_retry_after("7") == 7.0
+        assert parse_retry_after("soon") is None
+        later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+        assert 50 < parse_retry_after(later) <= 60
+
+
+class TestRetryPolicy:
+
+    @pytest.mark.asyncio
+    async def test_transient_error_is_retried(self):
+        policy = RetryPolicy("test.transient", max_attempts=3, base_delay=0, max_delay=0)
+        func = _Flaky(_status_error(503), httpx.ReadTimeout("slow"))
+
+        assert await policy.call(func) == "ok"
+        assert func.calls == 3
+        assert metrics.get_counter("retry.attempts_total", dependency="test.transient", outcome="transient") == 2
+
+    @pytest.mark.asyncio
+    async def test_permanent_error_is_not_retried(self):
+        policy = RetryPolicy("test.permanent", base_delay=0, max_delay=0)
+        func = _Flaky(_status_error(400))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await policy.call(func)
+        assert func.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_exhausted_attempts_give_up(self):
+        policy = RetryPolicy("test.exhausted", max_attempts=2, base_delay=0, max_delay=0)
+        func = _Flaky(_status_error(503), _status_error(503), _status_error(503))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await policy.call(func)
+        assert func.calls == 2
+        assert metrics.get_counter("retry.give_ups_total", dependency="test.exhausted", reason="exhausted") == 1
+
+    @pytest.mark.asyncio
+    async def test_long_retry_after_is_not_waited(self):
+        policy = RetryPolicy("test.retry_after", base_delay=0, max_delay=5)
+        func = _Flaky(_status_error(429, {"Retry-After": "120"}))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await policy.call(func)
+        assert func.calls == 1
+        assert metrics.get_counter("retry.give_ups_total", dependency="test.retry_after", reason="retry_after") == 1
+
+    @pytest.mark.asyncio
+    async def test_budget_limits_retries(self):
+        policy = RetryPolicy("test.budget", max_attempts=3, base_delay=0, max_delay=0)
+        policy.budget.balance = 1.0
+        policy.budget.min_per_second = 0.0
+
+        func = _Flaky(*(_status_error(503) for _ in range(3)))
+        with pytest.raises(httpx.HTTPStatusError):
+            await policy.call(func)
+
+        assert func.calls == 2
+        assert metrics.get_counter("retry.give_ups_total", dependency="test.budget", reason="budget") == 1
+
+    def test_budget_refills_from_requests(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0.0)
+        budget.balance = 0.0
+
+        assert not budget.try_spend()
+        budget.record_request()
+        budget.record_request()
+        assert budget.try_spend()
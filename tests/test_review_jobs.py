@@ -0,0 +1,179 @@
+"""Тесты фоновых проверок документов (ReviewJobService + SSE-эндпоинт)."""
+
+import asyncio
+
+import pytest
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from api.services.review_job_service import (
+    ReviewJobService,
+    ReviewJobsOverloadedError,
+    STATUS_CANCELLED,
+    STATUS_COMPLETED,
+    STATUS_FAILED,
+)
+
+
+@pytest.fixture(autouse=True)
+def _no_redis():
+    with patch("api.services.review_job_service.redis_service") as mock_redis:
+        mock_redis.set_json = AsyncMock(return_value=True)
+        mock_redis.get_json = AsyncMock(return_value=None)
+        yield mock_redis
+
+
+class _FakeReviewService:
+    """Два прохода, между ними ждёт release — чтобы поймать промежуточное состояние."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def review_document(self, document_name, prompt, model, on_pass_result=None, **kwargs):
+        await on_pass_result("Проход 1", "замечание 1", 1, 2)
+        await self.release.wait()
+        await on_pass_result("Проход 2", "замечание 2", 2, 2)
+        return {"document_name": document_name, "extracted_text": "текст", "review_result": "итог"}
+
+    async def review_document_fixes(self, document_name, prompt, model, on_pass_result=None, **kwargs):
+        raise ValueError("Неподдерживаемый формат файла")
+
+
+async def _collect(service, job, after=-1):
+    return [item async for item in service.events(job, after) if item is not None]
+
+
+class TestReviewJobService:
+
+    @pytest.mark.asyncio
+    async def test_streams_passes_then_result(self):
+        review = _FakeReviewService()
+        service = ReviewJobService(review)
+
+        job = await service.start(1, "review", "doc.docx")
+        collector = asyncio.create_task(_collect(service, job))
+        await asyncio.sleep(0)
+        assert job.passes == [{"label": "Проход 1", "result": "замечание 1"}]
+
+        review.release.set()
+        events = await asyncio.wait_for(collector, timeout=1)
+
+        assert [e["event"] for _, e in events] == ["status", "pass", "pass", "result"]
+        assert [event_id for event_id, _ in events] == [0, 1, 2, 3]
+        assert job.status == STATUS_COMPLETED
+        assert job.result["review_result"] == "итог"
+
+    @pytest.mark.asyncio
+    async def test_resume_after_last_event_id(self):
+        review = _FakeReviewService()
+        review.release.set()
+        service = ReviewJobService(review)
+
+        job = await service.start(1, "review", "doc.docx")
+        await service._tasks[job.id]
+
+        events = await _collect(service, job, after=1)
+        assert [event_id for event_id, _ in events] == [2, 3]
+
+    @pytest.mark.asyncio
+    async def test_error_is_mapped_and_stored(self):
+        service = ReviewJobService(_FakeReviewService())
+
+        job = await service.start(1, "fixes", "doc.txt")
+        await service._tasks[job.id]
+
+        assert job.status == STATUS_FAILED
+        assert job.error == {"status_code": 400, "detail": "Неподдерживаемый формат файла"}
+
+    @pytest.mark.asyncio
+    async def test_cancel_stops_running_job(self):
+        service = ReviewJobService(_FakeReviewService())
+
+        job = await service.start(1, "review", "doc.docx")
+        await asyncio.sleep(0)
+        cancelled = await service.cancel(job.id, 1)
+
+        assert cancelled.status == STATUS_CANCELLED
+        assert job.events[-1]["event"] == "cancelled"
+        assert len(job.passes) == 1  # второй проход так и не выполнился
+
+    @pytest.mark.asyncio
+    async def test_jobs_are_private_and_limited(self):
+        service = ReviewJobService(_FakeReviewService(), max_active=1)
+
+        job = await service.start(1, "review", "doc.docx")
+        assert await service.get(job.id, user_id=2) is None
+
+        with pytest.raises(ReviewJobsOverloadedError):
+            await service.start(1, "review", "other.docx")
+        await service.cancel(job.id, 1)
+
+    @pytest.mark.asyncio
+    async def test_rejects_unknown_mode_and_model(self):
+        service = ReviewJobService(_FakeReviewService())
+
+        with pytest.raises(ValueError):
+            await service.start(1, "summary", "doc.docx")
+        with pytest.raises(ValueError):
+            await service.start(1, "review", "doc.docx", model="gpt-2")
+
+    @pytest.mark.asyncio
+    async def test_finished_job_restored_from_snapshot(self, _no_redis):
+        review = _FakeReviewService()
+        review.release.set()
+        service = ReviewJobService(review)
+        job = await service.start(7, "review", "doc.docx")
+        await service._tasks[job.id]
+        snapshot = _no_redis.set_json.call_args.args[1]
+
+        restarted = ReviewJobService(review)
+        _no_redis.get_json.return_value = snapshot
+        restored = await restarted.get(job.id, 7)
+
+        assert restored.status == STATUS_COMPLETED
+        assert restored.result == job.result
+        assert len(await _collect(restarted, restored)) == 4
+
+
+class TestReviewJobRoutes:
+
+    @pytest.fixture
+    def client(self):
+        from fastapi.testclient import TestClient
+        from main import app
+        from api.dependencies.auth_dependencies import get_current_user
+        from api.models.entities import User
+
+        mock_user = MagicMock(spec=User)
+        mock_user.id = 1
+        app.dependency_overrides[get_current_user] = lambda: mock_user
+        yield TestClient(app)
+        app.dependency_overrides.clear()
+
+    def test_job_lifecycle_over_sse(self, client):
+        async def fake_review(document_name, prompt, model, on_pass_result=None, **kwargs):
+            await on_pass_result("Проход 1", "замечание", 1, 1)
+            return {"document_name": document_name, "extracted_text": "т", "review_result": "итог"}
+
+        with patch(
+            "api.routes.document_review.document_review_service.review_document",
+            side_effect=fake_review,
+        ):
+            resp = client.post("/repgen/documents/review-jobs", json={"document_name": "a.docx"})
+            assert resp.status_code == 202
+            job_id = resp.json()["job_id"]
+
+            with client.stream("GET", f"/repgen/documents/review-jobs/{job_id}/events") as stream:
+                assert stream.headers["content-type"].startswith("text/event-stream")
+                body = "".join(stream.iter_text())
+
+        assert "event: pass" in body
+        assert "event: result" in body
+        assert body.index("event: pass") < body.index("event: result")
+
+        resp = client.get(f"/repgen/documents/review-jobs/{job_id}")
+        assert resp.json()["status"] == "completed"
+        assert resp.json()["passes"] == [{"label": "Проход 1", "result": "замечание"}]
+
+    def test_unknown_job_is_404(self, client):
+        assert client.get("/repgen/documents/review-jobs/nope").status_code == 404
+        assert client.delete("/repgen/documents/review-jobs/nope").status_code == 404
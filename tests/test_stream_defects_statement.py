@@ -0,0 +1,155 @@
+"""Тесты для потокового генератора ведомости дефектов."""
+
+import io
+import zipfile
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from PIL import Image
+
+from docx_generator.generate_defects_statement_2_report import generate_defects_statement_2_report
+from docx_generator.stream_defects_statement_2_report import stream_defects_statement_2_report
+
+
+def _image_bytes(color, fmt="JPEG", size=(40, 30)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def statement_rows():
+    jpeg = _image_bytes((200, 0, 0))
+    png = _image_bytes((0, 0, 200), "PNG", (50, 80))
+    return [
+        {
+            "number": "1",
+            "scheme_name": "План <1> & \"А\"",
+            "element_name": " Стена ",
+            "defect_volume": 2.5,
+            "defects_and_causes": "Трещина\tшириной\n1 мм",
+            "photo_data": jpeg,
+            "danger_category": "Б",
+            "work_recommendations": "Расшить и заделать",
+            "recommended_work_types": "Ремонт",
+        },
+        {"number": "2", "photo_data": None},
+        {"number": 3, "photo_data": png},
+        {"number": "4", "photo_data": jpeg},  # повтор картинки — одна media-часть
+        {"number": "5", "photo_data": b"not an image"},
+    ]
+
+
+def _stream(rows) -> zipfile.ZipFile:
+    out = io.BytesIO()
+    stream_defects_statement_2_report(rows, out)
+    out.seek(0)
+    return zipfile.ZipFile(out)
+
+
+class TestStreamDefectsStatement:
+
+    def test_parts_match_python_docx_generator(self, statement_rows):
+        expected = zipfile.ZipFile(generate_defects_statement_2_report(statement_rows))
+        actual = _stream(statement_rows)
+
+        assert sorted(actual.namelist()) == sorted(expected.namelist())
+        for name in (
+            "word/document.xml",
+            "word/_rels/document.xml.rels",
+            "[Content_Types].xml",
+            "word/media/image1.jpg",
+            "word/media/image2.png",
+        ):
+            assert actual.read(name) == expected.read(name), name
+
+    def test_opens_with_python_docx(self, statement_rows):
+        from docx import Document
+
+        out = io.BytesIO()
+        stream_defects_statement_2_report(statement_rows, out)
+        doc = Document(out)
+
+        table = doc.tables[0]
+        assert len(table.rows) == 2 + len(statement_rows)
+        assert table.cell(2, 1).text == "План <1> & \"А\""
+        assert len(doc.inline_shapes) == 3
+
+    def test_accepts_generator(self):
+        rows = ({"number": str(i)} for i in range(1, 4))
+        doc_xml = _stream(rows).read("word/document.xml").decode("utf-8")
+        assert doc_xml.count("<w:tr>") == 5
+
+    def test_empty_rows(self):
+        expected = zipfile.ZipFile(generate_defects_statement_2_report([]))
+        actual = _stream([])
+        assert actual.read("word/document.xml") == expected.read("word/document.xml")
+
+    def test_loads_photo_by_path_per_row(self, statement_rows):
+        photos = {f"photo_{i}.jpg": row.pop("photo_data") for i, row in enumerate(statement_rows)}
+        for i, row in enumerate(statement_rows):
+            row["photo_path"] = f"photo_{i}.jpg"
+        loaded = []
+
+        def load_photo(path):
+            loaded.append(path)
+            return photos[path]
+
+        rows_seen = []
+
+        def rows():
+            for row in statement_rows:
+                # Фото строки скачивается не раньше, чем до неё дошла запись
+                assert len(loaded) == len(rows_seen)
+                rows_seen.append(row)
+                yield row
+
+        out = io.BytesIO()
+        stream_defects_statement_2_report(rows(), out, load_photo)
+        expected = zipfile.ZipFile(generate_defects_statement_2_report(
+            [{**row, "photo_data": photos[row["photo_path"]]} for row in statement_rows]
+        ))
+
+        assert loaded == [f"photo_{i}.jpg" for i in range(len(statement_rows))]
+        assert zipfile.ZipFile(out).read("word/document.xml") == expected.read("word/document.xml")
+
+    def test_default_loader_reads_photo_file(self, tmp_path):
+        jpeg = _image_bytes((0, 200, 0))
+        (tmp_path / "photo_0").write_bytes(jpeg)
+        rows = [
+            {"number": "1", "photo_path": str(tmp_path / "photo_0")},
+            {"number": "2", "photo_path": str(tmp_path / "missing")},
+        ]
+
+        archive = _stream(rows)
+
+        assert archive.read("word/media/image1.jpg") == jpeg
+        assert archive.read("word/document.xml").count(b"<w:drawing>") == 1
+
+
+class TestSpoolPhotos:
+
+    @pytest.mark.asyncio
+    async def test_each_photo_downloaded_once_to_file(self, tmp_path):
+        from api.services.report_service import ReportService
+
+        async def download(name):
+            if name == "broken.jpg":
+                raise FileNotFoundError(name)
+            return name.encode(), "image/jpeg"
+
+        rows = [
+            {"number": "1", "photo_name": "a.jpg"},
+            {"number": "2", "photo_name": "a.jpg"},
+            {"number": "3", "photo_name": ""},
+            {"number": "4", "photo_name": "broken.jpg"},
+        ]
+        with patch("api.services.report_service.images_storage") as storage:
+            storage.download = AsyncMock(side_effect=download)
+            await ReportService._spool_photos(rows, str(tmp_path))
+
+        assert storage.download.await_count == 2
+        assert rows[0]["photo_path"] == rows[1]["photo_path"]
+        assert open(rows[0]["photo_path"], "rb").read() == b"a.jpg"
+        assert rows[2]["photo_path"] is None and rows[3]["photo_path"] is None
+        assert all("photo_name" not in row for row in rows)